@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# Benchmark of the JSON output of pg_lock_tracer. Synthetic lock
+# events are formatted with the precomputed formatter of the tracer
+# and with the previous per-event implementation (json.dumps of a
+# dict, lock type lookup by a scan of the lock names, one write
+# call per line). Both variants write into a file.
+#
+# Usage: python benchmarks/json_output_benchmark.py [-n EVENTS] [-r RUNS]
+###############################################
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from pg_lock_tracer.helper import PostgreSQLLockHelper
+from pg_lock_tracer.lock_events import Events, PostgreSQLEvent, LOCK_MODE_EVENTS
+from pg_lock_tracer.pg_lock_tracer import PGLockTraceOutputJSON
+from pg_lock_tracer.trace_file import TraceFileWriter
+
+# The events of a single lock request (see the example output in the README)
+LOCK_CYCLE = [
+    (Events.TABLE_OPEN, 1),
+    (Events.LOCK_RELATION_OID, 1),
+    (Events.LOCK_GRANTED_FASTPATH, 1),
+    (Events.LOCK_GRANTED_LOCAL, 1),
+    (Events.LOCK_RELATION_OID_END, 0),
+    (Events.LOCK_UNGRANTED_FASTPATH, 1),
+    (Events.LOCK_UNGRANTED_LOCAL, 1),
+    (Events.TABLE_CLOSE, 1),
+]
+
+
+# pylint: disable=too-few-public-methods
+class StaticResolver:
+    def __init__(self, oids):
+        self.cache = {oid: f"pg_catalog.relation_{oid}" for oid in oids}
+
+    def resolve_oid(self, oid):
+        """
+        Resolve the OID using the static cache
+        """
+        return self.cache[oid]
+
+
+def create_events(count, oids):
+    """
+    Create the given number of synthetic events
+    """
+    events = []
+    timestamp = 745064333930117
+
+    while len(events) < count:
+        for oid in oids:
+            for event_type, mode in LOCK_CYCLE:
+                timestamp += 1000
+                events.append(
+                    PostgreSQLEvent(
+                        pid=1234,
+                        timestamp=timestamp,
+                        event_type=event_type,
+                        object=oid,
+                        mode=mode,
+                    )
+                )
+
+    return events[:count]
+
+
+class LegacyJSONOutput(PGLockTraceOutputJSON):
+    """
+    The per-event implementation of the JSON output before the
+    precomputed formatter was introduced
+    """
+
+    def handle_event(self, event):
+        if (
+            self.pids
+            and event.pid not in self.pids
+            and event.event_type < Events.GLOBAL
+        ):
+            return
+
+        output = {}
+        output["timestamp"] = event.timestamp
+        output["pid"] = event.pid
+        output["event"] = Events(event.event_type).name
+
+        if event.event_type in LOCK_MODE_EVENTS:
+            output["lock_type"] = PostgreSQLLockHelper.lock_type_to_str(event.mode)
+
+        if event.pid in self.oid_resolvers and event.object:
+            resolver = self.oid_resolvers[event.pid]
+            oid_value = resolver.resolve_oid(event.object)
+            output["table"] = oid_value
+            self.update_statistics(event, event.event_type, oid_value)
+        else:
+            self.update_statistics(event, event.event_type, event.object)
+
+        if event.object:
+            output["oid"] = event.object
+
+        if event.event_type == Events.QUERY_BEGIN:
+            output["query"] = event.payload_str1.decode("utf-8")
+        elif event.event_type == Events.LOCK_GRANTED_LOCAL:
+            output["lock_local_hold"] = event.lock_local_hold
+        elif event.event_type == Events.LOCK_RELATION_OID_END:
+            output["lock_time"] = self.get_lock_wait_time(event)
+
+        self.output_file.write(json.dumps(output) + "\n")
+
+
+def run_benchmark(output_class, output_file, events, resolvers):
+    """
+    Format all events and return the number of events per second
+    """
+    output_class.set_context(None, None, output_file, resolvers, [1234])
+
+    start = time.perf_counter()
+    for event in events:
+        output_class.handle_event(event)
+    output_class.flush_output()
+    duration = time.perf_counter() - start
+
+    return len(events) / duration
+
+
+def main():
+    """
+    Run the benchmark
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--events", type=int, default=400000)
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=5,
+        help="number of runs per implementation, the fastest run is reported",
+    )
+    args = parser.parse_args()
+
+    oids = list(range(16384, 16384 + 50))
+    resolvers = {1234: StaticResolver(oids)}
+    events = create_events(args.events, oids)
+
+    # The runs of both implementations alternate, so a phase of a noisy
+    # machine slows down both of them
+    legacy_rate = 0
+    formatter_rate = 0
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            legacy_path = os.path.join(tmp_dir, "legacy.json")
+            with open(legacy_path, "w", encoding="utf-8") as legacy_file:
+                legacy_rate = max(
+                    legacy_rate,
+                    run_benchmark(LegacyJSONOutput(), legacy_file, events, resolvers),
+                )
+
+            writer = TraceFileWriter(os.path.join(tmp_dir, "formatter.json"))
+            writer.open()
+            formatter_rate = max(
+                formatter_rate,
+                run_benchmark(PGLockTraceOutputJSON(), writer, events, resolvers),
+            )
+            writer.close()
+
+            # Both implementations produce the same output
+            with open(legacy_path, "r", encoding="utf-8") as legacy_file:
+                with open(writer.path, "r", encoding="utf-8") as formatter_file:
+                    if legacy_file.read() != formatter_file.read():
+                        print("Error: The output of the implementations differs")
+                        sys.exit(1)
+
+    print(f"Events:                 {len(events)}")
+    print(f"Legacy output:          {legacy_rate:,.0f} events/s")
+    print(f"Precomputed formatter:  {formatter_rate:,.0f} events/s")
+    print(f"Speedup:                {formatter_rate / legacy_rate:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,12 @@ import graphviz
 
 from pg_lock_tracer import __version__
 from pg_lock_tracer.helper import PostgreSQLLockHelper
+from pg_lock_tracer.lock_events import (
+    get_locktag_description,
+    get_locktag_fields,
+    get_locktag_type,
+)
+from pg_lock_tracer.trace_file import read_trace_lines, trace_exists
 
 # See https://github.com/magjac/d3-graphviz/blob/master/examples/basic-unpkg-worker.html
 HTML_TEMPLATE = """
@@ -135,6 +141,12 @@ usage examples:
 
 # Read events from 'test_trace.json' and generate 'test.html'
 animate_lock_graph.py -i test_trace.json -o test.html
+
+# Read events from a compressed trace ('test_trace.gz')
+animate_lock_graph.py -i test_trace.gz -o test.html
+
+# Read events from all segments of a rotated trace ('test_trace.index.json')
+animate_lock_graph.py -i test_trace -o test.html
 """
 
 parser = argparse.ArgumentParser(
@@ -164,7 +176,7 @@ parser.add_argument(
     type=str,
     dest="input_file",
     default=None,
-    help="the input file with the events",
+    help="the input file with the events (plain, compressed, or a rotated trace)",
     required=True,
 )
 parser.add_argument(
@@ -187,10 +199,9 @@ class DOTModel:
         """
         Calculate the dot graphs for each line of the input
         """
-        with open(self.input_file, "r", encoding="utf-8") as input_file_handle:
-            for line in input_file_handle:
-                json_data = json.loads(line)
-                self.handle_json(json_data)
+        for line in read_trace_lines(self.input_file):
+            json_data = json.loads(line)
+            self.handle_json(json_data)
 
     def handle_json(self, event):
         """
@@ -386,8 +397,19 @@ class StringHelper:
     @staticmethod
     def get_tablename(event):
         """
-        Get the tablename or the Oid of the event.
+        Get the tablename, the Oid, or the lock tag of the event.
         """
+        if "locktag" in event:
+            locktag_type = get_locktag_type(event["locktag"])
+            values = {
+                field: event[field]
+                for field in get_locktag_fields(locktag_type)
+                if field in event
+            }
+            if "table" in event:
+                values["oid"] = event["table"]
+            return get_locktag_description(event["locktag"], values)
+
         if "table" in event:
             return event["table"]
 
@@ -400,7 +422,7 @@ def main():
     """
     args = parser.parse_args()
 
-    if not os.path.exists(args.input_file):
+    if not trace_exists(args.input_file):
         raise ValueError(f"Input file does not exist {args.input_file}")
 
     if os.path.exists(args.output_file) and not args.force:
@@ -0,0 +1,147 @@
+/*
+ * Off-CPU accounting of the lock waits (--off-cpu). This part is inserted
+ * into the programs of the LW and heavyweight lock tracers, which call
+ * off_cpu_wait_begin() and off_cpu_wait_end() around a lock wait.
+ *
+ * While a backend waits, its context switches (sched:sched_switch) and its
+ * wakeups (sched:sched_waking) are traced. The wait is split into the time
+ * on the CPU (e.g., spinning), the time sleeping (waiting for the lock
+ * holder), and the time runnable but not scheduled (waiting for a CPU).
+ *
+ * sched_waking is raised in the context of the task that wakes the waiter
+ * (unlike sched_wakeup, which can be raised on the CPU of the waiter), so
+ * the current task is the waker (usually the releasing lock holder, or the
+ * interrupted task if the waiter is woken from an interrupt, e.g., by a
+ * timeout).
+ */
+
+#define OFF_CPU_ON_CPU 0
+#define OFF_CPU_SLEEPING 1
+#define OFF_CPU_RUNNABLE 2
+
+/* TASK_INTERRUPTIBLE | TASK_UNINTERRUPTIBLE (a preempted task is runnable) */
+#define OFF_CPU_SLEEP_STATES 3
+
+typedef struct OffCpuWait {
+  u64 lock;     // The awaited lock (see OffCpuKey)
+  u32 cluster;  // The index of the traced binary
+  u32 pid;      // The pid of the waiter that is reported
+  u32 state;    // OFF_CPU_*
+  u32 waker;    // The pid of the task that woke the waiter last
+  u64 since;    // Start of the current state
+  u64 on_cpu_ns;
+  u64 sleep_ns;
+  u64 runnable_ns;
+} OffCpuWait;
+
+/*
+ * The running waits (Key = pid of the waiter in the initial PID namespace,
+ * as reported by the scheduler tracepoints). A wait that is aborted by an
+ * error is replaced by the next wait of the backend.
+ */
+BPF_HASH(off_cpu_waits, u32, OffCpuWait, 10240);
+
+typedef struct OffCpuKey {
+  u64 lock;  // The tranche (LW locks) or the relation (heavyweight locks)
+  u32 cluster;
+  u32 pid;
+  u32 waker;  // The pid in the initial PID namespace (0 = not woken)
+  u32 pad;
+} OffCpuKey;
+
+typedef struct OffCpuTime {
+  u64 waits;
+  u64 on_cpu_ns;
+  u64 sleep_ns;
+  u64 runnable_ns;
+} OffCpuTime;
+
+/* The finished waits per lock, waiter, and waker */
+BPF_HASH(off_cpu_times, OffCpuKey, OffCpuTime, 10240);
+
+static void off_cpu_wait_begin(u32 host_pid, u32 pid, u32 cluster, u64 lock,
+                               u64 now) {
+  OffCpuWait wait = {.lock = lock,
+                     .cluster = cluster,
+                     .pid = pid,
+                     .state = OFF_CPU_ON_CPU,
+                     .since = now};
+
+  off_cpu_waits.update(&host_pid, &wait);
+}
+
+/*
+ * Finish the wait of the backend (which is on the CPU) and add it to the
+ * times of the lock, the waiter, and the waker
+ */
+static void off_cpu_wait_end(u32 host_pid, u64 now) {
+  OffCpuWait *wait = off_cpu_waits.lookup(&host_pid);
+  if (!wait) return;
+
+  OffCpuKey key = {.lock = wait->lock,
+                   .cluster = wait->cluster,
+                   .pid = wait->pid,
+                   .waker = wait->waker};
+  OffCpuTime zero = {};
+
+  OffCpuTime *time = off_cpu_times.lookup_or_try_init(&key, &zero);
+  if (time) {
+    time->waits++;
+    time->on_cpu_ns += wait->on_cpu_ns + (now - wait->since);
+    time->sleep_ns += wait->sleep_ns;
+    time->runnable_ns += wait->runnable_ns;
+  }
+
+  off_cpu_waits.delete(&host_pid);
+}
+
+/*
+ * The scheduler switches from the task prev to the task next
+ */
+int off_cpu_sched_switch(struct tracepoint__sched__sched_switch *args) {
+  u64 now = bpf_ktime_get_ns();
+  u32 prev_pid = args->prev_pid;
+  u32 next_pid = args->next_pid;
+
+  OffCpuWait *prev = off_cpu_waits.lookup(&prev_pid);
+  if (prev) {
+    prev->on_cpu_ns += now - prev->since;
+    prev->state = (args->prev_state & OFF_CPU_SLEEP_STATES) ? OFF_CPU_SLEEPING
+                                                            : OFF_CPU_RUNNABLE;
+    prev->since = now;
+  }
+
+  OffCpuWait *next = off_cpu_waits.lookup(&next_pid);
+  if (next) {
+    /* The wakeup was not seen (the time is counted as sleeping) */
+    if (next->state == OFF_CPU_SLEEPING)
+      next->sleep_ns += now - next->since;
+    else if (next->state == OFF_CPU_RUNNABLE)
+      next->runnable_ns += now - next->since;
+
+    next->state = OFF_CPU_ON_CPU;
+    next->since = now;
+  }
+
+  return 0;
+}
+
+/*
+ * The current task wakes the task pid
+ */
+int off_cpu_sched_waking(struct tracepoint__sched__sched_waking *args) {
+  u32 pid = args->pid;
+
+  OffCpuWait *wait = off_cpu_waits.lookup(&pid);
+  if (!wait) return 0;
+
+  wait->waker = bpf_get_current_pid_tgid();
+
+  if (wait->state != OFF_CPU_SLEEPING) return 0;
+
+  u64 now = bpf_ktime_get_ns();
+  wait->sleep_ns += now - wait->since;
+  wait->state = OFF_CPU_RUNNABLE;
+  wait->since = now;
+  return 0;
+}
@@ -6,11 +6,19 @@
  * #define EVENT_.... n
  *
  * Will by automatically generated from python Events ENUM
+ *
+ * The BPF functions of an event group are only compiled if the group is
+ * traced (TRACE_TABLE, TRACE_LOCK, ...).
  */
 __DEFINES__
 
+/* The size of a LOCKTAG (the same in all supported PostgreSQL versions) */
+#define LOCKTAG_SIZE 16
+
+/* Keep in sync with lock_events.PostgreSQLEvent */
 typedef struct PostgreSQLEvent {
   u32 pid;
+  u32 cluster;  // The index of the traced binary
   u64 timestamp;
   u32 event_type;
 
@@ -23,50 +31,435 @@ typedef struct PostgreSQLEvent {
                            // schema)
   char payload_str2[127];  // Generic payload string data 2 (e.g., a table)
 
-  int stackid;  // The id of the stack
+  int stackid;   // The id of the stack
+  u32 host_pid;  // The pid in the initial PID namespace
+
+  /* The LOCKTAG of the lock events (same layout as LOCKTAG) */
+  u32 locktag_field1;
+  u32 locktag_field2;
+  u32 locktag_field3;
+  u16 locktag_field4;
+  u8 locktag_type;
+  u8 locktag_lockmethodid;
+
+  /* The state of the shared LOCK on grant and ungrant */
+  u32 grant_mask;  // The granted lock modes (LOCKMASK)
+  u32 wait_mask;   // The awaited lock modes (LOCKMASK)
+  u32 granted;     // Granted locks
+  u32 waiting;     // Processes in the wait queue
 } PostgreSQLEvent;
 
 BPF_PERF_OUTPUT(lockevents);
 
-#if defined(STACKTRACE_DEADLOCK) || defined(STACKTRACE_LOCK) || \
-    defined(STACKTRACE_UNLOCK)
-BPF_STACK_TRACE(stacks, 4096);
+/*
+ * Only trace the tasks of a cgroup (and its descendants). The cgroup is
+ * stored at index 0 by the tracer.
+ */
+#ifdef FILTER_CGROUP
+BPF_CGROUP_ARRAY(cgroup_filter, 1);
 #endif
 
-static void fill_basic_data(PostgreSQLEvent *event) {
-  event->pid = bpf_get_current_pid_tgid();
-  event->timestamp = bpf_ktime_get_ns();
+/*
+ * The contention of the shared locks, aggregated per cluster and lock
+ * target (LOCKTAG) on grant and ungrant
+ */
+#ifdef CONTENTION_STATS
+typedef struct LockTarget {
+  u32 cluster;
+  u32 locktag_field1;
+  u32 locktag_field2;
+  u32 locktag_field3;
+  u16 locktag_field4;
+  u8 locktag_type;
+  u8 locktag_lockmethodid;
+} LockTarget;
+
+typedef struct LockContention {
+  u64 grants;       // Number of GrantLock calls
+  u64 ungrants;     // Number of UnGrantLock calls
+  u64 waiting_sum;  // Sum of the wait queue lengths
+  u32 waiting_max;  // Maximal wait queue length
+  u32 granted_max;  // Maximal number of granted locks
+  u32 grant_mask;   // All granted lock modes
+  u32 wait_mask;    // All awaited lock modes
+} LockContention;
+
+BPF_HASH(lock_contention, LockTarget, LockContention, 10240);
+#endif
+
+/*
+ * The lock requests are held back in the kernel with the wait time filter
+ * (--filter "wait_time > ...") and the slow lock threshold
+ * (--slow-lock-threshold)
+ */
+#if defined(FILTER_WAIT_TIME) || defined(SLOW_LOCK_THRESHOLD_NS)
+#define HOLD_LOCK_REQUESTS
+#endif
+
+#if defined(TOP_VIEW) || defined(HOLD_LOCK_REQUESTS)
+/*
+ * Number of events that could not be aggregated (a map is full) or held
+ * back with their lock request
+ */
+BPF_ARRAY(dropped_events, u64, 1);
+
+static void count_dropped_event() {
+  int zero = 0;
+  u64 *dropped = dropped_events.lookup(&zero);
+  if (dropped) __sync_fetch_and_add(dropped, 1);
 }
+#endif
 
 /*
- * ====================================
- * Table handling
- * ====================================
+ * The state of the top view (--top). The events are counted and the lock
+ * requests are aggregated in the kernel instead of submitting the events.
  */
+#ifdef TOP_VIEW
+typedef struct RelationKey {
+  u32 cluster;
+  u32 oid;
+} RelationKey;
 
-static void handle_table_event(PostgreSQLEvent *event, struct pt_regs *ctx) {
-  fill_basic_data(event);
+typedef struct RelationWait {
+  u64 requests;     // Number of LockRelationOid calls
+  u64 wait_ns;      // Total time spent in LockRelationOid
+  u64 wait_max_ns;  // Longest time spent in LockRelationOid
+} RelationWait;
 
-  bpf_probe_read_kernel(&(event->mode), sizeof(event->mode),
-                        &(PT_REGS_PARM2(ctx)));
+typedef struct LockRequest {
+  u64 start;  // Start of the LockRelationOid call
+  u32 cluster;
+  u32 oid;
+  int mode;
+} LockRequest;
 
-  // bpf_trace_printk("Event: %d %d\\n", event.object, event.mode);
+BPF_HASH(relation_waits, RelationKey, RelationWait, 10240);
 
-  lockevents.perf_submit(ctx, event, sizeof(PostgreSQLEvent));
+/* The running LockRelationOid calls (Key = pid) */
+BPF_HASH(lock_requests, u32, LockRequest, 10240);
+
+/* Number of events per event type */
+BPF_HASH(event_counts, u32, u64, 64);
+
+/*
+ * Aggregate a lock request into the wait time of the relation
+ */
+static void update_top_view(PostgreSQLEvent *event) {
+  event_counts.increment(event->event_type);
+
+  /* The lock wait is aborted (e.g., by the lock_timeout or a deadlock) */
+  if (event->event_type == EVENT_ERROR) {
+    lock_requests.delete(&(event->pid));
+    return;
+  }
+
+  if (event->event_type == EVENT_LOCK_RELATION_OID) {
+    LockRequest request = {.start = event->timestamp,
+                           .cluster = event->cluster,
+                           .oid = event->object,
+                           .mode = event->mode};
+    if (lock_requests.update(&(event->pid), &request) != 0)
+      count_dropped_event();
+    return;
+  }
+
+  if (event->event_type != EVENT_LOCK_RELATION_OID_END) return;
+
+  LockRequest *request = lock_requests.lookup(&(event->pid));
+  if (!request) return;
+
+  RelationKey key = {.cluster = request->cluster, .oid = request->oid};
+  u64 wait_ns = event->timestamp - request->start;
+  lock_requests.delete(&(event->pid));
+
+  RelationWait zero = {};
+  RelationWait *wait = relation_waits.lookup_or_try_init(&key, &zero);
+  if (!wait) {
+    count_dropped_event();
+    return;
+  }
+
+  __sync_fetch_and_add(&(wait->requests), 1);
+  __sync_fetch_and_add(&(wait->wait_ns), wait_ns);
+
+  /* Concurrent updates of the maximum might get lost, this is accepted */
+  if (wait_ns > wait->wait_max_ns) wait->wait_max_ns = wait_ns;
 }
 
 /*
- * PostgreSQL: table_open
- * Parameter 1: Oid relationId
- * Parameter 2: LOCKMODE lockmode
+ * A task exits (e.g., a backend that is terminated while it waits for a
+ * lock), remove its running lock request
  */
-int bpf_table_open(struct pt_regs *ctx) {
-  PostgreSQLEvent event = {.event_type = EVENT_TABLE_OPEN};
-  bpf_probe_read_kernel(&(event.object), sizeof(event.object),
-                        &(PT_REGS_PARM1(ctx)));
-  handle_table_event(&event, ctx);
+int top_process_exit(struct tracepoint__sched__sched_process_exit *args) {
+  u32 pid;
+
+#ifdef PIDNS_INO
+  struct bpf_pidns_info ns = {};
+  if (bpf_get_ns_current_pid_tgid(PIDNS_DEV, PIDNS_INO, &ns, sizeof(ns)) != 0)
+    return 0;
+
+  pid = ns.pid;
+#else
+  pid = bpf_get_current_pid_tgid();
+#endif
+
+  lock_requests.delete(&pid);
   return 0;
 }
+#endif
+
+/*
+ * The time spent in the catalog functions (--catalog-stats), aggregated
+ * per backend and relation in log2 histograms in the kernel
+ */
+#ifdef CATALOG_STATS
+typedef struct CatalogTimeKey {
+  u32 pid;
+  u32 cluster;
+  u32 function;  // CATALOG_FUNCTION_*
+  u32 oid;       // The relation (0 for AcceptInvalidationMessages)
+  u32 bucket;    // The log2 bucket of the duration
+} CatalogTimeKey;
+
+typedef struct CatalogTime {
+  u64 calls;
+  u64 total_ns;
+} CatalogTime;
+
+typedef struct CatalogCall {
+  u64 start;
+  u32 pid;
+  u32 oid;
+} CatalogCall;
+
+typedef struct CatalogCallKey {
+  u32 tid;
+  u32 function;
+  u32 depth;  // The nesting depth of the call in the thread
+} CatalogCallKey;
+
+/* Calls that are nested deeper are not measured */
+#define CATALOG_MAX_DEPTH 32
+
+BPF_HASH(catalog_times, CatalogTimeKey, CatalogTime, 10240);
+
+/*
+ * The running calls. The functions can be called recursively (e.g.,
+ * table_open while a relcache entry is built), so each nesting level has
+ * its own entry.
+ */
+BPF_HASH(catalog_calls, CatalogCallKey, CatalogCall, 10240);
+
+/*
+ * The nesting depth of the running calls (Key = function << 32 | thread
+ * id). The depths of a thread are reset by an error, which aborts the
+ * running calls.
+ */
+BPF_HASH(catalog_depths, u64, u32, 10240);
+
+/* Number of calls that could not be aggregated (a map is full) */
+BPF_ARRAY(catalog_dropped_calls, u64, 1);
+
+static void count_dropped_catalog_call() {
+  int zero = 0;
+  u64 *dropped = catalog_dropped_calls.lookup(&zero);
+  if (dropped) __sync_fetch_and_add(dropped, 1);
+}
+
+static void reset_catalog_depth(u32 function, u32 tid) {
+  u64 thread = ((u64)function << 32) | tid;
+  catalog_depths.delete(&thread);
+}
+#endif
+
+/*
+ * The filter expression (--filter) and the slow lock threshold
+ * (--slow-lock-threshold). FILTER_EVENT(event, wait_ns) is generated from
+ * the expression by the tracer.
+ */
+#if defined(FILTER_EVENT) || defined(HOLD_LOCK_REQUESTS)
+#define FILTER_EVENTS
+
+#ifndef FILTER_EVENT
+#define FILTER_EVENT(event, wait_ns) 1
+#endif
+
+#ifdef HOLD_LOCK_REQUESTS
+/*
+ * The lock grants within a LockRelationOid call (FastPathGrantRelationLock
+ * or GrantLock, and GrantLockLocal) are held back with the request
+ */
+#define HELD_LOCK_EVENTS 2
+
+typedef struct HeldRequest {
+  PostgreSQLEvent request;
+  PostgreSQLEvent events[HELD_LOCK_EVENTS];
+  u32 events_count;
+} HeldRequest;
+
+/* The running LockRelationOid calls (Key = pid) */
+BPF_HASH(held_requests, u32, HeldRequest, 10240);
+
+/* A held request is too large for the BPF stack */
+BPF_PERCPU_ARRAY(held_request_buffer, HeldRequest, 1);
+
+static void hold_request(PostgreSQLEvent *event) {
+  int zero = 0;
+  HeldRequest *held = held_request_buffer.lookup(&zero);
+  if (!held) return;
+
+  __builtin_memcpy(&(held->request), event, sizeof(PostgreSQLEvent));
+  held->events_count = 0;
+  held_requests.update(&(event->pid), held);
+}
+
+/*
+ * Hold a lock grant back with the running request of the backend. Returns
+ * 0 if the backend has no running request.
+ */
+static int hold_lock_event(PostgreSQLEvent *event) {
+  HeldRequest *held = held_requests.lookup(&(event->pid));
+  if (!held) return 0;
+
+  u32 index = held->events_count;
+  if (index < HELD_LOCK_EVENTS) {
+    __builtin_memcpy(&(held->events[index]), event, sizeof(PostgreSQLEvent));
+    held->events_count = index + 1;
+  } else {
+    count_dropped_event();
+  }
+
+  return 1;
+}
+
+/*
+ * Submit a held lock grant (filtered with the wait time of its request)
+ */
+static void submit_held_lock_event(struct pt_regs *ctx, PostgreSQLEvent *event,
+                                   u64 wait_ns) {
+  if (FILTER_EVENT(event, wait_ns))
+    lockevents.perf_submit(ctx, event, sizeof(PostgreSQLEvent));
+}
+
+/*
+ * Submit the held LockRelationOid request of the backend and its lock
+ * grants if the request matches. Called when the function returns or when
+ * it is aborted by an error (e.g., by the lock_timeout or a deadlock).
+ */
+static int submit_held_request(struct pt_regs *ctx, PostgreSQLEvent *event) {
+  HeldRequest *held = held_requests.lookup(&(event->pid));
+  if (!held) return 0;
+
+  PostgreSQLEvent *request = &(held->request);
+  u64 wait_ns = event->timestamp - request->timestamp;
+  int match = FILTER_EVENT(request, wait_ns);
+
+#ifdef SLOW_LOCK_THRESHOLD_NS
+  if (wait_ns <= SLOW_LOCK_THRESHOLD_NS) match = 0;
+#endif
+
+  if (match) {
+    lockevents.perf_submit(ctx, request, sizeof(PostgreSQLEvent));
+
+    if (held->events_count > 0)
+      submit_held_lock_event(ctx, &(held->events[0]), wait_ns);
+
+    if (held->events_count > 1)
+      submit_held_lock_event(ctx, &(held->events[1]), wait_ns);
+  }
+
+  held_requests.delete(&(event->pid));
+  return match;
+}
+#else
+/*
+ * The filter results of the running LockRelationOid calls (Key = pid). The
+ * end of a call carries no relation and lock mode, so it is submitted if
+ * and only if its request matched.
+ */
+BPF_HASH(request_matches, u32, u8, 10240);
+
+static int filter_request_end(PostgreSQLEvent *event) {
+  u8 *request_match = request_matches.lookup(&(event->pid));
+  if (!request_match) return 0;
+
+  int match = *request_match;
+  request_matches.delete(&(event->pid));
+  return match;
+}
+#endif
+
+/*
+ * Does the event match the filter? The wait time is only known when
+ * LockRelationOid returns, so the request and its lock grants are held
+ * back until then and submitted together with the end of the request if
+ * the request matches. Without a wait time, the request is filtered on
+ * its own and the end follows the result of its request. With the slow
+ * lock threshold, only the slow LockRelationOid calls (and the errors
+ * that abort them) are submitted.
+ */
+static int filter_event(struct pt_regs *ctx, PostgreSQLEvent *event) {
+#ifdef HOLD_LOCK_REQUESTS
+  u32 event_type = event->event_type;
+
+  if (event_type == EVENT_LOCK_RELATION_OID) {
+    hold_request(event);
+    return 0;
+  }
+
+  if (event_type == EVENT_LOCK_RELATION_OID_END)
+    return submit_held_request(ctx, event);
+
+#ifdef SLOW_LOCK_THRESHOLD_NS
+  /* Only the errors that abort a slow request are submitted */
+  if (event_type == EVENT_ERROR) return submit_held_request(ctx, event);
+#else
+  if (event_type == EVENT_ERROR) submit_held_request(ctx, event);
+#endif
+
+  if ((event_type == EVENT_LOCK_GRANTED ||
+       event_type == EVENT_LOCK_GRANTED_FASTPATH ||
+       event_type == EVENT_LOCK_GRANTED_LOCAL) &&
+      hold_lock_event(event))
+    return 0;
+
+#ifdef SLOW_LOCK_THRESHOLD_NS
+  /* The events outside of the LockRelationOid calls (e.g., the releases) */
+  return 0;
+#endif
+#else
+  if (event->event_type == EVENT_LOCK_RELATION_OID) {
+    u8 match = FILTER_EVENT(event, 0);
+    request_matches.update(&(event->pid), &match);
+    return match;
+  }
+
+  if (event->event_type == EVENT_LOCK_RELATION_OID_END)
+    return filter_request_end(event);
+#endif
+
+  return FILTER_EVENT(event, 0);
+}
+#endif
+
+/*
+ * Submit the event to user space (or aggregate it for the top view)
+ */
+static void submit_event(struct pt_regs *ctx, PostgreSQLEvent *event) {
+#ifdef TOP_VIEW
+  update_top_view(event);
+#else
+#ifdef FILTER_EVENTS
+  if (!filter_event(ctx, event)) return;
+#endif
+  lockevents.perf_submit(ctx, event, sizeof(PostgreSQLEvent));
+#endif
+}
+
+#if defined(STACKTRACE_DEADLOCK) || defined(STACKTRACE_LOCK) || \
+    defined(STACKTRACE_UNLOCK)
+BPF_STACK_TRACE(stacks, 4096);
+#endif
 
 /*
  *  ptype /o RangeVar
@@ -85,12 +478,91 @@ typedef struct RangeVar {
   char *relname;
 } RangeVar;
 
+#ifdef OFF_CPU
+__OFF_CPU__
+#endif
+
+/*
+ * The following part is compiled once per traced binary (cluster). Each
+ * copy gets its own CLUSTER_ID and OFFSET_* defines, and the suffix
+ * __CLUSTER__ of the function names is replaced by the cluster id.
+ */
+__CLUSTER_PROBES__
+
+/*
+ * Get the pid of the current task. Returns 0 if the current task is not
+ * traced (not in the traced cgroup or PID namespace).
+ */
+static int get_traced_pid__CLUSTER__(u32 *pid) {
+#ifdef FILTER_CGROUP
+  if (cgroup_filter.check_current_task(0) != 1) return 0;
+#endif
+
+  /* Report the pid of the PID namespace (e.g., of a container) */
+#ifdef PIDNS_INO
+  struct bpf_pidns_info ns = {};
+  if (bpf_get_ns_current_pid_tgid(PIDNS_DEV, PIDNS_INO, &ns, sizeof(ns)) != 0)
+    return 0;
+
+  *pid = ns.pid;
+#else
+  *pid = bpf_get_current_pid_tgid();
+#endif
+
+  return 1;
+}
+
+/*
+ * Fill the basic data of the event. Returns 0 if the current task is
+ * not traced (not in the traced cgroup or PID namespace).
+ */
+static int fill_basic_data__CLUSTER__(PostgreSQLEvent *event) {
+  if (!get_traced_pid__CLUSTER__(&(event->pid))) return 0;
+
+  event->host_pid = bpf_get_current_pid_tgid();
+  event->cluster = CLUSTER_ID;
+  event->timestamp = bpf_ktime_get_ns();
+  return 1;
+}
+
+/*
+ * ====================================
+ * Table handling
+ * ====================================
+ */
+
+static void handle_table_event__CLUSTER__(PostgreSQLEvent *event,
+                                          struct pt_regs *ctx) {
+  if (!fill_basic_data__CLUSTER__(event)) return;
+
+  bpf_probe_read_kernel(&(event->mode), sizeof(event->mode),
+                        &(PT_REGS_PARM2(ctx)));
+
+  // bpf_trace_printk("Event: %d %d\\n", event.object, event.mode);
+
+  submit_event(ctx, event);
+}
+
+#ifdef TRACE_TABLE
+/*
+ * PostgreSQL: table_open
+ * Parameter 1: Oid relationId
+ * Parameter 2: LOCKMODE lockmode
+ */
+int bpf_table_open__CLUSTER__(struct pt_regs *ctx) {
+  PostgreSQLEvent event = {.event_type = EVENT_TABLE_OPEN};
+  bpf_probe_read_kernel(&(event.object), sizeof(event.object),
+                        &(PT_REGS_PARM1(ctx)));
+  handle_table_event__CLUSTER__(&event, ctx);
+  return 0;
+}
+
 /*
  * PostgreSQL: table_openrv
  * Parameter 1: const RangeVar *relation
  * Parameter 2: LOCKMODE lockmode
  */
-int bpf_table_openrv(struct pt_regs *ctx, RangeVar *relation) {
+int bpf_table_openrv__CLUSTER__(struct pt_regs *ctx, RangeVar *relation) {
   PostgreSQLEvent event = {.event_type = EVENT_TABLE_OPEN_RV};
 
   bpf_probe_read_user_str(event.payload_str1, sizeof(event.payload_str1),
@@ -98,7 +570,7 @@ int bpf_table_openrv(struct pt_regs *ctx, RangeVar *relation) {
   bpf_probe_read_user_str(event.payload_str2, sizeof(event.payload_str2),
                           (void *)relation->relname);
 
-  handle_table_event(&event, ctx);
+  handle_table_event__CLUSTER__(&event, ctx);
 
   return 0;
 }
@@ -109,7 +581,8 @@ int bpf_table_openrv(struct pt_regs *ctx, RangeVar *relation) {
  * Parameter 2: LOCKMODE lockmode
  * Parameter 3: bool missing_ok
  */
-int bpf_table_openrv_extended(struct pt_regs *ctx, RangeVar *relation) {
+int bpf_table_openrv_extended__CLUSTER__(struct pt_regs *ctx,
+                                         RangeVar *relation) {
   PostgreSQLEvent event = {.event_type = EVENT_TABLE_OPEN_RV_EXTENDED};
 
   bpf_probe_read_user_str(event.payload_str1, sizeof(event.payload_str1),
@@ -117,16 +590,17 @@ int bpf_table_openrv_extended(struct pt_regs *ctx, RangeVar *relation) {
   bpf_probe_read_user_str(event.payload_str2, sizeof(event.payload_str2),
                           (void *)relation->relname);
 
-  handle_table_event(&event, ctx);
+  handle_table_event__CLUSTER__(&event, ctx);
 
   return 0;
 }
 
-int bpf_table_close(struct pt_regs *ctx) {
+int bpf_table_close__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_TABLE_CLOSE};
 
   // Param 1 is a Relation struct
-  // The Oid rd_id is stored at byte 72 (PG 15.1)
+  // The Oid rd_id is stored at byte 72 (PG 15.1), the offset of the
+  // traced binary is provided as OFFSET_RELATIONDATA_RD_ID
 
   // gdb: ptype /o Relation
   //
@@ -151,23 +625,18 @@ int bpf_table_close(struct pt_regs *ctx) {
   // /*   72      |     4 */    Oid rd_id;
   // [....]
 
-  char buffer[76];
-  bpf_probe_read_user(buffer, sizeof(buffer), (void *)PT_REGS_PARM1(ctx));
-  bpf_probe_read_kernel(&(event.object), sizeof(event.object), &(buffer[72]));
-
-  // Oid oid;
-  // bpf_probe_read_kernel(&oid, sizeof(oid), &(buffer[72]));
-  // bpf_probe_read_kernel(&(event.object), sizeof(event.object),
-  // &(PT_REGS_PARM1(ctx))); bpf_trace_printk("Oid: %d \\n", oid);
+  bpf_probe_read_user(&(event.object), sizeof(event.object),
+                      (void *)(PT_REGS_PARM1(ctx) + OFFSET_RELATIONDATA_RD_ID));
 
-  handle_table_event(&event, ctx);
+  handle_table_event__CLUSTER__(&event, ctx);
   return 0;
 }
+#endif /* TRACE_TABLE */
 
-static void fill_basic_data_and_submit(PostgreSQLEvent *event,
-                                       struct pt_regs *ctx) {
-  fill_basic_data(event);
-  lockevents.perf_submit(ctx, event, sizeof(PostgreSQLEvent));
+static void fill_basic_data_and_submit__CLUSTER__(PostgreSQLEvent *event,
+                                                  struct pt_regs *ctx) {
+  if (!fill_basic_data__CLUSTER__(event)) return;
+  submit_event(ctx, event);
 }
 
 /*
@@ -175,40 +644,45 @@ static void fill_basic_data_and_submit(PostgreSQLEvent *event,
  * Query handling
  * ====================================
  */
-int bpf_query_begin(struct pt_regs *ctx) {
+#ifdef TRACE_QUERY
+int bpf_query_begin__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_QUERY_BEGIN};
   bpf_probe_read_user_str(event.payload_str1, sizeof(event.payload_str1),
                           (void *)PT_REGS_PARM1(ctx));
-  fill_basic_data_and_submit(&event, ctx);
+  fill_basic_data_and_submit__CLUSTER__(&event, ctx);
   return 0;
 }
 
 /*
  * Query return probe
  */
-int bpf_query_end(struct pt_regs *ctx) {
+int bpf_query_end__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_QUERY_END};
-  fill_basic_data_and_submit(&event, ctx);
+  fill_basic_data_and_submit__CLUSTER__(&event, ctx);
   return 0;
 }
+#endif /* TRACE_QUERY */
 
 /*
  * ====================================
  * Error handling
  * ====================================
  */
-int bpf_errstart(struct pt_regs *ctx) {
+#ifdef TRACE_ERROR
+int bpf_errstart__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_ERROR};
-  fill_basic_data(&event);
+  if (!fill_basic_data__CLUSTER__(&event)) return 0;
+
   bpf_probe_read_kernel(&event.mode, sizeof(event.mode),
                         (void *)&(PT_REGS_PARM1(ctx)));
 
   if (event.mode >= PGERROR_ERROR) {
-    lockevents.perf_submit(ctx, &event, sizeof(PostgreSQLEvent));
+    submit_event(ctx, &event);
   }
 
   return 0;
 }
+#endif /* TRACE_ERROR */
 
 /*
  * ====================================
@@ -216,12 +690,13 @@ int bpf_errstart(struct pt_regs *ctx) {
  * ====================================
  */
 
+#ifdef TRACE_LOCK
 /*
  * PSQL: LockRelationOid
  * Parameter 1: Oid
  * Parameter 2: LOCKMODE
  */
-int bpf_lock_relation_oid(struct pt_regs *ctx) {
+int bpf_lock_relation_oid__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_LOCK_RELATION_OID};
   bpf_probe_read_kernel(&(event.object), sizeof(event.object),
                         &(PT_REGS_PARM1(ctx)));
@@ -230,16 +705,27 @@ int bpf_lock_relation_oid(struct pt_regs *ctx) {
   event.stackid = stacks.get_stackid(ctx, BPF_F_USER_STACK);
 #endif
 
-  handle_table_event(&event, ctx);
+  handle_table_event__CLUSTER__(&event, ctx);
+
+#ifdef OFF_CPU
+  /* The timestamp is only set for the traced backends */
+  if (event.timestamp)
+    off_cpu_wait_begin(event.host_pid, event.pid, CLUSTER_ID, event.object,
+                       event.timestamp);
+#endif
   return 0;
 }
 
 /*
  * PSQL: LockRelationOid - Return probe
  */
-int bpf_lock_relation_oid_end(struct pt_regs *ctx) {
+int bpf_lock_relation_oid_end__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_LOCK_RELATION_OID_END};
-  fill_basic_data_and_submit(&event, ctx);
+  fill_basic_data_and_submit__CLUSTER__(&event, ctx);
+
+#ifdef OFF_CPU
+  if (event.timestamp) off_cpu_wait_end(event.host_pid, event.timestamp);
+#endif
   return 0;
 }
 
@@ -248,18 +734,20 @@ int bpf_lock_relation_oid_end(struct pt_regs *ctx) {
  * Parameter 1: Oid
  * Parameter 2: LOCKMODE
  */
-int bpf_unlock_relation_oid(struct pt_regs *ctx) {
+int bpf_unlock_relation_oid__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_UNLOCK_RELATION_OID};
   bpf_probe_read_kernel(&(event.object), sizeof(event.object),
                         &(PT_REGS_PARM1(ctx)));
-  handle_table_event(&event, ctx);
+  handle_table_event__CLUSTER__(&event, ctx);
   return 0;
 }
 
 /*
  * Parse the LOCK Structure
-
- * PG 14.2
+ *
+ * The offsets of the traced binary are provided as OFFSET_ defines
+ * (see struct_offsets.py). The layout of PG 14.2 is:
+ *
  * (gdb) ptype /o lock
  * type = struct LOCK {
  *    0      |    16 *    LOCKTAG tag;
@@ -272,6 +760,9 @@ int bpf_unlock_relation_oid(struct pt_regs *ctx) {
  *  108      |    40 *    int granted[10];
  *  148      |     4 *    int nGranted;
  *
+ * The number of waiting processes is the member 'size' of the PROC_QUEUE
+ * waitProcs (the member 'count' of a dclist_head in PG >= 16).
+ *
  * (gdb) ptype /o LOCKTAG
  * type = struct LOCKTAG {
  *    0      |     4 *    uint32 locktag_field1; // Database OID (see
@@ -283,12 +774,66 @@ int bpf_unlock_relation_oid(struct pt_regs *ctx) {
  *   14      |     1 *    uint8 locktag_type;
  *   15      |     1 *    uint8 locktag_lockmethodid;
  */
-static void fill_lock_object(PostgreSQLEvent *event, void *param) {
-  char buffer[108];
-  bpf_probe_read_user(buffer, sizeof(buffer), param);
-  bpf_probe_read_kernel(&(event->object), sizeof(event->object), &(buffer[4]));
-  bpf_probe_read_kernel(&(event->requested), sizeof(event->requested),
-                        &(buffer[104]));
+static void fill_locktag__CLUSTER__(PostgreSQLEvent *event, void *locktag) {
+  bpf_probe_read_user(&(event->locktag_field1), LOCKTAG_SIZE, locktag);
+
+  /* The relation OID of relation locks */
+  event->object = event->locktag_field2;
+}
+
+static void fill_lock_object__CLUSTER__(PostgreSQLEvent *event, void *param) {
+  /* LOCKTAG is the first member of LOCK */
+  fill_locktag__CLUSTER__(event, param);
+  bpf_probe_read_user(&(event->requested), sizeof(event->requested),
+                      param + OFFSET_LOCK_NREQUESTED);
+  bpf_probe_read_user(&(event->grant_mask), sizeof(event->grant_mask),
+                      param + OFFSET_LOCK_GRANTMASK);
+  bpf_probe_read_user(&(event->wait_mask), sizeof(event->wait_mask),
+                      param + OFFSET_LOCK_WAITMASK);
+  bpf_probe_read_user(&(event->granted), sizeof(event->granted),
+                      param + OFFSET_LOCK_NGRANTED);
+  bpf_probe_read_user(&(event->waiting), sizeof(event->waiting),
+                      param + OFFSET_LOCK_WAITPROCS + OFFSET_WAIT_QUEUE_SIZE);
+}
+
+/*
+ * Add the state of the shared LOCK to the contention of the lock target.
+ * Only called for traced tasks (after fill_basic_data).
+ */
+static void update_contention__CLUSTER__(PostgreSQLEvent *event) {
+#ifdef CONTENTION_STATS
+  LockTarget target = {.cluster = event->cluster,
+                       .locktag_field1 = event->locktag_field1,
+                       .locktag_field2 = event->locktag_field2,
+                       .locktag_field3 = event->locktag_field3,
+                       .locktag_field4 = event->locktag_field4,
+                       .locktag_type = event->locktag_type,
+                       .locktag_lockmethodid = event->locktag_lockmethodid};
+  LockContention zero = {};
+
+  LockContention *contention =
+      lock_contention.lookup_or_try_init(&target, &zero);
+
+  if (!contention) return;
+
+  if (event->event_type == EVENT_LOCK_GRANTED)
+    __sync_fetch_and_add(&(contention->grants), 1);
+  else
+    __sync_fetch_and_add(&(contention->ungrants), 1);
+
+  __sync_fetch_and_add(&(contention->waiting_sum), event->waiting);
+
+  /* Concurrent updates of the maximum and the masks might get lost, this
+   * is accepted for the statistics */
+  if (event->waiting > contention->waiting_max)
+    contention->waiting_max = event->waiting;
+
+  if (event->granted > contention->granted_max)
+    contention->granted_max = event->granted;
+
+  contention->grant_mask |= event->grant_mask;
+  contention->wait_mask |= event->wait_mask;
+#endif
 }
 
 /*
@@ -297,13 +842,15 @@ static void fill_lock_object(PostgreSQLEvent *event, void *param) {
  * Parameter 2 PROCLOCK
  * Parameter 3 LOCKMODE
  */
-int bpf_lock_grant(struct pt_regs *ctx) {
+int bpf_lock_grant__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_LOCK_GRANTED};
   bpf_probe_read_kernel(&(event.mode), sizeof(event.mode),
                         &(PT_REGS_PARM3(ctx)));
-  fill_lock_object(&event, (void *)PT_REGS_PARM1(ctx));
+  fill_lock_object__CLUSTER__(&event, (void *)PT_REGS_PARM1(ctx));
+  if (!fill_basic_data__CLUSTER__(&event)) return 0;
 
-  if (event.object != 0) fill_basic_data_and_submit(&event, ctx);
+  update_contention__CLUSTER__(&event);
+  submit_event(ctx, &event);
 
   return 0;
 }
@@ -313,13 +860,14 @@ int bpf_lock_grant(struct pt_regs *ctx) {
  * Parameter 1 OID
  * Parameter 2 LOCKMODE
  */
-int bpf_lock_fastpath_grant(struct pt_regs *ctx) {
+int bpf_lock_fastpath_grant__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_LOCK_GRANTED_FASTPATH};
   bpf_probe_read_kernel(&(event.object), sizeof(event.object),
                         &(PT_REGS_PARM1(ctx)));
   bpf_probe_read_kernel(&(event.mode), sizeof(event.mode),
                         &(PT_REGS_PARM2(ctx)));
-  fill_basic_data_and_submit(&event, ctx);
+  event.locktag_field2 = event.object;
+  fill_basic_data_and_submit__CLUSTER__(&event, ctx);
   return 0;
 }
 
@@ -349,13 +897,15 @@ int bpf_lock_fastpath_grant(struct pt_regs *ctx) {
  *   16      |     4 *    LOCKMODE mode;
  *
  */
-static void fill_locallock_object(PostgreSQLEvent *event, void *param) {
-  char buffer[48];
-  bpf_probe_read_user(buffer, sizeof(buffer), param);
-  bpf_probe_read_kernel(&(event->object), sizeof(event->object), &(buffer[4]));
-  bpf_probe_read_kernel(&(event->lock_local_hold),
-                        sizeof(event->lock_local_hold), &(buffer[40]));
-  bpf_probe_read_kernel(&(event->mode), sizeof(event->mode), &(buffer[16]));
+static void fill_locallock_object__CLUSTER__(PostgreSQLEvent *event,
+                                             void *param) {
+  /* LOCALLOCKTAG is the first member of LOCALLOCK, LOCKTAG the first
+   * member of LOCALLOCKTAG */
+  fill_locktag__CLUSTER__(event, param);
+  bpf_probe_read_user(&(event->lock_local_hold), sizeof(event->lock_local_hold),
+                      param + OFFSET_LOCALLOCK_NLOCKS);
+  bpf_probe_read_user(&(event->mode), sizeof(event->mode),
+                      param + OFFSET_LOCALLOCKTAG_MODE);
 }
 
 /*
@@ -363,11 +913,11 @@ static void fill_locallock_object(PostgreSQLEvent *event, void *param) {
  * Parameter 1 LOCALLOCK
  * Parameter 2 ResourceOwner
  */
-int bpf_lock_local_grant(struct pt_regs *ctx) {
+int bpf_lock_local_grant__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_LOCK_GRANTED_LOCAL};
-  fill_locallock_object(&event, (void *)PT_REGS_PARM1(ctx));
+  fill_locallock_object__CLUSTER__(&event, (void *)PT_REGS_PARM1(ctx));
 
-  if (event.object != 0) fill_basic_data_and_submit(&event, ctx);
+  fill_basic_data_and_submit__CLUSTER__(&event, ctx);
 
   return 0;
 }
@@ -377,17 +927,20 @@ int bpf_lock_local_grant(struct pt_regs *ctx) {
  * Parameter 1 LOCK
  * Parameter 2 LOCKMODE
  */
-int bpf_lock_ungrant(struct pt_regs *ctx) {
+int bpf_lock_ungrant__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_LOCK_UNGRANTED};
   bpf_probe_read_kernel(&(event.mode), sizeof(event.mode),
                         &(PT_REGS_PARM2(ctx)));
-  fill_lock_object(&event, (void *)PT_REGS_PARM1(ctx));
+  fill_lock_object__CLUSTER__(&event, (void *)PT_REGS_PARM1(ctx));
+  if (!fill_basic_data__CLUSTER__(&event)) return 0;
+
+  update_contention__CLUSTER__(&event);
 
 #ifdef STACKTRACE_UNLOCK
   event.stackid = stacks.get_stackid(ctx, BPF_F_USER_STACK);
 #endif
 
-  if (event.object != 0) fill_basic_data_and_submit(&event, ctx);
+  submit_event(ctx, &event);
 
   return 0;
 }
@@ -397,18 +950,19 @@ int bpf_lock_ungrant(struct pt_regs *ctx) {
  * Parameter 1 Oid
  * Parameter 2 LOCKMODE
  */
-int bpf_lock_fastpath_ungrant(struct pt_regs *ctx) {
+int bpf_lock_fastpath_ungrant__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_LOCK_UNGRANTED_FASTPATH};
   bpf_probe_read_kernel(&(event.object), sizeof(event.object),
                         &(PT_REGS_PARM1(ctx)));
   bpf_probe_read_kernel(&(event.mode), sizeof(event.mode),
                         &(PT_REGS_PARM2(ctx)));
+  event.locktag_field2 = event.object;
 
 #ifdef STACKTRACE_UNLOCK
   event.stackid = stacks.get_stackid(ctx, BPF_F_USER_STACK);
 #endif
 
-  fill_basic_data_and_submit(&event, ctx);
+  fill_basic_data_and_submit__CLUSTER__(&event, ctx);
 
   return 0;
 }
@@ -417,25 +971,27 @@ int bpf_lock_fastpath_ungrant(struct pt_regs *ctx) {
  * PSQL: RemoveLocalLock
  * Parameter 1: LOCALLOCK
  */
-int bfp_local_lock_ungrant(struct pt_regs *ctx) {
+int bfp_local_lock_ungrant__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_LOCK_UNGRANTED_LOCAL};
-  fill_locallock_object(&event, (void *)PT_REGS_PARM1(ctx));
+  fill_locallock_object__CLUSTER__(&event, (void *)PT_REGS_PARM1(ctx));
 
-  if (event.object != 0) fill_basic_data_and_submit(&event, ctx);
+  fill_basic_data_and_submit__CLUSTER__(&event, ctx);
 
   return 0;
 }
+#endif /* TRACE_LOCK */
 
+#ifdef TRACE_TRANSACTION
 /*
  * Deadlock detected
  * PSQL: DeadLockReport
  */
-int bpf_deadlock(struct pt_regs *ctx) {
+int bpf_deadlock__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_DEADLOCK};
 #ifdef STACKTRACE_DEADLOCK
   event.stackid = stacks.get_stackid(ctx, BPF_F_USER_STACK);
 #endif
-  fill_basic_data_and_submit(&event, ctx);
+  fill_basic_data_and_submit__CLUSTER__(&event, ctx);
   return 0;
 }
 
@@ -448,29 +1004,30 @@ int bpf_deadlock(struct pt_regs *ctx) {
 /*
  * PSQL: StartTransaction
  */
-int bpf_transaction_begin(struct pt_regs *ctx) {
+int bpf_transaction_begin__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_TRANSACTION_BEGIN};
-  fill_basic_data_and_submit(&event, ctx);
+  fill_basic_data_and_submit__CLUSTER__(&event, ctx);
   return 0;
 }
 
 /*
  * PSQL: CommitTransaction
  */
-int bpf_transaction_commit(struct pt_regs *ctx) {
+int bpf_transaction_commit__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_TRANSACTION_COMMIT};
-  fill_basic_data_and_submit(&event, ctx);
+  fill_basic_data_and_submit__CLUSTER__(&event, ctx);
   return 0;
 }
 
 /*
  * PSQL: AbortTransaction
  */
-int bpf_transaction_abort(struct pt_regs *ctx) {
+int bpf_transaction_abort__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_TRANSACTION_ABORT};
-  fill_basic_data_and_submit(&event, ctx);
+  fill_basic_data_and_submit__CLUSTER__(&event, ctx);
   return 0;
 }
+#endif /* TRACE_TRANSACTION */
 
 /*
  * ====================================
@@ -478,11 +1035,145 @@ int bpf_transaction_abort(struct pt_regs *ctx) {
  * ====================================
  */
 
+#ifdef TRACE_INVALIDATION
 /*
  * PSQL: AcceptInvalidationMessages
  */
-int bpf_accept_invalidation_messages(struct pt_regs *ctx) {
+int bpf_accept_invalidation_messages__CLUSTER__(struct pt_regs *ctx) {
   PostgreSQLEvent event = {.event_type = EVENT_INVALIDATION_MESSAGES_ACCEPT};
-  fill_basic_data_and_submit(&event, ctx);
+  fill_basic_data_and_submit__CLUSTER__(&event, ctx);
   return 0;
-}
\ No newline at end of file
+}
+#endif /* TRACE_INVALIDATION */
+
+/*
+ * ====================================
+ * Catalog statistics
+ * ====================================
+ */
+
+#ifdef CATALOG_STATS
+/*
+ * A catalog function is called (for the given relation)
+ */
+static void catalog_call_begin__CLUSTER__(u32 function, u32 oid) {
+  CatalogCall call = {.oid = oid};
+  if (!get_traced_pid__CLUSTER__(&(call.pid))) return;
+
+  u32 tid = bpf_get_current_pid_tgid();
+  u64 thread = ((u64)function << 32) | tid;
+  u32 zero = 0;
+  u32 *depth = catalog_depths.lookup_or_try_init(&thread, &zero);
+  if (!depth) {
+    count_dropped_catalog_call();
+    return;
+  }
+
+  CatalogCallKey key = {.tid = tid, .function = function, .depth = *depth};
+  (*depth)++;
+
+  call.start = bpf_ktime_get_ns();
+  if (key.depth >= CATALOG_MAX_DEPTH || catalog_calls.update(&key, &call) != 0)
+    count_dropped_catalog_call();
+}
+
+/*
+ * A catalog function returns, add the duration to the histogram
+ */
+static void catalog_call_end__CLUSTER__(u32 function) {
+  u32 tid = bpf_get_current_pid_tgid();
+  u64 thread = ((u64)function << 32) | tid;
+  u32 *depth = catalog_depths.lookup(&thread);
+  if (!depth || *depth == 0) return;
+
+  (*depth)--;
+  CatalogCallKey key = {.tid = tid, .function = function, .depth = *depth};
+  if (key.depth == 0) catalog_depths.delete(&thread);
+
+  CatalogCall *call = catalog_calls.lookup(&key);
+  if (!call) return;
+
+  u64 duration = bpf_ktime_get_ns() - call->start;
+  CatalogTimeKey time_key = {.pid = call->pid,
+                             .cluster = CLUSTER_ID,
+                             .function = function,
+                             .oid = call->oid,
+                             .bucket = bpf_log2l(duration)};
+  catalog_calls.delete(&key);
+
+  CatalogTime zero = {};
+  CatalogTime *time = catalog_times.lookup_or_try_init(&time_key, &zero);
+  if (!time) {
+    count_dropped_catalog_call();
+    return;
+  }
+
+  __sync_fetch_and_add(&(time->calls), 1);
+  __sync_fetch_and_add(&(time->total_ns), duration);
+}
+
+/*
+ * PSQL: errstart
+ * Parameter 1: int elevel
+ *
+ * An error aborts the running calls of the backend (the return probes are
+ * not called), so the nesting depths of the thread are reset.
+ */
+int bpf_catalog_errstart__CLUSTER__(struct pt_regs *ctx) {
+  int elevel = PT_REGS_PARM1(ctx);
+  if (elevel < PGERROR_ERROR) return 0;
+
+  u32 tid = bpf_get_current_pid_tgid();
+  reset_catalog_depth(CATALOG_FUNCTION_ACCEPT_INVALIDATION_MESSAGES, tid);
+  reset_catalog_depth(CATALOG_FUNCTION_TABLE_OPEN, tid);
+  reset_catalog_depth(CATALOG_FUNCTION_RELATION_BUILD_DESC, tid);
+  return 0;
+}
+
+/*
+ * PSQL: AcceptInvalidationMessages
+ */
+int bpf_catalog_invalidation__CLUSTER__(struct pt_regs *ctx) {
+  catalog_call_begin__CLUSTER__(CATALOG_FUNCTION_ACCEPT_INVALIDATION_MESSAGES,
+                                0);
+  return 0;
+}
+
+int bpf_catalog_invalidation_end__CLUSTER__(struct pt_regs *ctx) {
+  catalog_call_end__CLUSTER__(CATALOG_FUNCTION_ACCEPT_INVALIDATION_MESSAGES);
+  return 0;
+}
+
+/*
+ * PSQL: table_open
+ * Parameter 1: Oid relationId
+ */
+int bpf_catalog_table_open__CLUSTER__(struct pt_regs *ctx) {
+  catalog_call_begin__CLUSTER__(CATALOG_FUNCTION_TABLE_OPEN,
+                                PT_REGS_PARM1(ctx));
+  return 0;
+}
+
+int bpf_catalog_table_open_end__CLUSTER__(struct pt_regs *ctx) {
+  catalog_call_end__CLUSTER__(CATALOG_FUNCTION_TABLE_OPEN);
+  return 0;
+}
+
+/*
+ * PSQL: RelationBuildDesc (builds a relcache entry)
+ * Parameter 1: Oid targetRelId
+ *
+ * RelationBuildDesc can be called recursively, each call is measured (the
+ * time of the outer call contains the time of the inner calls).
+ */
+int bpf_catalog_relation_build_desc__CLUSTER__(struct pt_regs *ctx) {
+  catalog_call_begin__CLUSTER__(CATALOG_FUNCTION_RELATION_BUILD_DESC,
+                                PT_REGS_PARM1(ctx));
+  return 0;
+}
+
+int bpf_catalog_relation_build_desc_end__CLUSTER__(struct pt_regs *ctx) {
+  catalog_call_end__CLUSTER__(CATALOG_FUNCTION_RELATION_BUILD_DESC);
+  return 0;
+}
+#endif /* CATALOG_STATS */
@@ -11,34 +11,490 @@ typedef enum LWLockMode {
 /* Placeholder for auto generated defines */
 __DEFINES__
 
+/* The size of the tranche names */
+#define TRANCHE_NAME_SIZE 255
+
 typedef struct LockEvent_t {
   u32 pid;
   u64 timestamp;
   u32 event_type;
 
-  /* LWLock tranche name (see T_NAME / GetLWTrancheName()
-   * in lwlock.c) */
-  char tranche[255];
+  /* The address of the LWLock tranche name (see T_NAME /
+   * GetLWTrancheName() in lwlock.c). The name is stored once per
+   * address in tranche_names. */
+  u64 tranche;
 
   /* LWLockMode */
   u32 mode;
+
+  /* The wait time (WAIT_DONE, see pair_wait) */
+  u64 wait_ns;
 } LockEvent;
 
 BPF_PERF_OUTPUT(lockevents);
 
+typedef struct TrancheName {
+  char name[TRANCHE_NAME_SIZE];
+} TrancheName;
+
+/*
+ * The tranche names (Key = address of the name). The addresses are
+ * stable for the lifetime of the processes, so each name is copied only
+ * once and resolved by the tracer in user space.
+ */
+BPF_HASH(tranche_names, u64, TrancheName, 1024);
+
+/* The TrancheName is too large for the BPF stack (together with the event) */
+BPF_PERCPU_ARRAY(tranche_name_buffer, TrancheName, 1);
+
+typedef struct LockWait {
+  u64 start;  // Start of the wait
+  u32 mode;
+  u64 tranche;  // The address of the tranche name
+} LockWait;
+
+/* The running waits (Key = pid) */
+BPF_HASH(lock_waits, u32, LockWait, 10240);
+
+/* Number of events that could not be aggregated (a map is full) */
+BPF_ARRAY(dropped_events, u64, 1);
+
+static void count_dropped_event() {
+  int zero = 0;
+  u64 *dropped = dropped_events.lookup(&zero);
+  if (dropped) __sync_fetch_and_add(dropped, 1);
+}
+
+/*
+ * The traced pids (-p together with -x). The probes are attached to all
+ * processes of the binary, so the pids are filtered in the kernel.
+ */
+#ifdef PID_FILTER
+BPF_HASH(traced_pids, u32, u8, 10240);
+#endif
+
+static int is_traced_pid(u32 pid) {
+#ifdef PID_FILTER
+  return traced_pids.lookup(&pid) ? 1 : 0;
+#else
+  return 1;
+#endif
+}
+
+#ifdef OFF_CPU
+__OFF_CPU__
+#endif
+
+/*
+ * The wait times per tranche and mode in log2 histograms (--statistics)
+ */
+#ifdef WAIT_HISTOGRAMS
+typedef struct WaitHistogramKey {
+  u64 tranche;  // The address of the tranche name
+  u32 mode;
+  u32 bucket;  // The log2 bucket of the wait time
+} WaitHistogramKey;
+
+typedef struct WaitHistogramValue {
+  u64 waits;    // Number of waits
+  u64 wait_ns;  // Total wait time
+} WaitHistogramValue;
+
+BPF_HASH(wait_histograms, WaitHistogramKey, WaitHistogramValue, 10240);
+
+/*
+ * Add a finished wait to the histogram of the tranche and mode
+ */
+static void update_wait_histogram(LockEvent *event) {
+  WaitHistogramKey key = {.tranche = event->tranche,
+                          .mode = event->mode,
+                          .bucket = bpf_log2l(event->wait_ns)};
+  WaitHistogramValue zero = {};
+  WaitHistogramValue *value = wait_histograms.lookup_or_try_init(&key, &zero);
+  if (!value) {
+    count_dropped_event();
+    return;
+  }
+
+  __sync_fetch_and_add(&(value->waits), 1);
+  __sync_fetch_and_add(&(value->wait_ns), event->wait_ns);
+}
+#endif
+
+/*
+ * The state of the top view (--top). The events are counted and the lock
+ * waits are aggregated in the kernel instead of submitting the events.
+ */
+#ifdef TOP_VIEW
+typedef struct TrancheWait {
+  u64 waits;        // Number of waits
+  u64 wait_ns;      // Total wait time
+  u64 wait_max_ns;  // Longest wait
+} TrancheWait;
+
+/* The waits per tranche (Key = address of the tranche name) */
+BPF_HASH(tranche_waits, u64, TrancheWait, 1024);
+
+/* Number of events per event type */
+BPF_HASH(event_counts, u32, u64, 64);
+
+/*
+ * Aggregate a finished lock wait into the wait time of the tranche
+ */
+static void update_tranche_wait(LockEvent *event) {
+  TrancheWait zero = {};
+  TrancheWait *tranche_wait =
+      tranche_waits.lookup_or_try_init(&(event->tranche), &zero);
+  if (!tranche_wait) {
+    count_dropped_event();
+    return;
+  }
+
+  __sync_fetch_and_add(&(tranche_wait->waits), 1);
+  __sync_fetch_and_add(&(tranche_wait->wait_ns), event->wait_ns);
+
+  /* Concurrent updates of the maximum might get lost, this is accepted */
+  if (event->wait_ns > tranche_wait->wait_max_ns)
+    tranche_wait->wait_max_ns = event->wait_ns;
+}
+#endif
+
+/*
+ * Pair the start and the end of a wait of the backend. The WAIT_DONE
+ * event gets the wait time, and the wait is aggregated in the kernel.
+ */
+static void pair_wait(LockEvent *event) {
+  if (event->event_type == EVENT_WAIT_START) {
+    LockWait wait = {.start = event->timestamp,
+                     .mode = event->mode,
+                     .tranche = event->tranche};
+
+    if (lock_waits.update(&(event->pid), &wait) != 0) count_dropped_event();
+
+#ifdef OFF_CPU
+    off_cpu_wait_begin(event->pid, event->pid, 0, event->tranche,
+                       event->timestamp);
+#endif
+    return;
+  }
+
+  if (event->event_type != EVENT_WAIT_DONE) return;
+
+#ifdef OFF_CPU
+  off_cpu_wait_end(event->pid, event->timestamp);
+#endif
+
+  /* The start of the wait was not traced */
+  LockWait *wait = lock_waits.lookup(&(event->pid));
+  if (!wait) return;
+
+  event->wait_ns = event->timestamp - wait->start;
+  lock_waits.delete(&(event->pid));
+
+#ifdef WAIT_HISTOGRAMS
+  update_wait_histogram(event);
+#endif
+
+#ifdef TOP_VIEW
+  update_tranche_wait(event);
+#endif
+}
+
+/*
+ * Copy the tranche name into tranche_names (once per address)
+ */
+static void register_tranche(u64 tranche_addr) {
+  if (tranche_names.lookup(&tranche_addr)) return;
+
+  int zero = 0;
+  TrancheName *name = tranche_name_buffer.lookup(&zero);
+  if (!name) return;
+
+  bpf_probe_read_user_str(name->name, sizeof(name->name), (void *)tranche_addr);
+  tranche_names.update(&tranche_addr, name);
+}
+
 static void fill_and_submit(struct pt_regs *ctx, LockEvent *event,
                             uint64_t tranche_addr) {
-  bpf_probe_read_user_str(event->tranche, sizeof(event->tranche),
-                          (void *)tranche_addr);
   event->pid = bpf_get_current_pid_tgid();
+  if (!is_traced_pid(event->pid)) return;
+
+  register_tranche(tranche_addr);
+
+  event->tranche = tranche_addr;
   event->timestamp = bpf_ktime_get_ns();
 
-  // sudo cat /sys/kernel/debug/tracing/trace_pipe
-  // bpf_trace_printk("LW lock event for trance: %s\\n", tranche);
+  pair_wait(event);
 
+#if defined(TOP_VIEW)
+  event_counts.increment(event->event_type);
+#elif !defined(STATISTICS_ONLY)
   lockevents.perf_submit(ctx, event, sizeof(LockEvent));
+#endif
+}
+
+#ifdef LWLOCK_UPROBES
+/*
+ * The uprobe mode (--uprobes). The probes are attached to the LWLock
+ * functions (PostgreSQL does not need to be compiled with
+ * '--enable-dtrace'). They see the LWLock itself, so the waits and the
+ * hold times are aggregated per lock instance (e.g., per partition of the
+ * buffer mapping) instead of submitting events.
+ */
+
+/* The traced LWLock functions */
+#define LWLOCK_ACQUIRE 1
+#define LWLOCK_CONDITIONAL_ACQUIRE 2
+#define LWLOCK_WAIT_FOR_VAR 3
+
+typedef struct LWLockCall {
+  u64 lock;  // The address of the LWLock
+  u64 start;
+  u32 function;
+} LWLockCall;
+
+/* The running calls of the LWLock functions (Key = pid) */
+BPF_HASH(lwlock_calls, u32, LWLockCall, 10240);
+
+typedef struct HeldLockKey {
+  u64 lock;  // The address of the LWLock
+  u32 pid;
+  u32 pad;
+} HeldLockKey;
+
+/* The acquire time of the held LWLocks */
+BPF_HASH(held_lwlocks, HeldLockKey, u64, 65536);
+
+typedef struct LockInstance {
+  u32 tranche_id;  // LWLock.tranche
+  u32 pad;
+  u64 acquires;       // LWLockAcquire calls
+  u64 waits;          // LWLockAcquire calls that had to wait
+  u64 wait_ns;        // Total wait time of LWLockAcquire
+  u64 wait_max_ns;    // Longest wait of LWLockAcquire
+  u64 cond_acquires;  // Successful LWLockConditionalAcquire calls
+  u64 cond_fails;     // Failed LWLockConditionalAcquire calls
+  u64 holds;          // Releases of locks that were acquired during the trace
+  u64 hold_ns;        // Total hold time
+  u64 hold_max_ns;    // Longest hold time
+  u64 var_waits;      // LWLockWaitForVar calls
+  u64 var_wait_ns;    // Total time in LWLockWaitForVar
+} LockInstance;
+
+/* The statistics per lock instance (Key = address of the LWLock) */
+BPF_HASH(lock_instances, u64, LockInstance, 65536);
+
+/*
+ * The waits for the content locks of the buffers per page (--buffer-pages)
+ */
+#ifdef BUFFER_PAGES
+/* The size of a BufferDesc in the array (BUFFERDESC_PAD_TO_SIZE) */
+#define BUFFERDESC_PAD_TO_SIZE 64
+
+typedef struct BufferDescriptors {
+  u64 address;  // BufferDescriptors
+  u64 count;    // NBuffers
+} BufferDescriptors;
+
+/* The buffer descriptors of the traced processes (set by the tracer) */
+BPF_ARRAY(buffer_descriptors, BufferDescriptors, 1);
+
+/* The BufferTag (the same layout in all supported versions) */
+typedef struct BufferTag {
+  u32 spc;
+  u32 db;
+  u32 rel;  // relfilenode
+  u32 fork;
+  u32 block;
+} BufferTag;
+
+typedef struct BufferPage {
+  u64 waits;        // Number of waits for the content lock
+  u64 wait_ns;      // Total wait time
+  u64 wait_max_ns;  // Longest wait
+} BufferPage;
+
+BPF_HASH(buffer_pages, BufferTag, BufferPage, 65536);
+
+/*
+ * Add a wait to the page of the buffer, if the lock is the content lock
+ * of a buffer. The lock is held, so the buffer contains the page.
+ */
+static void update_buffer_page(u64 lock, u64 wait_ns) {
+  int zero = 0;
+  BufferDescriptors *descriptors = buffer_descriptors.lookup(&zero);
+  if (!descriptors || !descriptors->address) return;
+
+  if (lock < descriptors->address + OFFSET_BUFFERDESC_CONTENT_LOCK) return;
+
+  u64 descriptor = lock - OFFSET_BUFFERDESC_CONTENT_LOCK;
+  u64 offset = descriptor - descriptors->address;
+
+  if (offset % BUFFERDESC_PAD_TO_SIZE != 0) return;
+  if (offset / BUFFERDESC_PAD_TO_SIZE >= descriptors->count) return;
+
+  /* The buffer tag is the first member of the BufferDesc */
+  BufferTag tag = {};
+  if (bpf_probe_read_user(&tag, sizeof(tag), (void *)descriptor) != 0) return;
+
+  BufferPage zero_page = {};
+  BufferPage *page = buffer_pages.lookup_or_try_init(&tag, &zero_page);
+  if (!page) {
+    count_dropped_event();
+    return;
+  }
+
+  __sync_fetch_and_add(&(page->waits), 1);
+  __sync_fetch_and_add(&(page->wait_ns), wait_ns);
+
+  /* Concurrent updates of the maximum might get lost, this is accepted */
+  if (wait_ns > page->wait_max_ns) page->wait_max_ns = wait_ns;
+}
+#endif
+
+/*
+ * Get the statistics of the lock instance
+ */
+static LockInstance *get_lock_instance(u64 lock) {
+  LockInstance *instance = lock_instances.lookup(&lock);
+  if (instance) return instance;
+
+  /* The tranche is the first member of the LWLock (uint16) */
+  u16 tranche_id = 0;
+  bpf_probe_read_user(&tranche_id, sizeof(tranche_id), (void *)lock);
+
+  LockInstance new_instance = {.tranche_id = tranche_id};
+  instance = lock_instances.lookup_or_try_init(&lock, &new_instance);
+  if (!instance) count_dropped_event();
+
+  return instance;
+}
+
+/*
+ * Remember the acquire time of a LWLock that is now held by the backend
+ */
+static void hold_lwlock(u32 pid, u64 lock, u64 now) {
+  HeldLockKey key = {.lock = lock, .pid = pid};
+  if (held_lwlocks.update(&key, &now) != 0) count_dropped_event();
+}
+
+static void lwlock_call_begin(u64 lock, u32 function) {
+  u32 pid = bpf_get_current_pid_tgid();
+  if (!is_traced_pid(pid)) return;
+
+  LWLockCall call = {
+      .lock = lock, .start = bpf_ktime_get_ns(), .function = function};
+
+  if (lwlock_calls.update(&pid, &call) != 0) count_dropped_event();
 }
 
+/*
+ * Acquire a LW Lock
+ * Arguments: bool LWLockAcquire(LWLock *lock, LWLockMode mode)
+ */
+int lwlock_acquire(struct pt_regs *ctx) {
+  lwlock_call_begin(PT_REGS_PARM1(ctx), LWLOCK_ACQUIRE);
+  return 0;
+}
+
+/*
+ * Acquire a LW Lock if it is free
+ * Arguments: bool LWLockConditionalAcquire(LWLock *lock, LWLockMode mode)
+ */
+int lwlock_conditional_acquire(struct pt_regs *ctx) {
+  lwlock_call_begin(PT_REGS_PARM1(ctx), LWLOCK_CONDITIONAL_ACQUIRE);
+  return 0;
+}
+
+/*
+ * Wait until the LW Lock is free or the variable is updated
+ * Arguments: bool LWLockWaitForVar(LWLock *lock, uint64 *valptr, uint64
+ * oldval, uint64 *newval)
+ */
+int lwlock_wait_for_var(struct pt_regs *ctx) {
+  lwlock_call_begin(PT_REGS_PARM1(ctx), LWLOCK_WAIT_FOR_VAR);
+  return 0;
+}
+
+/*
+ * The LWLock function returns (all functions return a bool)
+ */
+int lwlock_call_return(struct pt_regs *ctx) {
+  u64 now = bpf_ktime_get_ns();
+  u32 pid = bpf_get_current_pid_tgid();
+
+  LWLockCall *running_call = lwlock_calls.lookup(&pid);
+  if (!running_call) return 0;
+
+  LWLockCall call = *running_call;
+  lwlock_calls.delete(&pid);
+
+  LockInstance *instance = get_lock_instance(call.lock);
+  if (!instance) return 0;
+
+  u8 result = PT_REGS_RC(ctx) & 0xff;
+  u64 duration = now - call.start;
+
+  if (call.function == LWLOCK_ACQUIRE) {
+    __sync_fetch_and_add(&(instance->acquires), 1);
+
+    /* LWLockAcquire returns false if the backend had to wait */
+    if (!result) {
+      __sync_fetch_and_add(&(instance->waits), 1);
+      __sync_fetch_and_add(&(instance->wait_ns), duration);
+
+      /* Concurrent updates of the maximum might get lost, this is accepted */
+      if (duration > instance->wait_max_ns) instance->wait_max_ns = duration;
+
+#ifdef BUFFER_PAGES
+      update_buffer_page(call.lock, duration);
+#endif
+    }
+
+    hold_lwlock(pid, call.lock, now);
+  } else if (call.function == LWLOCK_CONDITIONAL_ACQUIRE) {
+    if (result) {
+      __sync_fetch_and_add(&(instance->cond_acquires), 1);
+      hold_lwlock(pid, call.lock, now);
+    } else {
+      __sync_fetch_and_add(&(instance->cond_fails), 1);
+    }
+  } else {
+    __sync_fetch_and_add(&(instance->var_waits), 1);
+    __sync_fetch_and_add(&(instance->var_wait_ns), duration);
+  }
+
+  return 0;
+}
+
+/*
+ * Release a LW Lock
+ * Arguments: void LWLockRelease(LWLock *lock)
+ */
+int lwlock_release(struct pt_regs *ctx) {
+  u64 now = bpf_ktime_get_ns();
+  HeldLockKey key = {.lock = PT_REGS_PARM1(ctx),
+                     .pid = bpf_get_current_pid_tgid()};
+
+  /* Acquired before the trace started (or the pid is not traced) */
+  u64 *acquired = held_lwlocks.lookup(&key);
+  if (!acquired) return 0;
+
+  u64 hold_ns = now - *acquired;
+  held_lwlocks.delete(&key);
+
+  LockInstance *instance = get_lock_instance(key.lock);
+  if (!instance) return 0;
+
+  __sync_fetch_and_add(&(instance->holds), 1);
+  __sync_fetch_and_add(&(instance->hold_ns), hold_ns);
+
+  /* Concurrent updates of the maximum might get lost, this is accepted */
+  if (hold_ns > instance->hold_max_ns) instance->hold_max_ns = hold_ns;
+
+  return 0;
+}
+#else
 /*
  * Acquire a LW Lock
  * Arguments: TRACE_POSTGRESQL_LWLOCK_ACQUIRE(T_NAME(lock), mode)
@@ -189,4 +645,5 @@ int lwlock_acquire_or_wait_fail(struct pt_regs *ctx) {
 
   fill_and_submit(ctx, &event, tranche_addr);
   return 0;
-}
\ No newline at end of file
+}
+#endif
@@ -43,7 +43,7 @@ static void fill_and_submit(struct pt_regs *ctx, RowLockEvent *event) {
  * Acquire a tuple lock
  *
  * Arguments:
- *   1. Relation relation (1st member RelFileNode)
+ *   1. Relation relation (member rd_node / rd_locator)
  *   2. ItemPointer tid
  *   3. Snapshot snapshot,
  *   4. TupleTableSlot *slot,
@@ -62,17 +62,18 @@ int heapam_tuple_lock(struct pt_regs *ctx) {
    *      0      |       4   Oid spcNode;
    *      4      |       4   Oid dbNode;
    *      8      |       4   Oid relNode;
+   *
+   * PG 16 renamed the struct into RelFileLocator (spcOid, dbOid, relNumber).
+   * The offsets of the traced binary are provided as OFFSET_ defines.
    */
-
-  char buffer_relation[12];
-  bpf_probe_read_user(buffer_relation, sizeof(buffer_relation),
-                      (void *)PT_REGS_PARM1(ctx));
-  bpf_probe_read_kernel(&(event.tablespace), sizeof(event.tablespace),
-                        &(buffer_relation[0]));
-  bpf_probe_read_kernel(&(event.database), sizeof(event.database),
-                        &(buffer_relation[4]));
-  bpf_probe_read_kernel(&(event.relation), sizeof(event.relation),
-                        &(buffer_relation[8]));
+  void *locator = (void *)PT_REGS_PARM1(ctx) + OFFSET_RELATIONDATA_RD_LOCATOR;
+
+  bpf_probe_read_user(&(event.tablespace), sizeof(event.tablespace),
+                      locator + OFFSET_RELFILELOCATOR_SPC);
+  bpf_probe_read_user(&(event.database), sizeof(event.database),
+                      locator + OFFSET_RELFILELOCATOR_DB);
+  bpf_probe_read_user(&(event.relation), sizeof(event.relation),
+                      locator + OFFSET_RELFILELOCATOR_REL);
 
   /* Locked tuple */
   char buffer_item_pointer[6];
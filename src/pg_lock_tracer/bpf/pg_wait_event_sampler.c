@@ -0,0 +1,137 @@
+#include <uapi/linux/bpf_perf_event.h>
+#include <uapi/linux/ptrace.h>
+
+/*
+ * Placeholder for the OFFSET_* defines of the traced binary and the
+ * MAX_BACKENDS and SAMPLE_PERIOD_NS defines of the sampler
+ */
+__DEFINES__
+
+/*
+ * A sampled backend. The wait event and the query id are stored in the
+ * shared memory of the cluster (PGPROC and PgBackendStatus), which is
+ * mapped at the same address in all processes of the cluster (but at
+ * another address in the processes of another cluster).
+ */
+typedef struct Backend {
+  u64 wait_event_info;  // The address of MyProc->wait_event_info
+  u64 query_id;         // The address of MyBEEntry->st_query_id (or 0)
+  u32 pid;              // 0 = unused slot
+  u32 cluster;          // The pid of the postmaster
+} Backend;
+
+/* The sampled backends, maintained by the sampler */
+BPF_ARRAY(backends, Backend, MAX_BACKENDS);
+
+typedef struct BackendSlot {
+  int slot;
+  u32 cluster;  // The pid of the postmaster
+} BackendSlot;
+
+/* The slots of the backends (Key = pid), maintained by the sampler */
+BPF_HASH(backend_slots, u32, BackendSlot, MAX_BACKENDS);
+
+/* The number of used slots (the highest used slot + 1) */
+BPF_ARRAY(used_slots, int, 1);
+
+typedef struct SampleKey {
+  u32 wait_event_info;  // 0 = no wait event (running on the CPU)
+  u32 cluster;          // The pid of the postmaster
+  u64 query_id;         // 0 = no query id (e.g., compute_query_id is off)
+} SampleKey;
+
+/* The number of samples per cluster, wait event, and query id */
+BPF_HASH(samples, SampleKey, u64, 10240);
+
+typedef struct ClusterRounds {
+  u64 next;    // The start of the next sample round
+  u64 rounds;  // Number of sample rounds
+} ClusterRounds;
+
+/* The sample rounds per cluster (Key = pid of the postmaster) */
+BPF_HASH(cluster_rounds, u32, ClusterRounds, 64);
+
+/* Number of samples whose memory could not be read (e.g., paged out) */
+BPF_ARRAY(failed_samples, u64, 1);
+
+static void count_failed_sample() {
+  int zero = 0;
+  u64 *failed = failed_samples.lookup(&zero);
+  if (failed) __sync_fetch_and_add(failed, 1);
+}
+
+/*
+ * Sample the wait event and the query id of a backend
+ */
+static void sample_backend(Backend *backend) {
+  SampleKey key = {};
+  key.cluster = backend->cluster;
+
+  if (bpf_probe_read_user(&(key.wait_event_info), sizeof(key.wait_event_info),
+                          (void *)backend->wait_event_info) != 0) {
+    count_failed_sample();
+    return;
+  }
+
+  /* The processes without a PgBackendStatus have no query id */
+  if (backend->query_id)
+    bpf_probe_read_user(&(key.query_id), sizeof(key.query_id),
+                        (void *)backend->query_id);
+
+  samples.increment(key);
+}
+
+/*
+ * Called by the perf timer of each CPU. Once per sample period, the wait
+ * events of all backends of a cluster are sampled (like pg_wait_sampling
+ * does). The shared memory of a cluster is only mapped in its processes,
+ * so the round of a cluster is taken by the first timer that interrupts
+ * one of its processes.
+ */
+int sample_wait_events(struct bpf_perf_event_data *ctx) {
+  u32 pid = bpf_get_current_pid_tgid() >> 32;
+  BackendSlot *current = backend_slots.lookup(&pid);
+  if (!current) return 0;
+
+  u32 cluster = current->cluster;
+  ClusterRounds zero_rounds = {};
+  ClusterRounds *rounds =
+      cluster_rounds.lookup_or_try_init(&cluster, &zero_rounds);
+
+  int zero = 0;
+  int *used = used_slots.lookup(&zero);
+  if (!rounds || !used) return 0;
+
+  /* Concurrent rounds of two CPUs are possible but rare, this is accepted */
+  u64 now = bpf_ktime_get_ns();
+  if (now < rounds->next) return 0;
+  rounds->next = now + SAMPLE_PERIOD_NS;
+  __sync_fetch_and_add(&(rounds->rounds), 1);
+
+  int count = *used;
+  for (int slot = 0; slot < MAX_BACKENDS; slot++) {
+    if (slot >= count) break;
+
+    Backend *backend = backends.lookup(&slot);
+    if (backend && backend->pid && backend->cluster == cluster)
+      sample_backend(backend);
+  }
+
+  return 0;
+}
+
+/*
+ * A process exits, stop sampling it (the PGPROC can be reused by the
+ * next backend before the sampler refreshes the backends)
+ */
+int sampler_process_exit(struct tracepoint__sched__sched_process_exit *args) {
+  u32 pid = bpf_get_current_pid_tgid() >> 32;
+
+  BackendSlot *slot = backend_slots.lookup(&pid);
+  if (!slot) return 0;
+
+  Backend *backend = backends.lookup(&(slot->slot));
+  if (backend) backend->pid = 0;
+
+  return 0;
+}
@@ -0,0 +1,137 @@
+"""
+The time spent in the catalog functions (processing invalidation
+messages, opening tables, and rebuilding relcache entries). The calls are
+aggregated per backend and relation in log2 histograms in the kernel, so
+latency can be attributed to catalog invalidations.
+"""
+
+from enum import IntEnum
+
+from prettytable import PrettyTable
+
+from pg_lock_tracer.lock_statistics import DurationStatistics, Log2Histogram
+
+
+class CatalogFunction(IntEnum):
+    """
+    The measured catalog functions (keep in sync with the probes)
+    """
+
+    ACCEPT_INVALIDATION_MESSAGES = 1
+    TABLE_OPEN = 2
+    RELATION_BUILD_DESC = 3
+
+
+# The PostgreSQL functions (Key = CatalogFunction, Value = function name)
+CATALOG_FUNCTIONS = {
+    CatalogFunction.ACCEPT_INVALIDATION_MESSAGES: "AcceptInvalidationMessages",
+    CatalogFunction.TABLE_OPEN: "table_open",
+    CatalogFunction.RELATION_BUILD_DESC: "RelationBuildDesc",
+}
+
+
+class CatalogStatistics:
+    """
+    The catalog function times per backend and per relation
+    """
+
+    def __init__(self, show_cluster=False, rows=20) -> None:
+        self.show_cluster = show_cluster
+        self.rows = rows
+
+        # Key = (cluster, pid, function)
+        self.backends = {}
+
+        # Key = (cluster, oid, function)
+        self.relations = {}
+
+    def add(self, key, value):
+        """
+        Add an entry of the BPF map (CatalogTimeKey, CatalogTime)
+        """
+        function = CatalogFunction(key.function)
+
+        backend = (key.cluster, key.pid, function)
+        if backend not in self.backends:
+            self.backends[backend] = DurationStatistics()
+        self.backends[backend].add(key.bucket, value.calls, value.total_ns)
+
+        # AcceptInvalidationMessages has no relation
+        if key.oid == 0:
+            return
+
+        relation = (key.cluster, key.oid, function)
+        if relation not in self.relations:
+            self.relations[relation] = DurationStatistics()
+        self.relations[relation].add(key.bucket, value.calls, value.total_ns)
+
+    def get_top_entries(self, entries):
+        """
+        Get the entries with the highest total time
+        """
+        return sorted(entries.items(), key=lambda item: item[1].total_ns, reverse=True)[
+            : self.rows
+        ]
+
+    @staticmethod
+    def get_times_row(times):
+        """
+        Get the columns of the times (calls, total, average, p50, and p99)
+        """
+        p50 = times.histogram.percentile(50)
+        p99 = times.histogram.percentile(99)
+
+        return [
+            times.count,
+            f"{times.total_ns / 1_000_000:.3f}",
+            f"{times.average() / 1_000:.1f}",
+            f"{p50 / 1_000:.1f}" if p50 is not None else "-",
+            f"{p99 / 1_000:.1f}" if p99 is not None else "-",
+        ]
+
+    def print_statistics(self, resolve_relation):
+        """
+        Print the catalog times. The resolve_relation function maps a
+        (cluster, oid) to the name of the relation.
+        """
+        columns = [
+            "Function",
+            "Calls",
+            "Total (ms)",
+            "Avg (us)",
+            "p50 (us)",
+            "p99 (us)",
+        ]
+        cluster = ["Cluster"] if self.show_cluster else []
+
+        print("\nCatalog time per backend")
+        table = PrettyTable(cluster + ["Pid"] + columns)
+        for (cluster_id, pid, function), times in self.get_top_entries(self.backends):
+            row = [pid, CATALOG_FUNCTIONS[function]]
+            row += CatalogStatistics.get_times_row(times)
+            table.add_row([cluster_id] + row if self.show_cluster else row)
+        print(table)
+
+        print("\nCatalog time per relation")
+        table = PrettyTable(cluster + ["Relation"] + columns)
+        for (cluster_id, oid, function), times in self.get_top_entries(self.relations):
+            row = [resolve_relation(cluster_id, oid), CATALOG_FUNCTIONS[function]]
+            row += CatalogStatistics.get_times_row(times)
+            table.add_row([cluster_id] + row if self.show_cluster else row)
+        print(table)
+
+        # The distribution of the durations per function
+        for function, name in CATALOG_FUNCTIONS.items():
+            histogram = Log2Histogram()
+            for (_, _, backend_function), times in self.backends.items():
+                if backend_function == function:
+                    histogram.merge(times.histogram)
+
+            if histogram.count() == 0:
+                continue
+
+            print(f"\n{name} time")
+            table = PrettyTable([f"{name} Time (ns)", "Calls"])
+            for lower, upper, count in histogram.items():
+                table.add_row([f"{lower} - {upper}", count])
+            print(table)
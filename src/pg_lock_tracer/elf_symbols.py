@@ -0,0 +1,141 @@
+"""
+Index of the function symbols of an ELF binary. The symbol tables
+(.symtab and .dynsym) are parsed once, so the probes of a tracer can
+be attached by address without scanning the symbols for each probe.
+The data symbols (e.g., global variables) are indexed as well.
+"""
+
+import re
+import struct
+
+ELF_MAGIC = b"\x7fELF"
+
+# ELF types
+ET_DYN = 3
+
+# Section types
+SHT_SYMTAB = 2
+SHT_DYNSYM = 11
+
+# Symbol types
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_GNU_IFUNC = 10
+
+# Undefined section index
+SHN_UNDEF = 0
+
+# A regex that matches exactly one name (e.g., '^LockRelationOid$')
+EXACT_NAME_REGEX = re.compile(r"^\^([\w.$]+)\$$")
+
+
+class ElfSymbolIndex:
+    """
+    The function symbols of an ELF binary, indexed by name and address
+    """
+
+    def __init__(self, path) -> None:
+        self.path = path
+
+        # Key = name, Value = list of addresses
+        self.functions = {}
+
+        # Key = address, Value = list of names
+        self.addresses = {}
+
+        # The data symbols. Key = name, Value = (address, size)
+        self.objects = {}
+
+        # Is the binary loaded at a random address (PIE)?
+        self.position_independent = False
+
+        with open(path, "rb") as elf_file:
+            self.read_symbols(elf_file.read())
+
+    def read_symbols(self, data):
+        """
+        Read the function symbols of the .symtab and .dynsym sections
+        """
+        if not data.startswith(ELF_MAGIC):
+            raise ValueError(f"{self.path} is not an ELF binary")
+
+        is_64bit = data[4] == 2
+        endian = "<" if data[5] == 1 else ">"
+
+        if is_64bit:
+            header = struct.unpack_from(endian + "HHIQQQIHHHHHH", data, 16)
+            section_format = struct.Struct(endian + "IIQQQQIIQQ")
+            # st_name, st_info, st_other, st_shndx, st_value, st_size
+            symbol_format = struct.Struct(endian + "IBBHQQ")
+        else:
+            header = struct.unpack_from(endian + "HHIIIIIHHHHHH", data, 16)
+            section_format = struct.Struct(endian + "IIIIIIIIII")
+            # st_name, st_value, st_size, st_info, st_other, st_shndx
+            symbol_format = struct.Struct(endian + "IIIBBH")
+
+        self.position_independent = header[0] == ET_DYN
+
+        section_offset, section_size, section_count = header[5], header[10], header[11]
+        sections = [
+            section_format.unpack_from(data, section_offset + section * section_size)
+            for section in range(section_count)
+        ]
+
+        for section in sections:
+            if section[1] not in (SHT_SYMTAB, SHT_DYNSYM):
+                continue
+
+            # sh_link is the index of the string table of the symbols
+            string_section = sections[section[6]]
+            strings = data[string_section[4] : string_section[4] + string_section[5]]
+            symbols = data[section[4] : section[4] + section[5]]
+
+            for symbol in symbol_format.iter_unpack(symbols):
+                if is_64bit:
+                    name_offset, info, _, section_index, address, size = symbol
+                else:
+                    name_offset, address, size, info, _, section_index = symbol
+
+                if info & 0xF not in (STT_OBJECT, STT_FUNC, STT_GNU_IFUNC):
+                    continue
+
+                if section_index == SHN_UNDEF or address == 0:
+                    continue
+
+                name_end = strings.index(b"\0", name_offset)
+                name = strings[name_offset:name_end].decode("utf-8", "replace")
+
+                if info & 0xF == STT_OBJECT:
+                    self.objects.setdefault(name, (address, size))
+                else:
+                    self.add_function(name, address)
+
+    def add_function(self, name, address):
+        """
+        Add a function to the index
+        """
+        addresses = self.functions.setdefault(name, [])
+        if address not in addresses:
+            addresses.append(address)
+
+        names = self.addresses.setdefault(address, [])
+        if name not in names:
+            names.append(name)
+
+    def find_functions(self, function_regex):
+        """
+        Get the (name, address) tuples of the functions that match the regex
+        """
+        exact_name = EXACT_NAME_REGEX.match(function_regex)
+
+        if exact_name:
+            name = exact_name.group(1)
+            return [(name, address) for address in self.functions.get(name, [])]
+
+        regex = re.compile(function_regex)
+        return [
+            (name, address)
+            for name, addresses in self.functions.items()
+            if regex.match(name)
+            for address in addresses
+        ]
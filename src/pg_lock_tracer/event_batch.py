@@ -0,0 +1,416 @@
+"""
+Decode batches of lock tracer events into NumPy structured arrays and
+compute the lock statistics with vectorized operations. The raw perf
+records (or the events of a recorded JSON trace) are collected per batch,
+so no Python object is created per event.
+"""
+
+import json
+import ctypes as ct
+
+from prettytable import PrettyTable
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pg_lock_tracer.helper import PostgreSQLLockHelper
+from pg_lock_tracer.lock_statistics import HISTOGRAM_BUCKETS, Log2Histogram
+from pg_lock_tracer.lock_events import (
+    Events,
+    LockTagType,
+    PostgreSQLEvent,
+    get_locktag_fields,
+    get_locktag_name,
+    get_locktag_type,
+)
+from pg_lock_tracer.trace_file import read_trace_lines
+
+# The number of lock tag types (locktag_type is an uint8)
+LOCKTAG_TYPES = 256
+
+
+def check_numpy():
+    """
+    Check that NumPy is available in this environment
+    """
+    if numpy is None:
+        raise ValueError(
+            "Batch decoding of events requires the 'numpy' package (pip install numpy)"
+        )
+
+
+def get_event_dtype():
+    """
+    Get the NumPy dtype of the events. The dtype is derived from the ctypes
+    structure, so it has the same field offsets as the BPF event. Strings
+    are mapped to fixed size byte strings.
+    """
+    # pylint: disable=protected-access
+    check_numpy()
+
+    names, formats, offsets = [], [], []
+    for name, field_type in PostgreSQLEvent._fields_:
+        names.append(name)
+        offsets.append(getattr(PostgreSQLEvent, name).offset)
+
+        if issubclass(field_type, ct.Array) and field_type._type_ is ct.c_char:
+            formats.append(f"S{field_type._length_}")
+        else:
+            formats.append(numpy.dtype(field_type))
+
+    return numpy.dtype(
+        {
+            "names": names,
+            "formats": formats,
+            "offsets": offsets,
+            "itemsize": ct.sizeof(PostgreSQLEvent),
+        }
+    )
+
+
+class EventBatch:
+    """
+    Collect raw event records (e.g., from the perf buffer) and decode them
+    as one structured array
+    """
+
+    def __init__(self) -> None:
+        self.event_size = ct.sizeof(PostgreSQLEvent)
+        self.dtype = get_event_dtype()
+        self.records = bytearray()
+
+    def __len__(self):
+        return len(self.records) // self.event_size
+
+    def append_record(self, _cpu, data, _size):
+        """
+        Append the record of the perf buffer (can be used as perf buffer callback)
+        """
+        self.records += ct.string_at(data, self.event_size)
+
+    def append_bytes(self, records):
+        """
+        Append one or more raw event records
+        """
+        if len(records) % self.event_size != 0:
+            raise ValueError(
+                f"Event records have to be a multiple of {self.event_size} bytes"
+            )
+
+        self.records += records
+
+    def take(self):
+        """
+        Return the collected events as structured array and reset the batch
+        """
+        events = numpy.frombuffer(bytes(self.records), dtype=self.dtype)
+        self.records.clear()
+        return events
+
+
+def read_trace_events(path):
+    """
+    Read the events of a recorded JSON trace into a structured array
+    """
+    events = []
+
+    for line in read_trace_lines(path):
+        if not line.startswith("{"):
+            continue
+
+        event = json.loads(line)
+        lock_type = event.get("lock_type")
+        locktag_type = LockTagType.RELATION
+        if "locktag" in event:
+            locktag_type = get_locktag_type(event["locktag"])
+
+        locktag = [
+            event.get(field, 0) for field in get_locktag_fields(locktag_type)
+        ] + [0] * 4
+
+        events.append(
+            {
+                "pid": event["pid"],
+                "cluster": event.get("cluster", 0),
+                "timestamp": event["timestamp"],
+                "event_type": Events[event["event"]],
+                "object": locktag[1],
+                "mode": (
+                    PostgreSQLLockHelper.lock_type_to_int(lock_type) if lock_type else 0
+                ),
+                "lock_local_hold": event.get("lock_local_hold", 0),
+                "host_pid": event["pid"],
+                "locktag_field1": locktag[0],
+                "locktag_field2": locktag[1],
+                "locktag_field3": locktag[2],
+                "locktag_field4": locktag[3],
+                "locktag_type": locktag_type,
+            }
+        )
+
+    result = numpy.zeros(len(events), dtype=get_event_dtype())
+
+    if events:
+        for field in events[0]:
+            result[field] = [event[field] for event in events]
+
+    return result
+
+
+def encode_key(pids, oids, modes=None):
+    """
+    Encode pid, oid and mode into a single 64 bit key (pids are below 2^22)
+    """
+    keys = (pids.astype(numpy.int64) << 40) | (oids.astype(numpy.int64) << 8)
+
+    if modes is not None:
+        keys |= modes.astype(numpy.int64) & 0xFF
+
+    return keys
+
+
+def decode_key(key):
+    """
+    Decode a key into the pid, oid and mode
+    """
+    return (key >> 40, (key >> 8) & 0xFFFFFFFF, key & 0xFF)
+
+
+class BatchLockStatistics:
+    """
+    Lock statistics that are updated with batches of events.
+
+    Per (pid, oid, mode), the number of lock requests is counted. The lock
+    wait time is the time between LOCK_RELATION_OID and the following
+    LOCK_RELATION_OID_END of the same pid. A lock request that is not
+    finished in a batch is carried over to the next batch.
+
+    If show_cluster is set, the objects are reported per cluster (the
+    index of the traced binary).
+    """
+
+    def __init__(self, pids=None, show_cluster=False) -> None:
+        check_numpy()
+        self.dtype = get_event_dtype()
+        self.pids = numpy.array(sorted(pids), dtype=numpy.uint32) if pids else None
+        self.show_cluster = show_cluster
+
+        # Key = pid, Value = cluster of the pid
+        self.pid_clusters = {}
+
+        # Key = (pid, oid, mode), Value = number of lock requests
+        self.requests = {}
+
+        # Key = (pid, oid), Value = total lock wait time (ns)
+        self.wait_time = {}
+
+        # Acquired (local) and granted locks per lock tag type
+        self.locktags = numpy.zeros((LOCKTAG_TYPES, 2), dtype=numpy.int64)
+
+        # Log2 histogram of the lock wait times
+        self.histogram = Log2Histogram()
+
+        # Lock requests without an end event
+        self.pending = numpy.zeros(0, dtype=self.dtype)
+
+    def add_events(self, events):
+        """
+        Update the statistics with a batch of events
+        """
+        if self.pids is not None:
+            events = events[numpy.isin(events["pid"], self.pids)]
+
+        event_types = events["event_type"]
+        self.count_locktags(events)
+
+        lock_events = (event_types == Events.LOCK_RELATION_OID) | (
+            event_types == Events.LOCK_RELATION_OID_END
+        )
+        events = events[lock_events]
+        self.update_pid_clusters(events)
+        self.count_requests(events)
+        self.measure_wait_time(events)
+
+    def update_pid_clusters(self, events):
+        """
+        Update the cluster of the pids of the events
+        """
+        if len(events) == 0:
+            return
+
+        keys = numpy.unique(
+            (events["pid"].astype(numpy.int64) << 32) | events["cluster"]
+        )
+
+        for key in keys.tolist():
+            self.pid_clusters[key >> 32] = key & 0xFFFFFFFF
+
+    def count_locktags(self, events):
+        """
+        Count the acquired and granted locks per lock tag type
+        """
+        for column, event_type in enumerate(
+            (Events.LOCK_GRANTED_LOCAL, Events.LOCK_GRANTED)
+        ):
+            locktag_types = events["locktag_type"][events["event_type"] == event_type]
+            self.locktags[:, column] += numpy.bincount(
+                locktag_types, minlength=LOCKTAG_TYPES
+            )
+
+    def get_locktag_statistics(self):
+        """
+        Get the number of acquired and granted locks per lock tag type
+        """
+        return {
+            locktag_type: tuple(self.locktags[locktag_type].tolist())
+            for locktag_type in numpy.flatnonzero(self.locktags.sum(axis=1)).tolist()
+        }
+
+    def count_requests(self, events):
+        """
+        Count the lock requests per pid, oid and mode
+        """
+        requests = events[events["event_type"] == Events.LOCK_RELATION_OID]
+
+        if len(requests) == 0:
+            return
+
+        keys, counts = numpy.unique(
+            encode_key(requests["pid"], requests["object"], requests["mode"]),
+            return_counts=True,
+        )
+
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            key = decode_key(key)
+            self.requests[key] = self.requests.get(key, 0) + count
+
+    def measure_wait_time(self, events):
+        """
+        Pair the lock requests with their end events and add the wait times
+        """
+        events = numpy.concatenate((self.pending, events))
+
+        if len(events) == 0:
+            return
+
+        events = events[numpy.lexsort((events["timestamp"], events["pid"]))]
+        pids = events["pid"]
+        is_start = events["event_type"] == Events.LOCK_RELATION_OID
+        same_pid = pids[1:] == pids[:-1]
+
+        # An end event finishes the directly preceding request of the pid
+        finished = numpy.flatnonzero(~is_start[1:] & is_start[:-1] & same_pid) + 1
+        starts = events[finished - 1]
+        wait_times = events["timestamp"][finished] - starts["timestamp"]
+
+        # The last request of a pid is pending if no end event follows
+        last_of_pid = numpy.append(~same_pid, True)
+        self.pending = events[is_start & last_of_pid]
+
+        if len(finished) == 0:
+            return
+
+        keys, inverse = numpy.unique(
+            encode_key(starts["pid"], starts["object"]), return_inverse=True
+        )
+        sums = numpy.bincount(inverse.ravel(), weights=wait_times)
+
+        for key, wait_time in zip(keys.tolist(), sums.tolist()):
+            key = decode_key(key)[:2]
+            self.wait_time[key] = self.wait_time.get(key, 0) + int(wait_time)
+
+        # The bucket is the bit length of the wait time
+        buckets = numpy.frexp(wait_times.astype(numpy.float64))[1]
+        self.histogram.add_bucket_counts(
+            numpy.bincount(buckets, minlength=HISTOGRAM_BUCKETS).tolist()
+        )
+
+    def get_object_name(self, pid, oid, resolve_object):
+        """
+        Get the name of the object in the statistics (prefixed by the
+        cluster if show_cluster is set)
+        """
+        cluster = self.pid_clusters.get(pid, 0)
+        name = resolve_object(pid, oid, cluster) if resolve_object else oid
+
+        return (cluster, name) if self.show_cluster else name
+
+    def get_lock_statistics(self, resolve_object=None):
+        """
+        Get the lock requests and wait time per object. The resolve_object
+        function maps a (pid, oid, cluster) to the name of the object.
+        """
+        statistics = {}
+
+        for (pid, oid, _), count in self.requests.items():
+            name = self.get_object_name(pid, oid, resolve_object)
+            requests, wait_time = statistics.get(name, (0, 0))
+            statistics[name] = (requests + count, wait_time)
+
+        for (pid, oid), total_wait_time in self.wait_time.items():
+            name = self.get_object_name(pid, oid, resolve_object)
+            requests, wait_time = statistics.get(name, (0, 0))
+            statistics[name] = (requests, wait_time + total_wait_time)
+
+        return statistics
+
+    def get_lock_type_statistics(self):
+        """
+        Get the number of lock requests per lock type
+        """
+        lock_types = {}
+
+        for (_, _, mode), count in self.requests.items():
+            lock_types[mode] = lock_types.get(mode, 0) + count
+
+        return lock_types
+
+    def print_statistics(self, resolve_object=None):
+        """
+        Print lock statistics
+        """
+        print("\nLock statistics:\n================")
+
+        # Oid lock statistics
+        print("\nLocks per OID")
+        columns = ["Lock Name", "Requests", "Total Lock Request Time (ns)"]
+        table = PrettyTable(["Cluster"] + columns if self.show_cluster else columns)
+
+        statistics = self.get_lock_statistics(resolve_object)
+        for name in sorted(statistics, key=lambda key: statistics[key], reverse=True):
+            requests, wait_time = statistics[name]
+            name = list(name) if self.show_cluster else [name]
+            table.add_row(name + [requests, wait_time])
+
+        print(table)
+
+        # Lock type statistics
+        print("\nLock types")
+        table = PrettyTable(["Lock Type", "Number of requested locks"])
+
+        lock_types = self.get_lock_type_statistics()
+        for lock_type in sorted(lock_types):
+            lock_name = PostgreSQLLockHelper.lock_type_to_str(lock_type)
+            table.add_row([lock_name, lock_types[lock_type]])
+
+        print(table)
+
+        # Lock tag type statistics
+        print("\nLock tag types")
+        table = PrettyTable(["Lock Tag Type", "Acquired Locks", "Granted Locks"])
+
+        for locktag_type, counts in self.get_locktag_statistics().items():
+            table.add_row([get_locktag_name(locktag_type), *counts])
+
+        print(table)
+
+        # Lock wait time histogram
+        print("\nLock request time")
+        table = PrettyTable(["Lock Request Time (ns)", "Requests"])
+
+        for lower, upper, count in self.histogram.items():
+            table.add_row([f"{lower} - {upper}", count])
+
+        print(table)
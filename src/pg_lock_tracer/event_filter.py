@@ -0,0 +1,303 @@
+"""
+Filter expressions of the lock tracer (e.g., "mode >= ShareLock and
+relation in ('public.orders', 'public.payments') and wait_ns > 1ms").
+An expression is compiled into a C condition (the FILTER_EVENT macro)
+and BPF maps for the 'in' lists, so the events that do not match are
+discarded in the BPF program and are never copied to user space.
+"""
+
+import re
+
+from pg_lock_tracer.helper import PostgreSQLLockHelper
+from pg_lock_tracer.lock_events import Events, get_locktag_type
+
+# The tokens of an expression
+TOKEN = re.compile(
+    r"""\s*(?:
+    (?P<number>\d+(?:\.\d+)?)(?P<unit>ns|us|µs|ms|s)?(?![\w.])
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<operator><=|>=|!=|<>|==|=|<|>)
+    | (?P<punctuation>[(),])
+    | (?P<word>[A-Za-z_]\w*)
+    )""",
+    re.VERBOSE,
+)
+
+# The units of durations (in ns)
+DURATION_UNITS = {
+    "ns": 1,
+    "us": 1_000,
+    "µs": 1_000,
+    "ms": 1_000_000,
+    "s": 1_000_000_000,
+}
+
+# The C operators of the comparisons
+OPERATORS = {"=": "==", "==": "==", "!=": "!=", "<>": "!=", "<": "<", "<=": "<="}
+OPERATORS.update({">": ">", ">=": ">="})
+
+KEYWORDS = frozenset(("and", "or", "not", "in"))
+
+
+class EventFilter:
+    """
+    Compile a filter expression into the C defines of the BPF program
+    """
+
+    # The fields of the events. Value = C expression, kind of the values
+    fields = {
+        "pid": ("(event)->pid", "number"),
+        "cluster": ("(event)->cluster", "number"),
+        "event": ("(event)->event_type", "event"),
+        "mode": ("(event)->mode", "mode"),
+        "relation": ("(event)->object", "relation"),
+        "locktype": ("(event)->locktag_type", "locktype"),
+        "granted": ("(event)->granted", "number"),
+        "waiting": ("(event)->waiting", "number"),
+        "wait_ns": ("(wait_ns)", "duration"),
+    }
+
+    def __init__(self, expression, resolve_relation=None) -> None:
+        self.expression = expression
+        self.resolve_relation = resolve_relation
+
+        # The values of the 'in' lists (one BPF map per list)
+        self.sets = []
+
+        # Does the expression use the wait time of LockRelationOid?
+        self.uses_wait_time = False
+
+        self.tokens = EventFilter.tokenize(expression)
+        self.position = 0
+        self.condition = self.parse_or()
+
+        if self.position < len(self.tokens):
+            self.error(f"unexpected '{self.tokens[self.position][1]}'")
+
+    @staticmethod
+    def tokenize(expression):
+        """
+        Split the expression into (kind, value, unit) tokens
+        """
+        tokens = []
+        position = 0
+        expression = expression.rstrip()
+
+        while position < len(expression):
+            match = TOKEN.match(expression, position)
+
+            if match is None or match.end() == position:
+                raise ValueError(
+                    f"Invalid filter expression at '{expression[position:].strip()}'"
+                )
+
+            kind = match.lastgroup
+            if kind == "unit":
+                kind = "number"
+
+            if kind == "string":
+                tokens.append((kind, match.group(kind)[1:-1].replace("''", "'"), None))
+            elif kind == "word" and match.group(kind).lower() in KEYWORDS:
+                tokens.append(("keyword", match.group(kind).lower(), None))
+            else:
+                tokens.append((kind, match.group(kind), match.group("unit")))
+
+            position = match.end()
+
+        return tokens
+
+    def error(self, message):
+        """
+        Raise an error about the expression
+        """
+        raise ValueError(f"Invalid filter expression '{self.expression}': {message}")
+
+    def peek(self, kind=None, value=None):
+        """
+        Is the next token of the given kind (and value)?
+        """
+        if self.position >= len(self.tokens):
+            return False
+
+        token_kind, token_value, _ = self.tokens[self.position]
+        return (kind is None or token_kind == kind) and (
+            value is None or token_value == value
+        )
+
+    def take(self, kind=None, value=None):
+        """
+        Get the next token (which has to be of the given kind and value)
+        """
+        if not self.peek(kind, value):
+            if self.position >= len(self.tokens):
+                self.error("unexpected end")
+            self.error(f"unexpected '{self.tokens[self.position][1]}'")
+
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def parse_or(self):
+        """
+        expression := and_expression ('or' and_expression)*
+        """
+        condition = self.parse_and()
+
+        while self.peek("keyword", "or"):
+            self.take()
+            condition = f"({condition} || {self.parse_and()})"
+
+        return condition
+
+    def parse_and(self):
+        """
+        and_expression := not_expression ('and' not_expression)*
+        """
+        condition = self.parse_not()
+
+        while self.peek("keyword", "and"):
+            self.take()
+            condition = f"({condition} && {self.parse_not()})"
+
+        return condition
+
+    def parse_not(self):
+        """
+        not_expression := 'not' not_expression | '(' expression ')' | comparison
+        """
+        if self.peek("keyword", "not"):
+            self.take()
+            return f"(!{self.parse_not()})"
+
+        if self.peek("punctuation", "("):
+            self.take()
+            condition = self.parse_or()
+            self.take("punctuation", ")")
+            return condition
+
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        """
+        comparison := field operator value | field ['not'] 'in' '(' value (',' value)* ')'
+        """
+        _, name, _ = self.take("word")
+        field = self.fields.get(name.lower())
+
+        if field is None:
+            self.error(f"unknown field '{name}' (known: {', '.join(self.fields)})")
+
+        c_field, value_kind = field
+
+        if value_kind == "duration":
+            self.uses_wait_time = True
+
+        # Set membership
+        negated = False
+        if self.peek("keyword", "not"):
+            self.take()
+            negated = True
+
+        if negated or self.peek("keyword", "in"):
+            self.take("keyword", "in")
+            self.take("punctuation", "(")
+
+            values = self.parse_value(value_kind)
+            while self.peek("punctuation", ","):
+                self.take()
+                values += self.parse_value(value_kind)
+
+            self.take("punctuation", ")")
+
+            condition = self.add_set(c_field, values)
+            return f"(!{condition})" if negated else condition
+
+        # Comparison
+        _, operator, _ = self.take("operator")
+        values = self.parse_value(value_kind)
+
+        if len(values) > 1 and OPERATORS[operator] not in ("==", "!="):
+            self.error(f"'{name}' matches several values, use = or !=")
+
+        comparisons = [f"{c_field} {OPERATORS[operator]} {value}" for value in values]
+        join = " && " if OPERATORS[operator] == "!=" else " || "
+        return f"({join.join(comparisons)})"
+
+    def parse_value(self, value_kind):
+        """
+        Parse a value of the given kind. Returns the list of the numeric
+        values (a relation name can match several OIDs).
+        """
+        kind, value, unit = self.take()
+
+        if kind == "number":
+            if unit is not None and value_kind != "duration":
+                self.error(f"unit '{unit}' is only allowed for the wait time")
+
+            number = float(value) * DURATION_UNITS[unit or "ns"]
+            if number != int(number):
+                self.error(f"'{value}' is not an integer")
+            return [int(number)]
+
+        if kind not in ("word", "string"):
+            self.error(f"unexpected '{value}'")
+
+        try:
+            if value_kind == "mode":
+                return [PostgreSQLLockHelper.lock_type_to_int(value)]
+
+            if value_kind == "event":
+                return [Events[value.upper()].value]
+
+            if value_kind == "locktype":
+                return [get_locktag_type(value)]
+        except (KeyError, ValueError):
+            self.error(f"unknown value '{value}'")
+
+        if value_kind == "relation":
+            if self.resolve_relation is None:
+                self.error(f"relation names ('{value}') require an OID resolver (-r)")
+
+            oids = self.resolve_relation(value)
+            if not oids:
+                self.error(f"unable to resolve the relation '{value}'")
+
+            return sorted(oids)
+
+        return self.error(f"'{value}' is not a number")
+
+    def add_set(self, c_field, values):
+        """
+        Add the values of an 'in' list (a BPF map) and get the condition
+        """
+        set_id = len(self.sets)
+        self.sets.append(sorted(set(values)))
+        return f"filter_in_set_{set_id}({c_field})"
+
+    def get_c_defines(self):
+        """
+        Get the C code of the filter (the maps of the 'in' lists, their
+        lookup functions, and the FILTER_EVENT macro)
+        """
+        defines = ""
+
+        for set_id, values in enumerate(self.sets):
+            defines += f"BPF_HASH(filter_set_{set_id}, u64, u8, {len(values)});\n"
+            defines += (
+                f"static int filter_in_set_{set_id}(u64 key) "
+                f"{{ return filter_set_{set_id}.lookup(&key) ? 1 : 0; }}\n"
+            )
+
+        if self.uses_wait_time:
+            defines += "#define FILTER_WAIT_TIME\n"
+
+        defines += f"#define FILTER_EVENT(event, wait_ns) {self.condition}\n"
+        return defines
+
+    def fill_maps(self, bpf_instance):
+        """
+        Store the values of the 'in' lists in the BPF maps
+        """
+        for set_id, values in enumerate(self.sets):
+            table = bpf_instance[f"filter_set_{set_id}"]
+            for value in values:
+                table[table.Key(value)] = table.Leaf(1)
@@ -0,0 +1,91 @@
+"""
+A common timeline of the events of several perf buffers. The events of
+the tracers of a session are collected (copied, since the perf buffer
+data is only valid during the callback) and handed to the callbacks of
+the tracers in the order of their timestamps (bpf_ktime_get_ns). Events
+are held back for a short delay because the perf buffers of the CPUs
+and tracers are read one after another.
+"""
+
+import heapq
+import ctypes
+
+
+class EventTimeline:
+    """
+    Merge the events of several sources (perf buffers) by their timestamp
+    """
+
+    def __init__(self, delay_ns=100_000_000) -> None:
+        if delay_ns < 0:
+            raise ValueError(f"Delay can not be negative ({delay_ns} was provided)")
+
+        self.delay_ns = delay_ns
+
+        # The callbacks of the sources (callback, flush)
+        self.sources = []
+
+        # The pending events (timestamp, sequence, source, cpu, data)
+        self.events = []
+        self.sequence = 0
+
+        # The last dispatched timestamp and the events that arrived after it
+        self.last_timestamp = 0
+        self.late_events = 0
+
+    def __len__(self):
+        return len(self.events)
+
+    def add_source(self, callback, flush=None):
+        """
+        Add a source. The callback gets the events of the source like a
+        perf buffer callback (cpu, data, size). The optional flush function
+        is called before the events of another source are dispatched (e.g.,
+        to write the buffered output lines of the source).
+        """
+        self.sources.append((callback, flush))
+        return len(self.sources) - 1
+
+    def add(self, source, timestamp, cpu, data):
+        """
+        Add the (copied) data of an event of a source
+        """
+        if timestamp < self.last_timestamp:
+            self.late_events += 1
+
+        self.sequence += 1
+        heapq.heappush(self.events, (timestamp, self.sequence, source, cpu, data))
+
+    def flush(self, now_ns=None):
+        """
+        Dispatch the events that are older than the delay (or all events
+        if no time is given)
+        """
+        last_source = None
+
+        while self.events:
+            if now_ns is not None and self.events[0][0] > now_ns - self.delay_ns:
+                break
+
+            timestamp, _, source, cpu, data = heapq.heappop(self.events)
+            self.last_timestamp = max(self.last_timestamp, timestamp)
+
+            if last_source is not None and last_source != source:
+                self.flush_source(last_source)
+            last_source = source
+
+            # The callback decodes the event from a pointer to the data
+            buffer = ctypes.create_string_buffer(data, len(data))
+            self.sources[source][0](cpu, ctypes.addressof(buffer), len(data))
+
+        if last_source is not None:
+            self.flush_source(last_source)
+
+    def flush_source(self, source):
+        """
+        Flush the output of a source
+        """
+        flush = self.sources[source][1]
+
+        if flush is not None:
+            flush()
@@ -0,0 +1,322 @@
+"""
+Analyze the usage of the fast-path relation lock slots per transaction.
+Each backend can hold only a small number of weak relation locks in its
+fast-path slots (FP_LOCK_SLOTS_PER_BACKEND); further locks are granted
+in the shared lock table, which needs the LockManager LWLocks.
+"""
+
+import re
+import heapq
+
+from prettytable import PrettyTable
+
+from pg_lock_tracer.lock_events import Events, LockTagType
+
+# The number of fast-path slots of a backend (PostgreSQL < 18)
+DEFAULT_FASTPATH_SLOTS = 16
+
+# Lock modes that are eligible for the fast-path (< ShareUpdateExclusiveLock)
+FASTPATH_MODES = frozenset((1, 2, 3))
+
+# Regexes to replace the literals of a query
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+LIST_OF_VALUES = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+
+def add_lock(relations, oid):
+    """
+    Count a lock on the relation (Key = OID, Value = number of locks)
+    """
+    relations[oid] = relations.get(oid, 0) + 1
+
+
+def remove_lock(relations, oid):
+    """
+    Remove a lock on the relation (Key = OID, Value = number of locks)
+    """
+    locks = relations.get(oid, 0) - 1
+
+    if locks > 0:
+        relations[oid] = locks
+    else:
+        relations.pop(oid, None)
+
+
+def get_query_fingerprint(query):
+    """
+    Get the fingerprint of a query (the literals are replaced by '?')
+    """
+    if not query:
+        return ""
+
+    fingerprint = STRING_LITERAL.sub("?", query)
+    fingerprint = NUMBER_LITERAL.sub("?", fingerprint)
+    fingerprint = WHITESPACE.sub(" ", fingerprint).strip()
+    return LIST_OF_VALUES.sub("(...)", fingerprint)
+
+
+class TransactionLocks:
+    """
+    The relation locks of a running transaction
+    """
+
+    # pylint: disable=too-many-instance-attributes
+    __slots__ = (
+        "pid",
+        "cluster",
+        "timestamp",
+        "fastpath_locks",
+        "shared_locks",
+        "spilled_locks",
+        "held_relations",
+        "fastpath_relations",
+        "peak_relations",
+        "first_spill",
+        "spill_query",
+    )
+
+    def __init__(self, pid, cluster, timestamp) -> None:
+        self.pid = pid
+        self.cluster = cluster
+        self.timestamp = timestamp
+
+        # Relation locks that are granted via the fast-path
+        self.fastpath_locks = 0
+
+        # Relation locks that are granted in the shared lock table
+        self.shared_locks = 0
+
+        # Weak relation locks that are granted in the shared lock table
+        self.spilled_locks = 0
+
+        # The held relation locks (Key = OID, Value = number of locks)
+        self.held_relations = {}
+        self.peak_relations = 0
+
+        # The relations with fast-path locks, each one uses a fast-path slot
+        # (Key = OID, Value = number of locks)
+        self.fastpath_relations = {}
+
+        # The first relation that spilled and the query at this time
+        self.first_spill = None
+        self.spill_query = None
+
+    def grant(self, oid, fastpath=False):
+        """
+        A lock on the relation is granted
+        """
+        add_lock(self.held_relations, oid)
+        self.peak_relations = max(self.peak_relations, len(self.held_relations))
+
+        if fastpath:
+            add_lock(self.fastpath_relations, oid)
+
+    def ungrant(self, oid, fastpath=False):
+        """
+        A lock on the relation is released
+        """
+        remove_lock(self.held_relations, oid)
+
+        if fastpath:
+            remove_lock(self.fastpath_relations, oid)
+
+
+class FastPathAnalyzer:
+    """
+    Track the fast-path and shared relation locks of each transaction
+    (from TRANSACTION_BEGIN to the commit or abort)
+    """
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, fastpath_slots=DEFAULT_FASTPATH_SLOTS, max_transactions=20):
+        if fastpath_slots <= 0:
+            raise ValueError(
+                f"Number of fast-path slots has to be positive ({fastpath_slots} was provided)"
+            )
+
+        self.fastpath_slots = fastpath_slots
+        self.max_transactions = max_transactions
+
+        # The running transactions (Key = pid)
+        self.transactions = {}
+
+        # The last query of each pid (Key = pid)
+        self.queries = {}
+
+        self.finished_transactions = 0
+        self.exceeding_transactions = 0
+
+        # The transactions with the most spilled locks (a bounded heap)
+        self.top_transactions = []
+        self.sequence = 0
+
+        # Key = fingerprint, Value = [transactions, spilled locks, peak relations]
+        self.fingerprints = {}
+
+    def handle_event(self, event, query=None):
+        """
+        Handle an event of the lock tracer. The query of QUERY_BEGIN
+        events is passed decoded.
+        """
+        # pylint: disable=too-many-branches
+        event_type = event.event_type
+        pid = event.pid
+
+        if event_type == Events.QUERY_BEGIN:
+            self.queries[pid] = query
+        elif event_type == Events.TRANSACTION_BEGIN:
+            self.transactions[pid] = TransactionLocks(
+                pid, event.cluster, event.timestamp
+            )
+        elif event_type in (Events.TRANSACTION_COMMIT, Events.TRANSACTION_ABORT):
+            transaction = self.transactions.pop(pid, None)
+            if transaction is not None:
+                self.finish_transaction(transaction)
+        else:
+            transaction = self.transactions.get(pid)
+
+            if transaction is None:
+                return
+
+            if event_type == Events.LOCK_GRANTED_FASTPATH:
+                transaction.fastpath_locks += 1
+                transaction.grant(event.object, fastpath=True)
+            elif event_type == Events.LOCK_UNGRANTED_FASTPATH:
+                transaction.ungrant(event.object, fastpath=True)
+            elif event.locktag_type != LockTagType.RELATION:
+                return
+            elif event_type == Events.LOCK_GRANTED:
+                transaction.shared_locks += 1
+                transaction.grant(event.object)
+
+                if self.is_spilled(transaction, event):
+                    transaction.spilled_locks += 1
+                    if transaction.first_spill is None:
+                        transaction.first_spill = event.object
+                        transaction.spill_query = self.queries.get(pid)
+            elif event_type == Events.LOCK_UNGRANTED:
+                transaction.ungrant(event.object)
+
+    def is_spilled(self, transaction, event):
+        """
+        Is the shared lock a weak relation lock that was not granted via the
+        fast-path because all fast-path slots of the transaction are used?
+        Relations of shared catalogs (database 0) are not eligible. Weak
+        locks are also granted in the shared lock table while another
+        backend holds a strong lock on the relation, these are no spills.
+        """
+        return (
+            event.mode in FASTPATH_MODES
+            and event.locktag_field1 != 0
+            and event.object not in transaction.fastpath_relations
+            and len(transaction.fastpath_relations) >= self.fastpath_slots
+        )
+
+    def is_exceeding(self, transaction):
+        """
+        Did the transaction exceed the fast-path capacity?
+        """
+        return transaction.spilled_locks > 0
+
+    def finish_transaction(self, transaction):
+        """
+        Add a finished transaction to the report
+        """
+        self.finished_transactions += 1
+
+        if not self.is_exceeding(transaction):
+            return
+
+        self.exceeding_transactions += 1
+
+        fingerprint = get_query_fingerprint(transaction.spill_query)
+        entry = self.fingerprints.get(fingerprint)
+        if entry is None:
+            entry = [0, 0, 0]
+            self.fingerprints[fingerprint] = entry
+
+        entry[0] += 1
+        entry[1] += transaction.spilled_locks
+        entry[2] = max(entry[2], transaction.peak_relations)
+
+        # Keep the transactions with the most spilled locks
+        self.sequence += 1
+        item = (
+            transaction.spilled_locks,
+            transaction.peak_relations,
+            -self.sequence,
+            transaction,
+        )
+
+        if len(self.top_transactions) < self.max_transactions:
+            heapq.heappush(self.top_transactions, item)
+        else:
+            heapq.heappushpop(self.top_transactions, item)
+
+    def get_top_transactions(self):
+        """
+        Get the transactions with the most spilled locks
+        """
+        return [item[3] for item in sorted(self.top_transactions, reverse=True)]
+
+    def print_report(self, resolve_object=None):
+        """
+        Print the transactions and query fingerprints that exceeded the
+        fast-path capacity. The resolve_object function maps a
+        (pid, oid, cluster) to the name of the relation.
+        """
+        print("\nFast-path lock analysis:\n========================")
+        print(
+            f"{self.exceeding_transactions} of {self.finished_transactions} "
+            f"transactions exceeded the {self.fastpath_slots} fast-path slots"
+        )
+
+        print("\nTransactions")
+        table = PrettyTable(
+            [
+                "Pid",
+                "Begin",
+                "Fast-Path Locks",
+                "Shared Locks",
+                "Spilled Locks",
+                "Peak Relations",
+                "First Spilled Relation",
+                "Query",
+            ]
+        )
+
+        for transaction in self.get_top_transactions():
+            first_spill = transaction.first_spill
+            if first_spill is not None and resolve_object:
+                first_spill = resolve_object(
+                    transaction.pid, first_spill, transaction.cluster
+                )
+
+            table.add_row(
+                [
+                    transaction.pid,
+                    transaction.timestamp,
+                    transaction.fastpath_locks,
+                    transaction.shared_locks,
+                    transaction.spilled_locks,
+                    transaction.peak_relations,
+                    first_spill if first_spill is not None else "-",
+                    get_query_fingerprint(transaction.spill_query),
+                ]
+            )
+
+        print(table)
+
+        print("\nQuery fingerprints")
+        table = PrettyTable(
+            ["Query", "Transactions", "Spilled Locks", "Peak Relations"]
+        )
+
+        for fingerprint in sorted(
+            self.fingerprints, key=lambda key: self.fingerprints[key], reverse=True
+        ):
+            table.add_row([fingerprint or "-", *self.fingerprints[fingerprint]])
+
+        print(table)
@@ -3,11 +3,22 @@ Helper classes
 """
 
 import os
+import re
+import time
 
+from contextlib import contextmanager
 from pathlib import Path
 
 from bcc import BPF
 
+from pg_lock_tracer.elf_symbols import ElfSymbolIndex
+
+# The scheduler tracepoints of the off-CPU accounting and their BPF functions
+OFF_CPU_TRACEPOINTS = (
+    ("sched:sched_switch", "off_cpu_sched_switch"),
+    ("sched:sched_waking", "off_cpu_sched_waking"),
+)
+
 
 class PostgreSQLLockHelper:
     """
@@ -95,6 +106,18 @@ class BPFHelper:
     # The size of the kernel ring buffer
     page_cnt = 2048
 
+    # The symbol indexes of the binaries (key = path)
+    symbol_indexes = {}
+
+    # The declarations of a BPF program (see get_program_names)
+    declaration_patterns = (
+        re.compile(r"^\s*BPF_\w+\(\s*(\w+)", re.MULTILINE),
+        re.compile(r"^\s*#\s*define\s+(\w+)", re.MULTILINE),
+        re.compile(r"^(?:typedef\s+)?(?:struct|enum|union)\s+(\w+)\s*\{", re.MULTILINE),
+        re.compile(r"^\}\s*(\w+)\s*;", re.MULTILINE),
+        re.compile(r"^(?:static\s+)?(?:inline\s+)?\w+\s+\**(\w+)\s*\(", re.MULTILINE),
+    )
+
     @staticmethod
     def enum_to_defines(enum_instance, prefix):
         """
@@ -121,12 +144,78 @@ class BPFHelper:
             return bpf_program.read()
 
     @staticmethod
-    def check_pid_exe(pids, executable):
+    def expand_clusters(bpf_program, cluster_defines):
+        """
+        Repeat the part of the BPF program after the __CLUSTER_PROBES__
+        placeholder for each traced binary (cluster). Each copy gets the
+        CLUSTER_ID, the given defines of the cluster, and the function
+        names are suffixed with the cluster id (see cluster_function_name).
+        """
+        if "__CLUSTER_PROBES__" not in bpf_program:
+            raise ValueError("BPF program has no __CLUSTER_PROBES__ placeholder")
+
+        common, cluster_part = bpf_program.split("__CLUSTER_PROBES__", 1)
+        result = common
+
+        for cluster, defines in enumerate(cluster_defines):
+            defines = f"#define CLUSTER_ID {cluster}\n{defines}"
+            result += defines
+            result += cluster_part.replace("__CLUSTER__", f"_{cluster}")
+
+            # The next cluster defines the same names
+            for line in defines.splitlines():
+                if line.startswith("#define "):
+                    result += f"#undef {line.split()[1]}\n"
+
+        return result
+
+    @staticmethod
+    def cluster_function_name(bpf_fn_name, cluster):
+        """
+        Get the name of the BPF function of the given cluster
+        """
+        return f"{bpf_fn_name}_{cluster}"
+
+    @staticmethod
+    def get_program_names(bpf_program):
         """
-        Do the given PIDs belong to the executable
+        Get the names that are declared by a BPF program (maps, functions,
+        types, and defines)
         """
+        names = set()
+
+        for pattern in BPFHelper.declaration_patterns:
+            names.update(pattern.findall(bpf_program))
+
+        return names
+
+    @staticmethod
+    def prefix_program(bpf_program, prefix):
+        """
+        Prefix the names that are declared by a BPF program, so that
+        several programs can be compiled into one BPF object (e.g., each
+        tracer declares the event map 'lockevents').
+        """
+        names = BPFHelper.get_program_names(bpf_program)
+
+        if not names:
+            return bpf_program
+
+        pattern = re.compile(
+            r"\b(" + "|".join(sorted(map(re.escape, names), reverse=True)) + r")\b"
+        )
+        return pattern.sub(lambda match: prefix + match.group(1), bpf_program)
+
+    @staticmethod
+    def check_pid_exe(pids, *executables):
+        """
+        Do the given PIDs belong to the executable(s). Returns a map with
+        the index of the executable per PID.
+        """
+        pid_executables = {}
+
         if not pids:
-            return
+            return pid_executables
 
         for pid in pids:
             if not os.path.isdir(f"/proc/{pid}"):
@@ -136,11 +225,68 @@ class BPFHelper:
 
             binary = os.readlink(f"/proc/{pid}/exe")
 
-            if binary != executable:
+            # The binary of a container has another path on the host
+            # (e.g., /proc/<pid>/root/...), so the files are also compared
+            matches = [
+                index
+                for index, executable in enumerate(executables)
+                if binary == executable
+                or os.path.samefile(f"/proc/{pid}/exe", executable)
+            ]
+
+            if not matches:
                 raise ValueError(
-                    f"Pid {pid} does not belong to binary {executable}. Executable is {binary}"
+                    f"Pid {pid} does not belong to binary {', '.join(executables)}. "
+                    f"Executable is {binary}"
                 )
 
+            pid_executables[pid] = matches[0]
+
+        return pid_executables
+
+    @staticmethod
+    def get_exe_pids(path):
+        """
+        Get the PIDs of the running processes of the executable
+        """
+        pids = []
+
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+
+            try:
+                if os.path.samefile(f"/proc/{entry}/exe", path):
+                    pids.append(int(entry))
+            except OSError:
+                # The process has exited or has no executable (kernel thread)
+                continue
+
+        return sorted(pids)
+
+    @staticmethod
+    def get_parent_pid(pid):
+        """
+        Get the pid of the parent of a process (e.g., the postmaster of a
+        PostgreSQL backend)
+        """
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("PPid:"):
+                    return int(line.split()[1])
+
+        raise ValueError(f"Parent of pid {pid} not found")
+
+    @staticmethod
+    def get_symbol_index(path):
+        """
+        Get the (cached) index of the function symbols of the binary
+        """
+        if path not in BPFHelper.symbol_indexes:
+            BPFHelper.symbol_indexes[path] = ElfSymbolIndex(path)
+
+        return BPFHelper.symbol_indexes[path]
+
     @staticmethod
     def register_ebpf_probe(
         path, bpf_instance, function_regex, bpf_fn_name, verbose, probe_on_enter=True
@@ -149,7 +295,11 @@ class BPFHelper:
         Register a BPF probe
         """
         addresses = set()
-        func_and_addr = BPF.get_user_functions_and_addresses(path, function_regex)
+        func_and_addr = BPFHelper.get_symbol_index(path).find_functions(function_regex)
+
+        # The symbols might be only available in a separate debug file
+        if not func_and_addr:
+            func_and_addr = BPF.get_user_functions_and_addresses(path, function_regex)
 
         if not func_and_addr:
             raise ValueError(f"Unable to locate function {function_regex}")
@@ -160,13 +310,222 @@ class BPFHelper:
                 continue
             addresses.add(address)
 
+            # Attach by address, so bcc does not resolve the symbol again
             if probe_on_enter:
-                bpf_instance.attach_uprobe(name=path, sym=function, fn_name=bpf_fn_name)
+                bpf_instance.attach_uprobe(name=path, addr=address, fn_name=bpf_fn_name)
                 if verbose:
                     print(f"Attaching to {function} at address {address} on enter")
             else:
                 bpf_instance.attach_uretprobe(
-                    name=path, sym=function, fn_name=bpf_fn_name
+                    name=path, addr=address, fn_name=bpf_fn_name
                 )
                 if verbose:
                     print(f"Attaching to {function} at address {address} on return")
+
+    @staticmethod
+    def insert_off_cpu_program(bpf_program, off_cpu):
+        """
+        Insert the off-CPU accounting of the lock waits (bpf/off_cpu.c) at
+        the __OFF_CPU__ placeholder of the program (if enabled)
+        """
+        off_cpu_program = BPFHelper.read_bpf_program("off_cpu.c") if off_cpu else ""
+        return bpf_program.replace("__OFF_CPU__", off_cpu_program)
+
+    @staticmethod
+    def attach_off_cpu_tracepoints(bpf_instance, verbose):
+        """
+        Attach the scheduler tracepoints of the off-CPU accounting
+        """
+        for tracepoint, bpf_fn_name in OFF_CPU_TRACEPOINTS:
+            bpf_instance.attach_tracepoint(tp=tracepoint, fn_name=bpf_fn_name)
+            if verbose:
+                print(f"Attaching to tracepoint {tracepoint}")
+
+
+class CgroupHelper:
+    """
+    Helper for tracing the processes of a cgroup (v2), e.g., of a container
+    """
+
+    @staticmethod
+    def check_cgroup(cgroup_path):
+        """
+        Check that the given path is a cgroup v2 directory
+        """
+        if not os.path.isfile(os.path.join(cgroup_path, "cgroup.procs")):
+            raise ValueError(f"{cgroup_path} is not a cgroup v2 directory")
+
+    @staticmethod
+    def get_cgroup_pids(cgroup_path):
+        """
+        Get the pids of the cgroup and its descendants
+        """
+        pids = []
+
+        for directory, _, files in os.walk(cgroup_path):
+            if "cgroup.procs" not in files:
+                continue
+
+            with open(
+                os.path.join(directory, "cgroup.procs"), "r", encoding="utf-8"
+            ) as procs:
+                pids.extend(int(line) for line in procs if line.strip())
+
+        return pids
+
+    @staticmethod
+    def get_cgroup_exe_pids(cgroup_path, executables):
+        """
+        Get the pids of the processes of the cgroup that run one of the
+        executables (e.g., not the pause container of a pod)
+        """
+        pids = []
+
+        for pid in CgroupHelper.get_cgroup_pids(cgroup_path):
+            try:
+                if any(
+                    os.path.samefile(f"/proc/{pid}/exe", executable)
+                    for executable in executables
+                ):
+                    pids.append(pid)
+            except OSError:
+                # The process has exited or has no executable (kernel thread)
+                continue
+
+        return pids
+
+    @staticmethod
+    def get_pid_namespace(pids):
+        """
+        Get the device and inode number of the PID namespace of the given
+        (host) pids. All processes have to be in the same namespace.
+        """
+        namespaces = set()
+
+        for pid in pids:
+            try:
+                namespace = os.stat(f"/proc/{pid}/ns/pid")
+            except FileNotFoundError:
+                continue
+
+            namespaces.add((namespace.st_dev, namespace.st_ino))
+
+        if not namespaces:
+            raise ValueError("No process of the traced binaries found in the cgroup")
+
+        if len(namespaces) > 1:
+            raise ValueError(
+                "The processes of the traced binaries are in different PID "
+                "namespaces, use the cgroup of a single container"
+            )
+
+        return namespaces.pop()
+
+    @staticmethod
+    def get_namespace_pid(pid):
+        """
+        Get the pid of a process in its innermost PID namespace
+        """
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("NSpid:"):
+                    return int(line.split()[-1])
+
+        return pid
+
+    @staticmethod
+    def get_host_pids(cgroup_path, namespace_pids, executables):
+        """
+        Map the pids of the PID namespace of a container to host pids. Only
+        the processes of the executables in the cgroup are considered.
+        """
+        host_pids = {}
+
+        for pid in CgroupHelper.get_cgroup_exe_pids(cgroup_path, executables):
+            try:
+                namespace_pid = CgroupHelper.get_namespace_pid(pid)
+            except FileNotFoundError:
+                continue
+
+            if namespace_pid not in namespace_pids:
+                continue
+
+            # The processes of other containers of the cgroup can use the
+            # same pids in their namespaces
+            if namespace_pid in host_pids:
+                raise ValueError(
+                    f"Pid {namespace_pid} is not unique in cgroup {cgroup_path}, "
+                    "use the cgroup of a single container"
+                )
+
+            host_pids[namespace_pid] = pid
+
+        for namespace_pid in namespace_pids:
+            if namespace_pid not in host_pids:
+                raise ValueError(
+                    f"Pid {namespace_pid} of binary {', '.join(executables)} "
+                    f"not found in cgroup {cgroup_path}"
+                )
+
+        return host_pids
+
+    @staticmethod
+    def generate_c_defines(cgroup_path, container, executables=(), pids=None):
+        """
+        Create the C defines for the cgroup and PID namespace filter. The
+        PID namespace is the namespace of the traced processes (the given
+        pids of the namespace or all processes of the executables).
+        """
+        if cgroup_path is None:
+            if container:
+                raise ValueError("--container requires the cgroup of the container")
+            return ""
+
+        CgroupHelper.check_cgroup(cgroup_path)
+        defines = "#define FILTER_CGROUP\n"
+
+        if container:
+            if pids:
+                host_pids = CgroupHelper.get_host_pids(
+                    cgroup_path, pids, executables
+                ).values()
+            else:
+                host_pids = CgroupHelper.get_cgroup_exe_pids(cgroup_path, executables)
+
+            namespace_dev, namespace_ino = CgroupHelper.get_pid_namespace(host_pids)
+            defines += f"#define PIDNS_DEV {namespace_dev}\n"
+            defines += f"#define PIDNS_INO {namespace_ino}\n"
+
+        return defines
+
+
+class StartupTimer:
+    """
+    Measure the duration of the startup phases of a tracer
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def measure(self, phase):
+        """
+        Measure the duration of the given phase
+        """
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((phase, time.perf_counter() - phase_start))
+
+    def print_breakdown(self):
+        """
+        Print the duration of the startup phases
+        """
+        print("===> Startup time")
+        for phase, duration in self.phases:
+            print(f"{phase:<24} {duration * 1000:10.1f} ms")
+
+        total = time.perf_counter() - self.start
+        print(f"{'Total':<24} {total * 1000:10.1f} ms")
@@ -0,0 +1,442 @@
+"""
+Format the events of the lock tracer. All strings that only depend on
+the event type and the lock mode are precomputed, decoded strings and
+resolved object names are cached, and the output is collected in a
+single reused buffer. So, the per-event work is mostly reduced to
+dictionary lookups and string concatenation.
+"""
+
+import sys
+
+from json.encoder import encode_basestring_ascii
+
+from pg_lock_tracer.helper import PostgreSQLLockHelper
+from pg_lock_tracer.lock_events import (
+    Events,
+    LockTagType,
+    PGError,
+    LOCK_MODE_EVENTS,
+    LOCKTAG_EVENTS,
+    get_locktag_description,
+    get_locktag_fields,
+    get_locktag_name,
+)
+
+# Events that are opened by a (string) range value
+RANGE_VALUE_EVENTS = frozenset((Events.TABLE_OPEN_RV, Events.TABLE_OPEN_RV_EXTENDED))
+
+# The human readable output of the events (without the timestamp and pid prefix)
+HUMAN_TEMPLATES = {
+    Events.TABLE_OPEN: "Table open {table} {lock_type}",
+    Events.TABLE_OPEN_RV: "Table open (by range value) {table} {lock_type}",
+    Events.TABLE_OPEN_RV_EXTENDED: "Table open (by range value) {table} {lock_type}",
+    Events.TABLE_CLOSE: "Table close {table} {lock_type}",
+    Events.LOCK_RELATION_OID: "Lock object {table} {lock_type}",
+    Events.LOCK_RELATION_OID_END: "Lock was acquired in {lock_time} ns",
+    Events.UNLOCK_RELATION_OID: "Unlock relation {table} {lock_type}",
+    Events.LOCK_GRANTED: (
+        "Lock granted {table} {lock_type} "
+        "(Requested locks {requested}, granted {granted}, waiting {waiting})"
+    ),
+    Events.LOCK_GRANTED_FASTPATH: "Lock granted (fastpath) {table} {lock_type}",
+    Events.LOCK_GRANTED_LOCAL: (
+        "Lock granted (local) {table} {lock_type} "
+        "(Already hold local {lock_local_hold})"
+    ),
+    Events.LOCK_UNGRANTED: (
+        "Lock ungranted {table} {lock_type} "
+        "(Requested locks {requested}, granted {granted}, waiting {waiting})"
+    ),
+    Events.LOCK_UNGRANTED_FASTPATH: "Lock ungranted (fastpath) {table} {lock_type}",
+    Events.LOCK_UNGRANTED_LOCAL: (
+        "Lock ungranted (local) {table} {lock_type} (Hold local {lock_local_hold})"
+    ),
+    Events.INVALIDATION_MESSAGES_ACCEPT: "Accept invalidation messages",
+    Events.ERROR: "Error occurred servity: {servity}",
+    Events.QUERY_BEGIN: "Query begin '{query}'",
+    Events.QUERY_END: "Query done\n",
+    Events.TRANSACTION_BEGIN: "Transaction begin",
+    Events.TRANSACTION_COMMIT: "Transaction commit",
+    Events.TRANSACTION_ABORT: "Transaction abort",
+    Events.DEADLOCK: "DEADLOCK DETECTED",
+}
+
+
+# Events that carry the state of the shared LOCK
+SHARED_LOCK_EVENTS = frozenset((Events.LOCK_GRANTED, Events.LOCK_UNGRANTED))
+
+# Events with output fields that change on each event
+DYNAMIC_EVENTS = frozenset(
+    (
+        Events.TABLE_OPEN_RV,
+        Events.TABLE_OPEN_RV_EXTENDED,
+        Events.LOCK_RELATION_OID_END,
+        Events.LOCK_GRANTED,
+        Events.LOCK_GRANTED_LOCAL,
+        Events.LOCK_UNGRANTED,
+        Events.LOCK_UNGRANTED_LOCAL,
+        Events.QUERY_BEGIN,
+    )
+)
+
+# Events with JSON fields that change on each event (the local hold count
+# of an ungranted lock is only part of the human readable output). The set
+# is checked per event, so it contains plain ints.
+JSON_DYNAMIC_EVENTS = frozenset(
+    map(int, DYNAMIC_EVENTS - {Events.LOCK_UNGRANTED_LOCAL})
+)
+
+# The event and lock tag types as plain ints (the lookup of an enum member is
+# much slower than the comparison)
+QUERY_BEGIN = int(Events.QUERY_BEGIN)
+LOCK_GRANTED_LOCAL = int(Events.LOCK_GRANTED_LOCAL)
+LOCK_RELATION_OID_END = int(Events.LOCK_RELATION_OID_END)
+LOCKTAG_RELATION = int(LockTagType.RELATION)
+
+
+class LockEventFormatter:
+    # The maximal number of cached decoded strings and output prefixes
+    max_cache_entries = 65536
+
+    def __init__(self, show_cluster=False) -> None:
+        # Add the cluster (index of the traced binary) to the output
+        self.show_cluster = show_cluster
+
+        # Key = (event type, mode), Value = template / JSON fragment
+        self.human_templates = {}
+        self.json_fragments = {}
+
+        # Key = raw bytes, Value = decoded string
+        self.decoded_strings = {}
+
+        # Key = (cluster, pid, oid), Value = (statistics key, human name, JSON fragment)
+        self.objects = {}
+
+        # Key = (cluster, pid, event type, mode, oid), Value = (statistics key, prefix)
+        self.human_prefixes = {}
+        self.json_prefixes = {}
+
+        # Precompute the strings for all lock modes and error levels
+        for lock_mode in PostgreSQLLockHelper.locks.values():
+            for event_type in LOCK_MODE_EVENTS:
+                self.build_templates(event_type, lock_mode)
+
+        for error in PGError:
+            self.build_templates(Events.ERROR, error)
+
+        for event_type in HUMAN_TEMPLATES:
+            if event_type not in LOCK_MODE_EVENTS and event_type != Events.ERROR:
+                self.build_templates(event_type, 0)
+
+    def build_templates(self, event_type, mode):
+        """
+        Build the human readable template and the JSON fragment
+        of the given event type and mode
+        """
+        if event_type not in HUMAN_TEMPLATES:
+            raise ValueError(f"Unsupported event type {event_type}")
+
+        event_name = Events(event_type).name
+        template = HUMAN_TEMPLATES[event_type]
+        fragment = f'"event": "{event_name}"'
+
+        if event_type in LOCK_MODE_EVENTS:
+            lock_type = PostgreSQLLockHelper.lock_type_to_str(mode)
+            template = template.replace("{lock_type}", lock_type)
+            fragment += f', "lock_type": "{lock_type}"'
+        elif event_type == Events.ERROR:
+            servity = PGError(mode).name
+            template = template.replace("{servity}", servity)
+            fragment += f', "servity": "{servity}"'
+
+        self.human_templates[(event_type, mode)] = template
+        self.json_fragments[(event_type, mode)] = fragment
+
+    def get_templates(self, event_type, mode):
+        """
+        Get the human readable template and the JSON fragment
+        """
+        key = (event_type, mode)
+
+        if key not in self.human_templates:
+            self.build_templates(event_type, mode)
+
+        return (self.human_templates[key], self.json_fragments[key])
+
+    def decode(self, value):
+        """
+        Decode the given string from the BPF event and cache the result
+        """
+        decoded = self.decoded_strings.get(value)
+
+        if decoded is None:
+            if len(self.decoded_strings) >= self.max_cache_entries:
+                self.decoded_strings.clear()
+
+            decoded = value.decode("utf-8")
+            self.decoded_strings[value] = decoded
+
+        return decoded
+
+    def get_range_value_name(self, event):
+        """
+        Get the name of a table that is opened by a range value
+        """
+        schema = self.decode(event.payload_str1)
+        table = self.decode(event.payload_str2)
+        return f"{schema}.{table}"
+
+    @staticmethod
+    def get_object(event, event_type):
+        """
+        Get the object of an event. This is the OID of a relation or the
+        lock tag (type, field 1 - 4) of other locks.
+        """
+        if event_type in LOCKTAG_EVENTS and event.locktag_type != LOCKTAG_RELATION:
+            return (
+                event.locktag_type,
+                event.locktag_field1,
+                event.locktag_field2,
+                event.locktag_field3,
+                event.locktag_field4,
+            )
+
+        return event.object
+
+    def resolve_locktag(self, pid, locktag, oid_resolvers, cluster):
+        """
+        Resolve a lock tag. Returns the key for the statistics, the human
+        readable name and the JSON fragment of the lock tag.
+        """
+        locktag_type, *fields = locktag
+        name = get_locktag_name(locktag_type)
+        values = dict(zip(get_locktag_fields(locktag_type), fields))
+        fragment = f', "locktag": "{name}"'
+
+        for field, value in values.items():
+            fragment += f', "{field}": {value}'
+
+        # The relation of page, tuple, and relation extension locks
+        if "oid" in values:
+            table_name, table, _ = self.resolve_object(
+                pid, values["oid"], oid_resolvers, cluster
+            )
+            values["oid"] = table
+            if isinstance(table_name, str):
+                fragment += f', "table": {encode_basestring_ascii(table_name)}'
+
+        description = get_locktag_description(name, values)
+        return (description, description, fragment)
+
+    def resolve_object(self, pid, oid, oid_resolvers, cluster=0):
+        """
+        Resolve the OID (or the lock tag) of an event. Returns the key for
+        the statistics, the human readable name and the JSON fragment of
+        the object.
+        """
+        key = (cluster, pid, oid)
+        result = self.objects.get(key)
+
+        if result is not None:
+            return result
+
+        if isinstance(oid, tuple):
+            result = self.resolve_locktag(pid, oid, oid_resolvers, cluster)
+
+            # Lock tags of unresolved relations are not cached
+            fields = get_locktag_fields(oid[0])
+            if "oid" in fields:
+                relation = oid[1 + fields.index("oid")]
+                if (cluster, pid, relation) not in self.objects:
+                    return result
+        elif oid and pid in oid_resolvers:
+            name = oid_resolvers[pid].resolve_oid(oid)
+            result = (
+                name,
+                f"{oid} ({name})",
+                f', "table": {encode_basestring_ascii(name)}, "oid": {oid}',
+            )
+
+            # Unresolved OIDs (e.g., of uncommitted relations) are not cached
+            if name in ("", f"Oid {oid}"):
+                return result
+        elif oid:
+            result = (oid, str(oid), f', "oid": {oid}')
+        else:
+            result = (oid, str(oid), "")
+
+        if len(self.objects) >= self.max_cache_entries:
+            self.objects.clear()
+
+        self.objects[key] = result
+        return result
+
+    # pylint: disable=too-many-arguments
+    def get_human_prefix(self, pid, event_type, mode, oid, oid_resolvers, cluster=0):
+        """
+        Get the statistics key and the human readable output of the event
+        (without the timestamp). For events with dynamic fields, the output
+        is a template that has to be formatted.
+        """
+        key = (cluster, pid, event_type, mode, oid)
+        result = self.human_prefixes.get(key)
+
+        if result is not None:
+            return result
+
+        statistics_key, table, _ = self.resolve_object(pid, oid, oid_resolvers, cluster)
+        template, _ = self.get_templates(event_type, mode)
+
+        # The template is formatted again, so braces in the name are escaped
+        if event_type in DYNAMIC_EVENTS:
+            table = table.replace("{", "{{").replace("}", "}}")
+
+        process = f" [Cluster {cluster}]" if self.show_cluster else ""
+        process += f" [Pid {pid}] "
+        result = (statistics_key, process + template.replace("{table}", table))
+
+        if len(self.human_prefixes) >= self.max_cache_entries:
+            self.human_prefixes.clear()
+
+        if self.objects.get((cluster, pid, oid)) is not None:
+            self.human_prefixes[key] = result
+
+        return result
+
+    # pylint: disable=too-many-arguments
+    def get_json_prefix(self, pid, event_type, mode, oid, oid_resolvers, cluster=0):
+        """
+        Get the statistics key and the JSON output of the event between
+        the timestamp and the dynamic fields
+        """
+        key = (cluster, pid, event_type, mode, oid)
+        result = self.json_prefixes.get(key)
+
+        if result is not None:
+            return result
+
+        statistics_key, _, object_fragment = self.resolve_object(
+            pid, oid, oid_resolvers, cluster
+        )
+        _, fragment = self.get_templates(event_type, mode)
+        process = f', "pid": {pid}'
+        if self.show_cluster:
+            process += f', "cluster": {cluster}'
+        result = (statistics_key, f"{process}, {fragment}{object_fragment}")
+
+        if len(self.json_prefixes) >= self.max_cache_entries:
+            self.json_prefixes.clear()
+
+        if self.objects.get((cluster, pid, oid)) is not None:
+            self.json_prefixes[key] = result
+
+        return result
+
+    def format_human(self, event, event_type, timestamp, prefix, lock_time=None):
+        """
+        Format the event in a human readable format
+        """
+        if event_type not in DYNAMIC_EVENTS:
+            return f"{timestamp}{prefix}"
+
+        if event_type == QUERY_BEGIN:
+            output = prefix.format(query=self.decode(event.payload_str1))
+        elif event_type in RANGE_VALUE_EVENTS:
+            output = prefix.format(table=self.get_range_value_name(event))
+        else:
+            output = prefix.format(
+                requested=event.requested,
+                granted=event.granted,
+                waiting=event.waiting,
+                lock_local_hold=event.lock_local_hold,
+                lock_time=lock_time,
+            )
+
+        return f"{timestamp}{output}"
+
+    # pylint: disable=too-many-arguments
+    def format_json(
+        self, event, event_type, timestamp, prefix, lock_time=None, stacktrace=None
+    ):
+        """
+        Format the event as JSON (the output is identical to json.dumps)
+        """
+        # The most frequent events (each lock acquisition) are checked first
+        if event_type == LOCK_GRANTED_LOCAL:
+            fields = f', "lock_local_hold": {event.lock_local_hold}'
+        elif event_type == LOCK_RELATION_OID_END:
+            lock_time = "null" if lock_time is None else lock_time
+            fields = f', "lock_time": {lock_time}'
+        elif event_type in SHARED_LOCK_EVENTS:
+            fields = (
+                f', "requested": {event.requested}, "granted": {event.granted}'
+                f', "waiting": {event.waiting}, "grant_mask": {event.grant_mask}'
+                f', "wait_mask": {event.wait_mask}'
+            )
+        elif event_type == QUERY_BEGIN:
+            query = self.decode(event.payload_str1)
+            fields = f', "query": {encode_basestring_ascii(query)}'
+        elif event_type in RANGE_VALUE_EVENTS:
+            table = self.get_range_value_name(event)
+            fields = f', "table": {encode_basestring_ascii(table)}'
+        else:
+            fields = ""
+
+        if stacktrace is not None:
+            fields += f', "stacktrace": {encode_basestring_ascii(stacktrace)}'
+
+        return f'{{"timestamp": {timestamp}{prefix}{fields}}}'
+
+
+class OutputBuffer:
+    """
+    Collect the output lines in one reused buffer and write them
+    as a block into the output file (or stdout)
+    """
+
+    # Flush the buffer when this number of lines is reached
+    flush_lines = 4096
+
+    def __init__(self, output_file=None) -> None:
+        self.output_file = output_file
+        self.lines = []
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    def append(self, line, timestamp=None):
+        """
+        Append a line to the buffer. The timestamp is provided for the
+        first line of an event. The buffer is only flushed before a new
+        event, so the lines of an event are written together.
+        """
+        if timestamp is not None:
+            if self.first_timestamp is None:
+                self.first_timestamp = timestamp
+            elif len(self.lines) >= self.flush_lines:
+                self.flush()
+                self.first_timestamp = timestamp
+            self.last_timestamp = timestamp
+
+        self.lines.append(line)
+
+    def flush(self):
+        """
+        Write the content of the buffer and reset the buffer
+        """
+        if not self.lines:
+            return
+
+        self.lines.append("")
+        block = "\n".join(self.lines)
+
+        if self.output_file:
+            self.output_file.write_block(
+                block, len(self.lines) - 1, self.first_timestamp, self.last_timestamp
+            )
+        else:
+            sys.stdout.write(block)
+            sys.stdout.flush()
+
+        self.lines.clear()
+        self.first_timestamp = None
+        self.last_timestamp = None
@@ -0,0 +1,194 @@
+"""Events of the PostgreSQL lock tracer (shared with the BPF program)"""
+
+import struct
+import ctypes as ct
+
+from enum import IntEnum, unique
+
+
+@unique
+class Events(IntEnum):
+    TABLE_OPEN = 1
+    TABLE_OPEN_RV = 2
+    TABLE_OPEN_RV_EXTENDED = 3
+    TABLE_CLOSE = 4
+    ERROR = 5
+    QUERY_BEGIN = 20
+    QUERY_END = 21
+    LOCK_RELATION_OID = 30
+    LOCK_RELATION_OID_END = 31
+    UNLOCK_RELATION_OID = 32
+    LOCK_GRANTED = 33
+    LOCK_GRANTED_FASTPATH = 34
+    LOCK_GRANTED_LOCAL = 35
+    LOCK_UNGRANTED = 36
+    LOCK_UNGRANTED_FASTPATH = 37
+    LOCK_UNGRANTED_LOCAL = 38
+    TRANSACTION_BEGIN = 40
+    TRANSACTION_COMMIT = 41
+    TRANSACTION_ABORT = 42
+    INVALIDATION_MESSAGES_ACCEPT = 50
+    # Events over 1000 are handled regardless of any pid filter
+    GLOBAL = 1000
+    DEADLOCK = 1001
+
+
+# From elog.h
+@unique
+class PGError(IntEnum):
+    ERROR = 21
+    FATAL = 22
+    PANIC = 23
+
+
+# From lock.h
+@unique
+class LockTagType(IntEnum):
+    RELATION = 0
+    RELATION_EXTEND = 1
+    DATABASE_FROZEN_IDS = 2
+    PAGE = 3
+    TUPLE = 4
+    TRANSACTION = 5
+    VIRTUALTRANSACTION = 6
+    SPECULATIVE_TOKEN = 7
+    OBJECT = 8
+    USERLOCK = 9
+    ADVISORY = 10
+    APPLY_TRANSACTION = 11
+
+
+# The names of the lock tag types (as in pg_locks.locktype)
+LOCKTAG_NAMES = {
+    LockTagType.RELATION: "relation",
+    LockTagType.RELATION_EXTEND: "extend",
+    LockTagType.DATABASE_FROZEN_IDS: "frozenid",
+    LockTagType.PAGE: "page",
+    LockTagType.TUPLE: "tuple",
+    LockTagType.TRANSACTION: "transactionid",
+    LockTagType.VIRTUALTRANSACTION: "virtualxid",
+    LockTagType.SPECULATIVE_TOKEN: "spectoken",
+    LockTagType.OBJECT: "object",
+    LockTagType.USERLOCK: "userlock",
+    LockTagType.ADVISORY: "advisory",
+    LockTagType.APPLY_TRANSACTION: "applytransaction",
+}
+
+# The meaning of locktag_field1 - locktag_field4 per lock tag type (see
+# the SET_LOCKTAG_* macros in lock.h). The field 'oid' is a relation.
+LOCKTAG_FIELDS = {
+    LockTagType.RELATION: ("database", "oid"),
+    LockTagType.RELATION_EXTEND: ("database", "oid"),
+    LockTagType.DATABASE_FROZEN_IDS: ("database",),
+    LockTagType.PAGE: ("database", "oid", "block"),
+    LockTagType.TUPLE: ("database", "oid", "block", "offset"),
+    LockTagType.TRANSACTION: ("xid",),
+    LockTagType.VIRTUALTRANSACTION: ("backend", "local_xid"),
+    LockTagType.SPECULATIVE_TOKEN: ("xid", "token"),
+    LockTagType.OBJECT: ("database", "class_oid", "object_oid", "object_subid"),
+    LockTagType.USERLOCK: ("field1", "field2", "field3", "field4"),
+    LockTagType.ADVISORY: ("database", "key1", "key2", "key_type"),
+    LockTagType.APPLY_TRANSACTION: ("database", "subscription", "xid", "object_oid"),
+}
+
+
+def get_locktag_name(locktag_type):
+    """
+    Get the name of a lock tag type
+    """
+    return LOCKTAG_NAMES.get(locktag_type, f"locktag {locktag_type}")
+
+
+def get_locktag_type(name):
+    """
+    Get the lock tag type of a name
+    """
+    for locktag_type, locktag_name in LOCKTAG_NAMES.items():
+        if locktag_name == name:
+            return locktag_type
+
+    raise ValueError(f"Unknown lock tag type {name}")
+
+
+def get_locktag_fields(locktag_type):
+    """
+    Get the names of the fields of a lock tag type
+    """
+    return LOCKTAG_FIELDS.get(locktag_type, LOCKTAG_FIELDS[LockTagType.USERLOCK])
+
+
+def get_locktag_description(name, values):
+    """
+    Get the human readable description of a lock tag (e.g., 'transactionid xid=1234')
+    """
+    return " ".join([name] + [f"{field}={value}" for field, value in values.items()])
+
+
+# Events that carry a lock mode
+LOCK_MODE_EVENTS = (
+    Events.TABLE_OPEN,
+    Events.TABLE_OPEN_RV,
+    Events.TABLE_OPEN_RV_EXTENDED,
+    Events.TABLE_CLOSE,
+    Events.LOCK_RELATION_OID,
+    Events.UNLOCK_RELATION_OID,
+    Events.LOCK_GRANTED,
+    Events.LOCK_GRANTED_FASTPATH,
+    Events.LOCK_GRANTED_LOCAL,
+    Events.LOCK_UNGRANTED,
+    Events.LOCK_UNGRANTED_FASTPATH,
+    Events.LOCK_UNGRANTED_LOCAL,
+)
+
+# Events that carry the LOCKTAG of the lock (the set is checked per event,
+# so it contains plain ints, which are faster to compare than enum members)
+LOCKTAG_EVENTS = frozenset(
+    map(
+        int,
+        (
+            Events.LOCK_GRANTED,
+            Events.LOCK_GRANTED_LOCAL,
+            Events.LOCK_UNGRANTED,
+            Events.LOCK_UNGRANTED_LOCAL,
+        ),
+    )
+)
+
+
+# pylint: disable=too-few-public-methods
+class PostgreSQLEvent(ct.Structure):
+    """
+    The event that is submitted by the BPF program. The layout has to
+    match the struct PostgreSQLEvent in bpf/pg_lock_tracer.c.
+    """
+
+    _fields_ = [
+        ("pid", ct.c_uint32),
+        ("cluster", ct.c_uint32),
+        ("timestamp", ct.c_uint64),
+        ("event_type", ct.c_uint32),
+        ("object", ct.c_uint32),
+        ("mode", ct.c_int),
+        ("requested", ct.c_uint32),
+        ("lock_local_hold", ct.c_int64),
+        ("payload_str1", ct.c_char * 127),
+        ("payload_str2", ct.c_char * 127),
+        ("stackid", ct.c_int),
+        ("host_pid", ct.c_uint32),
+        ("locktag_field1", ct.c_uint32),
+        ("locktag_field2", ct.c_uint32),
+        ("locktag_field3", ct.c_uint32),
+        ("locktag_field4", ct.c_uint16),
+        ("locktag_type", ct.c_uint8),
+        ("locktag_lockmethodid", ct.c_uint8),
+        ("grant_mask", ct.c_uint32),
+        ("wait_mask", ct.c_uint32),
+        ("granted", ct.c_uint32),
+        ("waiting", ct.c_uint32),
+    ]
+
+
+# The leading fields of PostgreSQLEvent (pid, cluster, timestamp, event_type,
+# object, mode). They are unpacked with one call, which is faster than
+# reading the fields of the ctypes structure one by one.
+EVENT_HEADER = struct.Struct("=IIQIIi")
@@ -0,0 +1,211 @@
+"""
+Constant-memory building blocks of the lock statistics. The counters per
+lock mode and the log2 histograms have a fixed size (independent of the
+number of events) and can be merged, e.g., to combine the statistics of
+several runs or workers.
+"""
+
+from array import array
+
+# The number of log2 buckets (the bit length of an unsigned 64 bit value)
+HISTOGRAM_BUCKETS = 65
+
+
+class ModeCounters:
+    """
+    Array-backed counters of a fixed number of lock modes
+    """
+
+    __slots__ = ("counts",)
+
+    def __init__(self, modes) -> None:
+        self.counts = array("Q", bytes(8 * modes))
+
+    def add(self, mode, count=1):
+        """
+        Count the given lock mode
+        """
+        if mode < 0:
+            raise ValueError(f"Unsupported lock mode {mode}")
+
+        try:
+            self.counts[mode] += count
+        except IndexError as error:
+            raise ValueError(f"Unsupported lock mode {mode}") from error
+
+    def merge(self, other):
+        """
+        Add the counters of another instance
+        """
+        if len(other.counts) != len(self.counts):
+            raise ValueError("Only counters of the same lock modes can be merged")
+
+        for mode, count in enumerate(other.counts):
+            self.counts[mode] += count
+
+    def items(self):
+        """
+        Get the (mode, count) tuples of the counted modes
+        """
+        return [(mode, count) for mode, count in enumerate(self.counts) if count]
+
+    def total(self):
+        """
+        Get the number of counted locks
+        """
+        return sum(self.counts)
+
+    def to_list(self):
+        """
+        Get the counters as list (e.g., to store them as JSON)
+        """
+        return self.counts.tolist()
+
+    @staticmethod
+    def from_list(counts):
+        """
+        Create counters from a list of counts
+        """
+        counters = ModeCounters(len(counts))
+        counters.counts = array("Q", counts)
+        return counters
+
+
+class Log2Histogram:
+    """
+    A histogram with log2 buckets. Bucket n contains the values with the
+    bit length n (i.e., the values from 2^(n-1) to 2^n - 1).
+    """
+
+    __slots__ = ("buckets",)
+
+    def __init__(self) -> None:
+        self.buckets = array("Q", bytes(8 * HISTOGRAM_BUCKETS))
+
+    def add(self, value, count=1):
+        """
+        Add a value (e.g., a lock wait time in ns) to the histogram
+        """
+        self.buckets[int(value).bit_length() if value > 0 else 0] += count
+
+    def add_bucket_counts(self, counts):
+        """
+        Add the counts of the buckets (e.g., computed with numpy.bincount)
+        """
+        for bucket, count in enumerate(counts):
+            self.buckets[bucket] += count
+
+    def merge(self, other):
+        """
+        Add the buckets of another histogram
+        """
+        self.add_bucket_counts(other.buckets)
+
+    def count(self):
+        """
+        Get the number of values in the histogram
+        """
+        return sum(self.buckets)
+
+    @staticmethod
+    def get_bucket_range(bucket):
+        """
+        Get the lowest and the highest value of a bucket
+        """
+        lower = 0 if bucket == 0 else 1 << (bucket - 1)
+        return (lower, (1 << bucket) - 1)
+
+    def items(self):
+        """
+        Get the (lower, upper, count) tuples of the non-empty buckets
+        """
+        return [
+            (*Log2Histogram.get_bucket_range(bucket), count)
+            for bucket, count in enumerate(self.buckets)
+            if count
+        ]
+
+    def percentile(self, percent):
+        """
+        Get the upper bound of the bucket that contains the percentile
+        (or None if the histogram is empty)
+        """
+        total = self.count()
+        if total == 0:
+            return None
+
+        rank = percent / 100 * total
+        seen = 0
+
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return Log2Histogram.get_bucket_range(bucket)[1]
+
+        return None
+
+    def to_dict(self):
+        """
+        Get the non-empty buckets as dict (e.g., to store them as JSON)
+        """
+        return {bucket: count for bucket, count in enumerate(self.buckets) if count}
+
+    @staticmethod
+    def from_dict(buckets):
+        """
+        Create a histogram from a dict of buckets
+        """
+        histogram = Log2Histogram()
+        for bucket, count in buckets.items():
+            histogram.buckets[int(bucket)] += count
+        return histogram
+
+
+class DurationStatistics:
+    """
+    The number, the total, and the log2 histogram of durations (e.g., of
+    the lock waits that are aggregated in the kernel per histogram bucket)
+    """
+
+    __slots__ = ("count", "total_ns", "histogram")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ns = 0
+        self.histogram = Log2Histogram()
+
+    def add(self, bucket, count, total_ns):
+        """
+        Add the durations of a histogram bucket
+        """
+        self.count += count
+        self.total_ns += total_ns
+        self.histogram.buckets[bucket] += count
+
+    def merge(self, other):
+        """
+        Add the durations of another instance
+        """
+        self.count += other.count
+        self.total_ns += other.total_ns
+        self.histogram.merge(other.histogram)
+
+    def average(self):
+        """
+        Get the average duration (or 0 if there are no durations)
+        """
+        return self.total_ns / self.count if self.count else 0
+
+
+def merge_statistics(target, source):
+    """
+    Merge the statistics entries (Key = statistics key, Value = entry with
+    a merge method) of source into target
+    """
+    for key, entry in source.items():
+        if key not in target:
+            target[key] = type(entry)()
+
+        target[key].merge(entry)
+
+    return target
@@ -0,0 +1,255 @@
+"""
+The tranche names and partitions of the LWLocks in the uprobe mode of
+the LW lock tracer. The uprobes see only the LWLock (its address and its
+tranche id), so the names of the tranches are read from the memory of a
+traced process (using the symbols of the binary), and the partition of a
+lock is its position in the locks of its tranche in the main LWLock array.
+The content locks of the buffers are located in the buffer descriptors.
+"""
+
+import os
+
+# The size of an LWLock in the main array (LWLOCK_PADDED_SIZE)
+LWLOCK_PADDED_SIZE = 128
+
+# The maximal number of locks that are read from the main array
+MAX_MAIN_LOCKS = 1024
+
+POINTER_SIZE = 8
+
+# The maximal length of a tranche name (NAMEDATALEN)
+MAX_NAME_SIZE = 64
+
+
+class ProcessMemory:
+    """
+    Read the memory of a process (/proc/<pid>/mem)
+    """
+
+    def __init__(self, pid, load_address=0) -> None:
+        self.pid = pid
+
+        # The address the binary is loaded to (PIE)
+        self.load_address = load_address
+
+    @staticmethod
+    def get_load_address(pid, path):
+        """
+        Get the address the binary is mapped to in the process
+        """
+        path = os.path.realpath(path)
+
+        with open(f"/proc/{pid}/maps", "r", encoding="utf-8") as maps:
+            for line in maps:
+                fields = line.split()
+                if len(fields) < 6 or int(fields[2], 16) != 0:
+                    continue
+
+                if os.path.realpath(fields[5]) == path:
+                    return int(fields[0].split("-")[0], 16)
+
+        raise ValueError(f"{path} is not mapped into the process {pid}")
+
+    def read(self, address, size):
+        """
+        Read the memory at the given address
+        """
+        with open(f"/proc/{self.pid}/mem", "rb") as memory:
+            memory.seek(address)
+            return memory.read(size)
+
+    def read_integer(self, address, size):
+        """
+        Read an unsigned integer
+        """
+        return int.from_bytes(self.read(address, size), "little")
+
+    def read_string(self, address):
+        """
+        Read a null-terminated string
+        """
+        return self.read(address, MAX_NAME_SIZE).split(b"\0")[0].decode("utf-8")
+
+
+class LWLockTranches:
+    """
+    Resolve the tranche names and the partitions of the LWLocks
+    """
+
+    def __init__(self, symbols, memories) -> None:
+        # The ElfSymbolIndex of the binary
+        self.symbols = symbols
+
+        # The memory of the traced processes
+        self.memories = memories
+
+        # The resolved names (Key = tranche id)
+        self.names = {}
+
+        # The tranche ids of the locks in the main array
+        self.main_tranches = None
+        self.main_array = None
+
+    @staticmethod
+    def for_processes(symbols, pids):
+        """
+        Resolve the tranches of the LWLocks of the given processes
+        """
+        memories = []
+
+        for pid in pids:
+            load_address = 0
+            if symbols.position_independent:
+                load_address = ProcessMemory.get_load_address(pid, symbols.path)
+            memories.append(ProcessMemory(pid, load_address))
+
+        return LWLockTranches(symbols, memories)
+
+    def read_variable(self, memory, name):
+        """
+        Read the value of a global variable (None if the symbol is unknown)
+        """
+        symbol = self.symbols.objects.get(name)
+        if symbol is None:
+            return None
+
+        address, size = symbol
+        return memory.read_integer(memory.load_address + address, size)
+
+    def read_array(self, memory, name):
+        """
+        Read the pointers of a global array (None if the symbol is unknown)
+        """
+        symbol = self.symbols.objects.get(name)
+        if symbol is None:
+            return None
+
+        address, size = symbol
+        data = memory.read(memory.load_address + address, size)
+        return [
+            int.from_bytes(data[offset : offset + POINTER_SIZE], "little")
+            for offset in range(0, len(data), POINTER_SIZE)
+        ]
+
+    def read_name(self, memory, tranche_id):
+        """
+        Read the name of the tranche (see GetLWTrancheName() in lwlock.c)
+        """
+        builtin_names = self.read_array(memory, "BuiltinTrancheNames")
+
+        if builtin_names is not None:
+            # PostgreSQL 13 - 16 store the individual LWLocks separately
+            names = (self.read_array(memory, "IndividualLWLockNames") or []) + (
+                builtin_names
+            )
+            if tranche_id < len(names):
+                return memory.read_string(names[tranche_id])
+
+            # The tranches of extensions are registered at run time
+            names_variable = "LWLockTrancheNames"
+            allocated_variable = "LWLockTrancheNamesAllocated"
+            index = tranche_id - len(names)
+        else:
+            # PostgreSQL <= 12 registers all tranches at run time
+            names_variable = "LWLockTrancheArray"
+            allocated_variable = "LWLockTranchesAllocated"
+            index = tranche_id
+
+        allocated = self.read_variable(memory, allocated_variable)
+        names_address = self.read_variable(memory, names_variable)
+
+        if not allocated or not names_address or index >= allocated:
+            return None
+
+        name_address = memory.read_integer(
+            names_address + index * POINTER_SIZE, POINTER_SIZE
+        )
+        return memory.read_string(name_address) if name_address else None
+
+    def get_name(self, tranche_id):
+        """
+        Get the name of the tranche. Unknown tranches are not cached, since
+        the tranches of extensions can be registered later.
+        """
+        name = self.names.get(tranche_id)
+        if name is not None:
+            return name
+
+        for memory in self.memories:
+            try:
+                name = self.read_name(memory, tranche_id)
+            except (OSError, UnicodeDecodeError):
+                # The process has exited
+                continue
+
+            if name:
+                self.names[tranche_id] = name
+                return name
+
+        return f"tranche {tranche_id}"
+
+    def read_main_tranches(self):
+        """
+        Read the tranche ids of the locks in the main array. The tranche
+        ids of the array are ascending (the individual locks, the partitions
+        of the built-in tranches, and the named tranches of extensions).
+        """
+        self.main_tranches = []
+
+        for memory in self.memories:
+            try:
+                self.main_array = self.read_variable(memory, "MainLWLockArray")
+                if not self.main_array:
+                    return
+
+                data = memory.read(self.main_array, MAX_MAIN_LOCKS * LWLOCK_PADDED_SIZE)
+            except OSError:
+                continue
+
+            # The tranche is the first member of the LWLock (uint16)
+            for offset in range(0, len(data) - 1, LWLOCK_PADDED_SIZE):
+                tranche_id = int.from_bytes(data[offset : offset + 2], "little")
+
+                if self.main_tranches and tranche_id < self.main_tranches[-1]:
+                    break
+
+                self.main_tranches.append(tranche_id)
+            return
+
+    def get_partition(self, lock, tranche_id):
+        """
+        Get the partition of the lock (its position in the locks of its
+        tranche in the main array). None for the locks outside of the main
+        array (e.g., the content locks of the buffers).
+        """
+        if self.main_tranches is None:
+            self.read_main_tranches()
+
+        if not self.main_tranches or lock < self.main_array:
+            return None
+
+        index, remainder = divmod(lock - self.main_array, LWLOCK_PADDED_SIZE)
+        if remainder != 0 or index >= len(self.main_tranches):
+            return None
+
+        if self.main_tranches[index] != tranche_id:
+            return None
+
+        return index - self.main_tranches.index(tranche_id)
+
+    def read_buffer_descriptors(self):
+        """
+        Read the address and the number of the buffer descriptors
+        (BufferDescriptors and NBuffers). (None, 0) if they are unknown.
+        """
+        for memory in self.memories:
+            try:
+                address = self.read_variable(memory, "BufferDescriptors")
+                count = self.read_variable(memory, "NBuffers")
+            except OSError:
+                continue
+
+            if address and count:
+                return (address, count)
+
+        return (None, 0)
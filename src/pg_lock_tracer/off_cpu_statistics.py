@@ -0,0 +1,142 @@
+"""
+The off-CPU time of the lock waits (--off-cpu). The waits are split by
+the scheduler tracepoints into the time on the CPU, the time sleeping
+(waiting for the lock holder), and the time runnable but not scheduled
+(waiting for a CPU). The waits are aggregated in the kernel per lock,
+waiter, and the pid of the task that woke the waiter.
+"""
+
+from prettytable import PrettyTable
+
+
+# pylint: disable=too-few-public-methods
+class OffCpuTime:
+    """
+    The split wait time of several waits
+    """
+
+    __slots__ = ("waits", "on_cpu_ns", "sleep_ns", "runnable_ns")
+
+    def __init__(self) -> None:
+        self.waits = 0
+        self.on_cpu_ns = 0
+        self.sleep_ns = 0
+        self.runnable_ns = 0
+
+    def add(self, value):
+        """
+        Add an entry of the BPF map (or another OffCpuTime)
+        """
+        self.waits += value.waits
+        self.on_cpu_ns += value.on_cpu_ns
+        self.sleep_ns += value.sleep_ns
+        self.runnable_ns += value.runnable_ns
+
+    def total_ns(self):
+        """
+        Get the total wait time
+        """
+        return self.on_cpu_ns + self.sleep_ns + self.runnable_ns
+
+
+class OffCpuStatistics:
+    """
+    The off-CPU time of the lock waits per lock and per waiter and waker
+    """
+
+    def __init__(self, show_cluster=False, rows=20) -> None:
+        self.show_cluster = show_cluster
+        self.rows = rows
+
+        # Key = (cluster, lock)
+        self.locks = {}
+
+        # Key = (cluster, lock, pid, waker)
+        self.wakeups = {}
+
+    def add(self, key, value):
+        """
+        Add an entry of the BPF map (OffCpuKey, OffCpuTime)
+        """
+        lock = (key.cluster, key.lock)
+        if lock not in self.locks:
+            self.locks[lock] = OffCpuTime()
+        self.locks[lock].add(value)
+
+        wakeup = (key.cluster, key.lock, key.pid, key.waker)
+        if wakeup not in self.wakeups:
+            self.wakeups[wakeup] = OffCpuTime()
+        self.wakeups[wakeup].add(value)
+
+    def get_top_entries(self, entries, sort_key):
+        """
+        Get the entries with the highest value of the sort key
+        """
+        return sorted(
+            entries.items(), key=lambda item: sort_key(item[1]), reverse=True
+        )[: self.rows]
+
+    @staticmethod
+    def get_share(part_ns, time):
+        """
+        Get the share of the total wait time in percent
+        """
+        total_ns = time.total_ns()
+        return f"{part_ns * 100 / total_ns:.1f}" if total_ns else "-"
+
+    def print_statistics(self, resolve_lock):
+        """
+        Print the off-CPU times. The resolve_lock function maps a
+        (cluster, lock) to the name of the lock.
+        """
+        cluster = ["Cluster"] if self.show_cluster else []
+
+        print("\nOff-CPU time of the lock waits")
+        table = PrettyTable(
+            cluster
+            + [
+                "Lock",
+                "Waits",
+                "Wait Time (ms)",
+                "On CPU (ms)",
+                "Sleeping (ms)",
+                "Runnable (ms)",
+                "Sleeping (%)",
+                "Runnable (%)",
+            ]
+        )
+        for (cluster_id, lock), time in self.get_top_entries(
+            self.locks, OffCpuTime.total_ns
+        ):
+            row = [
+                resolve_lock(cluster_id, lock),
+                time.waits,
+                f"{time.total_ns() / 1_000_000:.3f}",
+                f"{time.on_cpu_ns / 1_000_000:.3f}",
+                f"{time.sleep_ns / 1_000_000:.3f}",
+                f"{time.runnable_ns / 1_000_000:.3f}",
+                OffCpuStatistics.get_share(time.sleep_ns, time),
+                OffCpuStatistics.get_share(time.runnable_ns, time),
+            ]
+            table.add_row([cluster_id] + row if self.show_cluster else row)
+        print(table)
+
+        # The waker is the pid of the host (0 if the waiter did not sleep)
+        print("\nWakeups of the waiters")
+        table = PrettyTable(
+            cluster
+            + ["Lock", "Pid", "Woken by", "Waits", "Sleeping (ms)", "Runnable (ms)"]
+        )
+        for (cluster_id, lock, pid, waker), time in self.get_top_entries(
+            self.wakeups, lambda time: time.sleep_ns
+        ):
+            row = [
+                resolve_lock(cluster_id, lock),
+                pid,
+                waker if waker else "-",
+                time.waits,
+                f"{time.sleep_ns / 1_000_000:.3f}",
+                f"{time.runnable_ns / 1_000_000:.3f}",
+            ]
+            table.add_row([cluster_id] + row if self.show_cluster else row)
+        print(table)
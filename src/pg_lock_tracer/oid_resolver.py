@@ -134,3 +134,26 @@ class OIDResolver:
 
         # OID cache miss
         return self.fetch_oid_from_db(oid)
+
+    def resolve_name(self, name):
+        """
+        Resolve the given relation name (e.g., 'public.orders') into an
+        OID. Returns None if the relation does not exist.
+        """
+
+        # Name cache hit (the cache contains schema qualified names)
+        for oid, cached_name in self.cache.items():
+            if cached_name == name:
+                return int(oid)
+
+        try:
+            self.cur.execute("SELECT to_regclass(%s)::oid;", [name])
+            result_row = self.cur.fetchone()
+        except psycopg2.Error as error:
+            print(f"Error while executing SQL statement: {error}")
+            return None
+
+        if result_row is None or result_row[0] is None:
+            return None
+
+        return int(result_row[0])
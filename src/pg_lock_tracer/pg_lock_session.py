@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+#
+# Trace the heavyweight locks, LW locks, row locks, and spinlock delays
+# of PostgreSQL in one session. The BPF programs of the tracers are
+# compiled into one BPF object and the events are printed on a common
+# timeline.
+#
+###############################################
+
+import sys
+import time
+import ctypes
+import argparse
+
+from bcc import BPF
+
+from pg_lock_tracer import __version__
+from pg_lock_tracer.helper import BPFHelper, StartupTimer
+from pg_lock_tracer.event_timeline import EventTimeline
+from pg_lock_tracer.pg_lock_tracer import PGLockTracer, parser as lock_parser
+from pg_lock_tracer.pg_lw_lock_tracer import PGLWLockTracer, parser as lw_parser
+from pg_lock_tracer.pg_row_lock_tracer import PGRowLockTracer, parser as row_parser
+from pg_lock_tracer.pg_spinlock_delay_tracer import (
+    PGSpinDelayTracer,
+    parser as spin_parser,
+)
+
+EXAMPLES = """examples:
+# Trace the locks, LW locks, row locks, and spin delays of the PID 1234
+pg_lock_session -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234
+
+# Trace the locks, LW locks, row locks, and spin delays of all processes of the binary
+pg_lock_session -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres
+
+# Trace the locks and row locks of all processes of the binary
+pg_lock_session -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres --tracers lock row
+
+# Trace the PIDs 1234 and 5678 and show the statistics of the tracers
+pg_lock_session -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234 5678 --statistics
+"""
+
+# The tracers of a session (the prefix of their BPF names)
+TRACERS = ("lock", "lw", "row", "spin")
+
+parser = argparse.ArgumentParser(
+    description="",
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    epilog=EXAMPLES,
+)
+parser.add_argument(
+    "-V",
+    "--version",
+    action="version",
+    version=f"{parser.prog} ({__version__})",
+)
+parser.add_argument("-v", "--verbose", action="store_true", help="be verbose")
+parser.add_argument(
+    "-p",
+    "--pid",
+    type=int,
+    nargs="+",
+    action="extend",
+    dest="pids",
+    metavar="PID",
+    help="the pid(s) to trace",
+)
+parser.add_argument(
+    "-x",
+    "--exe",
+    type=str,
+    required=True,
+    dest="path",
+    metavar="PATH",
+    help="path to binary",
+)
+parser.add_argument(
+    "--tracers",
+    choices=TRACERS,
+    nargs="+",
+    default=list(TRACERS),
+    help="the tracers of the session (default all)",
+)
+parser.add_argument(
+    "--order-delay",
+    type=float,
+    default=100,
+    metavar="MS",
+    help="delay of the events to print them in timestamp order (default 100)",
+)
+parser.add_argument(
+    "--statistics", action="store_true", help="print the statistics of the tracers"
+)
+parser.add_argument(
+    "-d",
+    "--dry-run",
+    action="store_true",
+    help="compile and load the BPF program but exit afterward",
+)
+
+
+class SessionEventTable:
+    """
+    The event map of a tracer. The events are added to the timeline of
+    the session instead of being handed to the callback directly.
+    """
+
+    def __init__(self, table, timeline, flush=None) -> None:
+        self.table = table
+        self.timeline = timeline
+        self.flush = flush
+
+    def event(self, data):
+        """
+        Decode an event
+        """
+        return self.table.event(data)
+
+    def open_perf_buffer(self, callback, page_cnt=BPFHelper.page_cnt):
+        """
+        Open the perf buffer of the event map
+        """
+        source = self.timeline.add_source(callback, self.flush)
+
+        def add_event(cpu, data, size):
+            timestamp = self.table.event(data).timestamp
+            self.timeline.add(source, timestamp, cpu, ctypes.string_at(data, size))
+
+        self.table.open_perf_buffer(add_event, page_cnt=page_cnt)
+
+
+class SessionBPF:
+    """
+    The view of a tracer on the BPF object of the session. The names of
+    the maps and functions of the tracer are prefixed in the shared program.
+    """
+
+    def __init__(self, bpf_instance, prefix, timeline, flush=None) -> None:
+        self.bpf_instance = bpf_instance
+        self.prefix = prefix
+        self.timeline = timeline
+        self.flush = flush
+
+    def __getitem__(self, name):
+        table = self.bpf_instance[self.prefix + name]
+
+        if name == "lockevents":
+            return SessionEventTable(table, self.timeline, self.flush)
+
+        return table
+
+    def __getattr__(self, name):
+        return getattr(self.bpf_instance, name)
+
+    def get_table(self, name):
+        """
+        Get a map of the tracer
+        """
+        return self[name]
+
+    def attach_uprobe(self, **kwargs):
+        """
+        Attach a function of the tracer to an uprobe
+        """
+        kwargs["fn_name"] = self.prefix + kwargs["fn_name"]
+        return self.bpf_instance.attach_uprobe(**kwargs)
+
+    def attach_uretprobe(self, **kwargs):
+        """
+        Attach a function of the tracer to an uretprobe
+        """
+        kwargs["fn_name"] = self.prefix + kwargs["fn_name"]
+        return self.bpf_instance.attach_uretprobe(**kwargs)
+
+
+class PGLockSession:
+    def __init__(self, prog_args):
+        self.bpf_instance = None
+        self.args = prog_args
+        self.startup_timer = StartupTimer()
+
+        if prog_args.order_delay < 0:
+            raise ValueError(
+                f"Order delay can not be negative ({prog_args.order_delay} was provided)"
+            )
+
+        self.timeline = EventTimeline(int(prog_args.order_delay * 1_000_000))
+
+        # The tracers of the session. Key = prefix, Value = tracer
+        self.tracers = {}
+
+        for name in TRACERS:
+            if name in prog_args.tracers:
+                self.tracers[f"{name}_"] = self.create_tracer(name)
+
+    def get_tracer_args(self, tracer_parser, statistics=True):
+        """
+        Get the arguments of a tracer from the arguments of the session
+        """
+        tracer_args = ["-x", self.args.path]
+
+        if self.args.pids:
+            tracer_args += ["-p", *map(str, self.args.pids)]
+
+        if self.args.verbose:
+            tracer_args.append("-v")
+
+        if statistics and self.args.statistics:
+            tracer_args.append("--statistics")
+
+        return tracer_parser.parse_args(tracer_args)
+
+    def create_tracer(self, name):
+        """
+        Create the tracer with the given name
+        """
+        if name == "lock":
+            return PGLockTracer(self.get_tracer_args(lock_parser))
+
+        if name == "lw":
+            return PGLWLockTracer(self.get_tracer_args(lw_parser))
+
+        if name == "row":
+            return PGRowLockTracer(self.get_tracer_args(row_parser))
+
+        return PGSpinDelayTracer(self.get_tracer_args(spin_parser, statistics=False))
+
+    def init(self):
+        """
+        Compile the BPF programs of the tracers into one BPF object
+        """
+        bpf_programs = []
+        usdts = []
+
+        for prefix, tracer in self.tracers.items():
+            bpf_programs.append(
+                BPFHelper.prefix_program(tracer.get_bpf_program(), prefix)
+            )
+
+            if isinstance(tracer, PGLWLockTracer):
+                usdts = tracer.get_usdt_contexts(prefix)
+
+        bpf_program_final = "\n".join(bpf_programs)
+
+        if self.args.verbose:
+            print(bpf_program_final)
+
+        # Disable warnings like
+        # 'warning: '__HAVE_BUILTIN_BSWAP32__' macro redefined [-Wmacro-redefined]'
+        bpf_cflags = ["-Wno-macro-redefined"] if not self.args.verbose else []
+
+        print("===> Compiling BPF program")
+        with self.startup_timer.measure("Compile BPF program"):
+            self.bpf_instance = BPF(
+                text=bpf_program_final, cflags=bpf_cflags, usdt_contexts=usdts
+            )
+
+        for prefix, tracer in self.tracers.items():
+            flush = None
+
+            # The lock tracer buffers its output lines
+            if isinstance(tracer, PGLockTracer):
+                flush = tracer.flush_output
+
+            tracer.setup(SessionBPF(self.bpf_instance, prefix, self.timeline, flush))
+
+    def print_statistics(self):
+        """
+        Print the statistics of the tracers
+        """
+        for tracer in self.tracers.values():
+            if isinstance(tracer, PGLockTracer):
+                tracer.output_class.print_statistics()
+            elif not isinstance(tracer, PGSpinDelayTracer):
+                tracer.print_statistics()
+
+    def run(self):
+        """
+        Run the BPF program and print the events of the tracers
+        """
+        poll_timeout = max(10, min(1000, int(self.args.order_delay)))
+
+        print("===> Ready to trace")
+        while True:
+            try:
+                self.bpf_instance.perf_buffer_poll(timeout=poll_timeout)
+                self.timeline.flush(time.monotonic_ns())
+            except KeyboardInterrupt:
+                self.timeline.flush()
+
+                if self.timeline.late_events:
+                    print(
+                        f"{self.timeline.late_events} events arrived after the "
+                        "order delay (increase --order-delay)",
+                        file=sys.stderr,
+                    )
+
+                if self.args.statistics:
+                    self.print_statistics()
+                sys.exit(0)
+
+
+def main():
+    """
+    Entry point for the BPF based PostgreSQL lock tracing session.
+    """
+    args = parser.parse_args()
+
+    pg_lock_session = PGLockSession(args)
+    pg_lock_session.init()
+
+    if args.dry_run and args.verbose:
+        pg_lock_session.startup_timer.print_breakdown()
+
+    if not args.dry_run:
+        pg_lock_session.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,20 +8,53 @@
 # these locks. Therefore BPF, UProbes, and parameter parsing
 # is used to trace these events.
 ###############################################
+# pylint: disable=too-many-lines
 
-import os
 import sys
-import json
+import time
+import signal
 import argparse
 
 from abc import ABC
-from enum import IntEnum, auto, unique
+from enum import IntEnum, auto
 from bcc import BPF
 from prettytable import PrettyTable
 
 from pg_lock_tracer import __version__
+from pg_lock_tracer.catalog_statistics import CatalogFunction, CatalogStatistics
+from pg_lock_tracer.off_cpu_statistics import OffCpuStatistics
+from pg_lock_tracer.event_batch import BatchLockStatistics, EventBatch
+from pg_lock_tracer.event_filter import EventFilter
+from pg_lock_tracer.lock_events import (
+    EVENT_HEADER,
+    LOCKTAG_EVENTS,
+    Events,
+    PGError,
+    get_locktag_name,
+)
+from pg_lock_tracer.lock_event_formatter import (
+    JSON_DYNAMIC_EVENTS,
+    LOCKTAG_RELATION,
+    LockEventFormatter,
+    OutputBuffer,
+)
+from pg_lock_tracer.lock_statistics import Log2Histogram, ModeCounters
+from pg_lock_tracer.fastpath_analysis import DEFAULT_FASTPATH_SLOTS, FastPathAnalyzer
 from pg_lock_tracer.oid_resolver import OIDResolver
-from pg_lock_tracer.helper import PostgreSQLLockHelper, BPFHelper
+from pg_lock_tracer.struct_offsets import get_struct_offsets, offsets_to_defines
+from pg_lock_tracer.window_statistics import WindowedStatistics, add_window_arguments
+from pg_lock_tracer.top_view import TopView, add_top_arguments
+from pg_lock_tracer.trace_file import (
+    COMPRESSION_SUFFIXES,
+    TraceFileWriter,
+    parse_size,
+)
+from pg_lock_tracer.helper import (
+    PostgreSQLLockHelper,
+    BPFHelper,
+    CgroupHelper,
+    StartupTimer,
+)
 
 EXAMPLES = """
 
@@ -50,11 +83,53 @@ pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -
 # Trace only Transaction and Query related events
 pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234 -t TRANSACTION QUERY
 
+# Trace only the strong relation locks on two tables that waited longer than 1 ms (needs an OID resolver)
+pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234 -r 1234:psql://jan@localhost/test2 --filter "mode >= ShareLock and relation in ('public.orders', 'public.payments') and wait_ns > 1ms"
+
+# Trace only the LockRelationOid calls that took longer than 500 µs (with their stack)
+pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234 -t LOCK ERROR -s LOCK --slow-lock-threshold 500
+
 # Write the output into file 'trace'
 pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234 -o trace
 
+# Write the output as JSON into gzip compressed segments of 100 MB or 1 hour ('trace.00000.gz', ...)
+pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -j -o trace --compress gzip --rotate-size 100M --rotate-interval 3600
+
 # Show statistics about locks
 pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234 --statistics
+
+# Only collect statistics about locks (events are decoded in batches)
+pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234 --statistics-only
+
+# Aggregate the contention of the shared locks in the kernel (printed on exit)
+pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234 --contention
+
+# Show the most contended locks of the last second in the top view
+pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres --top --contention
+
+# Aggregate the time of AcceptInvalidationMessages, table_open, and RelationBuildDesc per backend and relation (printed on exit)
+pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234 --catalog-stats
+
+# Split the LockRelationOid waits into the time sleeping and runnable, and show who woke the waiters (printed on exit)
+pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234 -p 5678 -t LOCK --off-cpu
+
+# Report the transactions that exceed the fast-path lock slots (and their queries)
+pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234 -t TRANSACTION QUERY LOCK --fastpath-analysis
+
+# Show the relations with the highest lock wait time and the waiting backends (refreshed every second)
+pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres --top
+
+# Write the lock statistics of each second as JSON into 'locks.json' every minute (and on SIGUSR1)
+pg_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres -p 1234 --window-statistics 1 --window-report-interval 60 --window-output locks.json
+
+# Trace only the processes of a cgroup (e.g., of a Kubernetes pod)
+pg_lock_tracer -x /proc/4711/root/usr/lib/postgresql/16/bin/postgres --cgroup /sys/fs/cgroup/kubepods.slice/kubepods-pod1234.slice
+
+# Trace the processes of a container and use the pids of the container (PID 42 inside of the container)
+pg_lock_tracer -x /proc/4711/root/usr/lib/postgresql/16/bin/postgres --cgroup /sys/fs/cgroup/kubepods.slice/kubepods-pod1234.slice --container -p 42
+
+# Trace the clusters of two binaries in one session (the events are tagged with the cluster 0 / 1)
+pg_lock_tracer -x /usr/lib/postgresql/15/bin/postgres -x /usr/lib/postgresql/17/bin/postgres
 """
 
 
@@ -101,9 +176,11 @@ parser.add_argument(
     "--exe",
     type=str,
     required=True,
-    dest="path",
+    nargs="+",
+    action="extend",
+    dest="paths",
     metavar="PATH",
-    help="path to binary",
+    help="path to binary (one per traced cluster)",
 )
 parser.add_argument(
     "-r",
@@ -138,6 +215,22 @@ parser.add_argument(
     choices=[event.name for event in TraceEvents],
     help="events to trace (default: All events are traced)",
 )
+parser.add_argument(
+    "--filter",
+    type=str,
+    dest="filter",
+    default=None,
+    metavar="EXPR",
+    help="only submit the events that match the expression (evaluated in the kernel)",
+)
+parser.add_argument(
+    "--slow-lock-threshold",
+    type=float,
+    dest="slow_lock_threshold",
+    default=None,
+    metavar="US",
+    help="only submit the LockRelationOid calls (and their grants) that took longer than US µs",
+)
 parser.add_argument(
     "-o",
     "--output",
@@ -146,7 +239,80 @@ parser.add_argument(
     default=None,
     help="write the trace into output file",
 )
+parser.add_argument(
+    "--compress",
+    type=str,
+    dest="compression",
+    default="none",
+    choices=list(COMPRESSION_SUFFIXES),
+    help="compress the output file (default: none)",
+)
+parser.add_argument(
+    "--rotate-size",
+    type=parse_size,
+    dest="rotate_size",
+    default=None,
+    metavar="SIZE",
+    help="start a new output segment when the segment reaches SIZE bytes (e.g., 100M)",
+)
+parser.add_argument(
+    "--rotate-interval",
+    type=float,
+    dest="rotate_interval",
+    default=None,
+    metavar="SECONDS",
+    help="start a new output segment every SECONDS seconds",
+)
+parser.add_argument(
+    "--cgroup",
+    type=str,
+    dest="cgroup",
+    default=None,
+    metavar="PATH",
+    help="only trace the processes of this cgroup v2 directory and its descendants",
+)
+parser.add_argument(
+    "--container",
+    action="store_true",
+    help="use the pids of the PID namespace of the traced processes in the cgroup (needs --cgroup)",
+)
 parser.add_argument("--statistics", action="store_true", help="print lock statistics")
+add_window_arguments(parser)
+add_top_arguments(parser)
+parser.add_argument(
+    "--fastpath-analysis",
+    action="store_true",
+    help="report the transactions that exceed the fast-path lock slots on exit",
+)
+parser.add_argument(
+    "--fastpath-slots",
+    type=int,
+    default=DEFAULT_FASTPATH_SLOTS,
+    metavar="N",
+    help=f"number of fast-path lock slots per backend (default {DEFAULT_FASTPATH_SLOTS})",
+)
+parser.add_argument(
+    "--contention",
+    action="store_true",
+    help="aggregate the contention of the shared locks in the kernel (shown on exit and in --top)",
+)
+parser.add_argument(
+    "--catalog-stats",
+    action="store_true",
+    help="aggregate the time of the catalog functions (e.g., relcache rebuilds) "
+    "in the kernel and print it on exit",
+)
+parser.add_argument(
+    "--off-cpu",
+    action="store_true",
+    help="split the lock waits into the time on the CPU, sleeping, and runnable, "
+    "and record the waking pids (scheduler tracepoints, printed on exit)",
+)
+parser.add_argument(
+    "--statistics-only",
+    action="store_true",
+    help="collect the lock statistics in batches without printing the events (needs numpy)",
+)
 parser.add_argument(
     "-d",
     "--dry-run",
@@ -154,90 +320,68 @@ parser.add_argument(
     help="compile and load the BPF program but exit afterward",
 )
 
-
-@unique
-class Events(IntEnum):
-    TABLE_OPEN = 1
-    TABLE_OPEN_RV = 2
-    TABLE_OPEN_RV_EXTENDED = 3
-    TABLE_CLOSE = 4
-    ERROR = 5
-    QUERY_BEGIN = 20
-    QUERY_END = 21
-    LOCK_RELATION_OID = 30
-    LOCK_RELATION_OID_END = 31
-    UNLOCK_RELATION_OID = 32
-    LOCK_GRANTED = 33
-    LOCK_GRANTED_FASTPATH = 34
-    LOCK_GRANTED_LOCAL = 35
-    LOCK_UNGRANTED = 36
-    LOCK_UNGRANTED_FASTPATH = 37
-    LOCK_UNGRANTED_LOCAL = 38
-    TRANSACTION_BEGIN = 40
-    TRANSACTION_COMMIT = 41
-    TRANSACTION_ABORT = 42
-    INVALIDATION_MESSAGES_ACCEPT = 50
-    # Events over 1000 are handled regardless of any pid filter
-    GLOBAL = 1000
-    DEADLOCK = 1001
-
-
-# From elog.h
-@unique
-class PGError(IntEnum):
-    ERROR = 21
-    FATAL = 22
-    PANIC = 23
+# The event types that are compared per event as plain ints (the lookup of
+# an enum member is much slower than the comparison)
+GLOBAL_EVENTS = int(Events.GLOBAL)
+LOCK_RELATION_OID = int(Events.LOCK_RELATION_OID)
+LOCK_RELATION_OID_END = int(Events.LOCK_RELATION_OID_END)
+LOCK_GRANTED = int(Events.LOCK_GRANTED)
+LOCK_GRANTED_LOCAL = int(Events.LOCK_GRANTED_LOCAL)
+
+# Events that update the lock statistics
+STATISTICS_EVENTS = frozenset(
+    (LOCK_RELATION_OID, LOCK_RELATION_OID_END, LOCK_GRANTED, LOCK_GRANTED_LOCAL)
+)
 
 
+# pylint: disable=too-few-public-methods
 class LockStatisticsEntry:
+    __slots__ = ("lock_count", "lock_time_ns", "requested_locks", "lock_times")
+
     def __init__(self) -> None:
         # The number of requested locks
-        self._lock_count = 0
+        self.lock_count = 0
 
         # The total time spend for lock requests
-        self._lock_time_ns = 0
-
-        # A list with the requested locks
-        self._requested_locks = []
-
-    @property
-    def lock_count(self):
-        return self._lock_count
+        self.lock_time_ns = 0
 
-    @lock_count.setter
-    def lock_count(self, value):
-        self._lock_count = value
+        # The number of requested locks per lock type
+        self.requested_locks = ModeCounters(len(PostgreSQLLockHelper.locks))
 
-    @property
-    def lock_time_ns(self):
-        return self._lock_time_ns
+        # Log2 histogram of the lock request times
+        self.lock_times = Log2Histogram()
 
-    @lock_time_ns.setter
-    def lock_time_ns(self, value):
-        self._lock_time_ns = value
-
-    @property
-    def requested_locks(self):
-        return self._requested_locks
-
-    @requested_locks.setter
-    def requested_locks(self, lock_type):
-        self._requested_locks.append(lock_type)
+    def merge(self, other):
+        """
+        Add the statistics of another entry (e.g., of another run)
+        """
+        self.lock_count += other.lock_count
+        self.lock_time_ns += other.lock_time_ns
+        self.requested_locks.merge(other.requested_locks)
+        self.lock_times.merge(other.lock_times)
 
 
 class PGLockTraceOutput(ABC):
-    def __init__(self) -> None:
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, show_cluster=False) -> None:
         super().__init__()
+        self.show_cluster = show_cluster
         self.statistics = {}
+        # Key = lock tag type, Value = [acquired locks, granted locks]
+        self.locktag_statistics = {}
         self.bpf_instance = None
         self.bpf_stacks = None
         self.output_file = None
         self.oid_resolvers = None
         self.pids = None
-        # Variables for lock timing
-        self.last_lock_request_time = {}
-        self.last_lock_relation = {}
+        self.formatter = LockEventFormatter(show_cluster)
+        self.output_buffer = OutputBuffer()
+        # Variables for lock timing (Key = pid, Value = (timestamp, relation))
+        self.last_lock_request = {}
+        # The statistics per time window (optional)
+        self.window_statistics = None
+        # The fast-path lock analysis (optional)
+        self.fastpath_analyzer = None
 
     def set_context(
         self, bpf_instance, bpf_stacks, output_file, oid_resolvers, pids
@@ -249,46 +393,101 @@ class PGLockTraceOutput(ABC):
         self.bpf_stacks = bpf_stacks
         self.output_file = output_file
         self.oid_resolvers = oid_resolvers
-        self.pids = pids
+        self.pids = frozenset(pids) if pids else None
+        self.output_buffer = OutputBuffer(output_file)
 
     def print_event(self, _cpu, data, _size):
+        """
+        Decode and handle the given event
+        """
+        event = self.bpf_instance["lockevents"].event(data)
+
+        if self.fastpath_analyzer is not None:
+            query = None
+            if event.event_type == Events.QUERY_BEGIN:
+                query = self.formatter.decode(event.payload_str1)
+            self.fastpath_analyzer.handle_event(event, query)
+
+        self.handle_event(event)
+
+    def handle_event(self, event):
         """
         Handle the output of the given event. Subclasses will implement
         the concrete logic.
         """
 
-    def update_statistics(self, event, oid_value):
+    def update_statistics(self, event, event_type, oid_value):
         """
-        Add the lock call to the statistics and measure lock request time
+        Add the lock call to the statistics and measure lock request time.
+        Returns the lock wait time on LOCK_RELATION_OID_END.
         """
-        if event.event_type == Events.LOCK_RELATION_OID:
-            if oid_value not in self.statistics:
-                self.statistics[oid_value] = LockStatisticsEntry()
+        if event_type in (LOCK_GRANTED_LOCAL, LOCK_GRANTED):
+            locktag_type = event.locktag_type
+            locktag_entry = self.locktag_statistics.get(locktag_type)
+            if locktag_entry is None:
+                locktag_entry = [0, 0]
+                self.locktag_statistics[locktag_type] = locktag_entry
+
+            # Each lock acquisition grants a local lock. Locks that are not
+            # acquired by the fastpath are also granted in the shared table.
+            locktag_entry[event_type == LOCK_GRANTED] += 1
+            return None
+
+        if event_type == LOCK_RELATION_OID:
+            if self.show_cluster:
+                oid_value = (event.cluster, oid_value)
 
             statistics_entry = self.statistics.get(oid_value)
+            if statistics_entry is None:
+                statistics_entry = LockStatisticsEntry()
+                self.statistics[oid_value] = statistics_entry
+
             statistics_entry.lock_count += 1
-            statistics_entry.requested_locks = event.mode
+            statistics_entry.requested_locks.add(event.mode)
 
-            self.last_lock_request_time[event.pid] = event.timestamp
-            self.last_lock_relation[event.pid] = oid_value
+            timestamp = event.timestamp
+            if self.window_statistics is not None:
+                self.window_statistics.add(timestamp, oid_value, "requests")
 
-        if event.event_type == Events.LOCK_RELATION_OID_END:
-            lock_relation = self.last_lock_relation[event.pid]
-            statistics_entry = self.statistics.get(lock_relation)
-            statistics_entry.lock_time_ns += self.get_lock_wait_time(event)
-            self.last_lock_relation[event.pid] = None
+            self.last_lock_request[event.pid] = (timestamp, oid_value)
+            return None
+
+        if event_type == LOCK_RELATION_OID_END:
+            # The request was not seen (e.g., the tracer started during the call)
+            request = self.last_lock_request.pop(event.pid, None)
+            if request is None:
+                return None
+
+            timestamp = event.timestamp
+            request_time, lock_relation = request
+            lock_time = timestamp - request_time
+            statistics_entry = self.statistics[lock_relation]
+            statistics_entry.lock_time_ns += lock_time
+            statistics_entry.lock_times.add(lock_time)
+
+            if self.window_statistics is not None:
+                self.window_statistics.add(
+                    timestamp, lock_relation, "lock_time_ns", lock_time
+                )
+            return lock_time
+
+        return None
 
     def get_lock_wait_time(self, event):
         """
         Get the last lock wait time (LOCK_RELATION_OID updates
-        last_lock_request_time).
+        last_lock_request).
 
         This method should be called on LOCK_RELATION_OID_END.
         """
         if event.event_type != Events.LOCK_RELATION_OID_END:
             return None
 
-        return event.timestamp - self.last_lock_request_time[event.pid]
+        request = self.last_lock_request.get(event.pid)
+        if request is None:
+            return None
+
+        return event.timestamp - request[0]
 
     def print_statistics(self):
         """
@@ -298,7 +497,8 @@ class PGLockTraceOutput(ABC):
 
         # Oid lock statistics
         print("\nLocks per OID")
-        table = PrettyTable(["Lock Name", "Requests", "Total Lock Request Time (ns)"])
+        columns = ["Lock Name", "Requests", "Total Lock Request Time (ns)"]
+        table = PrettyTable(["Cluster"] + columns if self.show_cluster else columns)
 
         sorted_keys = sorted(
             self.statistics.keys(),
@@ -308,7 +508,8 @@ class PGLockTraceOutput(ABC):
 
         for key in sorted_keys:
             statistics = self.statistics[key]
-            table.add_row([key, statistics.lock_count, statistics.lock_time_ns])
+            name = list(key) if self.show_cluster else [key]
+            table.add_row(name + [statistics.lock_count, statistics.lock_time_ns])
 
         print(table)
 
@@ -316,141 +517,85 @@ class PGLockTraceOutput(ABC):
         print("\nLock types")
         table = PrettyTable(["Lock Type", "Number of requested locks"])
 
-        # Map: Key = Lock type, Value = Number of requested locks
-        requested_locks = {}
-
         # Gather per lock type statistics
+        requested_locks = ModeCounters(len(PostgreSQLLockHelper.locks))
+        lock_times = Log2Histogram()
         for statistics in self.statistics.values():
-            for lock_type in statistics.requested_locks:
-                locks = requested_locks.get(lock_type, 0) + 1
-                requested_locks[lock_type] = locks
+            requested_locks.merge(statistics.requested_locks)
+            lock_times.merge(statistics.lock_times)
 
         # Print statistics
-        for lock_type in sorted(requested_locks):
-            locks = requested_locks[lock_type]
+        for lock_type, locks in requested_locks.items():
             lock_name = PostgreSQLLockHelper.lock_type_to_str(lock_type)
             table.add_row([lock_name, locks])
 
         print(table)
 
-    def handle_output_line(self, line):
+        # Lock request time histogram
+        print("\nLock request time")
+        table = PrettyTable(["Lock Request Time (ns)", "Requests"])
+
+        for lower, upper, count in lock_times.items():
+            table.add_row([f"{lower} - {upper}", count])
+
+        print(table)
+
+        # Lock tag type statistics
+        print("\nLock tag types")
+        table = PrettyTable(["Lock Tag Type", "Acquired Locks", "Granted Locks"])
+
+        for locktag_type in sorted(self.locktag_statistics):
+            acquired, granted = self.locktag_statistics[locktag_type]
+            table.add_row([get_locktag_name(locktag_type), acquired, granted])
+
+        print(table)
+
+    def handle_output_line(self, line, timestamp=None):
         """
-        Handle a output line
+        Handle a output line. The timestamp is provided for the first line
+        of an event and allows the rotation of the output file.
         """
-        if self.output_file:
-            self.output_file.write(line + "\n")
-        else:
-            print(line)
+        self.output_buffer.append(line, timestamp)
+
+    def flush_output(self):
+        """
+        Write the buffered output lines
+        """
+        self.output_buffer.flush()
 
 
 class PGLockTraceOutputHuman(PGLockTraceOutput):
-    # pylint: disable=too-many-branches, too-many-statements
-    def print_event(self, _cpu, data, _size):
+    def handle_event(self, event):
         """
         Print event in a human readable format
         """
-        event = self.bpf_instance["lockevents"].event(data)
+        pid, cluster, timestamp, event_type, oid, mode = EVENT_HEADER.unpack_from(event)
 
-        if (
-            self.pids
-            and event.pid not in self.pids
-            and event.event_type < Events.GLOBAL
-        ):
+        if self.pids and pid not in self.pids and event_type < GLOBAL_EVENTS:
             return
 
-        print_prefix = f"{event.timestamp} [Pid {event.pid}]"
-
-        # Resolve the OID to a name
-        if event.object > 0:
-            tablename = event.object
+        # Only the other lock tags than relations have to be read
+        if event_type in LOCKTAG_EVENTS and event.locktag_type != LOCKTAG_RELATION:
+            oid = LockEventFormatter.get_object(event, event_type)
 
         # Resolve the OID to a table name
-        if event.pid in self.oid_resolvers and event.object:
-            resolver = self.oid_resolvers[event.pid]
-            oid_value = resolver.resolve_oid(event.object)
-            tablename = f"{tablename} ({oid_value})"
-            self.update_statistics(event, oid_value)
-        else:
-            self.update_statistics(event, event.object)
-
-        output = None
-        if event.event_type == Events.TABLE_OPEN:
-            lock_type = PostgreSQLLockHelper.lock_type_to_str(event.mode)
-            output = f"{print_prefix} Table open {tablename} {lock_type}"
-        elif event.event_type in (Events.TABLE_OPEN_RV, Events.TABLE_OPEN_RV_EXTENDED):
-            # Table is opened using a (string) range value
-            lock_type = PostgreSQLLockHelper.lock_type_to_str(event.mode)
-            schema = event.payload_str1.decode("utf-8")
-            table = event.payload_str2.decode("utf-8")
-            tablename = f"{schema}.{table}"
-            output = (
-                f"{print_prefix} Table open (by range value) {tablename} {lock_type}"
-            )
-        elif event.event_type == Events.TABLE_CLOSE:
-            lock_type = PostgreSQLLockHelper.lock_type_to_str(event.mode)
-            output = f"{print_prefix} Table close {tablename} {lock_type}"
-        elif event.event_type == Events.LOCK_RELATION_OID:
-            lock_type = PostgreSQLLockHelper.lock_type_to_str(event.mode)
-            output = f"{print_prefix} Lock object {tablename} {lock_type}"
-        elif event.event_type == Events.LOCK_RELATION_OID_END:
-            lock_time = self.get_lock_wait_time(event)
-            output = f"{print_prefix} Lock was acquired in {lock_time} ns"
-        elif event.event_type == Events.UNLOCK_RELATION_OID:
-            lock_type = PostgreSQLLockHelper.lock_type_to_str(event.mode)
-            output = f"{print_prefix} Unlock relation {tablename} {lock_type}"
-        elif event.event_type == Events.LOCK_GRANTED:
-            lock_type = PostgreSQLLockHelper.lock_type_to_str(event.mode)
-            output = (
-                f"{print_prefix} Lock granted {tablename} {lock_type} "
-                f"(Requested locks {event.requested})"
-            )
-        elif event.event_type == Events.LOCK_GRANTED_FASTPATH:
-            lock_type = PostgreSQLLockHelper.lock_type_to_str(event.mode)
-            output = f"{print_prefix} Lock granted (fastpath) {tablename} {lock_type}"
-        elif event.event_type == Events.LOCK_GRANTED_LOCAL:
-            lock_type = PostgreSQLLockHelper.lock_type_to_str(event.mode)
-            output = (
-                f"{print_prefix} Lock granted (local) {tablename} {lock_type} "
-                f"(Already hold local {event.lock_local_hold})"
-            )
-        elif event.event_type == Events.LOCK_UNGRANTED:
-            lock_type = PostgreSQLLockHelper.lock_type_to_str(event.mode)
-            output = (
-                f"{print_prefix} Lock ungranted {tablename} {lock_type} "
-                f"(Requested locks {event.requested})"
-            )
-        elif event.event_type == Events.LOCK_UNGRANTED_FASTPATH:
-            lock_type = PostgreSQLLockHelper.lock_type_to_str(event.mode)
-            output = f"{print_prefix} Lock ungranted (fastpath) {tablename} {lock_type}"
-        elif event.event_type == Events.LOCK_UNGRANTED_LOCAL:
-            lock_type = PostgreSQLLockHelper.lock_type_to_str(event.mode)
-            output = (
-                f"{print_prefix} Lock ungranted (local) {tablename} {lock_type} "
-                f"(Hold local {event.lock_local_hold})"
-            )
-        elif event.event_type == Events.INVALIDATION_MESSAGES_ACCEPT:
-            output = f"{print_prefix} Accept invalidation messages"
-        elif event.event_type == Events.ERROR:
-            pgerror_value = PGError(event.mode).name
-            output = f"{print_prefix} Error occurred servity: {pgerror_value}"
-        elif event.event_type == Events.QUERY_BEGIN:
-            query = event.payload_str1.decode("utf-8")
-            output = f"{print_prefix} Query begin '{query}'"
-        elif event.event_type == Events.QUERY_END:
-            output = f"{print_prefix} Query done\n"
-        elif event.event_type == Events.TRANSACTION_BEGIN:
-            output = f"{print_prefix} Transaction begin"
-        elif event.event_type == Events.TRANSACTION_COMMIT:
-            output = f"{print_prefix} Transaction commit"
-        elif event.event_type == Events.TRANSACTION_ABORT:
-            output = f"{print_prefix} Transaction abort"
-        elif event.event_type == Events.DEADLOCK:
-            output = f"{print_prefix} DEADLOCK DETECTED"
-        else:
-            raise ValueError(f"Unsupported event type {event.event_type}")
+        formatter = self.formatter
+        prefix = formatter.human_prefixes.get((cluster, pid, event_type, mode, oid))
+        if prefix is None:
+            prefix = formatter.get_human_prefix(
+                pid, event_type, mode, oid, self.oid_resolvers, cluster
+            )
+        statistics_key, prefix = prefix
 
-        self.handle_output_line(output)
-        self.print_stacktace_if_available(event)
+        lock_time = None
+        if event_type in STATISTICS_EVENTS:
+            lock_time = self.update_statistics(event, event_type, statistics_key)
+
+        output = formatter.format_human(event, event_type, timestamp, prefix, lock_time)
+        self.output_buffer.append(output, timestamp)
+
+        if self.bpf_stacks is not None and event.stackid != 0:
+            self.print_stacktace_if_available(event)
 
     def print_stacktace_if_available(self, event):
         """
@@ -460,13 +605,13 @@ class PGLockTraceOutputHuman(PGLockTraceOutput):
             return
 
         if event.stackid < 0:
-            print(
+            self.handle_output_line(
                 "Error stack is missing. Try to increase BPF_STACK_TRACE buffer size."
             )
         else:
             for frame in self.bpf_stacks.walk(event.stackid):
                 line = self.bpf_instance.sym(
-                    frame, event.pid, show_offset=True, show_module=True
+                    frame, event.host_pid, show_offset=True, show_module=True
                 )
                 line = line.decode("utf-8")
                 # Get line with: 'gdb info line *(symbol+0x1111)'
@@ -475,108 +620,174 @@ class PGLockTraceOutputHuman(PGLockTraceOutput):
 
 
 class PGLockTraceOutputJSON(PGLockTraceOutput):
-    def print_event(self, _cpu, data, _size):
+    def handle_event(self, event):
         """
         Print event in JSON format
         """
-        event = self.bpf_instance["lockevents"].event(data)
+        pid, cluster, timestamp, event_type, oid, mode = EVENT_HEADER.unpack_from(event)
 
-        if (
-            self.pids
-            and event.pid not in self.pids
-            and event.event_type < Events.GLOBAL
-        ):
+        if self.pids and pid not in self.pids and event_type < GLOBAL_EVENTS:
             return
 
-        output = {}
-        output["timestamp"] = event.timestamp
-        output["pid"] = event.pid
-        output["event"] = Events(event.event_type).name
-
-        if event.event_type in (
-            Events.TABLE_OPEN,
-            Events.TABLE_OPEN_RV,
-            Events.TABLE_OPEN_RV_EXTENDED,
-            Events.TABLE_CLOSE,
-            Events.LOCK_RELATION_OID,
-            Events.UNLOCK_RELATION_OID,
-            Events.LOCK_GRANTED,
-            Events.LOCK_GRANTED_FASTPATH,
-            Events.LOCK_GRANTED_LOCAL,
-            Events.LOCK_UNGRANTED,
-            Events.LOCK_UNGRANTED_FASTPATH,
-            Events.LOCK_UNGRANTED_LOCAL,
-        ):
-            output["lock_type"] = PostgreSQLLockHelper.lock_type_to_str(event.mode)
+        # Only the other lock tags than relations have to be read
+        if event_type in LOCKTAG_EVENTS and event.locktag_type != LOCKTAG_RELATION:
+            oid = LockEventFormatter.get_object(event, event_type)
 
         # Resolve OID to tablename
-        if event.pid in self.oid_resolvers and event.object:
-            resolver = self.oid_resolvers[event.pid]
-            oid_value = resolver.resolve_oid(event.object)
-            output["table"] = oid_value
-            self.update_statistics(event, oid_value)
-        else:
-            self.update_statistics(event, event.object)
-
-        # Resolve the OID to a name
-        if event.object:
-            output["oid"] = event.object
+        formatter = self.formatter
+        prefix = formatter.json_prefixes.get((cluster, pid, event_type, mode, oid))
+        if prefix is None:
+            prefix = formatter.get_json_prefix(
+                pid, event_type, mode, oid, self.oid_resolvers, cluster
+            )
+        statistics_key, prefix = prefix
 
-        if event.event_type == Events.ERROR:
-            pgerror_value = PGError(event.mode).name
-            output["servity"] = pgerror_value
-        elif event.event_type == Events.QUERY_BEGIN:
-            output["query"] = event.payload_str1.decode("utf-8")
-        elif event.event_type in (Events.TABLE_OPEN_RV, Events.TABLE_OPEN_RV_EXTENDED):
-            # Table is opened using a (string) range value
-            schema = event.payload_str1.decode("utf-8")
-            table = event.payload_str2.decode("utf-8")
-            output["table"] = f"{schema}.{table}"
-        elif event.event_type == Events.LOCK_GRANTED_LOCAL:
-            output["lock_local_hold"] = event.lock_local_hold
-        elif event.event_type == Events.LOCK_RELATION_OID_END:
-            lock_time = self.get_lock_wait_time(event)
-            output["lock_time"] = lock_time
+        lock_time = None
+        if event_type in STATISTICS_EVENTS:
+            lock_time = self.update_statistics(event, event_type, statistics_key)
 
-        self.add_stacktrace_if_available(output, event)
+        stacktrace = None
+        if self.bpf_stacks is not None and event.stackid != 0:
+            stacktrace = self.get_stacktrace_if_available(event)
 
-        self.handle_output_line(json.dumps(output))
+        # Events without dynamic fields are completed by the timestamp
+        if stacktrace is None and event_type not in JSON_DYNAMIC_EVENTS:
+            output = f'{{"timestamp": {timestamp}{prefix}}}'
+        else:
+            output = formatter.format_json(
+                event, event_type, timestamp, prefix, lock_time, stacktrace
+            )
+        self.output_buffer.append(output, timestamp)
 
-    def add_stacktrace_if_available(self, output, event):
+    def get_stacktrace_if_available(self, event):
         """
-        Add a stacktrace to the JSON structure if available
+        Get the stacktrace of the event as a single string (if available)
         """
         if event.stackid == 0 or self.bpf_stacks is None:
-            return
+            return None
 
         if event.stackid < 0:
-            output["stacktrace"] = "MISSING"
-        else:
-            lines = []
+            return "MISSING"
 
-            # Get stacktrace symbol with module
-            for frame in self.bpf_stacks.walk(event.stackid):
-                line = self.bpf_instance.sym(
-                    frame, event.pid, show_offset=True, show_module=True
-                )
-                lines.append(line.decode("utf-8"))
+        lines = []
+
+        # Get stacktrace symbol with module
+        for frame in self.bpf_stacks.walk(event.stackid):
+            line = self.bpf_instance.sym(
+                frame, event.host_pid, show_offset=True, show_module=True
+            )
+            lines.append(line.decode("utf-8"))
 
-            # Merge lines into a single string
-            stacktrace = ", ".join(lines)
-            output["stacktrace"] = stacktrace
+        # Merge lines into a single string
+        return ", ".join(lines)
 
 
 class PGLockTracer:
+    # pylint: disable=too-many-instance-attributes
+
+    # Number of locks that are shown in the contention statistics
+    contention_rows = 50
+
     def __init__(self, prog_args):
         self.bpf_instance = None
         self.bpf_stacks = None
         self.output_file = None
         self.output_class = None
+        self.event_batch = None
+        self.batch_statistics = None
+        self.startup_timer = StartupTimer()
         self.args = prog_args
 
+        # Each traced binary is a cluster (identified by the index of the binary)
+        if len(set(self.args.paths)) != len(self.args.paths):
+            raise ValueError("Each binary can only be traced once")
+
+        self.show_cluster = len(self.args.paths) > 1
+
+        # Filter the processes of a cgroup in the kernel
+        self.cgroup_defines = CgroupHelper.generate_c_defines(
+            self.args.cgroup, self.args.container, self.args.paths, self.args.pids
+        )
+
+        # Belong the processes to the binaries? Key = PID, Value = cluster
+        if self.args.container and self.args.pids:
+            # The pids are pids of the PID namespace of the container
+            host_pids = CgroupHelper.get_host_pids(
+                self.args.cgroup, self.args.pids, self.args.paths
+            )
+            host_clusters = BPFHelper.check_pid_exe(
+                list(host_pids.values()), *self.args.paths
+            )
+            self.pid_clusters = {
+                pid: host_clusters[host_pid] for pid, host_pid in host_pids.items()
+            }
+        else:
+            self.pid_clusters = BPFHelper.check_pid_exe(
+                self.args.pids, *self.args.paths
+            )
+
         # A map of OID resolvers. One resolver per PID is needed
         # because the Oid depend on the catalog of the database.
-        self.oid_resolvers = {}
+        self.oid_resolvers = self.create_oid_resolvers()
+
+        # Compression and rotation are only possible with an output file
+        if not self.args.output_file and (
+            self.args.compression != "none"
+            or self.args.rotate_size is not None
+            or self.args.rotate_interval is not None
+        ):
+            raise ValueError(
+                "Compression and rotation of the output require an output file (-o)"
+            )
+
+        self.check_aggregation_options()
+
+        # The filter expression is compiled into the BPF program
+        self.event_filter = None
+        if self.args.filter:
+            self.event_filter = EventFilter(
+                self.args.filter,
+                self.resolve_relation if self.oid_resolvers else None,
+            )
+
+        # Track the fast-path and shared relation locks per transaction
+        self.fastpath_analyzer = None
+        if self.args.fastpath_analysis:
+            self.fastpath_analyzer = FastPathAnalyzer(self.args.fastpath_slots)
+
+        # The top view aggregates the lock requests in the kernel
+        self.top_view = None
+        if self.args.top:
+            self.top_view = TopView(self.args.top_interval, self.args.top_rows)
+
+        # The lock statistics per time window
+        self.window_statistics = WindowedStatistics.from_args(
+            self.args,
+            ("cluster", "lock") if self.show_cluster else ("lock",),
+            ("requests", "lock_time_ns"),
+        )
+
+        # Collect the events in batches for the statistics (needs numpy)
+        if self.args.statistics_only:
+            self.event_batch = EventBatch()
+            self.batch_statistics = BatchLockStatistics(
+                self.args.pids, self.show_cluster
+            )
+
+        # Create the output writer (fails if the output file already exists)
+        if self.args.output_file:
+            self.output_file = TraceFileWriter(
+                self.args.output_file,
+                self.args.compression,
+                self.args.rotate_size,
+                self.args.rotate_interval,
+            )
+
+    def create_oid_resolvers(self):
+        """
+        Create the OID resolvers of the PIDs (-r)
+        """
+        oid_resolvers = {}
 
         for oid_resolver_url in self.args.oid_resolver_urls:
             if ":" not in oid_resolver_url:
@@ -595,20 +806,84 @@ class PGLockTracer:
                 sys.exit(1)
 
             if self.args.verbose:
-                print(f"Add resolver for PID {resolver_pid} with URL {database_url}")
+                cluster = self.pid_clusters[resolver_pid]
+                print(
+                    f"Add resolver for PID {resolver_pid} (cluster {cluster}) "
+                    f"with URL {database_url}"
+                )
+
+            oid_resolvers[resolver_pid] = OIDResolver(database_url)
+
+        return oid_resolvers
+
+    def check_aggregation_options(self):
+        """
+        Check that the options of the aggregated statistics can be combined
+        """
+        trace_lock = self.args.trace is None or TraceEvents.LOCK.name in self.args.trace
+
+        # The contention is collected by the lock grant and ungrant probes
+        if self.args.contention and not trace_lock:
+            raise ValueError("The contention statistics require the LOCK events")
 
-            oid_resolver = OIDResolver(database_url)
-            self.oid_resolvers[resolver_pid] = oid_resolver
+        if self.args.top and not trace_lock:
+            raise ValueError("The top view requires the LOCK events")
 
-        # Belong the processes to the binary?
-        BPFHelper.check_pid_exe(self.args.pids, self.args.path)
+        # The waits are the LockRelationOid calls
+        if self.args.off_cpu and not trace_lock:
+            raise ValueError("The off-CPU accounting requires the LOCK events")
 
-        # Does the output file already exists?
-        if self.args.output_file and os.path.exists(self.args.output_file):
-            raise ValueError(f"Output file {self.args.output_file} already exists")
+        if self.args.top and (self.args.statistics_only or self.args.output_file):
+            raise ValueError(
+                "The top view can not be combined with --statistics-only or -o"
+            )
+
+        if self.args.top and (
+            self.args.filter or self.args.slow_lock_threshold is not None
+        ):
+            raise ValueError(
+                "The filter and the slow lock threshold can not be combined with --top"
+            )
+
+        if self.args.slow_lock_threshold is not None:
+            if self.args.slow_lock_threshold < 0:
+                raise ValueError(
+                    "Slow lock threshold can not be negative "
+                    f"({self.args.slow_lock_threshold} was provided)"
+                )
+
+            if not trace_lock:
+                raise ValueError("The slow lock threshold requires the LOCK events")
+
+            if self.args.fastpath_analysis:
+                raise ValueError(
+                    "The slow lock threshold can not be combined with the "
+                    "fast-path analysis (only the slow requests are submitted)"
+                )
+
+        if self.args.fastpath_analysis and not (
+            trace_lock
+            and (
+                self.args.trace is None
+                or TraceEvents.TRANSACTION.name in self.args.trace
+            )
+        ):
+            raise ValueError(
+                "The fast-path analysis requires the TRANSACTION and LOCK events"
+            )
+
+        if self.args.fastpath_analysis and (self.args.statistics_only or self.args.top):
+            raise ValueError(
+                "The fast-path analysis can not be combined with --statistics-only or --top"
+            )
+
+        if self.args.window_statistics is not None and self.args.statistics_only:
+            raise ValueError(
+                "The window statistics can not be combined with --statistics-only"
+            )
 
     @staticmethod
-    def generate_c_defines(stacktrace_events, verbose):
+    def generate_c_defines(stacktrace_events, trace_events, verbose):
         """
         Create C defines from python enums
         """
@@ -616,6 +891,11 @@ class PGLockTracer:
         error_defines = BPFHelper.enum_to_defines(PGError, "PGERROR")
         defines = enum_defines + error_defines
 
+        # Only the BPF functions of the traced events are compiled
+        for trace_event in TraceEvents:
+            if trace_events is None or trace_event.name in trace_events:
+                defines += f"#define TRACE_{trace_event.name}\n"
+
         # Print stacktrace for each lock
         if stacktrace_events and "LOCK" in stacktrace_events:
             defines += "#define STACKTRACE_LOCK\n"
@@ -640,12 +920,7 @@ class PGLockTracer:
         """
         Init the PostgreSQL lock tracer
         """
-
-        defines = PGLockTracer.generate_c_defines(
-            self.args.stacktrace, self.args.verbose
-        )
-        bpf_program = BPFHelper.read_bpf_program("pg_lock_tracer.c")
-        bpf_program_final = bpf_program.replace("__DEFINES__", defines)
+        bpf_program_final = self.get_bpf_program()
 
         if self.args.verbose:
             print(bpf_program_final)
@@ -655,27 +930,103 @@ class PGLockTracer:
         bpf_cflags = ["-Wno-macro-redefined"] if not self.args.verbose else []
 
         print("===> Compiling BPF program")
-        self.bpf_instance = BPF(text=bpf_program_final, cflags=bpf_cflags)
+        with self.startup_timer.measure("Compile BPF program"):
+            bpf_instance = BPF(text=bpf_program_final, cflags=bpf_cflags)
+
+        self.setup(bpf_instance)
+
+    def get_bpf_program(self):
+        """
+        Generate the BPF program of the traced binaries
+        """
+        with self.startup_timer.measure("Generate program"):
+            defines = PGLockTracer.generate_c_defines(
+                self.args.stacktrace, self.args.trace, self.args.verbose
+            )
+            defines += self.cgroup_defines
+
+            if self.args.contention:
+                defines += "#define CONTENTION_STATS\n"
+
+            if self.args.catalog_stats:
+                defines += "#define CATALOG_STATS\n"
+                defines += BPFHelper.enum_to_defines(
+                    CatalogFunction, "CATALOG_FUNCTION"
+                )
+
+            if self.args.off_cpu:
+                defines += "#define OFF_CPU\n"
+
+            if self.top_view is not None:
+                defines += "#define TOP_VIEW\n"
+
+            if self.event_filter is not None:
+                defines += self.event_filter.get_c_defines()
+
+            # Only submit the slow LockRelationOid calls (threshold in ns)
+            if self.args.slow_lock_threshold is not None:
+                threshold_ns = int(self.args.slow_lock_threshold * 1000)
+                defines += f"#define SLOW_LOCK_THRESHOLD_NS {threshold_ns}\n"
+
+            # The struct offsets of the traced binaries
+            cluster_defines = []
+            for path in self.args.paths:
+                offsets = get_struct_offsets(path, self.args.verbose)
+                cluster_defines.append(offsets_to_defines(offsets))
+
+            bpf_program = BPFHelper.read_bpf_program("pg_lock_tracer.c")
+            bpf_program = BPFHelper.insert_off_cpu_program(
+                bpf_program, self.args.off_cpu
+            )
+            return BPFHelper.expand_clusters(
+                bpf_program.replace("__DEFINES__", defines), cluster_defines
+            )
+
+    def setup(self, bpf_instance):
+        """
+        Attach the probes of the compiled BPF program and open the event queue
+        """
+        self.bpf_instance = bpf_instance
+
+        # The cgroup of the processes to trace
+        if self.args.cgroup:
+            self.bpf_instance["cgroup_filter"][0] = self.args.cgroup
+
+        # The values of the 'in' lists of the filter
+        if self.event_filter is not None:
+            self.event_filter.fill_maps(self.bpf_instance)
 
         print("===> Attaching BPF probes")
-        self.attach_probes()
+        with self.startup_timer.measure("Attach probes"):
+            for cluster, path in enumerate(self.args.paths):
+                if self.show_cluster:
+                    print(f"===> Cluster {cluster}: {path}")
+                self.attach_probes(cluster, path)
+
+            if self.args.off_cpu:
+                BPFHelper.attach_off_cpu_tracepoints(
+                    self.bpf_instance, self.args.verbose
+                )
+
+            # Remove the lock requests of the exiting backends
+            if self.top_view is not None:
+                self.bpf_instance.attach_tracepoint(
+                    tp="sched:sched_process_exit", fn_name="top_process_exit"
+                )
 
         # Stack traces requested?
         if self.args.stacktrace:
             self.bpf_stacks = self.bpf_instance.get_table("stacks")
 
         # Open file for output if provided
-        if self.args.output_file:
-            # pylint: disable=consider-using-with
-            self.output_file = open(self.args.output_file, "w", encoding="utf-8")
-            if not self.output_file.writable():
-                raise ValueError(
-                    f"Output file {self.args.output_file} is not writeable"
-                )
+        if self.output_file:
+            self.output_file.open()
 
         # Output as human readable text or as json?
         self.output_class = (
-            PGLockTraceOutputJSON() if self.args.json else PGLockTraceOutputHuman()
+            PGLockTraceOutputJSON(self.show_cluster)
+            if self.args.json
+            else PGLockTraceOutputHuman(self.show_cluster)
         )
 
         # Init the output class
@@ -686,200 +1037,497 @@ class PGLockTracer:
             self.oid_resolvers,
             self.args.pids,
         )
+        self.output_class.window_statistics = self.window_statistics
+        self.output_class.fastpath_analyzer = self.fastpath_analyzer
 
         # Open the event queue
-        self.bpf_instance["lockevents"].open_perf_buffer(
-            self.output_class.print_event, page_cnt=BPFHelper.page_cnt
+        event_callback = self.output_class.print_event
+        if self.event_batch is not None:
+            event_callback = self.event_batch.append_record
+
+        with self.startup_timer.measure("Open perf buffer"):
+            self.bpf_instance["lockevents"].open_perf_buffer(
+                event_callback, page_cnt=BPFHelper.page_cnt
+            )
+
+    def flush_output(self):
+        """
+        Write the buffered output lines
+        """
+        self.output_class.flush_output()
+
+    def register_probe(
+        self, cluster, path, function_regex, bpf_fn_name, probe_on_enter=True
+    ):
+        """
+        Register the BPF probe of the given cluster
+        """
+        BPFHelper.register_ebpf_probe(
+            path,
+            self.bpf_instance,
+            function_regex,
+            BPFHelper.cluster_function_name(bpf_fn_name, cluster),
+            self.args.verbose,
+            probe_on_enter,
         )
 
-    def attach_probes(self):
+    def attach_probes(self, cluster, path):
         """
-        Attach BPF probes
+        Attach the BPF probes of a cluster
         """
         # Transaction probes
         if self.args.trace is None or TraceEvents.TRANSACTION.name in self.args.trace:
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^StartTransaction$",
-                "bpf_transaction_begin",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^CommitTransaction$",
-                "bpf_transaction_commit",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^AbortTransaction$",
-                "bpf_transaction_abort",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^DeadLockReport$",
-                "bpf_deadlock",
-                self.args.verbose,
+            self.register_probe(
+                cluster, path, "^StartTransaction$", "bpf_transaction_begin"
+            )
+            self.register_probe(
+                cluster, path, "^CommitTransaction$", "bpf_transaction_commit"
+            )
+            self.register_probe(
+                cluster, path, "^AbortTransaction$", "bpf_transaction_abort"
             )
+            self.register_probe(cluster, path, "^DeadLockReport$", "bpf_deadlock")
 
         # Query probes
         if self.args.trace is None or TraceEvents.QUERY.name in self.args.trace:
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^exec_simple_query$",
-                "bpf_query_begin",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^exec_simple_query$",
-                "bpf_query_end",
-                self.args.verbose,
-                False,
+            self.register_probe(cluster, path, "^exec_simple_query$", "bpf_query_begin")
+            self.register_probe(
+                cluster, path, "^exec_simple_query$", "bpf_query_end", False
             )
 
         # Table probes
         if self.args.trace is None or TraceEvents.TABLE.name in self.args.trace:
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^table_open$",
-                "bpf_table_open",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^table_openrv$",
-                "bpf_table_openrv",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^table_openrv_extended$",
-                "bpf_table_openrv_extended",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^table_close$",
-                "bpf_table_close",
-                self.args.verbose,
+            self.register_probe(cluster, path, "^table_open$", "bpf_table_open")
+            self.register_probe(cluster, path, "^table_openrv$", "bpf_table_openrv")
+            self.register_probe(
+                cluster, path, "^table_openrv_extended$", "bpf_table_openrv_extended"
             )
+            self.register_probe(cluster, path, "^table_close$", "bpf_table_close")
 
         # Lock probes
         if self.args.trace is None or TraceEvents.LOCK.name in self.args.trace:
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^LockRelationOid$",
-                "bpf_lock_relation_oid",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^LockRelationOid$",
-                "bpf_lock_relation_oid_end",
-                self.args.verbose,
-                False,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^UnlockRelationOid$",
-                "bpf_unlock_relation_oid",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^GrantLock$",
-                "bpf_lock_grant",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^FastPathGrantRelationLock$",
-                "bpf_lock_fastpath_grant",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^GrantLockLocal$",
-                "bpf_lock_local_grant",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^UnGrantLock$",
-                "bpf_lock_ungrant",
-                self.args.verbose,
-            )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
+            self.register_probe(
+                cluster, path, "^LockRelationOid$", "bpf_lock_relation_oid"
+            )
+            self.register_probe(
+                cluster, path, "^LockRelationOid$", "bpf_lock_relation_oid_end", False
+            )
+            self.register_probe(
+                cluster, path, "^UnlockRelationOid$", "bpf_unlock_relation_oid"
+            )
+            self.register_probe(cluster, path, "^GrantLock$", "bpf_lock_grant")
+            self.register_probe(
+                cluster, path, "^FastPathGrantRelationLock$", "bpf_lock_fastpath_grant"
+            )
+            self.register_probe(
+                cluster, path, "^GrantLockLocal$", "bpf_lock_local_grant"
+            )
+            self.register_probe(cluster, path, "^UnGrantLock$", "bpf_lock_ungrant")
+            self.register_probe(
+                cluster,
+                path,
                 "^FastPathUnGrantRelationLock$",
                 "bpf_lock_fastpath_ungrant",
-                self.args.verbose,
             )
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^RemoveLocalLock$",
-                "bfp_local_lock_ungrant",
-                self.args.verbose,
+            self.register_probe(
+                cluster, path, "^RemoveLocalLock$", "bfp_local_lock_ungrant"
             )
 
         # Invalidation messages probes
         if self.args.trace is None or TraceEvents.INVALIDATION.name in self.args.trace:
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
+            self.register_probe(
+                cluster,
+                path,
                 "^AcceptInvalidationMessages$",
                 "bpf_accept_invalidation_messages",
-                self.args.verbose,
             )
 
         # Error probes
         if self.args.trace is None or TraceEvents.ERROR.name in self.args.trace:
-            BPFHelper.register_ebpf_probe(
-                self.args.path,
-                self.bpf_instance,
-                "^errstart$",
-                "bpf_errstart",
-                self.args.verbose,
-            )
+            self.register_probe(cluster, path, "^errstart$", "bpf_errstart")
+
+        # Catalog function probes (independent of the traced events)
+        if self.args.catalog_stats:
+            for function, bpf_fn_name in (
+                ("AcceptInvalidationMessages", "bpf_catalog_invalidation"),
+                ("table_open", "bpf_catalog_table_open"),
+                ("RelationBuildDesc", "bpf_catalog_relation_build_desc"),
+            ):
+                self.register_probe(cluster, path, f"^{function}$", bpf_fn_name)
+                self.register_probe(
+                    cluster, path, f"^{function}$", f"{bpf_fn_name}_end", False
+                )
+
+            # Errors abort the running catalog calls
+            self.register_probe(cluster, path, "^errstart$", "bpf_catalog_errstart")
 
     def run(self):
         """
         Run the BPF program and read results
         """
+        if self.top_view is not None:
+            self.run_top()
+            return
+
+        poll_timeout = -1
+
+        # Rotate the output segments by time when no events arrive
+        if self.output_file is not None:
+            poll_timeout = self.output_file.poll_timeout
+
+        # Write the closed statistics windows on SIGUSR1
+        if self.window_statistics is not None:
+            signal.signal(signal.SIGUSR1, self.window_statistics.request_report)
+            window_timeout = self.window_statistics.poll_timeout
+            poll_timeout = (
+                window_timeout
+                if poll_timeout < 0
+                else min(poll_timeout, window_timeout)
+            )
 
         print("===> Ready to trace queries")
         while True:
             try:
-                self.bpf_instance.perf_buffer_poll()
+                self.bpf_instance.perf_buffer_poll(timeout=poll_timeout)
+                self.output_class.flush_output()
+                self.process_event_batch()
+
+                if self.output_file is not None:
+                    self.output_file.poll()
+
+                if self.window_statistics is not None:
+                    self.window_statistics.poll()
             except KeyboardInterrupt:
+                self.output_class.flush_output()
+                self.process_event_batch()
+
+                if self.window_statistics is not None:
+                    self.window_statistics.close()
+
                 if self.output_file:
                     self.output_file.close()
 
                 if self.args.statistics:
                     self.output_class.print_statistics()
+
+                if self.batch_statistics is not None:
+                    self.batch_statistics.print_statistics(self.resolve_object)
+
+                self.print_kernel_statistics()
+
+                if self.fastpath_analyzer is not None:
+                    self.fastpath_analyzer.print_report(self.resolve_object)
                 sys.exit(0)
 
+    def run_top(self):
+        """
+        Show the top view until the tracer is interrupted
+        """
+        self.top_view.run(self.refresh_top)
+        self.print_kernel_statistics()
+
+    def print_kernel_statistics(self):
+        """
+        Print the statistics that are aggregated in the kernel (on exit)
+        """
+        if self.args.contention:
+            self.print_contention()
+
+        if self.args.catalog_stats:
+            self.print_catalog_statistics()
+
+        if self.args.off_cpu:
+            self.print_off_cpu_statistics()
+
+        # The lock requests are held back in the kernel
+        if self.args.slow_lock_threshold is not None or (
+            self.event_filter is not None and self.event_filter.uses_wait_time
+        ):
+            dropped = self.bpf_instance["dropped_events"][0].value
+            if dropped:
+                print(
+                    f"{dropped} lock grants could not be held back with their request"
+                )
+
+    def refresh_top(self, now_ns):
+        """
+        Read the aggregated BPF maps and print the top view
+        """
+        top_view = self.top_view
+
+        # Event rate
+        event_counts = {
+            Events(key.value).name: value.value
+            for key, value in self.bpf_instance["event_counts"].items()
+        }
+        event_deltas = top_view.get_deltas("events", event_counts)
+        dropped = self.bpf_instance["dropped_events"][0].value
+        dropped_delta = top_view.get_deltas("dropped", {"dropped": dropped})["dropped"]
+
+        title = (
+            f"pg_lock_tracer - {time.strftime('%H:%M:%S')} - "
+            f"{top_view.get_rate(sum(event_deltas.values())):.0f} events/s, "
+            f"{sum(event_counts.values())} events, "
+            f"{dropped} dropped ({top_view.get_rate(dropped_delta):.0f}/s)"
+        )
+
+        # Relations with the highest lock wait time in the last interval
+        relation_waits = {}
+        relation_requests = {}
+        relation_max = {}
+        for key, value in self.bpf_instance["relation_waits"].items():
+            relation = (key.cluster, key.oid)
+            relation_waits[relation] = value.wait_ns
+            relation_requests[relation] = value.requests
+            relation_max[relation] = value.wait_max_ns
+
+        wait_deltas = top_view.get_deltas("wait_ns", relation_waits)
+        request_deltas = top_view.get_deltas("requests", relation_requests)
+
+        columns = [
+            "Relation",
+            "Requests/s",
+            "Lock Wait (ms/s)",
+            "Total Requests",
+            "Total Lock Wait (ms)",
+            "Max Lock Wait (ms)",
+        ]
+        relations = PrettyTable(["Cluster"] + columns if self.show_cluster else columns)
+        hottest = sorted(
+            relation_waits,
+            key=lambda relation: (wait_deltas[relation], relation_waits[relation]),
+            reverse=True,
+        )
+
+        for cluster, oid in hottest[: top_view.rows]:
+            relation = (cluster, oid)
+            row = [
+                self.get_top_name(cluster, oid),
+                f"{top_view.get_rate(request_deltas[relation]):.0f}",
+                f"{top_view.get_rate(wait_deltas[relation]) / 1_000_000:.3f}",
+                relation_requests[relation],
+                f"{relation_waits[relation] / 1_000_000:.3f}",
+                f"{relation_max[relation] / 1_000_000:.3f}",
+            ]
+            relations.add_row([cluster] + row if self.show_cluster else row)
+
+        # Backends in LockRelationOid (the pids are filtered in user space)
+        columns = ["Pid", "Relation", "Lock Mode", "Waiting (ms)"]
+        backends = PrettyTable(["Cluster"] + columns if self.show_cluster else columns)
+        requests = sorted(
+            (
+                (key, value)
+                for key, value in self.bpf_instance["lock_requests"].items()
+                if not self.args.pids or key.value in self.args.pids
+            ),
+            key=lambda item: item[1].start,
+        )
+
+        for key, value in requests[: top_view.rows]:
+            row = [
+                key.value,
+                self.get_top_name(value.cluster, value.oid),
+                PostgreSQLLockHelper.lock_type_to_str(value.mode),
+                f"{max(0, now_ns - value.start) / 1_000_000:.3f}",
+            ]
+            backends.add_row([value.cluster] + row if self.show_cluster else row)
+
+        sections = [
+            ("Relations by lock wait time", relations),
+            ("Waiting backends", backends),
+        ]
+
+        # Locks with the longest wait queues in the last interval
+        if self.args.contention:
+            contention = self.get_contention()
+            waiting_deltas = top_view.get_deltas(
+                "contention",
+                {target: value.waiting_sum for target, value in contention.items()},
+            )
+            targets = sorted(
+                contention,
+                key=lambda target: (
+                    waiting_deltas[target],
+                    contention[target].waiting_sum,
+                ),
+                reverse=True,
+            )
+            sections.append(
+                (
+                    "Locks by contention",
+                    self.get_contention_table(contention, targets[: top_view.rows]),
+                )
+            )
+
+        top_view.render(title, sections)
+
+    def get_resolver_pid(self, cluster):
+        """
+        Get the pid of an OID resolver of the cluster (0 if there is none)
+        """
+        for pid in self.oid_resolvers:
+            if self.pid_clusters.get(pid, 0) == cluster:
+                return pid
+
+        return 0
+
+    def get_top_name(self, cluster, oid):
+        """
+        Get the name of a relation of the top view. The OID is resolved
+        with a resolver of the cluster (if present).
+        """
+        _, name, _ = self.output_class.formatter.resolve_object(
+            self.get_resolver_pid(cluster), oid, self.oid_resolvers, cluster
+        )
+        return name
+
+    def get_contention(self):
+        """
+        Read the contention of the shared locks that is aggregated in the
+        kernel (Key = cluster and lock tag)
+        """
+        return {
+            (
+                key.cluster,
+                (
+                    key.locktag_type,
+                    key.locktag_field1,
+                    key.locktag_field2,
+                    key.locktag_field3,
+                    key.locktag_field4,
+                ),
+            ): value
+            for key, value in self.bpf_instance["lock_contention"].items()
+        }
+
+    def get_contention_table(self, contention, targets):
+        """
+        Create the table of the contention of the given lock targets
+        """
+        columns = [
+            "Lock",
+            "Grants",
+            "Ungrants",
+            "Avg Waiting",
+            "Max Waiting",
+            "Max Granted",
+            "Granted Modes",
+            "Awaited Modes",
+        ]
+        table = PrettyTable(["Cluster"] + columns if self.show_cluster else columns)
+
+        for cluster, locktag in targets:
+            value = contention[(cluster, locktag)]
+            name, _, _ = self.output_class.formatter.resolve_object(
+                self.get_resolver_pid(cluster), locktag, self.oid_resolvers, cluster
+            )
+            events = value.grants + value.ungrants
+            row = [
+                name,
+                value.grants,
+                value.ungrants,
+                f"{value.waiting_sum / events:.2f}" if events else 0,
+                value.waiting_max,
+                value.granted_max,
+                PGLockTracer.lock_mask_to_str(value.grant_mask),
+                PGLockTracer.lock_mask_to_str(value.wait_mask),
+            ]
+            table.add_row([cluster] + row if self.show_cluster else row)
+
+        return table
+
+    def print_contention(self):
+        """
+        Print the contention of the shared locks that is aggregated in the kernel
+        """
+        print("\nLock contention")
+        contention = self.get_contention()
+        targets = sorted(
+            contention,
+            key=lambda target: contention[target].waiting_sum,
+            reverse=True,
+        )
+
+        print(
+            self.get_contention_table(
+                contention, targets[: PGLockTracer.contention_rows]
+            )
+        )
+
+    def print_catalog_statistics(self):
+        """
+        Print the time of the catalog functions that is aggregated in the kernel
+        """
+        catalog_statistics = CatalogStatistics(self.show_cluster)
+
+        # The pids are filtered in user space
+        for key, value in self.bpf_instance["catalog_times"].items():
+            if not self.args.pids or key.pid in self.args.pids:
+                catalog_statistics.add(key, value)
+
+        catalog_statistics.print_statistics(self.get_top_name)
+
+        dropped = self.bpf_instance["catalog_dropped_calls"][0].value
+        if dropped:
+            print(
+                f"{dropped} catalog calls could not be aggregated (a BPF map is full)"
+            )
+
+    def print_off_cpu_statistics(self):
+        """
+        Print the off-CPU time of the lock waits that is aggregated in the kernel
+        """
+        off_cpu_statistics = OffCpuStatistics(self.show_cluster)
+
+        # The pids are filtered in user space
+        for key, value in self.bpf_instance["off_cpu_times"].items():
+            if not self.args.pids or key.pid in self.args.pids:
+                off_cpu_statistics.add(key, value)
+
+        off_cpu_statistics.print_statistics(self.get_top_name)
+
+    @staticmethod
+    def lock_mask_to_str(lock_mask):
+        """
+        Convert a mask of lock modes into a list of lock names
+        """
+        locks = PostgreSQLLockHelper.decode_locks_from_value(lock_mask)
+        return ", ".join(
+            PostgreSQLLockHelper.lock_type_to_str(lock) for lock in locks if lock > 0
+        )
+
+    def process_event_batch(self):
+        """
+        Add the events that are collected in the current batch to the statistics
+        """
+        if self.event_batch is None or len(self.event_batch) == 0:
+            return
+
+        self.batch_statistics.add_events(self.event_batch.take())
+
+    def resolve_relation(self, name):
+        """
+        Resolve a relation name of the filter into the OIDs of the
+        databases of the OID resolvers
+        """
+        oids = set()
+
+        for oid_resolver in self.oid_resolvers.values():
+            oid = oid_resolver.resolve_name(name)
+            if oid is not None:
+                oids.add(oid)
+
+        return oids
+
+    def resolve_object(self, pid, oid, cluster=0):
+        """
+        Resolve the OID of the given pid into the name that is used in the statistics
+        """
+        statistics_key, _, _ = self.output_class.formatter.resolve_object(
+            pid, oid, self.oid_resolvers, cluster
+        )
+        return statistics_key
+
 
 def main():
     """
@@ -890,6 +1538,9 @@ def main():
     pg_lock_tracer = PGLockTracer(args)
     pg_lock_tracer.init()
 
+    if args.dry_run and args.verbose:
+        pg_lock_tracer.startup_timer.print_breakdown()
+
     if not args.dry_run:
         pg_lock_tracer.run()
 
@@ -1,15 +1,19 @@
 #!/usr/bin/env python3
 #
-# PostgreSQL LW lock tracer. To use this script, PostgreSQL has to be
-# compiled with '--enable-dtrace'.
+# PostgreSQL LW lock tracer. To use the USDT probes, PostgreSQL has to be
+# compiled with '--enable-dtrace'. Otherwise, the LWLock functions of the
+# binary can be traced with uprobes (--uprobes).
 #
 # See https://www.postgresql.org/docs/current/dynamic-trace.html
 #
 # List all available USDT probes
 # sudo bpftrace -l "usdt:/home/jan/postgresql-sandbox/bin/REL_15_1_DEBUG/bin/postgres:*"
 ###############################################
+# pylint: disable=too-many-lines
 
 import sys
+import time
+import signal
 import argparse
 
 from enum import IntEnum, unique
@@ -18,7 +22,13 @@ from bcc import BPF, USDT
 from prettytable import PrettyTable
 
 from pg_lock_tracer import __version__
-from pg_lock_tracer.helper import BPFHelper
+from pg_lock_tracer.helper import BPFHelper, StartupTimer
+from pg_lock_tracer.lock_statistics import DurationStatistics, ModeCounters
+from pg_lock_tracer.lwlock_tranches import LWLockTranches
+from pg_lock_tracer.off_cpu_statistics import OffCpuStatistics
+from pg_lock_tracer.struct_offsets import get_struct_offsets, offsets_to_defines
+from pg_lock_tracer.window_statistics import WindowedStatistics, add_window_arguments
+from pg_lock_tracer.top_view import TopView, add_top_arguments
 
 EXAMPLES = """examples:
 # Trace the LW locks of the PID 1234
@@ -27,11 +37,33 @@ pg_lw_lock_tracer -p 1234
 # Trace the LW locks of the PIDs 1234 and 5678
 pg_lw_lock_tracer -p 1234 -p 5678
 
+# Trace the LW locks of all processes of the binary (including backends that connect later)
+pg_lw_lock_tracer -x /usr/lib/postgresql/16/bin/postgres --statistics-only
+
 # Trace the LW locks of the PID 1234 and be verbose
 pg_lw_lock_tracer -p 1234 -v
 
 # Trace the LW locks of the PID 1234 and collect statistics
 pg_lw_lock_tracer -p 1234 -v --statistics
+
+# Only aggregate the wait times per tranche and mode in the kernel and print them on exit
+pg_lw_lock_tracer -p 1234 --statistics-only
+
+# Trace the LWLock functions of the binary with uprobes (PostgreSQL without '--enable-dtrace')
+# and show the waits and hold times per lock instance (e.g., per buffer mapping partition)
+pg_lw_lock_tracer -p 1234 -p 5678 -x /usr/lib/postgresql/16/bin/postgres --uprobes
+
+# Show the pages (relation and block) with the highest wait time for the content lock of their buffer
+pg_lw_lock_tracer -p 1234 -p 5678 -x /usr/lib/postgresql/16/bin/postgres --uprobes --buffer-pages
+
+# Split the LW lock waits into the time sleeping and runnable, and show who woke the waiters (printed on exit)
+pg_lw_lock_tracer -p 1234 -p 5678 --statistics-only --off-cpu
+
+# Show the tranches with the highest wait time and the waiting backends (refreshed every second)
+pg_lw_lock_tracer -p 1234 -p 5678 --top
+
+# Write the statistics of each second as CSV into 'lwlocks.csv' every minute
+pg_lw_lock_tracer -p 1234 --window-statistics 1 --window-report-interval 60 --window-format csv --window-output lwlocks.csv
 """
 
 parser = argparse.ArgumentParser(
@@ -51,10 +83,10 @@ parser.add_argument(
     "--pid",
     type=int,
     nargs="+",
+    action="extend",
     dest="pids",
     metavar="PID",
-    help="the pid(s) to trace",
-    required=True,
+    help="the pid(s) to trace (filtered in the kernel when used with -x)",
 )
 parser.add_argument(
     "-d",
@@ -63,6 +95,47 @@ parser.add_argument(
     help="compile and load the BPF program but exit afterward",
 )
 parser.add_argument("--statistics", action="store_true", help="print lock statistics")
+parser.add_argument(
+    "--statistics-only",
+    action="store_true",
+    help="aggregate the wait times in the kernel without submitting the events "
+    "and print them on exit",
+)
+parser.add_argument(
+    "-x",
+    "--exe",
+    type=str,
+    dest="path",
+    metavar="PATH",
+    help="attach the probes to all processes of the binary (including new backends)",
+)
+parser.add_argument(
+    "--uprobes",
+    action="store_true",
+    help="trace the LWLock functions of the binary (-x) with uprobes instead of the "
+    "USDT probes and aggregate the waits and hold times per lock instance",
+)
+parser.add_argument(
+    "--instance-rows",
+    type=int,
+    default=25,
+    metavar="N",
+    help="number of lock instances in the statistics of the uprobe mode (default 25)",
+)
+parser.add_argument(
+    "--buffer-pages",
+    action="store_true",
+    help="aggregate the waits for the content locks of the buffers per page "
+    "(relation and block) in the uprobe mode",
+)
+parser.add_argument(
+    "--off-cpu",
+    action="store_true",
+    help="split the waits into the time on the CPU, sleeping, and runnable, and "
+    "record the waking pids (scheduler tracepoints, printed on exit)",
+)
+add_window_arguments(parser)
+add_top_arguments(parser)
 
 
 @unique
@@ -84,95 +157,90 @@ class LWLockMode(IntEnum):
     LW_WAIT_UNTIL_FREE = 2
 
 
+# The counters of the window statistics. Key = event, Value = counter
+WINDOW_COUNTERS = {
+    Events.LOCK: "acquired",
+    Events.LOCK_OR_WAIT: "acquire_or_wait",
+    Events.LOCK_OR_WAIT_FAIL: "acquire_or_wait_failed",
+    Events.COND_ACQUIRE: "cond_acquired",
+    Events.COND_ACQUIRE_FAIL: "cond_acquire_failed",
+    Events.WAIT_START: "waits",
+}
+
+# The USDT probes of the LW locks and their BPF functions
+USDT_PROBES = (
+    ("lwlock__acquire", "lwlock_acquire"),
+    ("lwlock__acquire__or__wait", "lwlock_acquire_or_wait"),
+    ("lwlock__acquire__or__wait__fail", "lwlock_acquire_or_wait_fail"),
+    ("lwlock__release", "lwlock_release"),
+    ("lwlock__wait__start", "lwlock_wait_start"),
+    ("lwlock__wait__done", "lwlock_wait_done"),
+    ("lwlock__condacquire", "lwlock_condacquire"),
+    ("lwlock__condacquire__fail", "lwlock_condacquire_fail"),
+)
+
+# The names of the forks (ForkNumber)
+FORK_NAMES = {0: "main", 1: "fsm", 2: "vm", 3: "init"}
+
+# The LWLock functions of the uprobe mode and their BPF functions. All
+# functions return a bool, which is handled by lwlock_call_return.
+UPROBE_FUNCTIONS = (
+    ("LWLockAcquire", "lwlock_acquire"),
+    ("LWLockConditionalAcquire", "lwlock_conditional_acquire"),
+    ("LWLockWaitForVar", "lwlock_wait_for_var"),
+)
+
+
+# pylint: disable=too-few-public-methods
 class LockStatisticsEntry:
+    __slots__ = (
+        "direct_lock_count",
+        "acquire_or_wait_count",
+        "acquire_or_wait_failed_count",
+        "lock_cond_count",
+        "lock_cond_failed_count",
+        "wait_lock_count",
+        "lock_wait_time_ns",
+        "requested_locks",
+    )
+
     def __init__(self) -> None:
         # The number of non-waited requested locks
-        self._direct_lock_count = 0
+        self.direct_lock_count = 0
 
         # The number of acquire lock or wait calls
-        self._acquire_or_wait_count = 0
+        self.acquire_or_wait_count = 0
 
         # The number of failed acquire lock or wait calls
-        self._acquire_or_wait_failed_count = 0
+        self.acquire_or_wait_failed_count = 0
 
         # The number of locks with condition
-        self._lock_cond_count = 0
+        self.lock_cond_count = 0
 
         # The number of failed lock with condition
-        self._lock_cond_failed_count = 0
+        self.lock_cond_failed_count = 0
 
         # The number of lock waits
-        self._wait_lock_count = 0
+        self.wait_lock_count = 0
 
         # The total time spend for lock wait requests
-        self._lock_wait_time_ns = 0
-
-        # A list with the requested locks
-        self._requested_locks = []
-
-    @property
-    def direct_lock_count(self):
-        return self._direct_lock_count
-
-    @direct_lock_count.setter
-    def direct_lock_count(self, value):
-        self._direct_lock_count = value
-
-    @property
-    def acquire_or_wait_count(self):
-        return self._acquire_or_wait_count
-
-    @acquire_or_wait_count.setter
-    def acquire_or_wait_count(self, value):
-        self._acquire_or_wait_count = value
-
-    @property
-    def acquire_or_wait_failed_count(self):
-        return self._acquire_or_wait_failed_count
-
-    @acquire_or_wait_failed_count.setter
-    def acquire_or_wait_failed_count(self, value):
-        self._acquire_or_wait_failed_count = value
-
-    @property
-    def wait_lock_count(self):
-        return self._wait_lock_count
-
-    @wait_lock_count.setter
-    def wait_lock_count(self, value):
-        self._wait_lock_count = value
-
-    @property
-    def lock_cond_count(self):
-        return self._lock_cond_count
-
-    @lock_cond_count.setter
-    def lock_cond_count(self, value):
-        self._lock_cond_count = value
-
-    @property
-    def lock_cond_failed_count(self):
-        return self._lock_cond_failed_count
+        self.lock_wait_time_ns = 0
 
-    @lock_cond_failed_count.setter
-    def lock_cond_failed_count(self, value):
-        self._lock_cond_failed_count = value
+        # The number of requested locks per LWLockMode
+        self.requested_locks = ModeCounters(len(LWLockMode))
 
-    @property
-    def lock_wait_time_ns(self):
-        return self._lock_wait_time_ns
-
-    @lock_wait_time_ns.setter
-    def lock_wait_time_ns(self, value):
-        self._lock_wait_time_ns = value
-
-    @property
-    def requested_locks(self):
-        return self._requested_locks
-
-    @requested_locks.setter
-    def requested_locks(self, lock_type):
-        self._requested_locks.append(lock_type)
+    def merge(self, other):
+        """
+        Add the statistics of another entry (e.g., of another run)
+        """
+        self.direct_lock_count += other.direct_lock_count
+        self.acquire_or_wait_count += other.acquire_or_wait_count
+        self.acquire_or_wait_failed_count += other.acquire_or_wait_failed_count
+        self.lock_cond_count += other.lock_cond_count
+        self.lock_cond_failed_count += other.lock_cond_failed_count
+        self.wait_lock_count += other.wait_lock_count
+        self.lock_wait_time_ns += other.lock_wait_time_ns
+        self.requested_locks.merge(other.requested_locks)
 
 
 class PGLWLockTracer:
@@ -181,11 +249,64 @@ class PGLWLockTracer:
         self.usdts = None
         self.prog_args = prog_args
         self.statistics = {}
+        self.startup_timer = StartupTimer()
+
+        # The lock statistics per time window
+        self.window_statistics = WindowedStatistics.from_args(
+            prog_args, ("tranche",), (*WINDOW_COUNTERS.values(), "wait_time_ns")
+        )
 
-        # Variables for lock timing
-        self.last_lock_request_time = {}
+        # The top view aggregates the lock waits in the kernel
+        self.top_view = None
+        if prog_args.top:
+            self.top_view = TopView(prog_args.top_interval, prog_args.top_rows)
 
-    def update_statistics(self, event, tranche, lock_mode):
+        if prog_args.statistics_only and (
+            prog_args.top or prog_args.window_statistics is not None
+        ):
+            raise ValueError(
+                "--statistics-only can not be combined with --top or the window statistics"
+            )
+
+        # The resolved tranche names (Key = address of the name)
+        self.tranche_names = {}
+
+        # The tranche names and partitions of the uprobe mode
+        self.lwlock_tranches = None
+
+        if prog_args.path is None:
+            if not prog_args.pids:
+                raise ValueError(
+                    "The pids (-p) or the binary (-x) of the traced processes are required"
+                )
+
+            if prog_args.uprobes:
+                raise ValueError("The uprobe mode (--uprobes) requires the binary (-x)")
+        else:
+            # Belong the processes to the binary?
+            BPFHelper.check_pid_exe(prog_args.pids, prog_args.path)
+
+        if prog_args.buffer_pages and not prog_args.uprobes:
+            raise ValueError("--buffer-pages requires the uprobe mode (--uprobes)")
+
+        # The waits are paired by the USDT probes
+        if prog_args.off_cpu and prog_args.uprobes:
+            raise ValueError("--off-cpu can not be combined with the uprobe mode")
+
+        if prog_args.uprobes:
+            if prog_args.top or prog_args.window_statistics is not None:
+                raise ValueError(
+                    "The uprobe mode (--uprobes) can not be combined with --top or "
+                    "the window statistics"
+                )
+
+            if prog_args.instance_rows < 1:
+                raise ValueError(
+                    f"Instance rows has to be positive ({prog_args.instance_rows} "
+                    "was provided)"
+                )
+
+    def update_statistics(self, event, tranche):
         """
         Update the statistics
         """
@@ -195,57 +316,83 @@ class PGLWLockTracer:
 
         statistics_entry = self.statistics.get(tranche)
 
+        if self.window_statistics is not None:
+            self.update_window_statistics(event, tranche)
+
         # Lock directly requested
         if event.event_type == Events.LOCK:
             statistics_entry.direct_lock_count += 1
-            statistics_entry.requested_locks = lock_mode
+            statistics_entry.requested_locks.add(event.mode)
             return
 
         # LWLockAcquireOrWait - Acquired
         if event.event_type == Events.LOCK_OR_WAIT:
             statistics_entry.acquire_or_wait_count += 1
-            statistics_entry.requested_locks = lock_mode
+            statistics_entry.requested_locks.add(event.mode)
             return
 
         # LWLockAcquireOrWait - Waited
         if event.event_type == Events.LOCK_OR_WAIT_FAIL:
             statistics_entry.acquire_or_wait_failed_count += 1
-            statistics_entry.requested_locks = lock_mode
+            statistics_entry.requested_locks.add(event.mode)
             return
 
         # Wait for lock
         if event.event_type == Events.WAIT_START:
             statistics_entry.wait_lock_count += 1
-            self.last_lock_request_time[event.pid] = event.timestamp
             return
 
         # Wait for lock done
         if event.event_type == Events.WAIT_DONE:
-            wait_time = self.get_lock_wait_time(event)
-            statistics_entry.lock_wait_time_ns += wait_time
+            statistics_entry.lock_wait_time_ns += event.wait_ns
             return
 
         # LWLockConditionalAcquire - Acquire with condition
         if event.event_type == Events.COND_ACQUIRE:
             statistics_entry.lock_cond_count += 1
-            statistics_entry.requested_locks = lock_mode
+            statistics_entry.requested_locks.add(event.mode)
             return
 
         # LWLockConditionalAcquire - Condition not possible
         if event.event_type == Events.COND_ACQUIRE_FAIL:
             statistics_entry.lock_cond_failed_count += 1
-            statistics_entry.requested_locks = lock_mode
+            statistics_entry.requested_locks.add(event.mode)
             return
 
-    def get_lock_wait_time(self, event):
+    def update_window_statistics(self, event, tranche):
         """
-        Get the last lock wait time (WAIT_START updates
-        last_lock_request_time).
+        Update the statistics of the current time window
         """
-        if event.event_type != Events.WAIT_DONE:
-            return None
+        counter = WINDOW_COUNTERS.get(event.event_type)
 
-        return event.timestamp - self.last_lock_request_time[event.pid]
+        if counter is not None:
+            self.window_statistics.add(event.timestamp, tranche, counter)
+
+        if event.event_type == Events.WAIT_DONE:
+            self.window_statistics.add(
+                event.timestamp, tranche, "wait_time_ns", event.wait_ns
+            )
+
+    def get_tranche_name(self, tranche_addr):
+        """
+        Get the name of the tranche at the given address. The name is
+        read from the BPF map once and cached.
+        """
+        name = self.tranche_names.get(tranche_addr)
+
+        if name is None:
+            tranche_names = self.bpf_instance["tranche_names"]
+
+            try:
+                value = tranche_names[tranche_names.Key(tranche_addr)]
+            except KeyError:
+                # The map is full, the name is unknown
+                return f"0x{tranche_addr:x}"
+
+            name = value.name.decode("utf-8")
+            self.tranche_names[tranche_addr] = name
+
+        return name
 
     def print_lock_event(self, _cpu, data, _size):
         """
@@ -256,12 +403,12 @@ class PGLWLockTracer:
         b LWLockAcquireOrWait
         """
         event = self.bpf_instance["lockevents"].event(data)
-        tranche = event.tranche.decode("utf-8")
+        tranche = self.get_tranche_name(event.tranche)
 
         print_prefix = f"{event.timestamp} [Pid {event.pid}]"
         lock_mode = LWLockMode(event.mode).name
 
-        self.update_statistics(event, tranche, lock_mode)
+        self.update_statistics(event, tranche)
 
         if event.event_type == Events.LOCK:
             print(
@@ -282,8 +429,7 @@ class PGLWLockTracer:
         elif event.event_type == Events.WAIT_START:
             print(f"{print_prefix} Wait for {tranche}")
         elif event.event_type == Events.WAIT_DONE:
-            lock_time = self.get_lock_wait_time(event)
-            print(f"{print_prefix} Wait for {tranche} lock took {lock_time} ns")
+            print(f"{print_prefix} Wait for {tranche} lock took {event.wait_ns} ns")
         elif event.event_type == Events.COND_ACQUIRE:
             print(
                 f"{print_prefix} Acquired lock {tranche} (mode {lock_mode}) "
@@ -301,31 +447,17 @@ class PGLWLockTracer:
         """
         Compile and load the BPF program
         """
-        print(f"==> Attaching to PIDs {self.prog_args.pids}")
-        self.usdts = list(map(lambda pid: USDT(pid=pid), self.prog_args.pids))
-
-        # See https://www.postgresql.org/docs/15/dynamic-trace.html
-        for usdt in self.usdts:
-            usdt.enable_probe("lwlock__acquire", "lwlock_acquire")
-            usdt.enable_probe("lwlock__acquire__or__wait", "lwlock_acquire_or_wait")
-            usdt.enable_probe(
-                "lwlock__acquire__or__wait__fail", "lwlock_acquire_or_wait_fail"
-            )
-            usdt.enable_probe("lwlock__release", "lwlock_release")
-            usdt.enable_probe("lwlock__wait__start", "lwlock_wait_start")
-            usdt.enable_probe("lwlock__wait__done", "lwlock_wait_done")
-            usdt.enable_probe("lwlock__condacquire", "lwlock_condacquire")
-            usdt.enable_probe("lwlock__condacquire__fail", "lwlock_condacquire_fail")
+        if self.prog_args.uprobes:
+            self.usdts = []
+        else:
+            self.usdts = self.get_usdt_contexts()
 
         if self.prog_args.verbose:
             print("=======")
             print("\n".join(map(lambda u: u.get_text(), self.usdts)))
             print("=======")
 
-        enum_defines = BPFHelper.enum_to_defines(Events, "EVENT")
-
-        bpf_program = BPFHelper.read_bpf_program("pg_lw_lock_tracer.c")
-        bpf_program_final = bpf_program.replace("__DEFINES__", enum_defines)
+        bpf_program_final = self.get_bpf_program()
 
         if self.prog_args.verbose:
             print(bpf_program_final)
@@ -335,20 +467,351 @@ class PGLWLockTracer:
         bpf_cflags = ["-Wno-macro-redefined"] if not self.prog_args.verbose else []
 
         print("===> Compiling BPF program")
-        self.bpf_instance = BPF(
-            text=bpf_program_final, cflags=bpf_cflags, usdt_contexts=self.usdts
+        with self.startup_timer.measure("Compile BPF program"):
+            bpf_instance = BPF(
+                text=bpf_program_final, cflags=bpf_cflags, usdt_contexts=self.usdts
+            )
+
+        self.setup(bpf_instance)
+
+    def get_usdt_contexts(self, fn_prefix=""):
+        """
+        Enable the USDT probes of the traced processes. The names of the
+        BPF functions get the given prefix. With a binary, the probes are
+        enabled once for all processes of the binary.
+        """
+        with self.startup_timer.measure("Enable USDT probes"):
+            if self.prog_args.path is not None:
+                print(f"==> Attaching to binary {self.prog_args.path}")
+                usdts = [USDT(path=self.prog_args.path)]
+            else:
+                print(f"==> Attaching to PIDs {self.prog_args.pids}")
+                usdts = list(map(lambda pid: USDT(pid=pid), self.prog_args.pids))
+
+            # See https://www.postgresql.org/docs/15/dynamic-trace.html
+            for usdt in usdts:
+                for probe, bpf_fn_name in USDT_PROBES:
+                    usdt.enable_probe(probe, fn_prefix + bpf_fn_name)
+
+        return usdts
+
+    def get_bpf_program(self):
+        """
+        Generate the BPF program of the tracer
+        """
+        enum_defines = BPFHelper.enum_to_defines(Events, "EVENT")
+
+        if self.top_view is not None:
+            enum_defines += "#define TOP_VIEW\n"
+
+        # The probes of the binary see all processes
+        if self.prog_args.path is not None and self.prog_args.pids:
+            enum_defines += "#define PID_FILTER\n"
+
+        if self.prog_args.uprobes:
+            enum_defines += "#define LWLOCK_UPROBES\n"
+
+            # The content locks are located by the offset in the BufferDesc
+            if self.prog_args.buffer_pages:
+                enum_defines += "#define BUFFER_PAGES\n"
+                enum_defines += offsets_to_defines(
+                    get_struct_offsets(self.prog_args.path, self.prog_args.verbose)
+                )
+        elif self.prog_args.statistics or self.prog_args.statistics_only:
+            # The wait times are aggregated in histograms in the kernel
+            enum_defines += "#define WAIT_HISTOGRAMS\n"
+
+        if self.prog_args.statistics_only:
+            enum_defines += "#define STATISTICS_ONLY\n"
+
+        if self.prog_args.off_cpu:
+            enum_defines += "#define OFF_CPU\n"
+
+        bpf_program = BPFHelper.read_bpf_program("pg_lw_lock_tracer.c")
+        bpf_program = BPFHelper.insert_off_cpu_program(
+            bpf_program, self.prog_args.off_cpu
         )
+        return bpf_program.replace("__DEFINES__", enum_defines)
+
+    def setup(self, bpf_instance):
+        """
+        Open the event queue of the compiled BPF program
+        """
+        self.bpf_instance = bpf_instance
+
+        if self.prog_args.path is not None and self.prog_args.pids:
+            traced_pids = self.bpf_instance["traced_pids"]
+            for pid in self.prog_args.pids:
+                traced_pids[traced_pids.Key(pid)] = traced_pids.Leaf(1)
+
+        if self.prog_args.uprobes:
+            print("===> Attaching BPF probes")
+            with self.startup_timer.measure("Attach probes"):
+                self.attach_probes()
+
+            # The processes are alive (the load address of the binary is known)
+            symbols = BPFHelper.get_symbol_index(self.prog_args.path)
+            self.lwlock_tranches = LWLockTranches.for_processes(
+                symbols,
+                self.prog_args.pids or BPFHelper.get_exe_pids(self.prog_args.path),
+            )
+
+            if self.prog_args.buffer_pages:
+                self.set_buffer_descriptors()
+
+        if self.prog_args.off_cpu:
+            BPFHelper.attach_off_cpu_tracepoints(
+                self.bpf_instance, self.prog_args.verbose
+            )
 
         self.bpf_instance["lockevents"].open_perf_buffer(
             self.print_lock_event, page_cnt=BPFHelper.page_cnt
         )
 
+    def set_buffer_descriptors(self):
+        """
+        Store the location of the buffer descriptors in the BPF map
+        """
+        address, count = self.lwlock_tranches.read_buffer_descriptors()
+
+        if address is None:
+            raise ValueError(
+                "Unable to read the buffer descriptors (BufferDescriptors and "
+                f"NBuffers) of the processes of {self.prog_args.path}"
+            )
+
+        if self.prog_args.verbose:
+            print(f"Buffer descriptors at 0x{address:x} ({count} buffers)")
+
+        buffer_descriptors = self.bpf_instance["buffer_descriptors"]
+        leaf = buffer_descriptors[0]
+        leaf.address = address
+        leaf.count = count
+        buffer_descriptors[0] = leaf
+
+    def attach_probes(self):
+        """
+        Attach the uprobes to the LWLock functions of the binary
+        """
+        for function, bpf_fn_name in UPROBE_FUNCTIONS:
+            BPFHelper.register_ebpf_probe(
+                self.prog_args.path,
+                self.bpf_instance,
+                f"^{function}$",
+                bpf_fn_name,
+                self.prog_args.verbose,
+            )
+            BPFHelper.register_ebpf_probe(
+                self.prog_args.path,
+                self.bpf_instance,
+                f"^{function}$",
+                "lwlock_call_return",
+                self.prog_args.verbose,
+                False,
+            )
+
+        BPFHelper.register_ebpf_probe(
+            self.prog_args.path,
+            self.bpf_instance,
+            "^LWLockRelease$",
+            "lwlock_release",
+            self.prog_args.verbose,
+        )
+
+    def get_wait_histograms(self):
+        """
+        Get the wait times that are aggregated in the kernel. Key =
+        (tranche, mode), Value = DurationStatistics
+        """
+        wait_histograms = {}
+
+        for key, value in self.bpf_instance["wait_histograms"].items():
+            # Several addresses can have the same name (e.g., of several clusters)
+            wait_key = (self.get_tranche_name(key.tranche), key.mode)
+
+            if wait_key not in wait_histograms:
+                wait_histograms[wait_key] = DurationStatistics()
+
+            wait_histograms[wait_key].add(key.bucket, value.waits, value.wait_ns)
+
+        return wait_histograms
+
+    def print_wait_histograms(self):
+        """
+        Print the wait times per tranche and mode
+        """
+        print("\nWait time per tranche and mode")
+        table = PrettyTable(
+            [
+                "Tranche",
+                "Mode",
+                "Waits",
+                "Wait time (ns)",
+                "Avg (ns)",
+                "p50 (ns)",
+                "p90 (ns)",
+                "p99 (ns)",
+            ]
+        )
+
+        wait_histograms = self.get_wait_histograms()
+        for tranche, mode in sorted(wait_histograms):
+            waits = wait_histograms[(tranche, mode)]
+            table.add_row(
+                [
+                    tranche,
+                    LWLockMode(mode).name,
+                    waits.count,
+                    waits.total_ns,
+                    f"{waits.average():.0f}",
+                    waits.histogram.percentile(50),
+                    waits.histogram.percentile(90),
+                    waits.histogram.percentile(99),
+                ]
+            )
+
+        print(table)
+
+    def get_instance_name(self, lock, tranche_id):
+        """
+        Get the tranche name and the instance of a lock (uprobe mode). The
+        instance is the partition for the locks of the main array and the
+        address otherwise.
+        """
+        tranche = self.lwlock_tranches.get_name(tranche_id)
+        partition = self.lwlock_tranches.get_partition(lock, tranche_id)
+
+        if partition is None:
+            return (tranche, f"0x{lock:x}")
+
+        return (tranche, str(partition))
+
+    def print_lock_instances(self):
+        """
+        Print the waits and hold times per lock instance (uprobe mode)
+        """
+        instances = sorted(
+            self.bpf_instance["lock_instances"].items(),
+            key=lambda item: (
+                item[1].wait_ns + item[1].var_wait_ns,
+                item[1].acquires + item[1].cond_acquires,
+            ),
+            reverse=True,
+        )
+
+        print(f"\nLock instances (top {self.prog_args.instance_rows} by wait time)")
+        table = PrettyTable(
+            [
+                "Tranche",
+                "Instance",
+                "Acquired",
+                "Waits",
+                "Wait time (ns)",
+                "Max wait (ns)",
+                "ConditionalAcquire (Acquired)",
+                "ConditionalAcquire (Failed)",
+                "Hold time (ns)",
+                "Avg hold (ns)",
+                "Max hold (ns)",
+                "WaitForVar",
+                "WaitForVar time (ns)",
+            ]
+        )
+
+        for key, value in instances[: self.prog_args.instance_rows]:
+            average_hold = value.hold_ns / value.holds if value.holds else 0
+            table.add_row(
+                [
+                    *self.get_instance_name(key.value, value.tranche_id),
+                    value.acquires,
+                    value.waits,
+                    value.wait_ns,
+                    value.wait_max_ns,
+                    value.cond_acquires,
+                    value.cond_fails,
+                    value.hold_ns,
+                    f"{average_hold:.0f}",
+                    value.hold_max_ns,
+                    value.var_waits,
+                    value.var_wait_ns,
+                ]
+            )
+
+        print(table)
+
+        if self.prog_args.buffer_pages:
+            self.print_buffer_pages()
+
+        dropped = self.bpf_instance["dropped_events"][0].value
+        if dropped:
+            print(f"{dropped} calls could not be aggregated (a BPF map is full)")
+
+    def print_buffer_pages(self):
+        """
+        Print the pages with the highest wait time for the content locks
+        """
+        pages = sorted(
+            self.bpf_instance["buffer_pages"].items(),
+            key=lambda item: (item[1].wait_ns, item[1].waits),
+            reverse=True,
+        )
+
+        print(f"\nBuffer pages (top {self.prog_args.instance_rows} by wait time)")
+        table = PrettyTable(
+            [
+                "Relation (spc/db/relfilenode)",
+                "Fork",
+                "Block",
+                "Waits",
+                "Wait time (ns)",
+                "Avg wait (ns)",
+                "Max wait (ns)",
+            ]
+        )
+
+        for key, value in pages[: self.prog_args.instance_rows]:
+            table.add_row(
+                [
+                    f"{key.spc}/{key.db}/{key.rel}",
+                    FORK_NAMES.get(key.fork, key.fork),
+                    key.block,
+                    value.waits,
+                    value.wait_ns,
+                    f"{value.wait_ns / value.waits:.0f}",
+                    value.wait_max_ns,
+                ]
+            )
+
+        print(table)
+
+    def print_off_cpu_statistics(self):
+        """
+        Print the off-CPU time of the waits that is aggregated in the kernel
+        """
+        off_cpu_statistics = OffCpuStatistics()
+
+        for key, value in self.bpf_instance["off_cpu_times"].items():
+            off_cpu_statistics.add(key, value)
+
+        off_cpu_statistics.print_statistics(
+            lambda _cluster, tranche: self.get_tranche_name(tranche)
+        )
+
     def print_statistics(self):
         """
         Print lock statistics
         """
         print("\nLock statistics:\n================")
 
+        if self.prog_args.uprobes:
+            self.print_lock_instances()
+            return
+
+        # Only the wait times are aggregated without events
+        if self.prog_args.statistics_only:
+            self.print_wait_histograms()
+            return
+
         # Tranche lock statistics
         print("\nLocks per tranche")
         table = PrettyTable(
@@ -385,31 +848,143 @@ class PGLWLockTracer:
         print("\nLocks per type")
         table = PrettyTable(["Lock type", "Requests"])
 
-        # Map: Key = Lock type, Value = Number of requested locks
-        requested_locks = {}
-
+        requested_locks = ModeCounters(len(LWLockMode))
         for statistics in self.statistics.values():
-            for lock_type in statistics.requested_locks:
-                locks = requested_locks.get(lock_type, 0) + 1
-                requested_locks[lock_type] = locks
+            requested_locks.merge(statistics.requested_locks)
 
-        for lock_type in sorted(requested_locks):
-            locks = requested_locks[lock_type]
-            table.add_row([lock_type, locks])
+        for lock_type, locks in requested_locks.items():
+            table.add_row([LWLockMode(lock_type).name, locks])
 
         print(table)
 
+        self.print_wait_histograms()
+
+    def refresh_top(self, now_ns):
+        """
+        Read the aggregated BPF maps and print the top view
+        """
+        top_view = self.top_view
+
+        # Event rate
+        event_counts = {
+            Events(key.value).name: value.value
+            for key, value in self.bpf_instance["event_counts"].items()
+        }
+        event_deltas = top_view.get_deltas("events", event_counts)
+        dropped = self.bpf_instance["dropped_events"][0].value
+        dropped_delta = top_view.get_deltas("dropped", {"dropped": dropped})["dropped"]
+
+        title = (
+            f"pg_lw_lock_tracer - {time.strftime('%H:%M:%S')} - "
+            f"{top_view.get_rate(sum(event_deltas.values())):.0f} events/s, "
+            f"{sum(event_counts.values())} events, "
+            f"{dropped} dropped ({top_view.get_rate(dropped_delta):.0f}/s)"
+        )
+
+        # Tranches with the highest wait time in the last interval
+        tranche_waits = {}
+        tranche_counts = {}
+        tranche_max = {}
+        for key, value in self.bpf_instance["tranche_waits"].items():
+            # Several addresses can have the same name (e.g., of several clusters)
+            tranche = self.get_tranche_name(key.value)
+            tranche_waits[tranche] = tranche_waits.get(tranche, 0) + value.wait_ns
+            tranche_counts[tranche] = tranche_counts.get(tranche, 0) + value.waits
+            tranche_max[tranche] = max(tranche_max.get(tranche, 0), value.wait_max_ns)
+
+        wait_deltas = top_view.get_deltas("wait_ns", tranche_waits)
+        count_deltas = top_view.get_deltas("waits", tranche_counts)
+
+        tranches = PrettyTable(
+            [
+                "Tranche",
+                "Waits/s",
+                "Wait Time (ms/s)",
+                "Total Waits",
+                "Total Wait Time (ms)",
+                "Max Wait Time (ms)",
+            ]
+        )
+        hottest = sorted(
+            tranche_waits,
+            key=lambda tranche: (wait_deltas[tranche], tranche_waits[tranche]),
+            reverse=True,
+        )
+
+        for tranche in hottest[: top_view.rows]:
+            tranches.add_row(
+                [
+                    tranche,
+                    f"{top_view.get_rate(count_deltas[tranche]):.0f}",
+                    f"{top_view.get_rate(wait_deltas[tranche]) / 1_000_000:.3f}",
+                    tranche_counts[tranche],
+                    f"{tranche_waits[tranche] / 1_000_000:.3f}",
+                    f"{tranche_max[tranche] / 1_000_000:.3f}",
+                ]
+            )
+
+        # Backends that wait for a LW lock
+        backends = PrettyTable(["Pid", "Tranche", "Mode", "Waiting (ms)"])
+        waits = sorted(
+            self.bpf_instance["lock_waits"].items(), key=lambda item: item[1].start
+        )
+
+        for key, value in waits[: top_view.rows]:
+            backends.add_row(
+                [
+                    key.value,
+                    self.get_tranche_name(value.tranche),
+                    LWLockMode(value.mode).name,
+                    f"{max(0, now_ns - value.start) / 1_000_000:.3f}",
+                ]
+            )
+
+        top_view.render(
+            title,
+            [
+                ("Tranches by wait time", tranches),
+                ("Waiting backends", backends),
+            ],
+        )
+
     def run(self):
         """
         Run the BPF program and read results
         """
-        print("===> Ready to trace")
+        if self.top_view is not None:
+            self.top_view.run(self.refresh_top)
+
+            if self.prog_args.off_cpu:
+                self.print_off_cpu_statistics()
+            return
+
+        poll_timeout = -1
+
+        # Write the closed statistics windows on SIGUSR1
+        if self.window_statistics is not None:
+            signal.signal(signal.SIGUSR1, self.window_statistics.request_report)
+            poll_timeout = self.window_statistics.poll_timeout
+
+        # Without events, the statistics are printed on exit
+        statistics_only = self.prog_args.statistics_only or self.prog_args.uprobes
+
+        if statistics_only:
+            print("===> Collecting statistics (press Ctrl+C to print them)")
+        else:
+            print("===> Ready to trace")
         while True:
             try:
-                self.bpf_instance.perf_buffer_poll()
+                self.bpf_instance.perf_buffer_poll(timeout=poll_timeout)
+
+                if self.window_statistics is not None:
+                    self.window_statistics.poll()
             except KeyboardInterrupt:
-                if self.prog_args.statistics:
+                if self.window_statistics is not None:
+                    self.window_statistics.close()
+                if self.prog_args.statistics or statistics_only:
                     self.print_statistics()
+                if self.prog_args.off_cpu:
+                    self.print_off_cpu_statistics()
                 sys.exit(0)
 
 
@@ -422,6 +997,9 @@ def main():
     pg_lock_tracer = PGLWLockTracer(args)
     pg_lock_tracer.init()
 
+    if args.dry_run and args.verbose:
+        pg_lock_tracer.startup_timer.print_breakdown()
+
     if not args.dry_run:
         pg_lock_tracer.run()
 
@@ -7,6 +7,7 @@
 ###############################################
 
 import sys
+import signal
 import argparse
 
 from enum import IntEnum, unique
@@ -15,7 +16,9 @@ from bcc import BPF
 from prettytable import PrettyTable
 
 from pg_lock_tracer import __version__
-from pg_lock_tracer.helper import BPFHelper
+from pg_lock_tracer.helper import BPFHelper, StartupTimer
+from pg_lock_tracer.struct_offsets import get_struct_offsets, offsets_to_defines
+from pg_lock_tracer.window_statistics import WindowedStatistics, add_window_arguments
 
 EXAMPLES = """examples:
 # Trace the row locks of the given PostgreSQL binary
@@ -32,6 +35,9 @@ pg_row_lock_tracer -p 1234 -x /home/jan/postgresql-sandbox/bin/REL_14_9_DEBUG/bi
 
 # Trace the row locks and show statistics
 pg_row_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_14_9_DEBUG/bin/postgres --statistics
+
+# Collect the statistics in windows of 10 seconds and write them as JSON on SIGUSR1 and exit
+pg_row_lock_tracer -x /home/jan/postgresql-sandbox/bin/REL_14_9_DEBUG/bin/postgres --window-statistics 10
 """
 
 parser = argparse.ArgumentParser(
@@ -71,6 +77,7 @@ parser.add_argument(
     help="compile and load the BPF program but exit afterward",
 )
 parser.add_argument("--statistics", action="store_true", help="print lock statistics")
+add_window_arguments(parser)
 
 
 @unique
@@ -149,6 +156,18 @@ class PGRowLockTracer:
         self.bpf_instance = None
         self.args = prog_args
         self.statistics = {}
+        self.startup_timer = StartupTimer()
+
+        # The lock statistics per time window (counters of the modes, policies, and results)
+        self.window_statistics = WindowedStatistics.from_args(
+            self.args,
+            ("pid",),
+            [
+                value.name.lower()
+                for values in (LockTupleMode, LockWaitPolicy, TMResult)
+                for value in values
+            ],
+        )
 
         # Variables for lock timing
         self.last_lock_request_time = {}
@@ -191,6 +210,7 @@ class PGRowLockTracer:
             else:
                 statistics_entry.lock_modes[lock_tuple_mode] = 1
 
+            self.update_window_statistics(event, lock_wait_policy, lock_tuple_mode)
             return
 
         # Lock request done
@@ -201,10 +221,22 @@ class PGRowLockTracer:
                 statistics_entry.lock_results[lock_result] += 1
             else:
                 statistics_entry.lock_results[lock_result] = 1
+
+            self.update_window_statistics(event, lock_result)
             return
 
         return
 
+    def update_window_statistics(self, event, *values):
+        """
+        Count the given lock modes, policies, or results in the current time window
+        """
+        if self.window_statistics is None:
+            return
+
+        for value in values:
+            self.window_statistics.add(event.timestamp, event.pid, value.name.lower())
+
     def print_lock_event(self, _cpu, data, _size):
         """
         Print a new lock event.
@@ -241,10 +273,7 @@ class PGRowLockTracer:
         """
         Init the PostgreSQL lock tracer
         """
-        enum_defines = BPFHelper.enum_to_defines(Events, "EVENT")
-
-        bpf_program = BPFHelper.read_bpf_program("pg_row_lock_tracer.c")
-        bpf_program_final = bpf_program.replace("__DEFINES__", enum_defines)
+        bpf_program_final = self.get_bpf_program()
 
         if self.args.verbose:
             print(bpf_program_final)
@@ -254,10 +283,34 @@ class PGRowLockTracer:
         bpf_cflags = ["-Wno-macro-redefined"] if not self.args.verbose else []
 
         print("===> Compiling BPF program")
-        self.bpf_instance = BPF(text=bpf_program_final, cflags=bpf_cflags)
+        with self.startup_timer.measure("Compile BPF program"):
+            bpf_instance = BPF(text=bpf_program_final, cflags=bpf_cflags)
+
+        self.setup(bpf_instance)
+
+    def get_bpf_program(self):
+        """
+        Generate the BPF program of the traced binary
+        """
+        with self.startup_timer.measure("Generate program"):
+            enum_defines = BPFHelper.enum_to_defines(Events, "EVENT")
+
+            # The struct offsets of the traced binary
+            offsets = get_struct_offsets(self.args.path, self.args.verbose)
+            defines = enum_defines + offsets_to_defines(offsets)
+
+            bpf_program = BPFHelper.read_bpf_program("pg_row_lock_tracer.c")
+            return bpf_program.replace("__DEFINES__", defines)
+
+    def setup(self, bpf_instance):
+        """
+        Attach the probes of the compiled BPF program and open the event queue
+        """
+        self.bpf_instance = bpf_instance
 
         print("===> Attaching BPF probes")
-        self.attach_probes()
+        with self.startup_timer.measure("Attach probes"):
+            self.attach_probes()
 
         # Open the event queue
         self.bpf_instance["lockevents"].open_perf_buffer(
@@ -345,11 +398,23 @@ class PGRowLockTracer:
         """
         Run the BPF program and read results
         """
+        poll_timeout = -1
+
+        # Write the closed statistics windows on SIGUSR1
+        if self.window_statistics is not None:
+            signal.signal(signal.SIGUSR1, self.window_statistics.request_report)
+            poll_timeout = self.window_statistics.poll_timeout
+
         print("===> Ready to trace")
         while True:
             try:
-                self.bpf_instance.perf_buffer_poll()
+                self.bpf_instance.perf_buffer_poll(timeout=poll_timeout)
+
+                if self.window_statistics is not None:
+                    self.window_statistics.poll()
             except KeyboardInterrupt:
+                if self.window_statistics is not None:
+                    self.window_statistics.close()
                 if self.args.statistics:
                     self.print_statistics()
                 sys.exit(0)
@@ -364,6 +429,9 @@ def main():
     pg_lock_tracer = PGRowLockTracer(args)
     pg_lock_tracer.init()
 
+    if args.dry_run and args.verbose:
+        pg_lock_tracer.startup_timer.print_breakdown()
+
     if not args.dry_run:
         pg_lock_tracer.run()
 
@@ -10,7 +10,7 @@ import argparse
 from bcc import BPF
 
 from pg_lock_tracer import __version__
-from pg_lock_tracer.helper import BPFHelper
+from pg_lock_tracer.helper import BPFHelper, StartupTimer
 
 EXAMPLES = """examples:
 # Trace spin delays of the given PostgreSQL binary
@@ -68,6 +68,7 @@ class PGSpinDelayTracer:
     def __init__(self, prog_args):
         self.bpf_instance = None
         self.args = prog_args
+        self.startup_timer = StartupTimer()
 
         # Belong the processes to the binary?
         BPFHelper.check_pid_exe(self.args.pids, self.args.path)
@@ -98,7 +99,7 @@ class PGSpinDelayTracer:
         """
         Init the PostgreSQL spin delay tracer
         """
-        bpf_program = BPFHelper.read_bpf_program("pg_spinlock_delay_tracer.c")
+        bpf_program = self.get_bpf_program()
 
         if self.args.verbose:
             print(bpf_program)
@@ -108,10 +109,27 @@ class PGSpinDelayTracer:
         bpf_cflags = ["-Wno-macro-redefined"] if not self.args.verbose else []
 
         print("===> Compiling BPF program")
-        self.bpf_instance = BPF(text=bpf_program, cflags=bpf_cflags)
+        with self.startup_timer.measure("Compile BPF program"):
+            bpf_instance = BPF(text=bpf_program, cflags=bpf_cflags)
+
+        self.setup(bpf_instance)
+
+    @staticmethod
+    def get_bpf_program():
+        """
+        Get the BPF program of the tracer
+        """
+        return BPFHelper.read_bpf_program("pg_spinlock_delay_tracer.c")
+
+    def setup(self, bpf_instance):
+        """
+        Attach the probes of the compiled BPF program and open the event queue
+        """
+        self.bpf_instance = bpf_instance
 
         print("===> Attaching BPF probes")
-        self.attach_probes()
+        with self.startup_timer.measure("Attach probes"):
+            self.attach_probes()
 
         # Open the event queue
         self.bpf_instance["lockevents"].open_perf_buffer(
@@ -151,6 +169,9 @@ def main():
     pg_spin_delay_tracer = PGSpinDelayTracer(args)
     pg_spin_delay_tracer.init()
 
+    if args.dry_run and args.verbose:
+        pg_spin_delay_tracer.startup_timer.print_breakdown()
+
     if not args.dry_run:
         pg_spin_delay_tracer.run()
 
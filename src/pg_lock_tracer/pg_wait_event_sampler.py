@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+#
+# PostgreSQL wait event sampler
+#
+# A perf timer fires on each CPU at a fixed frequency. Once per sample
+# period, the current wait event and query id of all backends of the
+# traced binary are read from the shared memory (the PGPROC and the
+# PgBackendStatus of each backend) and counted in the kernel. No
+# extension has to be installed.
+###############################################
+
+import sys
+import time
+import argparse
+
+from bcc import BPF, PerfType, PerfSWConfig
+from prettytable import PrettyTable
+
+from pg_lock_tracer import __version__
+from pg_lock_tracer.helper import BPFHelper, StartupTimer
+from pg_lock_tracer.lwlock_tranches import LWLockTranches, ProcessMemory
+from pg_lock_tracer.struct_offsets import get_struct_offsets, offsets_to_defines
+from pg_lock_tracer.top_view import TopView, add_top_arguments
+from pg_lock_tracer.wait_events import (
+    BackendSlots,
+    WaitEventProfile,
+    get_query_id,
+    get_wait_event_name,
+    get_wait_event_type,
+)
+
+EXAMPLES = """examples:
+# Sample the wait events of all processes of the binary at 99 Hz (printed on exit)
+pg_wait_event_sampler -x /usr/lib/postgresql/16/bin/postgres
+
+# Sample the wait events of the PIDs 1234 and 5678 at 499 Hz
+pg_wait_event_sampler -x /usr/lib/postgresql/16/bin/postgres -p 1234 -p 5678 -F 499
+
+# Show the sampled wait events and queries of the last interval (refreshed every second)
+pg_wait_event_sampler -x /usr/lib/postgresql/16/bin/postgres --top
+"""
+
+parser = argparse.ArgumentParser(
+    description="",
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    epilog=EXAMPLES,
+)
+parser.add_argument(
+    "-V",
+    "--version",
+    action="version",
+    version=f"{parser.prog} ({__version__})",
+)
+parser.add_argument("-v", "--verbose", action="store_true", help="Be verbose")
+parser.add_argument(
+    "-x",
+    "--exe",
+    type=str,
+    required=True,
+    dest="path",
+    metavar="PATH",
+    help="path to binary",
+)
+parser.add_argument(
+    "-p",
+    "--pid",
+    type=int,
+    nargs="+",
+    action="extend",
+    dest="pids",
+    metavar="PID",
+    help="the pid(s) to sample (default: all processes of the binary)",
+)
+parser.add_argument(
+    "-F",
+    "--frequency",
+    type=int,
+    default=99,
+    metavar="HZ",
+    help="sample rounds per second (default 99)",
+)
+parser.add_argument(
+    "--rows",
+    type=int,
+    default=20,
+    metavar="N",
+    help="number of rows per table of the profile (default 20)",
+)
+parser.add_argument(
+    "-d",
+    "--dry-run",
+    action="store_true",
+    help="compile and load the BPF program but exit afterward",
+)
+add_top_arguments(parser)
+
+# The global variables that point to the shared memory of a backend
+WAIT_EVENT_VARIABLE = "my_wait_event_info"
+BACKEND_STATUS_VARIABLE = "MyBEEntry"
+
+# my_wait_event_info points to this variable until the process has a PGPROC
+LOCAL_WAIT_EVENT_VARIABLE = "local_my_wait_event_info"
+
+# The maximal number of sampled processes (the slots of the BPF program)
+MAX_BACKENDS = 1024
+
+# The interval (in seconds) in which new processes of the binary are added
+REFRESH_INTERVAL = 1.0
+
+
+class PGWaitEventSampler:
+    def __init__(self, prog_args):
+        self.bpf_instance = None
+        self.args = prog_args
+        self.startup_timer = StartupTimer()
+
+        if prog_args.frequency <= 0:
+            raise ValueError(
+                f"Sample frequency has to be positive ({prog_args.frequency} was provided)"
+            )
+
+        if prog_args.rows <= 0:
+            raise ValueError(
+                f"Number of rows has to be positive ({prog_args.rows} was provided)"
+            )
+
+        # Belong the processes to the binary?
+        BPFHelper.check_pid_exe(prog_args.pids, prog_args.path)
+
+        # The global variables exist since PostgreSQL 14
+        self.symbols = BPFHelper.get_symbol_index(prog_args.path)
+        for variable in (WAIT_EVENT_VARIABLE, BACKEND_STATUS_VARIABLE):
+            if variable not in self.symbols.objects:
+                raise ValueError(
+                    f"Symbol {variable} not found in {prog_args.path} "
+                    "(PostgreSQL 14 or later is required)"
+                )
+
+        # The sampled processes (Key = pid, Value = load address)
+        self.backends = {}
+
+        # The slots of the sampled processes in the BPF maps
+        self.slots = BackendSlots(MAX_BACKENDS)
+
+        # The struct offsets of the binary
+        self.offsets = None
+
+        # The time the sampling started (time.monotonic())
+        self.start_time = None
+
+        # The names of the LWLock tranches (read from the sampled processes)
+        self.lwlock_tranches = LWLockTranches(self.symbols, [])
+
+        self.top_view = None
+        if prog_args.top:
+            self.top_view = TopView(prog_args.top_interval, prog_args.top_rows)
+
+    def init(self):
+        """
+        Compile and load the BPF program
+        """
+        bpf_program = self.get_bpf_program()
+
+        if self.args.verbose:
+            print(bpf_program)
+
+        # Disable warnings like
+        # 'warning: '__HAVE_BUILTIN_BSWAP32__' macro redefined [-Wmacro-redefined]'
+        bpf_cflags = ["-Wno-macro-redefined"] if not self.args.verbose else []
+
+        print("===> Compiling BPF program")
+        with self.startup_timer.measure("Compile BPF program"):
+            bpf_instance = BPF(text=bpf_program, cflags=bpf_cflags)
+
+        self.setup(bpf_instance)
+
+    def get_bpf_program(self):
+        """
+        Get the BPF program of the sampler
+        """
+        self.offsets = get_struct_offsets(self.args.path, self.args.verbose)
+        defines = offsets_to_defines(self.offsets)
+        defines += f"#define MAX_BACKENDS {MAX_BACKENDS}\n"
+        defines += f"#define SAMPLE_PERIOD_NS {1_000_000_000 // self.args.frequency}\n"
+
+        bpf_program = BPFHelper.read_bpf_program("pg_wait_event_sampler.c")
+        return bpf_program.replace("__DEFINES__", defines)
+
+    def setup(self, bpf_instance):
+        """
+        Register the sampled processes and attach the perf timer
+        """
+        self.bpf_instance = bpf_instance
+
+        with self.startup_timer.measure("Register processes"):
+            self.refresh_backends()
+
+        print(f"===> Sampling at {self.args.frequency} Hz on each CPU")
+        with self.startup_timer.measure("Attach perf event"):
+            self.bpf_instance.attach_perf_event(
+                ev_type=PerfType.SOFTWARE,
+                ev_config=PerfSWConfig.CPU_CLOCK,
+                fn_name="sample_wait_events",
+                sample_freq=self.args.frequency,
+            )
+
+            # Stop sampling the exiting processes immediately
+            self.bpf_instance.attach_tracepoint(
+                tp="sched:sched_process_exit", fn_name="sampler_process_exit"
+            )
+
+        self.start_time = time.monotonic()
+
+    def read_backend_addresses(self, pid):
+        """
+        Read the addresses of the wait event (in the PGPROC) and of the query
+        id (in the PgBackendStatus) of a process and its cluster (the pid of
+        the postmaster). Returns None if the process has no PGPROC (yet) or
+        has exited.
+        """
+        try:
+            cluster = BPFHelper.get_parent_pid(pid)
+
+            load_address = 0
+            if self.symbols.position_independent:
+                load_address = ProcessMemory.get_load_address(pid, self.args.path)
+
+            memory = ProcessMemory(pid, load_address)
+            wait_event_info = self.lwlock_tranches.read_variable(
+                memory, WAIT_EVENT_VARIABLE
+            )
+            be_entry = self.lwlock_tranches.read_variable(
+                memory, BACKEND_STATUS_VARIABLE
+            )
+        except (OSError, ValueError):
+            # The process has exited
+            return None
+
+        local_wait_event_info = self.symbols.objects.get(LOCAL_WAIT_EVENT_VARIABLE)
+        if not wait_event_info or (
+            local_wait_event_info is not None
+            and wait_event_info == load_address + local_wait_event_info[0]
+        ):
+            return None
+
+        query_id = 0
+        if be_entry:
+            query_id = be_entry + self.offsets["PGBACKENDSTATUS_ST_QUERY_ID"]
+
+        return load_address, wait_event_info, query_id, cluster
+
+    def register_backend(self, pid):
+        """
+        Add a process to a free slot of the BPF maps (or update the
+        addresses of a registered process)
+        """
+        slot = self.slots.find_slot(pid)
+        if slot is None:
+            self.slots.skipped.add(pid)
+            return
+
+        addresses = self.read_backend_addresses(pid)
+        if addresses is None:
+            return
+
+        load_address, wait_event_info, query_id, cluster = addresses
+        if self.args.verbose and pid not in self.backends:
+            print(f"Sampling process {pid}")
+
+        backend_map = self.bpf_instance["backends"]
+        leaf = backend_map.Leaf()
+        leaf.wait_event_info = wait_event_info
+        leaf.query_id = query_id
+        leaf.pid = pid
+        leaf.cluster = cluster
+        backend_map[backend_map.Key(slot)] = leaf
+
+        slot_map = self.bpf_instance["backend_slots"]
+        slot_map[slot_map.Key(pid)] = slot_map.Leaf(slot, cluster)
+
+        self.backends[pid] = load_address
+        self.slots.assign(pid, slot, query_id != 0)
+
+    def unregister_backend(self, pid):
+        """
+        Remove an exited process from the BPF maps
+        """
+        del self.backends[pid]
+        slot = self.slots.release(pid)
+
+        backend_map = self.bpf_instance["backends"]
+        backend_map[backend_map.Key(slot)] = backend_map.Leaf()
+
+        slot_map = self.bpf_instance["backend_slots"]
+        try:
+            del slot_map[slot_map.Key(pid)]
+        except KeyError:
+            pass
+
+    def refresh_backends(self):
+        """
+        Add the new processes of the binary to the BPF maps and remove the
+        exited processes. The processes without a PGPROC are added as soon
+        as they have one.
+        """
+        if self.args.pids:
+            pids = self.args.pids
+        else:
+            pids = BPFHelper.get_exe_pids(self.args.path)
+
+        for pid in set(self.backends) - set(pids):
+            self.unregister_backend(pid)
+
+        self.slots.skipped &= set(pids)
+
+        for pid in pids:
+            if self.slots.needs_refresh(pid):
+                self.register_backend(pid)
+
+        used_slots = self.bpf_instance["used_slots"]
+        used_slots[used_slots.Key(0)] = used_slots.Leaf(self.slots.get_used())
+
+        self.lwlock_tranches.memories = [
+            ProcessMemory(pid, load_address)
+            for pid, load_address in self.backends.items()
+        ]
+
+    def get_rounds(self):
+        """
+        Get the number of sample rounds per cluster (Key = pid of the
+        postmaster)
+        """
+        return {
+            key.value: value.rounds
+            for key, value in self.bpf_instance["cluster_rounds"].items()
+        }
+
+    def get_profile(self):
+        """
+        Get the samples that are aggregated in the kernel
+        """
+        profile = WaitEventProfile(self.args.frequency, self.args.rows)
+
+        # A sample represents the sampled time divided by the rounds of its
+        # cluster (the periods without a round are not sampled)
+        elapsed = time.monotonic() - self.start_time
+        rounds = self.get_rounds()
+
+        for key, value in self.bpf_instance["samples"].items():
+            cluster_rounds = rounds.get(key.cluster)
+            sample_time = elapsed / cluster_rounds if cluster_rounds else None
+            profile.add(key.wait_event_info, key.query_id, value.value, sample_time)
+
+        return profile
+
+    def print_profile(self):
+        """
+        Print the sampled wait events
+        """
+        profile = self.get_profile()
+        profile.print_profile(self.lwlock_tranches.get_name)
+
+        # A round is only taken when a process of the cluster is on a CPU
+        periods = (time.monotonic() - self.start_time) * self.args.frequency
+        print()
+        for cluster, rounds in sorted(self.get_rounds().items()):
+            coverage = min(100.0, rounds * 100 / periods) if periods else 0.0
+            print(
+                f"Postmaster {cluster}: {rounds} sample rounds "
+                f"({coverage:.1f}% of the sample periods)"
+            )
+
+        failed = self.bpf_instance["failed_samples"][0].value
+        if failed:
+            print(f"{failed} samples could not be read")
+
+        if self.slots.skipped:
+            print(
+                f"{len(self.slots.skipped)} processes were not sampled "
+                f"(more than {MAX_BACKENDS} processes)"
+            )
+
+    def refresh_top(self, _now_ns):
+        """
+        Read the samples and print the top view
+        """
+        top_view = self.top_view
+
+        self.refresh_backends()
+
+        profile = self.get_profile()
+        event_deltas = top_view.get_deltas("events", profile.events)
+        query_deltas = top_view.get_deltas("queries", profile.queries)
+        rounds = sum(self.get_rounds().values())
+        rounds_delta = top_view.get_deltas("rounds", {"rounds": rounds})["rounds"]
+
+        title = (
+            f"pg_wait_event_sampler - {time.strftime('%H:%M:%S')} - "
+            f"{len(self.backends)} processes, "
+            f"{top_view.get_rate(sum(event_deltas.values())):.0f} samples/s, "
+            f"{top_view.get_rate(rounds_delta):.0f} rounds/s at {self.args.frequency} Hz"
+        )
+
+        events = PrettyTable(["Wait Event Type", "Wait Event", "Samples/s", "Samples"])
+        hottest = sorted(
+            profile.events,
+            key=lambda event: (event_deltas[event], profile.events[event]),
+            reverse=True,
+        )
+        for wait_event_info in hottest[: top_view.rows]:
+            events.add_row(
+                [
+                    get_wait_event_type(wait_event_info),
+                    get_wait_event_name(wait_event_info, self.lwlock_tranches.get_name),
+                    f"{top_view.get_rate(event_deltas[wait_event_info]):.1f}",
+                    profile.events[wait_event_info],
+                ]
+            )
+
+        queries = PrettyTable(
+            ["Wait Event Type", "Wait Event", "Query Id", "Samples/s", "Samples"]
+        )
+        hottest = sorted(
+            profile.queries,
+            key=lambda query: (query_deltas[query], profile.queries[query]),
+            reverse=True,
+        )
+        for wait_event_info, query_id in hottest[: top_view.rows]:
+            queries.add_row(
+                [
+                    get_wait_event_type(wait_event_info),
+                    get_wait_event_name(wait_event_info, self.lwlock_tranches.get_name),
+                    get_query_id(query_id),
+                    f"{top_view.get_rate(query_deltas[(wait_event_info, query_id)]):.1f}",
+                    profile.queries[(wait_event_info, query_id)],
+                ]
+            )
+
+        top_view.render(
+            title,
+            [
+                ("Wait events by samples", events),
+                ("Queries by samples", queries),
+            ],
+        )
+
+    def run(self):
+        """
+        Collect the samples until the sampler is interrupted
+        """
+        if self.top_view is not None:
+            self.top_view.run(self.refresh_top)
+            self.print_profile()
+            return
+
+        print("===> Sampling (press Ctrl+C to print the profile)")
+        while True:
+            try:
+                time.sleep(REFRESH_INTERVAL)
+
+                # Sample the backends that connect later
+                self.refresh_backends()
+            except KeyboardInterrupt:
+                self.print_profile()
+                sys.exit(0)
+
+
+def main():
+    """
+    Entry point for the BPF based PostgreSQL wait event sampler.
+    """
+    args = parser.parse_args()
+
+    pg_wait_event_sampler = PGWaitEventSampler(args)
+    pg_wait_event_sampler.init()
+
+    if args.dry_run and args.verbose:
+        pg_wait_event_sampler.startup_timer.print_breakdown()
+
+    if not args.dry_run:
+        pg_wait_event_sampler.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Determine the offsets of the PostgreSQL structs that are read by the
+BPF programs. The offsets are extracted from the DWARF debug information
+of the binary (using pyelftools) and cached per ELF build-id. If the
+debug information is not available, the layout of PostgreSQL 14 / 15
+is used.
+"""
+
+import os
+import json
+import struct
+import hashlib
+
+try:
+    from elftools.elf.elffile import ELFFile
+except ImportError:
+    ELFFile = None
+
+# The struct members that are read by the BPF programs. Each entry
+# contains the name of the define, the struct names and member names
+# (the names changed between PostgreSQL versions), and the offset in
+# PostgreSQL 14 / 15.
+STRUCT_MEMBERS = [
+    ("RELATIONDATA_RD_LOCATOR", ("RelationData",), ("rd_locator", "rd_node"), 0),
+    ("RELATIONDATA_RD_ID", ("RelationData",), ("rd_id",), 72),
+    ("LOCK_GRANTMASK", ("LOCK",), ("grantMask",), 16),
+    ("LOCK_WAITMASK", ("LOCK",), ("waitMask",), 20),
+    ("LOCK_WAITPROCS", ("LOCK",), ("waitProcs",), 40),
+    ("LOCK_NREQUESTED", ("LOCK",), ("nRequested",), 104),
+    ("LOCK_NGRANTED", ("LOCK",), ("nGranted",), 148),
+    # The wait queue is a PROC_QUEUE (PostgreSQL < 16) or a dclist_head
+    ("WAIT_QUEUE_SIZE", ("PROC_QUEUE", "dclist_head"), ("size", "count"), 16),
+    ("LOCALLOCKTAG_MODE", ("LOCALLOCKTAG",), ("mode",), 16),
+    ("LOCALLOCK_NLOCKS", ("LOCALLOCK",), ("nLocks",), 40),
+    (
+        "RELFILELOCATOR_SPC",
+        ("RelFileLocator", "RelFileNode"),
+        ("spcOid", "spcNode"),
+        0,
+    ),
+    ("RELFILELOCATOR_DB", ("RelFileLocator", "RelFileNode"), ("dbOid", "dbNode"), 4),
+    (
+        "RELFILELOCATOR_REL",
+        ("RelFileLocator", "RelFileNode"),
+        ("relNumber", "relNode"),
+        8,
+    ),
+    ("BUFFERDESC_CONTENT_LOCK", ("BufferDesc",), ("content_lock",), 36),
+    ("PGBACKENDSTATUS_ST_QUERY_ID", ("PgBackendStatus",), ("st_query_id",), 424),
+]
+
+# Version of the cache file format (increase when STRUCT_MEMBERS changes)
+CACHE_VERSION = 6
+
+# ELF constants
+ELF_MAGIC = b"\x7fELF"
+SHT_NOTE = 7
+NT_GNU_BUILD_ID = 3
+
+# The DWARF 2 operation of the struct member offsets
+DW_OP_PLUS_UCONST = 0x23
+
+
+def get_default_offsets():
+    """
+    Get the offsets of the PostgreSQL 14 / 15 layout
+    """
+    return {name: default for name, _, _, default in STRUCT_MEMBERS}
+
+
+def get_build_id(path):
+    """
+    Get the GNU build-id of an ELF binary (or None if the binary has no build-id)
+    """
+    with open(path, "rb") as elf_file:
+        ident = elf_file.read(16)
+
+        if len(ident) < 16 or not ident.startswith(ELF_MAGIC):
+            raise ValueError(f"{path} is not an ELF binary")
+
+        is_64bit = ident[4] == 2
+        endian = "<" if ident[5] == 1 else ">"
+
+        if is_64bit:
+            header = struct.unpack(endian + "HHIQQQIHHHHHH", elf_file.read(48))
+        else:
+            header = struct.unpack(endian + "HHIIIIIHHHHHH", elf_file.read(36))
+
+        section_offset, section_size, section_count = header[5], header[10], header[11]
+        section_format = endian + ("IIQQQQIIQQ" if is_64bit else "IIIIIIIIII")
+
+        for section in range(section_count):
+            elf_file.seek(section_offset + section * section_size)
+            section_header = struct.unpack(
+                section_format, elf_file.read(struct.calcsize(section_format))
+            )
+
+            if section_header[1] != SHT_NOTE:
+                continue
+
+            elf_file.seek(section_header[4])
+            build_id = parse_build_id_note(elf_file.read(section_header[5]), endian)
+            if build_id:
+                return build_id
+
+    return None
+
+
+def parse_build_id_note(notes, endian):
+    """
+    Parse the notes of a note section and return the GNU build-id (if present)
+    """
+    position = 0
+
+    while position + 12 <= len(notes):
+        name_size, desc_size, note_type = struct.unpack_from(
+            endian + "III", notes, position
+        )
+        position += 12
+        name = notes[position : position + name_size]
+        position += (name_size + 3) & ~3
+        desc = notes[position : position + desc_size]
+        position += (desc_size + 3) & ~3
+
+        if note_type == NT_GNU_BUILD_ID and name.rstrip(b"\0") == b"GNU":
+            return desc.hex()
+
+    return None
+
+
+def get_cache_key(path, build_id):
+    """
+    Get the key of the binary in the cache. The build-id is used if present,
+    otherwise the path, size and modification time of the binary.
+    """
+    if build_id:
+        return build_id
+
+    stat = os.stat(path)
+    file_id = f"{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha256(file_id.encode("utf-8")).hexdigest()
+
+
+def get_cache_directory():
+    """
+    Get the directory for cached offsets
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "pg_lock_tracer")
+
+
+def get_debug_files(path, build_id):
+    """
+    Get the files that may contain the debug information of the binary.
+    The debug information can be stored in a separate file (e.g., provided
+    by a postgresql-debuginfo / -dbgsym package).
+    """
+    debug_files = [path]
+
+    if build_id:
+        debug_files.append(
+            f"/usr/lib/debug/.build-id/{build_id[:2]}/{build_id[2:]}.debug"
+        )
+
+    debug_files.append(f"/usr/lib/debug{os.path.realpath(path)}.debug")
+    return [debug_file for debug_file in debug_files if os.path.isfile(debug_file)]
+
+
+def decode_uleb128(data):
+    """
+    Decode an unsigned LEB128 number that spans all bytes of data (or
+    return None if the data contains something else)
+    """
+    value = 0
+
+    for index, byte in enumerate(data):
+        value |= (byte & 0x7F) << (7 * index)
+
+        if not byte & 0x80:
+            return value if index == len(data) - 1 else None
+
+    return None
+
+
+def get_member_offset(member_die):
+    """
+    Get the offset of a struct member DIE (or None if it is unknown)
+    """
+    location = member_die.attributes.get("DW_AT_data_member_location")
+
+    if location is None:
+        return None
+
+    # DWARF 2 encodes the offset as expression (DW_OP_plus_uconst ULEB128)
+    if isinstance(location.value, list):
+        if not location.value or location.value[0] != DW_OP_PLUS_UCONST:
+            return None
+
+        return decode_uleb128(location.value[1:])
+
+    return location.value
+
+
+def get_struct_name(die):
+    """
+    Get the name of a struct definition DIE (or None if the DIE is no struct definition)
+    """
+    if die.tag != "DW_TAG_structure_type" or "DW_AT_declaration" in die.attributes:
+        return None
+
+    struct_name = die.attributes.get("DW_AT_name")
+    return struct_name.value.decode("utf-8") if struct_name else None
+
+
+def get_struct_members(struct_die):
+    """
+    Get the offsets of the members of a struct DIE
+    """
+    members = {}
+
+    for member in struct_die.iter_children():
+        member_name = member.attributes.get("DW_AT_name")
+
+        if member.tag != "DW_TAG_member" or member_name is None:
+            continue
+
+        offset = get_member_offset(member)
+        if offset is not None:
+            members[member_name.value.decode("utf-8")] = offset
+
+    return members
+
+
+def read_dwarf_offsets(debug_file):
+    """
+    Read the offsets of the struct members from the DWARF information
+    of the file. Returns the offsets that are found.
+    """
+    wanted_structs = {}
+    for name, struct_names, member_names, _ in STRUCT_MEMBERS:
+        for struct_name in struct_names:
+            wanted_structs.setdefault(struct_name, []).append((name, member_names))
+
+    offsets = {}
+
+    with open(debug_file, "rb") as elf_file:
+        elf = ELFFile(elf_file)
+
+        if not elf.has_dwarf_info():
+            return offsets
+
+        for compile_unit in elf.get_dwarf_info().iter_CUs():
+            for die in compile_unit.iter_DIEs():
+                struct_name = get_struct_name(die)
+                if struct_name not in wanted_structs:
+                    continue
+
+                members = get_struct_members(die)
+                for name, member_names in wanted_structs.pop(struct_name):
+                    for member_name in member_names:
+                        if member_name in members and name not in offsets:
+                            offsets[name] = members[member_name]
+
+            # Stop the (expensive) scan when all structs are found
+            if len(offsets) == len(STRUCT_MEMBERS):
+                break
+
+    return offsets
+
+
+def extract_offsets(path, build_id):
+    """
+    Extract the offsets from the debug information of the binary.
+    Returns the offsets and the source of the offsets.
+    """
+    offsets = get_default_offsets()
+
+    for debug_file in get_debug_files(path, build_id):
+        dwarf_offsets = read_dwarf_offsets(debug_file)
+
+        if dwarf_offsets:
+            offsets.update(dwarf_offsets)
+            return (offsets, debug_file)
+
+    return (offsets, None)
+
+
+def get_struct_offsets(path, verbose=False, cache_directory=None):
+    """
+    Get the struct offsets of the given binary. The offsets are read from
+    the cache or extracted from the debug information.
+    """
+    if cache_directory is None:
+        cache_directory = get_cache_directory()
+
+    build_id = get_build_id(path)
+    cache_key = get_cache_key(path, build_id)
+    cache_file = os.path.join(cache_directory, f"offsets-{cache_key}.json")
+
+    if os.path.isfile(cache_file):
+        with open(cache_file, "r", encoding="utf-8") as cache:
+            cached = json.load(cache)
+
+        if cached.get("version") == CACHE_VERSION:
+            if verbose:
+                print(f"Using cached struct offsets from {cache_file}")
+            return cached["offsets"]
+
+    if ELFFile is None:
+        if verbose:
+            print(
+                "pyelftools is not installed (pip install pyelftools), "
+                "using the struct offsets of PostgreSQL 14 / 15"
+            )
+        return get_default_offsets()
+
+    offsets, source = extract_offsets(path, build_id)
+
+    if verbose:
+        if source:
+            print(f"Extracted struct offsets from the debug information of {source}")
+        else:
+            print(
+                f"No debug information found for {path}, "
+                "using the struct offsets of PostgreSQL 14 / 15"
+            )
+
+    # The default offsets are not cached, the debug information might be
+    # installed later (e.g., a -dbgsym package)
+    if source is None:
+        return offsets
+
+    os.makedirs(cache_directory, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as cache:
+        json.dump(
+            {"version": CACHE_VERSION, "source": source, "offsets": offsets}, cache
+        )
+    os.replace(tmp_file, cache_file)
+
+    return offsets
+
+
+def offsets_to_defines(offsets):
+    """
+    Convert the offsets into C '#define' statements
+    """
+    result = ""
+
+    for name, offset in sorted(offsets.items()):
+        result += f"#define OFFSET_{name} {offset}\n"
+
+    return result
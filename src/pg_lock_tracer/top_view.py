@@ -0,0 +1,108 @@
+"""
+A top-style view of the tracers. The aggregated BPF maps are read
+periodically and the hottest entries are printed; the events are not
+submitted to user space, which keeps the overhead on busy systems low.
+"""
+
+import sys
+import time
+
+# Move the cursor to the top and clear the terminal
+CLEAR_SCREEN = "\033[H\033[2J"
+
+
+def add_top_arguments(parser):
+    """
+    Add the command line arguments of the top view to the parser
+    """
+    parser.add_argument(
+        "--top",
+        action="store_true",
+        help="show a periodically refreshed view of the hottest locks instead of the events",
+    )
+    parser.add_argument(
+        "--top-interval",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="refresh interval of the top view (default 1)",
+    )
+    parser.add_argument(
+        "--top-rows",
+        type=int,
+        default=15,
+        metavar="N",
+        help="number of rows per table of the top view (default 15)",
+    )
+
+
+class TopView:
+    """
+    Refresh the tables of a top-style view periodically
+    """
+
+    def __init__(self, interval=1.0, rows=15, output=None) -> None:
+        if interval <= 0:
+            raise ValueError(
+                f"Refresh interval has to be positive ({interval} was provided)"
+            )
+
+        if rows <= 0:
+            raise ValueError(f"Number of rows has to be positive ({rows} was provided)")
+
+        self.interval = interval
+        self.rows = rows
+        self.output = output
+        self.elapsed = None
+        self.last_refresh = None
+
+        # The values of the last refresh. Key = group, Value = values
+        self.last_values = {}
+
+    def get_deltas(self, group, values):
+        """
+        Get the change of the values (Key = name, Value = number) since the last refresh
+        """
+        last_values = self.last_values.get(group, {})
+        self.last_values[group] = values
+        return {key: value - last_values.get(key, 0) for key, value in values.items()}
+
+    def get_rate(self, delta):
+        """
+        Get the rate per second of a delta since the last refresh
+        """
+        if not self.elapsed:
+            return 0.0
+
+        return delta / self.elapsed
+
+    def render(self, title, sections):
+        """
+        Print the title and the sections (tuples of heading and PrettyTable)
+        """
+        lines = [CLEAR_SCREEN + title]
+
+        for heading, table in sections:
+            lines.append("")
+            lines.append(heading)
+            lines.append(table.get_string())
+
+        output = self.output or sys.stdout
+        output.write("\n".join(lines) + "\n")
+        output.flush()
+
+    def run(self, refresh):
+        """
+        Call refresh(now_ns) in the refresh interval until the view is interrupted
+        """
+        while True:
+            try:
+                now_ns = time.monotonic_ns()
+                if self.last_refresh is not None:
+                    self.elapsed = (now_ns - self.last_refresh) / 1_000_000_000
+                self.last_refresh = now_ns
+
+                refresh(now_ns)
+                time.sleep(self.interval)
+            except KeyboardInterrupt:
+                return
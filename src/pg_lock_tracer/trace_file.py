@@ -0,0 +1,389 @@
+"""
+Write and read trace files. The output can be compressed
+(gzip or zstd) and rotated into segments by size and time.
+"""
+
+import io
+import os
+import re
+import gzip
+import json
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# File suffix per supported compression
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+# Magic bytes to detect compressed files on read
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Suffix of the index file that is written for rotated traces
+INDEX_SUFFIX = ".index.json"
+
+SIZE_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parse_size(value):
+    """
+    Parse a size with an optional unit (e.g., 512K, 100M, 2G) into bytes
+    """
+    value = value.strip().upper()
+
+    if value and value[-1] in SIZE_UNITS:
+        size = int(value[:-1]) * SIZE_UNITS[value[-1]]
+    else:
+        size = int(value)
+
+    if size <= 0:
+        raise ValueError(f"Size has to be positive ({value} was provided)")
+
+    return size
+
+
+def check_compression(compression):
+    """
+    Check that the given compression is supported in this environment
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unsupported compression {compression}")
+
+    if compression == "zstd" and zstandard is None:
+        raise ValueError(
+            "zstd compression requires the 'zstandard' package (pip install zstandard)"
+        )
+
+
+class TraceFileWriter:
+    """
+    Write trace lines into a file.
+
+    Without rotation, a single file is written. With rotation, the
+    lines are written into numbered segments (e.g., trace.00000.gz)
+    and an index file (trace.index.json) records the time range of
+    each segment. The index is rewritten after each rotation, so
+    completed segments can be processed while the trace is running.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(
+        self, path, compression="none", rotate_size=None, rotate_interval=None
+    ):
+        check_compression(compression)
+
+        if rotate_size is not None and rotate_size <= 0:
+            raise ValueError(
+                f"Rotate size has to be positive ({rotate_size} was provided)"
+            )
+
+        if rotate_interval is not None and rotate_interval <= 0:
+            raise ValueError(
+                f"Rotate interval has to be positive ({rotate_interval} was provided)"
+            )
+
+        self.path = path
+        self.compression = compression
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.segments = []
+
+        # The current segment
+        self.raw_file = None
+        self.text_file = None
+        self.segment_start = None
+
+        for file_name in self.get_initial_files() + self.get_existing_segments():
+            if os.path.exists(file_name):
+                raise ValueError(f"Output file {file_name} already exists")
+
+    def open(self):
+        """
+        Open the writer and create the first segment
+        """
+        self.open_segment()
+
+    @property
+    def rotate(self):
+        return self.rotate_size is not None or self.rotate_interval is not None
+
+    @property
+    def index_path(self):
+        return f"{self.path}{INDEX_SUFFIX}"
+
+    def get_initial_files(self):
+        """
+        Get the files that are created when the writer is opened
+        """
+        if self.rotate:
+            return [self.index_path, self.get_segment_name(0)]
+
+        return [self.get_segment_name(0)]
+
+    def get_existing_segments(self):
+        """
+        Get the existing files that have the name of a (later) segment. A
+        rotation would fail on these files while the trace is running.
+        """
+        if not self.rotate:
+            return []
+
+        suffix = COMPRESSION_SUFFIXES[self.compression]
+        first_segment = self.get_segment_name(0)
+        directory, prefix = os.path.split(first_segment[: -len(f"00000{suffix}")])
+        segment_pattern = re.compile(re.escape(prefix) + r"\d{5,}" + re.escape(suffix))
+
+        if not os.path.isdir(directory or "."):
+            return []
+
+        return sorted(
+            os.path.join(directory, file_name)
+            for file_name in os.listdir(directory or ".")
+            if segment_pattern.fullmatch(file_name)
+        )
+
+    def get_segment_name(self, segment_number):
+        """
+        Get the file name of the given segment
+        """
+        suffix = COMPRESSION_SUFFIXES[self.compression]
+        base_path = self.path
+
+        # Do not duplicate the suffix, if it is part of the path (e.g., trace.gz)
+        if suffix and base_path.endswith(suffix):
+            base_path = base_path[: -len(suffix)]
+
+        if not self.rotate:
+            return f"{base_path}{suffix}"
+
+        return f"{base_path}.{segment_number:05d}{suffix}"
+
+    def open_segment(self):
+        """
+        Open a new segment for writing
+        """
+        file_name = self.get_segment_name(len(self.segments))
+
+        # pylint: disable=consider-using-with
+        self.raw_file = open(file_name, "xb")
+
+        if self.compression == "gzip":
+            binary_file = gzip.GzipFile(fileobj=self.raw_file, mode="wb")
+        elif self.compression == "zstd":
+            binary_file = zstandard.ZstdCompressor().stream_writer(self.raw_file)
+        else:
+            binary_file = self.raw_file
+
+        # Pass the data directly to the (compressed) file. So, the size
+        # of the segment on disk is known for the rotation.
+        self.text_file = io.TextIOWrapper(
+            binary_file, encoding="utf-8", write_through=True
+        )
+        self.segment_start = time.monotonic()
+
+        self.segments.append(
+            {
+                "file": os.path.basename(file_name),
+                "first_timestamp": None,
+                "last_timestamp": None,
+                "lines": 0,
+                "start_time": time.time(),
+                "end_time": None,
+                "complete": False,
+            }
+        )
+
+        self.write_index()
+
+    def close_segment(self):
+        """
+        Close the current segment and update the index
+        """
+        self.text_file.close()
+
+        if not self.raw_file.closed:
+            self.raw_file.close()
+
+        segment = self.segments[-1]
+        segment["end_time"] = time.time()
+        segment["complete"] = True
+
+        self.write_index()
+
+    def write_index(self):
+        """
+        Write the index of the segments. The index is replaced atomically,
+        so readers always see a consistent version.
+        """
+        if not self.rotate:
+            return
+
+        index = {
+            "version": 1,
+            "compression": self.compression,
+            "segments": self.segments,
+        }
+
+        tmp_file_name = f"{self.index_path}.tmp"
+        with open(tmp_file_name, "w", encoding="utf-8") as index_file:
+            json.dump(index, index_file, indent=2)
+
+        os.replace(tmp_file_name, self.index_path)
+
+    def need_rotation(self):
+        """
+        Is the current segment full?
+        """
+        if not self.rotate or self.segments[-1]["lines"] == 0:
+            return False
+
+        if self.rotate_size is not None and self.raw_file.tell() >= self.rotate_size:
+            return True
+
+        if self.rotate_interval is not None:
+            segment_age = time.monotonic() - self.segment_start
+            if segment_age >= self.rotate_interval:
+                return True
+
+        return False
+
+    @property
+    def poll_timeout(self):
+        """
+        The timeout (in ms) of the perf buffer polls, so that segments are
+        rotated by time when no events arrive
+        """
+        if self.rotate_interval is None:
+            return -1
+
+        return max(10, min(1000, int(self.rotate_interval * 1000)))
+
+    def poll(self):
+        """
+        Rotate the segment if it is full. Called from the poll loop between
+        two events, so events are not split.
+        """
+        if self.text_file is not None and self.need_rotation():
+            self.close_segment()
+            self.open_segment()
+
+    def write_line(self, line, timestamp=None):
+        """
+        Write a line into the trace. Segments are only rotated on lines
+        with a timestamp (i.e., the first line of an event), so an event
+        and its additional lines (e.g., a stack trace) stay in one segment.
+        """
+        self.write_block(line + "\n", 1, timestamp, timestamp)
+
+    def write_block(self, block, lines, first_timestamp=None, last_timestamp=None):
+        """
+        Write a block of lines into the trace. The block has to start
+        with the first line of an event if a timestamp is provided.
+        """
+        if first_timestamp is not None and self.need_rotation():
+            self.close_segment()
+            self.open_segment()
+
+        self.text_file.write(block)
+
+        segment = self.segments[-1]
+        segment["lines"] += lines
+
+        if first_timestamp is not None:
+            if segment["first_timestamp"] is None:
+                segment["first_timestamp"] = first_timestamp
+            segment["last_timestamp"] = last_timestamp
+
+    def close(self):
+        """
+        Close the writer
+        """
+        if self.text_file is None:
+            return
+
+        self.close_segment()
+        self.text_file = None
+        self.raw_file = None
+
+
+def open_trace_segment(file_name):
+    """
+    Open a (compressed) trace file for reading. The compression is
+    detected based on the first bytes of the file.
+    """
+    # pylint: disable=consider-using-with
+    raw_file = open(file_name, "rb")
+    magic = raw_file.read(4)
+    raw_file.seek(0)
+
+    if magic.startswith(GZIP_MAGIC):
+        raw_file.close()
+        binary_file = gzip.open(file_name, "rb")
+    elif magic.startswith(ZSTD_MAGIC):
+        check_compression("zstd")
+        binary_file = zstandard.ZstdDecompressor().stream_reader(raw_file, closefd=True)
+    else:
+        binary_file = raw_file
+
+    return io.TextIOWrapper(binary_file, encoding="utf-8")
+
+
+def get_trace_index(path):
+    """
+    Get the index file for the given path or None if the trace is
+    not rotated
+    """
+    if path.endswith(INDEX_SUFFIX) and os.path.isfile(path):
+        return path
+
+    if os.path.isfile(f"{path}{INDEX_SUFFIX}"):
+        return f"{path}{INDEX_SUFFIX}"
+
+    return None
+
+
+def trace_exists(path):
+    """
+    Does a (rotated) trace exist for the given path?
+    """
+    return os.path.isfile(path) or get_trace_index(path) is not None
+
+
+def get_trace_segments(path):
+    """
+    Get the segments of a trace as (file name, complete) tuples. For rotated
+    traces, these are the segments listed in the index (in the order they
+    were written). The last segment of a running trace is not complete.
+    """
+    index_path = get_trace_index(path)
+
+    if index_path is None:
+        return [(path, True)]
+
+    with open(index_path, "r", encoding="utf-8") as index_file:
+        index = json.load(index_file)
+
+    directory = os.path.dirname(index_path)
+    return [
+        (os.path.join(directory, segment["file"]), segment["complete"])
+        for segment in index["segments"]
+    ]
+
+
+def read_trace_lines(path):
+    """
+    Read the lines of a trace. The path can be a single (compressed) file,
+    the index of a rotated trace, or the base path of a rotated trace.
+    """
+    for file_name, complete in get_trace_segments(path):
+        with open_trace_segment(file_name) as trace_file:
+            try:
+                for line in trace_file:
+                    yield line.rstrip("\n")
+            except EOFError:
+                # The segment of a running trace is not completely written
+                if complete:
+                    raise
@@ -0,0 +1,234 @@
+"""
+The wait events of the PostgreSQL backends (wait_event_info), the
+profile of the sampled wait events, and the slots of the sampled backends. The upper byte of wait_event_info is
+the class of the wait event (the wait_event_type of pg_stat_activity),
+the lower 16 bits are the event of the class. The events of the LWLock
+class are the tranche ids, the events of the Lock class are the lock tag
+types. The ids of the other events depend on the PostgreSQL version.
+"""
+
+from prettytable import PrettyTable
+
+from pg_lock_tracer.lock_events import get_locktag_name
+
+# The classes of the wait events (PG_WAIT_* in wait_event.h)
+PG_WAIT_LWLOCK = 0x01000000
+PG_WAIT_LOCK = 0x03000000
+
+WAIT_EVENT_CLASSES = {
+    PG_WAIT_LWLOCK: "LWLock",
+    PG_WAIT_LOCK: "Lock",
+    0x04000000: "BufferPin",
+    0x05000000: "Activity",
+    0x06000000: "Client",
+    0x07000000: "Extension",
+    0x08000000: "IPC",
+    0x09000000: "Timeout",
+    0x0A000000: "IO",
+    0x0B000000: "InjectionPoint",
+}
+
+WAIT_EVENT_CLASS_MASK = 0xFF000000
+WAIT_EVENT_ID_MASK = 0x0000FFFF
+
+
+def get_wait_event_type(wait_event_info):
+    """
+    Get the type (class) of a wait event. A backend without a wait event
+    is running on the CPU.
+    """
+    if wait_event_info == 0:
+        return "CPU"
+
+    wait_class = wait_event_info & WAIT_EVENT_CLASS_MASK
+    return WAIT_EVENT_CLASSES.get(wait_class, f"0x{wait_class:08x}")
+
+
+def get_wait_event_name(wait_event_info, resolve_tranche=None):
+    """
+    Get the name of a wait event. The resolve_tranche function maps the
+    tranche id of an LWLock wait event to the name of the tranche.
+    """
+    if wait_event_info == 0:
+        return "-"
+
+    wait_class = wait_event_info & WAIT_EVENT_CLASS_MASK
+    event_id = wait_event_info & WAIT_EVENT_ID_MASK
+
+    if wait_class == PG_WAIT_LWLOCK and resolve_tranche is not None:
+        return resolve_tranche(event_id)
+
+    if wait_class == PG_WAIT_LOCK:
+        return get_locktag_name(event_id)
+
+    return str(event_id)
+
+
+def get_query_id(query_id):
+    """
+    Get the query id as shown by pg_stat_activity and pg_stat_statements
+    (a signed 64-bit integer). 0 is shown if no query id was computed.
+    """
+    return query_id - (1 << 64) if query_id >= (1 << 63) else query_id
+
+
+class WaitEventProfile:
+    """
+    The samples per wait event and per wait event and query id
+    """
+
+    def __init__(self, frequency, rows=20) -> None:
+        # The sample rounds per second (Hz)
+        self.frequency = frequency
+        self.rows = rows
+
+        # Key = wait_event_info
+        self.events = {}
+
+        # The time in seconds that the samples represent (Key = wait_event_info)
+        self.times = {}
+
+        # Key = (wait_event_info, query_id)
+        self.queries = {}
+
+    def add(self, wait_event_info, query_id, samples, sample_time=None):
+        """
+        Add the samples of a wait event and query id. A sample represents
+        sample_time seconds (default: one sample period). When the sampler
+        missed sample periods, a sample represents more than one period.
+        """
+        if sample_time is None:
+            sample_time = 1 / self.frequency
+
+        self.events[wait_event_info] = self.events.get(wait_event_info, 0) + samples
+        self.times[wait_event_info] = (
+            self.times.get(wait_event_info, 0.0) + samples * sample_time
+        )
+
+        query = (wait_event_info, query_id)
+        self.queries[query] = self.queries.get(query, 0) + samples
+
+    def total(self):
+        """
+        Get the number of samples
+        """
+        return sum(self.events.values())
+
+    def get_time(self, wait_event_info):
+        """
+        Get the time in seconds that the samples of a wait event represent
+        """
+        return f"{self.times.get(wait_event_info, 0.0):.2f}"
+
+    def get_share(self, samples):
+        """
+        Get the share of the samples in percent
+        """
+        total = self.total()
+        return f"{samples * 100 / total:.1f}" if total else "-"
+
+    def get_top_entries(self, entries):
+        """
+        Get the entries with the most samples
+        """
+        return sorted(entries.items(), key=lambda item: item[1], reverse=True)[
+            : self.rows
+        ]
+
+    def print_profile(self, resolve_tranche=None):
+        """
+        Print the samples per wait event and per wait event and query id
+        """
+        print(f"\nWait event samples ({self.total()} samples at {self.frequency} Hz)")
+        table = PrettyTable(
+            ["Wait Event Type", "Wait Event", "Samples", "Time (s)", "Samples (%)"]
+        )
+        for wait_event_info, samples in self.get_top_entries(self.events):
+            table.add_row(
+                [
+                    get_wait_event_type(wait_event_info),
+                    get_wait_event_name(wait_event_info, resolve_tranche),
+                    samples,
+                    self.get_time(wait_event_info),
+                    self.get_share(samples),
+                ]
+            )
+        print(table)
+
+        print("\nWait event samples per query id")
+        table = PrettyTable(
+            ["Wait Event Type", "Wait Event", "Query Id", "Samples", "Samples (%)"]
+        )
+        for (wait_event_info, query_id), samples in self.get_top_entries(self.queries):
+            table.add_row(
+                [
+                    get_wait_event_type(wait_event_info),
+                    get_wait_event_name(wait_event_info, resolve_tranche),
+                    get_query_id(query_id),
+                    samples,
+                    self.get_share(samples),
+                ]
+            )
+        print(table)
+
+
+class BackendSlots:
+    """
+    The slots of the sampled processes in the BPF maps of the sampler
+    """
+
+    def __init__(self, size) -> None:
+        self.size = size
+
+        # Key = pid, Value = slot
+        self.slots = {}
+
+        # The sampled processes without a PgBackendStatus (MyBEEntry is set
+        # after the PGPROC, the addresses are read again on refresh)
+        self.without_status = set()
+
+        # The processes that could not be sampled (all slots are used)
+        self.skipped = set()
+
+    def find_slot(self, pid):
+        """
+        Get the slot of a process or the lowest free slot for a new process
+        (None if all slots are used)
+        """
+        slot = self.slots.get(pid)
+        if slot is None:
+            free_slots = set(range(self.size)) - set(self.slots.values())
+            slot = min(free_slots, default=None)
+
+        return slot
+
+    def assign(self, pid, slot, has_status):
+        """
+        Store the slot of a process
+        """
+        self.slots[pid] = slot
+        self.skipped.discard(pid)
+
+        if has_status:
+            self.without_status.discard(pid)
+        else:
+            self.without_status.add(pid)
+
+    def release(self, pid):
+        """
+        Free the slot of a process and return it
+        """
+        self.without_status.discard(pid)
+        return self.slots.pop(pid)
+
+    def needs_refresh(self, pid):
+        """
+        Has the process no slot or no PgBackendStatus yet?
+        """
+        return pid not in self.slots or pid in self.without_status
+
+    def get_used(self):
+        """
+        Get the number of used slots (the highest used slot + 1)
+        """
+        return max(self.slots.values(), default=-1) + 1
@@ -0,0 +1,315 @@
+"""
+Time-windowed statistics. The counters of the tracers are collected in
+fixed-size windows (e.g., one second) and the closed windows are kept
+in a ring of the last N windows. The windows are written as JSON lines
+or CSV periodically, on SIGUSR1, and on exit.
+"""
+
+import io
+import csv
+import sys
+import json
+import time
+
+from collections import deque
+
+# Supported output formats of the windows
+WINDOW_FORMATS = ("json", "csv")
+
+
+def add_window_arguments(parser):
+    """
+    Add the command line arguments of the windowed statistics to the parser
+    """
+    parser.add_argument(
+        "--window-statistics",
+        type=float,
+        metavar="SECONDS",
+        help="collect the statistics in windows of the given length",
+    )
+    parser.add_argument(
+        "--window-history",
+        type=int,
+        default=60,
+        metavar="N",
+        help="number of closed windows that are kept until they are written (default 60)",
+    )
+    parser.add_argument(
+        "--window-report-interval",
+        type=float,
+        metavar="SECONDS",
+        help="write the closed windows periodically (default only on SIGUSR1 and exit)",
+    )
+    parser.add_argument(
+        "--window-output",
+        type=str,
+        metavar="FILE",
+        help="write the windows into the given file (default stdout)",
+    )
+    parser.add_argument(
+        "--window-format",
+        choices=WINDOW_FORMATS,
+        default="json",
+        help="output format of the windows (default json)",
+    )
+
+
+# pylint: disable=too-few-public-methods
+class StatisticsWindow:
+    """
+    The counters of one window. Key = statistics key, Value = counters.
+    """
+
+    def __init__(self, index, window_ns) -> None:
+        self.index = index
+        self.start_ns = index * window_ns
+        self.end_ns = self.start_ns + window_ns
+        self.counters = {}
+
+    def add(self, key, counter, value):
+        """
+        Add the value to a counter of the given key
+        """
+        counters = self.counters.get(key)
+        if counters is None:
+            counters = {}
+            self.counters[key] = counters
+
+        counters[counter] = counters.get(counter, 0) + value
+
+
+class WindowedStatistics:
+    """
+    Collect counters in windows of a fixed length. The event timestamps
+    (bpf_ktime_get_ns) and time.monotonic_ns() use the same clock.
+    Events that arrive after their window is closed (the perf buffers
+    of the CPUs are not ordered) are counted in the current window.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(
+        self,
+        window_seconds,
+        history=60,
+        report_interval=None,
+        output=None,
+        output_format="json",
+        key_columns=("key",),
+        counters=(),
+    ):
+        if window_seconds <= 0:
+            raise ValueError(
+                f"Window length has to be positive ({window_seconds} was provided)"
+            )
+
+        if history <= 0:
+            raise ValueError(
+                f"Window history has to be positive ({history} was provided)"
+            )
+
+        if report_interval is not None and report_interval <= 0:
+            raise ValueError(
+                f"Report interval has to be positive ({report_interval} was provided)"
+            )
+
+        if output_format not in WINDOW_FORMATS:
+            raise ValueError(f"Unsupported window format {output_format}")
+
+        self.window_ns = int(window_seconds * 1_000_000_000)
+        self.report_interval_ns = (
+            int(report_interval * 1_000_000_000) if report_interval else None
+        )
+        self.output = output
+        self.output_format = output_format
+        self.key_columns = tuple(key_columns)
+        self.counters = tuple(counters)
+
+        self.current = None
+        self.history = deque(maxlen=history)
+        # Number of windows at the end of the history that are not written
+        self.pending = 0
+        # Number of windows that left the history before they were written
+        self.dropped_windows = 0
+
+        self.report_requested = False
+        self.last_report_ns = time.monotonic_ns()
+
+        # Offset to convert the monotonic timestamps into the wall clock
+        self.clock_offset_ns = time.time_ns() - time.monotonic_ns()
+
+        self.output_file = None
+        self.csv_writer = None
+
+    @staticmethod
+    def from_args(args, key_columns, counters):
+        """
+        Create the windowed statistics of the command line arguments
+        (or None if no windowed statistics are requested)
+        """
+        if args.window_statistics is None:
+            return None
+
+        return WindowedStatistics(
+            args.window_statistics,
+            args.window_history,
+            args.window_report_interval,
+            args.window_output,
+            args.window_format,
+            key_columns,
+            counters,
+        )
+
+    @property
+    def poll_timeout(self):
+        """
+        The timeout (in ms) of the perf buffer polls, so that windows
+        are closed and written when no events arrive
+        """
+        interval_ns = self.window_ns
+        if self.report_interval_ns:
+            interval_ns = min(interval_ns, self.report_interval_ns)
+
+        return max(10, min(1000, interval_ns // 1_000_000))
+
+    def add(self, timestamp_ns, key, counter, value=1):
+        """
+        Add the value to a counter of the given key in the window of the timestamp
+        """
+        index = timestamp_ns // self.window_ns
+
+        if self.current is None or index > self.current.index:
+            self.close_current()
+            self.current = StatisticsWindow(index, self.window_ns)
+
+        self.current.add(key, counter, value)
+
+    def close_current(self):
+        """
+        Move the current window into the history
+        """
+        if self.current is None:
+            return
+
+        if self.pending == self.history.maxlen:
+            self.dropped_windows += 1
+        else:
+            self.pending += 1
+
+        self.history.append(self.current)
+        self.current = None
+
+    def close_windows(self, now_ns):
+        """
+        Close the current window if it has ended
+        """
+        if self.current is not None and now_ns >= self.current.end_ns:
+            self.close_current()
+
+    def take_pending(self):
+        """
+        Get the closed windows that are not written yet
+        """
+        if self.pending == 0:
+            return []
+
+        windows = list(self.history)[-self.pending :]
+        self.pending = 0
+        return windows
+
+    def request_report(self, _signum=None, _frame=None):
+        """
+        Request to write the closed windows (can be used as signal handler)
+        """
+        self.report_requested = True
+
+    def poll(self, now_ns=None):
+        """
+        Close the ended window and write the closed windows if a
+        report is requested or the report interval has passed
+        """
+        if now_ns is None:
+            now_ns = time.monotonic_ns()
+
+        self.close_windows(now_ns)
+
+        report_due = (
+            self.report_interval_ns is not None
+            and now_ns - self.last_report_ns >= self.report_interval_ns
+        )
+
+        if self.report_requested or report_due:
+            self.report_requested = False
+            self.last_report_ns = now_ns
+            self.write_windows(self.take_pending())
+
+    def close(self):
+        """
+        Write the remaining windows (including the current window) and close the output
+        """
+        self.close_current()
+        self.write_windows(self.take_pending())
+
+        if self.dropped_windows:
+            print(
+                f"{self.dropped_windows} statistics windows were dropped "
+                "before they were written (increase --window-history)",
+                file=sys.stderr,
+            )
+
+        if self.output_file is not None and self.output_file is not sys.stdout:
+            self.output_file.close()
+        self.output_file = None
+
+    def get_rows(self, windows):
+        """
+        Get the rows (one per window and key) of the given windows
+        """
+        rows = []
+
+        for window in windows:
+            start = (window.start_ns + self.clock_offset_ns) / 1_000_000_000
+            for key in sorted(window.counters, key=str):
+                counters = window.counters[key]
+                row = {"window_start": round(start, 3)}
+                key_values = key if isinstance(key, tuple) else (key,)
+                row.update(zip(self.key_columns, key_values))
+
+                for counter in self.counters:
+                    row[counter] = counters.get(counter, 0)
+
+                rows.append(row)
+
+        return rows
+
+    def write_windows(self, windows):
+        """
+        Write the given windows into the output
+        """
+        rows = self.get_rows(windows)
+
+        if not rows:
+            return
+
+        if self.output_file is None:
+            if self.output:
+                # pylint: disable=consider-using-with
+                self.output_file = open(self.output, "w", encoding="utf-8", newline="")
+            else:
+                self.output_file = sys.stdout
+
+        if self.output_format == "csv":
+            if self.csv_writer is None:
+                self.csv_writer = csv.DictWriter(
+                    self.output_file,
+                    ["window_start", *self.key_columns, *self.counters],
+                )
+                self.csv_writer.writeheader()
+            self.csv_writer.writerows(rows)
+        else:
+            buffer = io.StringIO()
+            for row in rows:
+                buffer.write(json.dumps(row))
+                buffer.write("\n")
+            self.output_file.write(buffer.getvalue())
+
+        self.output_file.flush()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import io
+import unittest
+
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+from src.pg_lock_tracer.catalog_statistics import (
+    CatalogFunction,
+    CatalogStatistics,
+)
+
+
+def create_entry(pid, function, oid, bucket, calls, total_ns, cluster=0):
+    """
+    Create an entry of the catalog_times map
+    """
+    key = SimpleNamespace(
+        pid=pid, cluster=cluster, function=function, oid=oid, bucket=bucket
+    )
+    return (key, SimpleNamespace(calls=calls, total_ns=total_ns))
+
+
+class CatalogStatisticsTests(unittest.TestCase):
+    def test_aggregation(self):
+        """
+        Test the aggregation per backend and per relation
+        """
+        catalog_statistics = CatalogStatistics()
+
+        for entry in (
+            create_entry(10, CatalogFunction.TABLE_OPEN, 1259, 11, 4, 4_000),
+            create_entry(10, CatalogFunction.TABLE_OPEN, 16384, 21, 1, 2_000_000),
+            create_entry(11, CatalogFunction.TABLE_OPEN, 16384, 11, 2, 2_000),
+            create_entry(
+                10, CatalogFunction.ACCEPT_INVALIDATION_MESSAGES, 0, 8, 5, 500
+            ),
+        ):
+            catalog_statistics.add(*entry)
+
+        backend = catalog_statistics.backends[(0, 10, CatalogFunction.TABLE_OPEN)]
+        self.assertEqual(5, backend.count)
+        self.assertEqual(2_004_000, backend.total_ns)
+        self.assertEqual(2047, backend.histogram.percentile(50))
+        self.assertEqual(2**21 - 1, backend.histogram.percentile(99))
+
+        # AcceptInvalidationMessages has no relation
+        self.assertEqual(3, len(catalog_statistics.backends))
+        self.assertEqual(
+            {
+                (0, 1259, CatalogFunction.TABLE_OPEN),
+                (0, 16384, CatalogFunction.TABLE_OPEN),
+            },
+            set(catalog_statistics.relations),
+        )
+
+        relation = catalog_statistics.relations[(0, 16384, CatalogFunction.TABLE_OPEN)]
+        self.assertEqual(3, relation.count)
+        self.assertEqual(2_002_000, relation.total_ns)
+
+        # The entries with the highest total time first
+        top = catalog_statistics.get_top_entries(catalog_statistics.relations)
+        self.assertEqual((0, 16384, CatalogFunction.TABLE_OPEN), top[0][0])
+
+    def test_print_statistics(self):
+        """
+        Test the printed tables
+        """
+        catalog_statistics = CatalogStatistics()
+        catalog_statistics.add(
+            *create_entry(10, CatalogFunction.RELATION_BUILD_DESC, 16384, 11, 2, 3_000)
+        )
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            catalog_statistics.print_statistics(
+                lambda cluster, oid: f"public.table_{oid}"
+            )
+
+        self.assertIn("public.table_16384", output.getvalue())
+        self.assertIn("RelationBuildDesc", output.getvalue())
+        self.assertIn("1024 - 2047", output.getvalue())
+        self.assertNotIn("AcceptInvalidationMessages", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import unittest
+import tempfile
+import subprocess
+
+from src.pg_lock_tracer.elf_symbols import ElfSymbolIndex
+
+TEST_PROGRAM = """
+int LockRelationOid(int oid, int mode) { return oid + mode; }
+int UnlockRelationOid(int oid, int mode) { return oid - mode; }
+const char *const IndividualLWLockNames[] = {"ShmemIndex", "OidGen"};
+static int counter = 1;
+int main(void) { return LockRelationOid(1, 2) + UnlockRelationOid(3, counter); }
+"""
+
+
+def get_libc_path():
+    """
+    Get the path of the libc that is used by this process
+    """
+    with open("/proc/self/maps", "r", encoding="utf-8") as maps:
+        for line in maps:
+            path = line.split()[-1]
+            if os.path.basename(path).startswith("libc.so"):
+                return path
+
+    return None
+
+
+class ElfSymbolIndexTests(unittest.TestCase):
+    @unittest.skipIf(shutil.which("gcc") is None, "gcc is not installed")
+    def test_binary_symbols(self):
+        """
+        Test the symbols of a binary against the output of nm
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            binary = os.path.join(tmp_dir, "postgres")
+            source = os.path.join(tmp_dir, "postgres.c")
+
+            with open(source, "w", encoding="utf-8") as source_file:
+                source_file.write(TEST_PROGRAM)
+
+            subprocess.run(["gcc", "-O0", "-o", binary, source], check=True)
+            index = ElfSymbolIndex(binary)
+
+            nm_output = subprocess.run(
+                ["nm", binary], check=True, capture_output=True, text=True
+            ).stdout
+
+        nm_addresses = {}
+        for line in nm_output.splitlines():
+            fields = line.split()
+            if len(fields) == 3 and fields[1] in ("T", "t", "D", "d", "R", "r"):
+                nm_addresses[fields[2]] = int(fields[0], 16)
+
+        functions = index.find_functions("^LockRelationOid$")
+        self.assertEqual(
+            [("LockRelationOid", nm_addresses["LockRelationOid"])], functions
+        )
+
+        # Regexes are matched at the beginning of the name
+        names = {name for name, _ in index.find_functions("^(Un)?[Ll]ockRelation")}
+        self.assertEqual({"LockRelationOid", "UnlockRelationOid"}, names)
+        self.assertEqual(["main"], index.addresses[index.functions["main"][0]])
+
+        self.assertEqual([], index.find_functions("^DeadLockReport$"))
+
+        # Data symbols (global and static variables)
+        self.assertEqual(
+            (nm_addresses["IndividualLWLockNames"], 16),
+            index.objects["IndividualLWLockNames"],
+        )
+        self.assertEqual((nm_addresses["counter"], 4), index.objects["counter"])
+        self.assertNotIn("IndividualLWLockNames", index.functions)
+
+    @unittest.skipIf(get_libc_path() is None, "libc not found")
+    def test_libc_symbols(self):
+        """
+        Test the dynamic symbols of the libc
+        """
+        index = ElfSymbolIndex(get_libc_path())
+        functions = index.find_functions("^malloc$")
+
+        self.assertGreater(len(functions), 0)
+        for name, address in functions:
+            self.assertEqual("malloc", name)
+            self.assertGreater(address, 0)
+
+    def test_no_elf_file(self):
+        """
+        Non ELF files are rejected
+        """
+        with tempfile.NamedTemporaryFile() as no_elf_file:
+            no_elf_file.write(b"no elf file")
+            no_elf_file.flush()
+
+            with self.assertRaises(ValueError):
+                ElfSymbolIndex(no_elf_file.name)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+import os
+import ctypes as ct
+import tempfile
+import unittest
+
+from src.pg_lock_tracer.lock_events import Events, LockTagType, PostgreSQLEvent
+from src.pg_lock_tracer.event_batch import (
+    BatchLockStatistics,
+    EventBatch,
+    numpy,
+    read_trace_events,
+)
+from src.pg_lock_tracer.lock_event_formatter import LockEventFormatter
+
+
+def create_events(*events):
+    """
+    Create the raw records of the given (pid, timestamp, event type, oid, mode) tuples
+    """
+    records = b""
+
+    for pid, timestamp, event_type, oid, mode in events:
+        event = PostgreSQLEvent(
+            pid=pid, timestamp=timestamp, event_type=event_type, object=oid, mode=mode
+        )
+        records += bytes(event)
+
+    return records
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class EventBatchTests(unittest.TestCase):
+    def test_decode_records(self):
+        """
+        Test the decoding of raw records into a structured array
+        """
+        batch = EventBatch()
+        self.assertEqual(ct.sizeof(PostgreSQLEvent), batch.dtype.itemsize)
+
+        event = PostgreSQLEvent(
+            pid=42, timestamp=1000, event_type=Events.QUERY_BEGIN, stackid=-1
+        )
+        event.payload_str1 = b"select 1;"
+        batch.append_record(0, ct.addressof(event), ct.sizeof(event))
+        batch.append_bytes(create_events((43, 2000, Events.LOCK_RELATION_OID, 1259, 1)))
+        self.assertEqual(2, len(batch))
+
+        events = batch.take()
+        self.assertEqual(0, len(batch))
+        self.assertEqual([42, 43], events["pid"].tolist())
+        self.assertEqual([1000, 2000], events["timestamp"].tolist())
+        self.assertEqual(b"select 1;", events["payload_str1"][0])
+        self.assertEqual(-1, events["stackid"][0])
+        self.assertEqual(1259, events["object"][1])
+
+        with self.assertRaises(ValueError):
+            batch.append_bytes(b"\0")
+
+    def test_lock_statistics(self):
+        """
+        Test the statistics over multiple batches
+        """
+        statistics = BatchLockStatistics([1, 2])
+        batch = EventBatch()
+
+        batch.append_bytes(
+            create_events(
+                (1, 100, Events.LOCK_RELATION_OID, 1259, 1),
+                (2, 110, Events.LOCK_RELATION_OID, 1259, 3),
+                (1, 150, Events.LOCK_RELATION_OID_END, 0, 0),
+                (1, 200, Events.LOCK_RELATION_OID, 2662, 1),
+                # Not traced pid
+                (3, 210, Events.LOCK_RELATION_OID, 2662, 8),
+            )
+        )
+        statistics.add_events(batch.take())
+
+        # The requests of pid 2 (and the second request of pid 1) end in the next batch
+        batch.append_bytes(
+            create_events(
+                (1, 203, Events.LOCK_RELATION_OID_END, 0, 0),
+                (2, 1134, Events.LOCK_RELATION_OID_END, 0, 0),
+            )
+        )
+        statistics.add_events(batch.take())
+
+        self.assertEqual(
+            {1259: (2, 1074), 2662: (1, 3)}, statistics.get_lock_statistics()
+        )
+        self.assertEqual({1: 2, 3: 1}, statistics.get_lock_type_statistics())
+
+        # Buckets of 3 ns (2 - 3), 50 ns (32 - 63) and 1024 ns (1024 - 2047)
+        self.assertEqual(
+            [2, 6, 11], numpy.flatnonzero(statistics.histogram.buckets).tolist()
+        )
+        self.assertEqual(0, len(statistics.pending))
+
+    def test_cluster_statistics(self):
+        """
+        Test the statistics of events of several clusters
+        """
+        statistics = BatchLockStatistics(show_cluster=True)
+        batch = EventBatch()
+
+        for cluster, pid in ((0, 1), (1, 2)):
+            for timestamp, event_type, oid in (
+                (100, Events.LOCK_RELATION_OID, 1259),
+                (110, Events.LOCK_RELATION_OID_END, 0),
+            ):
+                event = PostgreSQLEvent(
+                    pid=pid,
+                    cluster=cluster,
+                    timestamp=timestamp * (cluster + 1),
+                    event_type=event_type,
+                    object=oid,
+                    mode=1,
+                )
+                batch.append_bytes(bytes(event))
+
+        statistics.add_events(batch.take())
+        self.assertEqual({1: 0, 2: 1}, statistics.pid_clusters)
+        self.assertEqual(
+            {(0, 1259): (1, 10), (1, 1259): (1, 20)}, statistics.get_lock_statistics()
+        )
+
+    def test_read_trace(self):
+        """
+        Test the statistics of a recorded JSON trace
+        """
+        pid = 1234
+        formatter = LockEventFormatter()
+        lines = []
+
+        for timestamp, event_type, oid, mode in (
+            (100, Events.LOCK_RELATION_OID, 1259, 1),
+            (164, Events.LOCK_RELATION_OID_END, 0, 0),
+            (200, Events.TABLE_CLOSE, 1259, 1),
+        ):
+            _, prefix = formatter.get_json_prefix(pid, event_type, mode, oid, {})
+            event = PostgreSQLEvent(pid=pid, timestamp=timestamp)
+            lock_time = 64 if event_type == Events.LOCK_RELATION_OID_END else None
+            lines.append(
+                formatter.format_json(event, event_type, timestamp, prefix, lock_time)
+            )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "trace")
+            with open(path, "w", encoding="utf-8") as trace_file:
+                trace_file.write("\n".join(lines) + "\n")
+
+            events = read_trace_events(path)
+
+        self.assertEqual(3, len(events))
+        self.assertEqual(Events.TABLE_CLOSE, events["event_type"][2])
+
+        statistics = BatchLockStatistics()
+        statistics.add_events(events)
+        self.assertEqual({1259: (1, 64)}, statistics.get_lock_statistics())
+
+    def test_locktag_statistics(self):
+        """
+        Test the statistics per lock tag type
+        """
+        formatter = LockEventFormatter()
+        lines = []
+
+        for event_type, locktag_type in (
+            (Events.LOCK_GRANTED_LOCAL, LockTagType.RELATION),
+            (Events.LOCK_GRANTED_LOCAL, LockTagType.ADVISORY),
+            (Events.LOCK_GRANTED, LockTagType.ADVISORY),
+            (Events.LOCK_UNGRANTED, LockTagType.ADVISORY),
+        ):
+            event = PostgreSQLEvent(
+                pid=1,
+                event_type=event_type,
+                mode=7,
+                object=42,
+                locktag_type=locktag_type,
+                locktag_field1=5,
+                locktag_field2=42,
+                locktag_field4=1,
+            )
+            _, prefix = formatter.get_json_prefix(
+                1, event_type, 7, formatter.get_object(event, event_type), {}
+            )
+            lines.append(formatter.format_json(event, event_type, 0, prefix))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "trace")
+            with open(path, "w", encoding="utf-8") as trace_file:
+                trace_file.write("\n".join(lines) + "\n")
+
+            events = read_trace_events(path)
+
+        self.assertEqual([0, 10, 10, 10], events["locktag_type"].tolist())
+        self.assertEqual([42] * 4, events["locktag_field2"].tolist())
+        self.assertEqual(1, events["locktag_field4"][1])
+
+        statistics = BatchLockStatistics()
+        statistics.add_events(events)
+        self.assertEqual(
+            {LockTagType.RELATION: (1, 0), LockTagType.ADVISORY: (1, 1)},
+            statistics.get_locktag_statistics(),
+        )
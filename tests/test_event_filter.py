@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from src.pg_lock_tracer.event_filter import EventFilter
+
+
+class FakeTable(dict):
+    """
+    A BPF map (the key and leaf types are plain integers)
+    """
+
+    Key = int
+    Leaf = int
+
+
+class EventFilterTests(unittest.TestCase):
+    def test_tokenize(self):
+        """
+        Test the tokens of an expression
+        """
+        tokens = EventFilter.tokenize("wait_ns>1.5ms AND relation = 'it''s'")
+        self.assertEqual(
+            [
+                ("word", "wait_ns", None),
+                ("operator", ">", None),
+                ("number", "1.5", "ms"),
+                ("keyword", "and", None),
+                ("word", "relation", None),
+                ("operator", "=", None),
+                ("string", "it's", None),
+            ],
+            tokens,
+        )
+
+        with self.assertRaises(ValueError):
+            EventFilter.tokenize("pid ~ 1")
+
+    def test_compile(self):
+        """
+        Test the compiled C condition
+        """
+        event_filter = EventFilter("pid = 1234")
+        self.assertEqual("((event)->pid == 1234)", event_filter.condition)
+        self.assertFalse(event_filter.uses_wait_time)
+
+        event_filter = EventFilter("mode >= ShareLock and wait_ns > 1ms")
+        self.assertEqual(
+            "(((event)->mode >= 5) && ((wait_ns) > 1000000))", event_filter.condition
+        )
+        self.assertTrue(event_filter.uses_wait_time)
+
+        # 'and' binds stronger than 'or'
+        event_filter = EventFilter(
+            "event = lock_granted or not locktype = 'transactionid' and cluster = 1"
+        )
+        self.assertEqual(
+            "(((event)->event_type == 33) || "
+            "((!((event)->locktag_type == 5)) && ((event)->cluster == 1)))",
+            event_filter.condition,
+        )
+
+    def test_sets(self):
+        """
+        Test the maps of the 'in' lists
+        """
+        event_filter = EventFilter(
+            "relation in ('public.orders', 'public.payments') and pid not in (1, 2, 1)",
+            lambda name: {"public.orders": {16384}, "public.payments": {16390, 16391}}[
+                name
+            ],
+        )
+
+        self.assertEqual(
+            "(filter_in_set_0((event)->object) && (!filter_in_set_1((event)->pid)))",
+            event_filter.condition,
+        )
+        self.assertEqual([[16384, 16390, 16391], [1, 2]], event_filter.sets)
+
+        defines = event_filter.get_c_defines()
+        self.assertIn("BPF_HASH(filter_set_0, u64, u8, 3);", defines)
+        self.assertIn("BPF_HASH(filter_set_1, u64, u8, 2);", defines)
+        self.assertIn("#define FILTER_EVENT(event, wait_ns) (filter_in_set_0", defines)
+        self.assertNotIn("FILTER_WAIT_TIME", defines)
+
+        tables = {"filter_set_0": FakeTable(), "filter_set_1": FakeTable()}
+        event_filter.fill_maps(tables)
+        self.assertEqual({16384: 1, 16390: 1, 16391: 1}, tables["filter_set_0"])
+        self.assertEqual({1: 1, 2: 1}, tables["filter_set_1"])
+
+        # A relation name can match several OIDs (one per database)
+        event_filter = EventFilter("relation != 'users'", lambda name: {2, 1})
+        self.assertEqual(
+            "((event)->object != 1 && (event)->object != 2)", event_filter.condition
+        )
+
+    def test_errors(self):
+        """
+        Test invalid expressions
+        """
+        for expression in (
+            "",
+            "mode >",
+            "(pid = 1",
+            "pid = 1 pid",
+            "unknown = 1",
+            "mode = 1ms",
+            "mode = FooLock",
+            "pid = 'x'",
+            "pid = 1.5",
+            "relation = 'public.orders'",
+        ):
+            with self.assertRaises(ValueError, msg=expression):
+                EventFilter(expression)
+
+        # The relation can not be resolved
+        with self.assertRaises(ValueError):
+            EventFilter("relation = 'public.orders'", lambda name: set())
+
+
+if __name__ == "__main__":
+    unittest.main()
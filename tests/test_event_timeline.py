@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import ctypes
+import unittest
+
+from src.pg_lock_tracer.event_timeline import EventTimeline
+
+
+# pylint: disable=too-few-public-methods
+class Event(ctypes.Structure):
+    _fields_ = [("pid", ctypes.c_uint32), ("timestamp", ctypes.c_uint64)]
+
+
+class EventTimelineTests(unittest.TestCase):
+    def setUp(self):
+        self.output = []
+
+    def add_event(self, timeline, source, pid, timestamp):
+        """
+        Add an event like the perf buffer callback of a session
+        """
+        event = Event(pid, timestamp)
+        timeline.add(source, timestamp, 0, bytes(event))
+
+    def create_callback(self, name):
+        """
+        Create a callback that decodes the event from the pointer
+        """
+
+        def callback(_cpu, data, size):
+            self.assertEqual(ctypes.sizeof(Event), size)
+            event = ctypes.cast(data, ctypes.POINTER(Event)).contents
+            self.output.append((name, event.pid, event.timestamp))
+
+        return callback
+
+    def test_merge_sources(self):
+        """
+        Test the merge of the events of several sources by their timestamp
+        """
+        timeline = EventTimeline(delay_ns=100)
+        lock = timeline.add_source(
+            self.create_callback("lock"), lambda: self.output.append("flush")
+        )
+        lw_lock = timeline.add_source(self.create_callback("lw"))
+
+        self.add_event(timeline, lock, 1, 1000)
+        self.add_event(timeline, lock, 1, 1300)
+        self.add_event(timeline, lw_lock, 2, 1100)
+        self.add_event(timeline, lw_lock, 1, 1250)
+        self.assertEqual(4, len(timeline))
+
+        # Only the events that are older than the delay are dispatched
+        timeline.flush(now_ns=1300)
+        self.assertEqual(
+            [("lock", 1, 1000), "flush", ("lw", 2, 1100)],
+            self.output,
+        )
+        self.assertEqual(2, len(timeline))
+
+        # An event that arrives after a newer event was dispatched
+        self.add_event(timeline, lock, 3, 1050)
+        self.assertEqual(1, timeline.late_events)
+
+        self.output.clear()
+        timeline.flush()
+        self.assertEqual(
+            [("lock", 3, 1050), "flush", ("lw", 1, 1250), ("lock", 1, 1300), "flush"],
+            self.output,
+        )
+        self.assertEqual(0, len(timeline))
+
+        with self.assertRaises(ValueError):
+            EventTimeline(delay_ns=-1)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import io
+import unittest
+import contextlib
+
+from types import SimpleNamespace
+
+from src.pg_lock_tracer.fastpath_analysis import (
+    FastPathAnalyzer,
+    get_query_fingerprint,
+)
+from src.pg_lock_tracer.lock_events import Events, LockTagType
+
+
+def create_event(event_type, pid=1234, oid=0, mode=1, **kwargs):
+    """
+    Create an event of the lock tracer
+    """
+    fields = {
+        "event_type": event_type,
+        "pid": pid,
+        "cluster": 0,
+        "timestamp": 1,
+        "object": oid,
+        "mode": mode,
+        "locktag_type": LockTagType.RELATION,
+        "locktag_field1": 5,
+    }
+    fields.update(kwargs)
+    return SimpleNamespace(**fields)
+
+
+class FastPathAnalyzerTests(unittest.TestCase):
+    def run_transaction(self, analyzer, locks, pid=1234, query="SELECT 1"):
+        """
+        Run a transaction that locks the given relations (fast-path
+        locks for the first four relations, shared locks afterward)
+        """
+        analyzer.handle_event(create_event(Events.QUERY_BEGIN, pid), query)
+        analyzer.handle_event(create_event(Events.TRANSACTION_BEGIN, pid))
+
+        for oid in range(1, locks + 1):
+            if oid <= 4:
+                event_type = Events.LOCK_GRANTED_FASTPATH
+            else:
+                event_type = Events.LOCK_GRANTED
+            analyzer.handle_event(create_event(event_type, pid, oid))
+
+        analyzer.handle_event(create_event(Events.TRANSACTION_COMMIT, pid))
+
+    def test_fingerprint(self):
+        """
+        Test the fingerprints of queries
+        """
+        self.assertEqual(
+            "SELECT * FROM t WHERE a = ? AND b = ?",
+            get_query_fingerprint("SELECT *  FROM t\nWHERE a = 42 AND b = 'it''s'"),
+        )
+        self.assertEqual(
+            "SELECT * FROM t WHERE a IN (...)",
+            get_query_fingerprint("SELECT * FROM t WHERE a IN (1, 2, 3)"),
+        )
+        self.assertEqual("", get_query_fingerprint(None))
+
+    def test_spilled_transactions(self):
+        """
+        Test the detection of transactions that exceed the fast-path slots
+        """
+        analyzer = FastPathAnalyzer(fastpath_slots=4)
+        self.run_transaction(analyzer, 3)
+        self.run_transaction(analyzer, 6, query="SELECT * FROM parent WHERE a = 1")
+        self.run_transaction(analyzer, 7, pid=5678, query="SELECT * FROM parent")
+
+        self.assertEqual(3, analyzer.finished_transactions)
+        self.assertEqual(2, analyzer.exceeding_transactions)
+        self.assertEqual({}, analyzer.transactions)
+
+        transactions = analyzer.get_top_transactions()
+        self.assertEqual([5678, 1234], [t.pid for t in transactions])
+        self.assertEqual(4, transactions[0].fastpath_locks)
+        self.assertEqual(3, transactions[0].shared_locks)
+        self.assertEqual(3, transactions[0].spilled_locks)
+        self.assertEqual(7, transactions[0].peak_relations)
+        self.assertEqual(5, transactions[0].first_spill)
+
+        self.assertEqual(
+            {
+                "SELECT * FROM parent WHERE a = ?": [1, 2, 6],
+                "SELECT * FROM parent": [1, 3, 7],
+            },
+            analyzer.fingerprints,
+        )
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            analyzer.print_report(lambda pid, oid, cluster: f"table_{oid}")
+
+        self.assertIn(
+            "2 of 3 transactions exceeded the 4 fast-path slots", output.getvalue()
+        )
+        self.assertIn("table_5", output.getvalue())
+
+    def test_held_relations(self):
+        """
+        Test the peak of the concurrently held relations and the lock tags
+        that are not counted
+        """
+        analyzer = FastPathAnalyzer(fastpath_slots=2)
+        analyzer.handle_event(create_event(Events.TRANSACTION_BEGIN))
+
+        for oid in (1, 2, 1):
+            analyzer.handle_event(create_event(Events.LOCK_GRANTED_FASTPATH, oid=oid))
+        analyzer.handle_event(create_event(Events.LOCK_UNGRANTED_FASTPATH, oid=2))
+        analyzer.handle_event(create_event(Events.LOCK_GRANTED_FASTPATH, oid=3))
+
+        # Strong locks, shared catalogs, and other lock tags did not spill
+        analyzer.handle_event(create_event(Events.LOCK_GRANTED, oid=4, mode=8))
+        analyzer.handle_event(
+            create_event(Events.LOCK_GRANTED, oid=5, locktag_field1=0)
+        )
+        analyzer.handle_event(
+            create_event(
+                Events.LOCK_GRANTED,
+                oid=6,
+                locktag_type=LockTagType.TRANSACTION,
+            )
+        )
+
+        transaction = analyzer.transactions[1234]
+        self.assertEqual({1: 2, 3: 1, 4: 1, 5: 1}, transaction.held_relations)
+        self.assertEqual({1: 2, 3: 1}, transaction.fastpath_relations)
+        self.assertEqual(4, transaction.peak_relations)
+        self.assertEqual(0, transaction.spilled_locks)
+
+        # More held relations than slots, but no spilled lock
+        analyzer.handle_event(create_event(Events.TRANSACTION_ABORT))
+        self.assertEqual(0, analyzer.exceeding_transactions)
+
+    def test_free_fastpath_slots(self):
+        """
+        Weak locks in the shared lock table only spill when all fast-path
+        slots are used
+        """
+        analyzer = FastPathAnalyzer(fastpath_slots=2)
+        analyzer.handle_event(create_event(Events.TRANSACTION_BEGIN))
+
+        # A free slot (e.g., another backend holds a strong lock)
+        analyzer.handle_event(create_event(Events.LOCK_GRANTED_FASTPATH, oid=1))
+        analyzer.handle_event(create_event(Events.LOCK_GRANTED, oid=2))
+        self.assertEqual(0, analyzer.transactions[1234].spilled_locks)
+
+        # All slots are used
+        analyzer.handle_event(create_event(Events.LOCK_GRANTED_FASTPATH, oid=3))
+        analyzer.handle_event(create_event(Events.LOCK_GRANTED, oid=4))
+        self.assertEqual(1, analyzer.transactions[1234].spilled_locks)
+        self.assertEqual(4, analyzer.transactions[1234].first_spill)
+
+        # A slot is released again
+        analyzer.handle_event(create_event(Events.LOCK_UNGRANTED_FASTPATH, oid=3))
+        analyzer.handle_event(create_event(Events.LOCK_GRANTED, oid=5))
+        self.assertEqual(1, analyzer.transactions[1234].spilled_locks)
+
+        analyzer.handle_event(create_event(Events.TRANSACTION_COMMIT))
+        self.assertEqual(1, analyzer.exceeding_transactions)
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+import tempfile
 import unittest
 
-from src.pg_lock_tracer.helper import PostgreSQLLockHelper
+from src.pg_lock_tracer.helper import BPFHelper, CgroupHelper, PostgreSQLLockHelper
 
 
 class UNITTests(unittest.TestCase):
@@ -107,3 +110,168 @@ class UNITTests(unittest.TestCase):
 
         # Only unique values are present
         self.assertListEqual([my_locks[0], my_locks[4]], decoded_my_locks)
+
+    def test_expand_clusters(self):
+        """
+        Test the expansion of the per cluster part of a BPF program
+        """
+        program = "typedef int Oid;\n__CLUSTER_PROBES__\nint probe__CLUSTER__() {}\n"
+        result = BPFHelper.expand_clusters(
+            program, ["#define OFFSET_A 1\n", "#define OFFSET_A 2\n"]
+        )
+
+        self.assertEqual(1, result.count("typedef int Oid;"))
+        self.assertIn(
+            "#define CLUSTER_ID 0\n#define OFFSET_A 1\n\nint probe_0()", result
+        )
+        self.assertIn("#undef OFFSET_A\n#define CLUSTER_ID 1\n", result)
+        self.assertIn("#define OFFSET_A 2\n\nint probe_1()", result)
+        self.assertEqual("probe_1", BPFHelper.cluster_function_name("probe", 1))
+
+        with self.assertRaises(ValueError):
+            BPFHelper.expand_clusters("int probe() {}", [""])
+
+    def test_prefix_program(self):
+        """
+        Test the prefix of the names that are declared by a BPF program
+        """
+        program = (
+            "#define EVENT_LOCK 1\n"
+            "typedef struct LockEvent_t {\n  u32 pid;\n} LockEvent;\n"
+            "BPF_PERF_OUTPUT(lockevents);\n"
+            "static void fill_and_submit(struct pt_regs *ctx, LockEvent *event) {\n"
+            "  lockevents.perf_submit(ctx, event, sizeof(LockEvent));\n}\n"
+            "int lwlock_acquire(struct pt_regs *ctx) {\n"
+            "  LockEvent event = {.pid = EVENT_LOCK};\n"
+            "  fill_and_submit(ctx, &event);\n  return 0;\n}\n"
+        )
+
+        self.assertEqual(
+            {
+                "EVENT_LOCK",
+                "LockEvent_t",
+                "LockEvent",
+                "lockevents",
+                "fill_and_submit",
+                "lwlock_acquire",
+            },
+            BPFHelper.get_program_names(program),
+        )
+
+        result = BPFHelper.prefix_program(program, "lw_")
+        self.assertIn("#define lw_EVENT_LOCK 1\n", result)
+        self.assertIn("BPF_PERF_OUTPUT(lw_lockevents);", result)
+        self.assertIn(
+            "lw_lockevents.perf_submit(ctx, event, sizeof(lw_LockEvent));", result
+        )
+        self.assertIn("int lw_lwlock_acquire(struct pt_regs *ctx)", result)
+        self.assertIn("lw_fill_and_submit(ctx, &event);", result)
+
+        # Fields, parameters, and external names are not changed
+        self.assertIn("u32 pid;", result)
+        self.assertIn("struct pt_regs *ctx", result)
+
+    def test_off_cpu_program(self):
+        """
+        Test the insertion of the off-CPU accounting into a BPF program
+        """
+        program = "#ifdef OFF_CPU\n__OFF_CPU__\n#endif\n"
+
+        result = BPFHelper.insert_off_cpu_program(program, True)
+        self.assertNotIn("__OFF_CPU__", result)
+        self.assertIn("int off_cpu_sched_switch(", result)
+        self.assertIn("int off_cpu_sched_waking(", result)
+
+        # The tracepoint functions are prefixed in a session
+        names = BPFHelper.get_program_names(result)
+        self.assertIn("off_cpu_sched_switch", names)
+        self.assertIn("off_cpu_times", names)
+
+        self.assertEqual(
+            "#ifdef OFF_CPU\n\n#endif\n",
+            BPFHelper.insert_off_cpu_program(program, False),
+        )
+
+    def test_exe_pids(self):
+        """
+        Test the processes of an executable
+        """
+        pids = BPFHelper.get_exe_pids(sys.executable)
+        self.assertIn(os.getpid(), pids)
+        self.assertEqual(sorted(pids), pids)
+
+        with tempfile.NamedTemporaryFile() as no_executable:
+            self.assertEqual([], BPFHelper.get_exe_pids(no_executable.name))
+
+    def test_parent_pid(self):
+        """
+        Test the parent of a process
+        """
+        self.assertEqual(os.getppid(), BPFHelper.get_parent_pid(os.getpid()))
+
+    def test_cgroup_filter(self):
+        """
+        Test the cgroup and PID namespace filter
+        """
+        with tempfile.TemporaryDirectory() as cgroup:
+            # A cgroup with the current process in a child cgroup
+            child = os.path.join(cgroup, "container")
+            os.mkdir(child)
+
+            with open(os.path.join(cgroup, "cgroup.procs"), "w", encoding="utf-8"):
+                pass
+
+            with open(
+                os.path.join(child, "cgroup.procs"), "w", encoding="utf-8"
+            ) as procs:
+                procs.write(f"{os.getpid()}\n")
+
+            self.assertEqual([os.getpid()], CgroupHelper.get_cgroup_pids(cgroup))
+
+            namespace = os.stat("/proc/self/ns/pid")
+            defines = CgroupHelper.generate_c_defines(cgroup, True, [sys.executable])
+            self.assertIn("#define FILTER_CGROUP\n", defines)
+            self.assertIn(f"#define PIDNS_INO {namespace.st_ino}\n", defines)
+
+            namespace_pid = CgroupHelper.get_namespace_pid(os.getpid())
+            self.assertEqual(
+                {namespace_pid: os.getpid()},
+                CgroupHelper.get_host_pids(cgroup, [namespace_pid], [sys.executable]),
+            )
+            defines = CgroupHelper.generate_c_defines(
+                cgroup, True, [sys.executable], [namespace_pid]
+            )
+            self.assertIn(f"#define PIDNS_INO {namespace.st_ino}\n", defines)
+
+            with self.assertRaises(ValueError):
+                CgroupHelper.get_host_pids(
+                    cgroup, [namespace_pid + 1], [sys.executable]
+                )
+
+            # The processes of other binaries (e.g., the pause container of
+            # a pod) do not determine the PID namespace
+            with tempfile.NamedTemporaryFile() as other_executable:
+                self.assertEqual(
+                    [],
+                    CgroupHelper.get_cgroup_exe_pids(cgroup, [other_executable.name]),
+                )
+                with self.assertRaises(ValueError):
+                    CgroupHelper.generate_c_defines(
+                        cgroup, True, [other_executable.name]
+                    )
+                with self.assertRaises(ValueError):
+                    CgroupHelper.get_host_pids(
+                        cgroup, [namespace_pid], [other_executable.name]
+                    )
+
+            self.assertEqual(
+                (namespace.st_dev, namespace.st_ino),
+                CgroupHelper.get_pid_namespace([os.getpid(), os.getppid()]),
+            )
+
+            with self.assertRaises(ValueError):
+                CgroupHelper.generate_c_defines(child + "/missing", False)
+
+        self.assertEqual("", CgroupHelper.generate_c_defines(None, False))
+        with self.assertRaises(ValueError):
+            CgroupHelper.generate_c_defines(None, True)
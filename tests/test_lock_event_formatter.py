@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import json
+import unittest
+
+from src.pg_lock_tracer.lock_events import Events, LockTagType, PostgreSQLEvent
+from src.pg_lock_tracer.lock_event_formatter import LockEventFormatter
+
+
+# pylint: disable=too-few-public-methods
+class StaticResolver:
+    def __init__(self, names):
+        self.names = names
+
+    def resolve_oid(self, oid):
+        """
+        Resolve the OID using the static names
+        """
+        return self.names.get(oid, f"Oid {oid}")
+
+
+def create_event(event_type, pid=1234, **fields):
+    """
+    Create a new event with the given fields
+    """
+    return PostgreSQLEvent(
+        event_type=event_type, pid=pid, timestamp=745064333930117, **fields
+    )
+
+
+class LockEventFormatterTests(unittest.TestCase):
+    def setUp(self):
+        self.formatter = LockEventFormatter()
+        self.resolvers = {1234: StaticResolver({1259: "pg_catalog.pg_class"})}
+
+    def format_json(self, event, lock_time=None, stacktrace=None):
+        """
+        Format the event as JSON and parse the result
+        """
+        _, prefix = self.formatter.get_json_prefix(
+            event.pid,
+            event.event_type,
+            event.mode,
+            self.formatter.get_object(event, event.event_type),
+            self.resolvers,
+        )
+        output = self.formatter.format_json(
+            event, event.event_type, event.timestamp, prefix, lock_time, stacktrace
+        )
+        return output, json.loads(output)
+
+    def format_human(self, event):
+        """
+        Format the event in a human readable format
+        """
+        _, prefix = self.formatter.get_human_prefix(
+            event.pid,
+            event.event_type,
+            event.mode,
+            self.formatter.get_object(event, event.event_type),
+            self.resolvers,
+        )
+        return self.formatter.format_human(
+            event, event.event_type, event.timestamp, prefix
+        )
+
+    def test_json_lock_event(self):
+        """
+        Test the JSON output of a lock event
+        """
+        event = create_event(Events.LOCK_GRANTED_LOCAL, object=1259, mode=1)
+        output, parsed = self.format_json(event)
+
+        expected = {
+            "timestamp": 745064333930117,
+            "pid": 1234,
+            "event": "LOCK_GRANTED_LOCAL",
+            "lock_type": "AccessShareLock",
+            "table": "pg_catalog.pg_class",
+            "oid": 1259,
+            "lock_local_hold": 0,
+        }
+
+        self.assertEqual(expected, parsed)
+        self.assertEqual(json.dumps(expected), output)
+
+    def test_json_unresolved_event(self):
+        """
+        Test the JSON output of an event without a resolver
+        """
+        event = create_event(Events.LOCK_RELATION_OID, pid=42, object=3079, mode=8)
+        output, _ = self.format_json(event)
+
+        expected = {
+            "timestamp": 745064333930117,
+            "pid": 42,
+            "event": "LOCK_RELATION_OID",
+            "lock_type": "AccessExclusiveLock",
+            "oid": 3079,
+        }
+        self.assertEqual(json.dumps(expected), output)
+
+    def test_json_special_fields(self):
+        """
+        Test the JSON output of events with additional fields
+        """
+        event = create_event(Events.QUERY_BEGIN, payload_str1='select "ä";'.encode())
+        output, parsed = self.format_json(event)
+        self.assertEqual('select "ä";', parsed["query"])
+        self.assertIn('"query": "select \\"\\u00e4\\";"', output)
+
+        event = create_event(Events.ERROR, mode=22)
+        _, parsed = self.format_json(event)
+        self.assertEqual("FATAL", parsed["servity"])
+
+        event = create_event(Events.LOCK_RELATION_OID_END)
+        _, parsed = self.format_json(event, 1234, "LockRelationOid+0x0 [postgres]")
+        self.assertEqual(1234, parsed["lock_time"])
+        self.assertEqual("LockRelationOid+0x0 [postgres]", parsed["stacktrace"])
+
+        event = create_event(
+            Events.TABLE_OPEN_RV, payload_str1=b"public", payload_str2=b"metrics"
+        )
+        _, parsed = self.format_json(event)
+        self.assertEqual("public.metrics", parsed["table"])
+
+    def test_human_output(self):
+        """
+        Test the human readable output
+        """
+        event = create_event(Events.LOCK_GRANTED, object=1259, mode=3, requested=2)
+        self.assertEqual(
+            "745064333930117 [Pid 1234] Lock granted 1259 (pg_catalog.pg_class) "
+            "RowExclusiveLock (Requested locks 2, granted 0, waiting 0)",
+            self.format_human(event),
+        )
+
+        event = create_event(Events.QUERY_BEGIN, payload_str1=b"select {1};")
+        self.assertEqual(
+            "745064333930117 [Pid 1234] Query begin 'select {1};'",
+            self.format_human(event),
+        )
+
+        # Braces in object names are not interpreted as format fields
+        self.resolvers[1234].names[1260] = "public.{requested}"
+        event = create_event(Events.LOCK_UNGRANTED, object=1260, mode=1, requested=3)
+        self.assertEqual(
+            "745064333930117 [Pid 1234] Lock ungranted 1260 (public.{requested}) "
+            "AccessShareLock (Requested locks 3, granted 0, waiting 0)",
+            self.format_human(event),
+        )
+
+    def test_locktag_output(self):
+        """
+        Test the output of locks that are no relation locks
+        """
+        event = create_event(
+            Events.LOCK_GRANTED,
+            mode=7,
+            requested=1,
+            granted=1,
+            waiting=2,
+            grant_mask=1 << 7,
+            locktag_type=LockTagType.TRANSACTION,
+            locktag_field1=4711,
+        )
+        self.assertEqual(
+            "745064333930117 [Pid 1234] Lock granted transactionid xid=4711 "
+            "ExclusiveLock (Requested locks 1, granted 1, waiting 2)",
+            self.format_human(event),
+        )
+        _, parsed = self.format_json(event)
+        self.assertEqual("transactionid", parsed["locktag"])
+        self.assertEqual(4711, parsed["xid"])
+        self.assertEqual(
+            (1, 2, 128), (parsed["granted"], parsed["waiting"], parsed["grant_mask"])
+        )
+        self.assertNotIn("oid", parsed)
+
+        event = create_event(
+            Events.LOCK_UNGRANTED_LOCAL,
+            mode=7,
+            locktag_type=LockTagType.TUPLE,
+            locktag_field1=5,
+            locktag_field2=1259,
+            locktag_field3=2,
+            locktag_field4=3,
+        )
+        self.assertEqual(
+            "745064333930117 [Pid 1234] Lock ungranted (local) tuple database=5 "
+            "oid=1259 (pg_catalog.pg_class) block=2 offset=3 ExclusiveLock "
+            "(Hold local 0)",
+            self.format_human(event),
+        )
+        _, parsed = self.format_json(event)
+        self.assertEqual("pg_catalog.pg_class", parsed["table"])
+        self.assertEqual(
+            (1259, 2, 3), (parsed["oid"], parsed["block"], parsed["offset"])
+        )
+
+    def test_cluster_output(self):
+        """
+        Test the output of events of several clusters
+        """
+        formatter = LockEventFormatter(show_cluster=True)
+        event = create_event(Events.LOCK_RELATION_OID, object=1259, mode=1, cluster=1)
+
+        key, prefix = formatter.get_json_prefix(
+            1234, event.event_type, 1, 1259, self.resolvers, event.cluster
+        )
+        parsed = json.loads(
+            formatter.format_json(event, event.event_type, event.timestamp, prefix)
+        )
+        self.assertEqual("pg_catalog.pg_class", key)
+        self.assertEqual(1, parsed["cluster"])
+
+        _, prefix = formatter.get_human_prefix(
+            1234, event.event_type, 1, 1259, self.resolvers, event.cluster
+        )
+        self.assertEqual(
+            "745064333930117 [Cluster 1] [Pid 1234] "
+            "Lock object 1259 (pg_catalog.pg_class) AccessShareLock",
+            formatter.format_human(event, event.event_type, event.timestamp, prefix),
+        )
+
+    def test_unsupported_values(self):
+        """
+        Unsupported event types and lock modes are rejected
+        """
+        with self.assertRaises(ValueError):
+            self.format_human(create_event(999))
+
+        with self.assertRaises(ValueError):
+            self.format_human(create_event(Events.LOCK_GRANTED, mode=42))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import json
+import unittest
+
+from src.pg_lock_tracer.lock_statistics import (
+    DurationStatistics,
+    Log2Histogram,
+    ModeCounters,
+    merge_statistics,
+)
+
+
+# pylint: disable=too-few-public-methods
+class StatisticsEntry:
+    def __init__(self) -> None:
+        self.requested_locks = ModeCounters(3)
+
+    def merge(self, other):
+        """
+        Merge the counters of another entry
+        """
+        self.requested_locks.merge(other.requested_locks)
+
+
+class LockStatisticsTests(unittest.TestCase):
+    def test_mode_counters(self):
+        """
+        Test the counters per lock mode
+        """
+        counters = ModeCounters(9)
+        for mode in (1, 1, 8, 3):
+            counters.add(mode)
+
+        self.assertEqual([(1, 2), (3, 1), (8, 1)], counters.items())
+        self.assertEqual(4, counters.total())
+
+        other = ModeCounters.from_list(json.loads(json.dumps(counters.to_list())))
+        other.add(0, 5)
+        counters.merge(other)
+        self.assertEqual([(0, 5), (1, 4), (3, 2), (8, 2)], counters.items())
+
+        with self.assertRaises(ValueError):
+            counters.add(9)
+
+        with self.assertRaises(ValueError):
+            counters.merge(ModeCounters(3))
+
+    def test_histogram(self):
+        """
+        Test the log2 buckets, the percentiles, and merging of histograms
+        """
+        histogram = Log2Histogram()
+        self.assertIsNone(histogram.percentile(50))
+
+        for value in (0, 1, 3, 1000, 1023, 1024):
+            histogram.add(value)
+
+        self.assertEqual(
+            [(0, 0, 1), (1, 1, 1), (2, 3, 1), (512, 1023, 2), (1024, 2047, 1)],
+            histogram.items(),
+        )
+        self.assertEqual(3, histogram.percentile(50))
+        self.assertEqual(2047, histogram.percentile(100))
+
+        other = Log2Histogram.from_dict(json.loads(json.dumps(histogram.to_dict())))
+        other.add(5, count=10)
+        histogram.merge(other)
+        self.assertEqual(22, histogram.count())
+        self.assertEqual(7, histogram.percentile(50))
+
+    def test_duration_statistics(self):
+        """
+        Test the durations that are aggregated per histogram bucket
+        """
+        durations = DurationStatistics()
+        self.assertEqual(0, durations.average())
+
+        durations.add(10, 3, 2_400)
+        durations.add(20, 1, 600_000)
+        self.assertEqual(4, durations.count)
+        self.assertEqual(150_600, durations.average())
+        self.assertEqual(1023, durations.histogram.percentile(50))
+        self.assertEqual(2**20 - 1, durations.histogram.percentile(100))
+
+        other = DurationStatistics()
+        other.add(10, 1, 1_000)
+        durations.merge(other)
+        self.assertEqual(5, durations.count)
+        self.assertEqual(603_400, durations.total_ns)
+        self.assertEqual(4, durations.histogram.buckets[10])
+
+    def test_merge_statistics(self):
+        """
+        Test merging the statistics of two runs
+        """
+        first_run = {"users": StatisticsEntry()}
+        first_run["users"].requested_locks.add(1)
+
+        second_run = {"users": StatisticsEntry(), "orders": StatisticsEntry()}
+        second_run["users"].requested_locks.add(1)
+        second_run["orders"].requested_locks.add(2)
+
+        merged = merge_statistics(first_run, second_run)
+        self.assertEqual([(1, 2)], merged["users"].requested_locks.items())
+        self.assertEqual([(2, 1)], merged["orders"].requested_locks.items())
+
+        # The entries of the source are not shared
+        merged["orders"].requested_locks.add(2)
+        self.assertEqual([(2, 1)], second_run["orders"].requested_locks.items())
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import ctypes
+import unittest
+
+from types import SimpleNamespace
+
+from src.pg_lock_tracer.lwlock_tranches import (
+    LWLOCK_PADDED_SIZE,
+    LWLockTranches,
+    ProcessMemory,
+)
+
+MAIN_ARRAY = 0x10000
+
+
+def pointers(*addresses):
+    """
+    Encode an array of pointers
+    """
+    return b"".join(address.to_bytes(8, "little") for address in addresses)
+
+
+def main_array(*tranche_ids):
+    """
+    Encode the main LWLock array (the tranche is the first member of a lock)
+    """
+    return b"".join(
+        tranche_id.to_bytes(2, "little") + bytes(LWLOCK_PADDED_SIZE - 2)
+        for tranche_id in tranche_ids
+    )
+
+
+class FakeMemory(ProcessMemory):
+    """
+    The memory of a process (Key = start address, Value = bytes)
+    """
+
+    def __init__(self, regions, pid=1) -> None:
+        super().__init__(pid)
+        self.regions = regions
+
+    def read(self, address, size):
+        for start, data in self.regions.items():
+            if start <= address < start + len(data):
+                return data[address - start : address - start + size]
+
+        raise OSError(f"Address 0x{address:x} is not mapped")
+
+
+def create_postgresql_16():
+    """
+    The tranches of a PostgreSQL 16 process with an extension
+    """
+    symbols = SimpleNamespace(
+        objects={
+            "IndividualLWLockNames": (0x1000, 16),
+            "BuiltinTrancheNames": (0x1100, 16),
+            "LWLockTrancheNames": (0x1200, 8),
+            "LWLockTrancheNamesAllocated": (0x1300, 4),
+            "MainLWLockArray": (0x1400, 8),
+            "BufferDescriptors": (0x1500, 8),
+            "NBuffers": (0x1600, 4),
+        },
+        position_independent=False,
+    )
+    memory = FakeMemory(
+        {
+            0x1000: pointers(0x2000, 0x2040),
+            0x1100: pointers(0x2080, 0x20C0),
+            0x1200: pointers(0x3000),
+            0x1300: (1).to_bytes(4, "little"),
+            0x1400: pointers(MAIN_ARRAY),
+            0x1500: pointers(0x100000),
+            0x1600: (16384).to_bytes(4, "little"),
+            0x2000: b"ShmemIndex\0",
+            0x2040: b"OidGen\0",
+            0x2080: b"XactBuffer\0",
+            0x20C0: b"BufferMapping\0",
+            0x2100: b"pg_stat_statements\0",
+            0x3000: pointers(0x2100),
+            MAIN_ARRAY: main_array(0, 1, 3, 3, 3, 4, 0),
+        }
+    )
+
+    return symbols, memory
+
+
+class LWLockTranchesTests(unittest.TestCase):
+    def test_names(self):
+        """
+        Test the names of the built-in and the extension tranches
+        """
+        symbols, memory = create_postgresql_16()
+        tranches = LWLockTranches(symbols, [memory])
+
+        self.assertEqual("ShmemIndex", tranches.get_name(0))
+        self.assertEqual("XactBuffer", tranches.get_name(2))
+        self.assertEqual("BufferMapping", tranches.get_name(3))
+        self.assertEqual("pg_stat_statements", tranches.get_name(4))
+        self.assertEqual("tranche 5", tranches.get_name(5))
+
+        # Unknown tranches are not cached
+        self.assertEqual({0, 2, 3, 4}, set(tranches.names))
+
+        # The names are read from the next process if a process has exited
+        tranches = LWLockTranches(symbols, [FakeMemory({}), memory])
+        self.assertEqual("OidGen", tranches.get_name(1))
+
+    def test_names_postgresql_12(self):
+        """
+        PostgreSQL <= 12 registers all tranches at run time
+        """
+        symbols = SimpleNamespace(
+            objects={
+                "LWLockTrancheArray": (0x1000, 8),
+                "LWLockTranchesAllocated": (0x1100, 4),
+            }
+        )
+        memory = FakeMemory(
+            {
+                0x1000: pointers(0x3000),
+                0x1100: (2).to_bytes(4, "little"),
+                0x2000: b"ShmemIndex\0",
+                0x3000: pointers(0x2000, 0),
+            }
+        )
+        tranches = LWLockTranches(symbols, [memory])
+
+        self.assertEqual("ShmemIndex", tranches.get_name(0))
+        self.assertEqual("tranche 1", tranches.get_name(1))
+        self.assertEqual("tranche 2", tranches.get_name(2))
+
+    def test_partitions(self):
+        """
+        Test the partitions of the locks in the main array
+        """
+        symbols, memory = create_postgresql_16()
+        tranches = LWLockTranches(symbols, [memory])
+
+        # The array ends at the first descending tranche id
+        self.assertEqual(0, tranches.get_partition(MAIN_ARRAY, 0))
+        self.assertEqual([0, 1, 3, 3, 3, 4], tranches.main_tranches)
+
+        for index, partition in ((2, 0), (3, 1), (4, 2)):
+            self.assertEqual(
+                partition,
+                tranches.get_partition(MAIN_ARRAY + index * LWLOCK_PADDED_SIZE, 3),
+            )
+
+        self.assertEqual(0, tranches.get_partition(MAIN_ARRAY + 5 * 128, 4))
+
+        # Locks outside of the main array
+        self.assertIsNone(tranches.get_partition(MAIN_ARRAY + 8, 3))
+        self.assertIsNone(tranches.get_partition(MAIN_ARRAY + 6 * 128, 0))
+        self.assertIsNone(tranches.get_partition(MAIN_ARRAY - 128, 3))
+        self.assertIsNone(tranches.get_partition(MAIN_ARRAY + 3 * 128, 4))
+
+    def test_buffer_descriptors(self):
+        """
+        Test the location of the buffer descriptors
+        """
+        symbols, memory = create_postgresql_16()
+
+        tranches = LWLockTranches(symbols, [FakeMemory({}), memory])
+        self.assertEqual((0x100000, 16384), tranches.read_buffer_descriptors())
+
+        tranches = LWLockTranches(symbols, [FakeMemory({})])
+        self.assertEqual((None, 0), tranches.read_buffer_descriptors())
+
+    def test_process_memory(self):
+        """
+        Test the memory of this process
+        """
+        name = ctypes.create_string_buffer(b"LockManager")
+        memory = ProcessMemory(os.getpid())
+
+        self.assertEqual("LockManager", memory.read_string(ctypes.addressof(name)))
+
+        load_address = ProcessMemory.get_load_address(
+            os.getpid(), os.path.realpath(sys.executable)
+        )
+        self.assertEqual(b"\x7fELF", memory.read(load_address, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import io
+import unittest
+
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+from src.pg_lock_tracer.off_cpu_statistics import OffCpuStatistics, OffCpuTime
+
+
+def create_entry(lock, pid, waker, waits, on_cpu_ns, sleep_ns, runnable_ns):
+    """
+    Create an entry of the off_cpu_times map
+    """
+    key = SimpleNamespace(lock=lock, cluster=0, pid=pid, waker=waker)
+    value = SimpleNamespace(
+        waits=waits, on_cpu_ns=on_cpu_ns, sleep_ns=sleep_ns, runnable_ns=runnable_ns
+    )
+    return (key, value)
+
+
+class OffCpuStatisticsTests(unittest.TestCase):
+    def test_aggregation(self):
+        """
+        Test the aggregation per lock and per waiter and waker
+        """
+        off_cpu_statistics = OffCpuStatistics()
+
+        for entry in (
+            create_entry(16384, 10, 11, 2, 1_000, 8_000, 1_000),
+            create_entry(16384, 10, 12, 1, 1_000, 2_000, 3_000),
+            create_entry(16384, 12, 11, 1, 500, 500, 0),
+            create_entry(1259, 10, 0, 4, 400, 0, 0),
+        ):
+            off_cpu_statistics.add(*entry)
+
+        lock = off_cpu_statistics.locks[(0, 16384)]
+        self.assertEqual(4, lock.waits)
+        self.assertEqual(2_500, lock.on_cpu_ns)
+        self.assertEqual(10_500, lock.sleep_ns)
+        self.assertEqual(4_000, lock.runnable_ns)
+        self.assertEqual(17_000, lock.total_ns())
+        self.assertEqual(4, len(off_cpu_statistics.wakeups))
+
+        # The waits with the highest sleep time first
+        top = off_cpu_statistics.get_top_entries(
+            off_cpu_statistics.wakeups, lambda time: time.sleep_ns
+        )
+        self.assertEqual((0, 16384, 10, 11), top[0][0])
+        self.assertEqual((0, 1259, 10, 0), top[-1][0])
+
+        self.assertEqual("50.0", OffCpuStatistics.get_share(8_500, lock))
+        self.assertEqual("-", OffCpuStatistics.get_share(0, OffCpuTime()))
+
+    def test_print_statistics(self):
+        """
+        Test the printed tables
+        """
+        off_cpu_statistics = OffCpuStatistics()
+        off_cpu_statistics.add(*create_entry(16384, 10, 11, 1, 0, 3_000_000, 1_000_000))
+        off_cpu_statistics.add(*create_entry(16384, 12, 0, 1, 1_000, 0, 0))
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            off_cpu_statistics.print_statistics(
+                lambda cluster, lock: f"public.table_{lock}"
+            )
+
+        self.assertIn("public.table_16384", output.getvalue())
+        self.assertIn("3.000", output.getvalue())
+        self.assertIn("75.0", output.getvalue())
+        self.assertIn("Woken by", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
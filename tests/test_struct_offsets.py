@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from src.pg_lock_tracer.struct_offsets import (
+    CACHE_VERSION,
+    ELFFile,
+    decode_uleb128,
+    get_build_id,
+    get_default_offsets,
+    get_struct_offsets,
+    offsets_to_defines,
+)
+
+# A binary with the structs in the layout of PostgreSQL 16
+TEST_PROGRAM = """
+typedef unsigned int Oid;
+typedef struct RelFileLocator { Oid spcOid; Oid dbOid; Oid relNumber; } RelFileLocator;
+typedef struct RelationData {
+  void *rd_smgr; RelFileLocator rd_locator; int rd_refcnt; Oid rd_id;
+} RelationData;
+typedef struct LOCKTAG {
+  unsigned int locktag_field1; unsigned int locktag_field2;
+  unsigned int locktag_field3; unsigned short locktag_field4;
+  unsigned char locktag_type; unsigned char locktag_lockmethodid;
+} LOCKTAG;
+typedef struct dlist_node { struct dlist_node *prev; struct dlist_node *next; } dlist_node;
+typedef struct dlist_head { dlist_node head; } dlist_head;
+typedef struct dclist_head { dlist_head dlist; unsigned int count; } dclist_head;
+typedef struct LOCK {
+  LOCKTAG tag; int grantMask; int waitMask; dlist_head procLocks; dclist_head waitProcs;
+  int requested[10]; int nRequested; int granted[10]; int nGranted;
+} LOCK;
+typedef struct LOCALLOCKTAG { LOCKTAG lock; int mode; } LOCALLOCKTAG;
+typedef struct LOCALLOCK { LOCALLOCKTAG tag; long nLocks; } LOCALLOCK;
+
+RelationData relation;
+LOCK lock;
+LOCALLOCK locallock;
+
+int main(void) { return 0; }
+"""
+
+
+@unittest.skipIf(shutil.which("gcc") is None, "gcc is not installed")
+class StructOffsetsTests(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_directory = os.path.join(self.tmp_dir.name, "cache")
+        self.binary = os.path.join(self.tmp_dir.name, "postgres")
+
+        source = os.path.join(self.tmp_dir.name, "postgres.c")
+        with open(source, "w", encoding="utf-8") as source_file:
+            source_file.write(TEST_PROGRAM)
+
+        subprocess.run(
+            ["gcc", "-g", "-Wl,--build-id", "-o", self.binary, source], check=True
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_build_id(self):
+        """
+        Test reading the build-id of a binary
+        """
+        build_id = get_build_id(self.binary)
+        self.assertIsNotNone(build_id)
+        self.assertEqual(40, len(build_id))
+
+        with self.assertRaises(ValueError):
+            get_build_id(os.path.join(self.tmp_dir.name, "postgres.c"))
+
+    @unittest.skipIf(ELFFile is None, "pyelftools is not installed")
+    def test_extract_offsets(self):
+        """
+        Test the extraction of the offsets from the debug information
+        """
+        offsets = get_struct_offsets(self.binary, cache_directory=self.cache_directory)
+
+        self.assertEqual(8, offsets["RELATIONDATA_RD_LOCATOR"])
+        self.assertEqual(24, offsets["RELATIONDATA_RD_ID"])
+        self.assertEqual(104, offsets["LOCK_NREQUESTED"])
+        self.assertEqual(20, offsets["LOCK_WAITMASK"])
+        self.assertEqual(40, offsets["LOCK_WAITPROCS"])
+        self.assertEqual(148, offsets["LOCK_NGRANTED"])
+        self.assertEqual(16, offsets["WAIT_QUEUE_SIZE"])
+        self.assertEqual(16, offsets["LOCALLOCKTAG_MODE"])
+        self.assertEqual(24, offsets["LOCALLOCK_NLOCKS"])
+        self.assertEqual(8, offsets["RELFILELOCATOR_REL"])
+
+        # The offsets are cached by the build-id
+        cache_file = os.path.join(
+            self.cache_directory, f"offsets-{get_build_id(self.binary)}.json"
+        )
+        self.assertTrue(os.path.isfile(cache_file))
+
+        with open(cache_file, "w", encoding="utf-8") as cache:
+            json.dump(
+                {"version": CACHE_VERSION, "offsets": {"RELATIONDATA_RD_ID": 1}}, cache
+            )
+
+        offsets = get_struct_offsets(self.binary, cache_directory=self.cache_directory)
+        self.assertEqual({"RELATIONDATA_RD_ID": 1}, offsets)
+
+    @unittest.skipIf(ELFFile is None, "pyelftools is not installed")
+    def test_default_offsets(self):
+        """
+        Binaries without debug information use the default offsets
+        """
+        subprocess.run(["strip", "--strip-debug", self.binary], check=True)
+
+        offsets = get_struct_offsets(self.binary, cache_directory=self.cache_directory)
+        self.assertEqual(get_default_offsets(), offsets)
+        self.assertIn(
+            "#define OFFSET_RELATIONDATA_RD_ID 72\n", offsets_to_defines(offsets)
+        )
+
+        # The default offsets are not cached
+        self.assertFalse(os.path.exists(self.cache_directory))
+
+    @unittest.skipIf(ELFFile is None, "pyelftools is not installed")
+    def test_dwarf2_offsets(self):
+        """
+        Test the offsets of DWARF 2 (encoded as DW_OP_plus_uconst expression)
+        """
+        source = os.path.join(self.tmp_dir.name, "postgres.c")
+        subprocess.run(
+            ["gcc", "-gdwarf-2", "-gstrict-dwarf", "-o", self.binary, source],
+            check=True,
+        )
+
+        offsets = get_struct_offsets(self.binary, cache_directory=self.cache_directory)
+        self.assertEqual(24, offsets["RELATIONDATA_RD_ID"])
+        self.assertEqual(148, offsets["LOCK_NGRANTED"])
+
+    def test_uleb128(self):
+        """
+        Test the decoding of the DWARF 2 member offsets
+        """
+        self.assertEqual(24, decode_uleb128([24]))
+        self.assertEqual(148, decode_uleb128([0x94, 0x01]))
+        self.assertEqual(624485, decode_uleb128([0xE5, 0x8E, 0x26]))
+
+        # Truncated numbers and trailing bytes
+        self.assertIsNone(decode_uleb128([]))
+        self.assertIsNone(decode_uleb128([0x94]))
+        self.assertIsNone(decode_uleb128([0x14, 0x01]))
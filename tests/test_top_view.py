@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import io
+import unittest
+
+from prettytable import PrettyTable
+
+from src.pg_lock_tracer.top_view import CLEAR_SCREEN, TopView
+
+
+class TopViewTests(unittest.TestCase):
+    def test_deltas(self):
+        """
+        Test the deltas and rates between two refreshes
+        """
+        top_view = TopView(interval=2)
+
+        deltas = top_view.get_deltas("wait_ns", {"users": 100, "orders": 50})
+        self.assertEqual({"users": 100, "orders": 50}, deltas)
+        self.assertEqual(0.0, top_view.get_rate(deltas["users"]))
+
+        top_view.elapsed = 2
+        deltas = top_view.get_deltas("wait_ns", {"users": 300, "items": 10})
+        self.assertEqual({"users": 200, "items": 10}, deltas)
+        self.assertEqual(100.0, top_view.get_rate(deltas["users"]))
+
+        # The groups are independent
+        self.assertEqual({"users": 1}, top_view.get_deltas("requests", {"users": 1}))
+
+    def test_render(self):
+        """
+        Test the output of the view
+        """
+        output = io.StringIO()
+        top_view = TopView(output=output)
+
+        table = PrettyTable(["Relation", "Requests/s"])
+        table.add_row(["users", 10])
+        top_view.render("title", [("Relations", table)])
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(CLEAR_SCREEN + "title", lines[0])
+        self.assertEqual("Relations", lines[2])
+        self.assertIn("users", output.getvalue())
+
+    def test_invalid_arguments(self):
+        """
+        Test the validation of the arguments
+        """
+        with self.assertRaises(ValueError):
+            TopView(interval=0)
+
+        with self.assertRaises(ValueError):
+            TopView(rows=0)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import os
+import gzip
+import json
+import tempfile
+import unittest
+
+from src.pg_lock_tracer.trace_file import (
+    TraceFileWriter,
+    parse_size,
+    read_trace_lines,
+    trace_exists,
+    zstandard,
+)
+
+
+class TraceFileTests(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "trace")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_events(self, writer, events):
+        """
+        Write the given number of events (with a second line per event)
+        """
+        writer.open()
+        for timestamp in range(events):
+            writer.write_line(json.dumps({"timestamp": timestamp}), timestamp)
+            writer.write_line("\tstacktrace")
+        writer.close()
+
+    def test_parse_size(self):
+        """
+        Test the parsing of sizes
+        """
+        self.assertEqual(100, parse_size("100"))
+        self.assertEqual(512 * 1024, parse_size("512K"))
+        self.assertEqual(100 * 1024 * 1024, parse_size("100m"))
+        self.assertEqual(2 * 1024 * 1024 * 1024, parse_size("2G"))
+
+        with self.assertRaises(ValueError):
+            parse_size("0")
+
+    def test_plain_file(self):
+        """
+        Test writing and reading an uncompressed file
+        """
+        self.write_events(TraceFileWriter(self.path), 10)
+
+        self.assertTrue(os.path.isfile(self.path))
+        self.assertEqual(20, len(list(read_trace_lines(self.path))))
+
+    def test_existing_file(self):
+        """
+        Existing files are not overwritten
+        """
+        self.write_events(TraceFileWriter(self.path), 1)
+
+        with self.assertRaises(ValueError):
+            TraceFileWriter(self.path)
+
+        # A later segment of a rotated trace would fail during the trace
+        with open(f"{self.path}.00003.gz", "w", encoding="utf-8"):
+            pass
+
+        with self.assertRaises(ValueError):
+            TraceFileWriter(self.path, "gzip", rotate_size=100)
+
+        TraceFileWriter(self.path, rotate_size=100)
+
+    def test_invalid_rotation(self):
+        """
+        The rotate size and interval have to be positive
+        """
+        for rotation in ({"rotate_size": 0}, {"rotate_interval": -1}):
+            with self.assertRaises(ValueError):
+                TraceFileWriter(self.path, **rotation)
+
+        self.assertEqual(-1, TraceFileWriter(self.path).poll_timeout)
+        self.assertEqual(
+            1000, TraceFileWriter(self.path, rotate_interval=3600).poll_timeout
+        )
+
+    def test_gzip_file(self):
+        """
+        Test writing and reading a gzip compressed file
+        """
+        self.write_events(TraceFileWriter(self.path, "gzip"), 10)
+
+        compressed_path = f"{self.path}.gz"
+        self.assertFalse(os.path.exists(self.path))
+
+        with gzip.open(compressed_path, "rt", encoding="utf-8") as trace_file:
+            self.assertEqual(20, len(trace_file.readlines()))
+
+        lines = list(read_trace_lines(compressed_path))
+        self.assertEqual({"timestamp": 0}, json.loads(lines[0]))
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_zstd_file(self):
+        """
+        Test writing and reading a zstd compressed file
+        """
+        self.write_events(TraceFileWriter(self.path, "zstd"), 10)
+        self.assertEqual(20, len(list(read_trace_lines(f"{self.path}.zst"))))
+
+    def test_size_rotation(self):
+        """
+        Test the rotation by size. An event and its stack trace are kept
+        in the same segment.
+        """
+        self.write_events(TraceFileWriter(self.path, rotate_size=100), 20)
+
+        with open(f"{self.path}.index.json", "r", encoding="utf-8") as index_file:
+            index = json.load(index_file)
+
+        segments = index["segments"]
+        self.assertGreater(len(segments), 1)
+
+        expected_timestamp = 0
+        for segment in segments:
+            self.assertTrue(segment["complete"])
+            self.assertEqual(0, segment["lines"] % 2)
+            self.assertEqual(expected_timestamp, segment["first_timestamp"])
+            expected_timestamp = segment["last_timestamp"] + 1
+
+        self.assertEqual(20, expected_timestamp)
+
+        # Read all segments using the base path and the index
+        self.assertTrue(trace_exists(self.path))
+        self.assertEqual(40, len(list(read_trace_lines(self.path))))
+        self.assertEqual(40, len(list(read_trace_lines(f"{self.path}.index.json"))))
+
+    def test_time_rotation(self):
+        """
+        Test the rotation by time
+        """
+        self.write_events(
+            TraceFileWriter(self.path, "gzip", rotate_interval=0.000001), 5
+        )
+
+        self.assertTrue(os.path.isfile(f"{self.path}.00004.gz"))
+        lines = list(read_trace_lines(self.path))
+        self.assertEqual(10, len(lines))
+        self.assertEqual({"timestamp": 4}, json.loads(lines[8]))
+
+    def test_poll_rotation(self):
+        """
+        The segments are rotated by time when no events are written
+        """
+        writer = TraceFileWriter(self.path, rotate_interval=0.000001)
+        writer.open()
+
+        # Empty segments are not rotated
+        writer.poll()
+        self.assertEqual(1, len(writer.segments))
+
+        writer.write_line(json.dumps({"timestamp": 0}), 0)
+        writer.poll()
+        self.assertEqual(2, len(writer.segments))
+        self.assertTrue(writer.segments[0]["complete"])
+        writer.close()
+
+        self.assertEqual(1, len(list(read_trace_lines(self.path))))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import io
+import unittest
+
+from contextlib import redirect_stdout
+
+from src.pg_lock_tracer.wait_events import (
+    BackendSlots,
+    WaitEventProfile,
+    get_query_id,
+    get_wait_event_name,
+    get_wait_event_type,
+)
+
+
+class WaitEventsTests(unittest.TestCase):
+    def test_names(self):
+        """
+        Test the names of the wait events
+        """
+        self.assertEqual("CPU", get_wait_event_type(0))
+        self.assertEqual("-", get_wait_event_name(0))
+
+        # LWLock:BufferMapping (the event is the tranche id)
+        buffer_mapping = 0x01000000 | 52
+        self.assertEqual("LWLock", get_wait_event_type(buffer_mapping))
+        self.assertEqual("52", get_wait_event_name(buffer_mapping))
+        self.assertEqual(
+            "BufferMapping",
+            get_wait_event_name(buffer_mapping, {52: "BufferMapping"}.get),
+        )
+
+        # Lock:transactionid (the event is the lock tag type)
+        self.assertEqual("Lock", get_wait_event_type(0x03000005))
+        self.assertEqual("transactionid", get_wait_event_name(0x03000005))
+
+        # The ids of the other events depend on the version
+        self.assertEqual("IO", get_wait_event_type(0x0A000003))
+        self.assertEqual("3", get_wait_event_name(0x0A000003))
+        self.assertEqual("0x0c000000", get_wait_event_type(0x0C000001))
+
+    def test_query_id(self):
+        """
+        Test the query ids (signed as in pg_stat_statements)
+        """
+        self.assertEqual(0, get_query_id(0))
+        self.assertEqual(4711, get_query_id(4711))
+        self.assertEqual(-1, get_query_id(2**64 - 1))
+        self.assertEqual(-(2**63), get_query_id(2**63))
+
+    def test_profile(self):
+        """
+        Test the aggregation and the printed tables
+        """
+        profile = WaitEventProfile(100, rows=2)
+        profile.add(0, 4711, 300)
+        profile.add(0x01000000 | 52, 4711, 50)
+        profile.add(0x01000000 | 52, 4712, 150)
+        profile.add(0x0A000003, 0, 10, sample_time=0.05)
+
+        self.assertEqual(510, profile.total())
+        self.assertEqual(200, profile.events[0x01000000 | 52])
+        self.assertEqual(4, len(profile.queries))
+        self.assertEqual("2.00", profile.get_time(0x01000000 | 52))
+        self.assertEqual("0.50", profile.get_time(0x0A000003))
+        self.assertEqual("0.00", profile.get_time(0x0A000004))
+        self.assertEqual("50.0", profile.get_share(255))
+
+        top = profile.get_top_entries(profile.queries)
+        self.assertEqual([((0, 4711), 300), ((0x01000000 | 52, 4712), 150)], top)
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            profile.print_profile({52: "BufferMapping"}.get)
+
+        self.assertIn("510 samples at 100 Hz", output.getvalue())
+        self.assertIn("BufferMapping", output.getvalue())
+        self.assertIn("4712", output.getvalue())
+
+        # Only the top rows are printed
+        self.assertNotIn("IO", output.getvalue())
+
+    def test_backend_slots(self):
+        """
+        Test the slots of the sampled processes
+        """
+        slots = BackendSlots(2)
+        self.assertEqual(0, slots.get_used())
+        self.assertTrue(slots.needs_refresh(100))
+
+        slots.assign(100, slots.find_slot(100), has_status=False)
+        slots.assign(200, slots.find_slot(200), has_status=True)
+        self.assertEqual({100: 0, 200: 1}, slots.slots)
+        self.assertEqual(2, slots.get_used())
+
+        # The process without a PgBackendStatus is refreshed
+        self.assertTrue(slots.needs_refresh(100))
+        self.assertFalse(slots.needs_refresh(200))
+        self.assertEqual(0, slots.find_slot(100))
+
+        # All slots are used
+        self.assertIsNone(slots.find_slot(300))
+
+        # The lowest free slot is reused
+        self.assertEqual(0, slots.release(100))
+        self.assertFalse(slots.without_status)
+        self.assertEqual(2, slots.get_used())
+        self.assertEqual(0, slots.find_slot(300))
+
+
+if __name__ == "__main__":
+    unittest.main()
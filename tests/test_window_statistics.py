@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import json
+import tempfile
+import unittest
+
+from src.pg_lock_tracer.window_statistics import WindowedStatistics
+
+SECOND = 1_000_000_000
+
+
+class WindowedStatisticsTests(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "windows")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_json(self):
+        """
+        Read the written JSON lines
+        """
+        with open(self.path, "r", encoding="utf-8") as output:
+            return [json.loads(line) for line in output]
+
+    def test_windows(self):
+        """
+        Test the assignment of the events to the windows
+        """
+        statistics = WindowedStatistics(
+            1, output=self.path, key_columns=("lock",), counters=("requests", "time")
+        )
+        statistics.add(10 * SECOND, "table1", "requests")
+        statistics.add(10 * SECOND + 5, "table1", "time", 100)
+        statistics.add(10 * SECOND + 10, "table2", "requests")
+        statistics.add(12 * SECOND, "table1", "requests")
+
+        # Late events are counted in the current window
+        statistics.add(11 * SECOND, "table1", "requests")
+
+        self.assertEqual(1, len(statistics.history))
+        self.assertEqual(
+            {"table1": {"requests": 1, "time": 100}, "table2": {"requests": 1}},
+            statistics.history[0].counters,
+        )
+        self.assertEqual({"table1": {"requests": 2}}, statistics.current.counters)
+
+        # The windows are written on request
+        statistics.poll(12 * SECOND)
+        self.assertFalse(os.path.exists(self.path))
+        statistics.request_report()
+        statistics.poll(13 * SECOND)
+
+        rows = self.read_json()
+        self.assertEqual(3, len(rows))
+        self.assertEqual({"lock", "requests", "time", "window_start"}, set(rows[0]))
+        self.assertEqual(["table1", "table2", "table1"], [row["lock"] for row in rows])
+        self.assertEqual([1, 1, 2], [row["requests"] for row in rows])
+        self.assertEqual([100, 0, 0], [row["time"] for row in rows])
+        self.assertEqual(2, round(rows[2]["window_start"] - rows[0]["window_start"]))
+
+        # Each window is written once
+        statistics.close()
+        self.assertEqual(3, len(self.read_json()))
+
+    def test_history(self):
+        """
+        Test the ring of windows and the periodic report as CSV
+        """
+        statistics = WindowedStatistics(
+            0.5,
+            history=2,
+            report_interval=60,
+            output=self.path,
+            output_format="csv",
+            key_columns=("cluster", "lock"),
+            counters=("requests",),
+        )
+        statistics.last_report_ns = 0
+
+        for window in range(4):
+            statistics.add(window * SECOND // 2, (window % 2, "table1"), "requests")
+        statistics.close_current()
+
+        self.assertEqual(2, len(statistics.history))
+        self.assertEqual(2, statistics.dropped_windows)
+
+        statistics.poll(59 * SECOND)
+        self.assertFalse(os.path.exists(self.path))
+        statistics.poll(60 * SECOND)
+        statistics.close()
+
+        with open(self.path, "r", encoding="utf-8") as output:
+            rows = list(csv.DictReader(output))
+
+        self.assertEqual(["0", "1"], [row["cluster"] for row in rows])
+        self.assertEqual(["1", "1"], [row["requests"] for row in rows])
+
+    def test_invalid_arguments(self):
+        """
+        Test the validation of the arguments
+        """
+        with self.assertRaises(ValueError):
+            WindowedStatistics(0)
+
+        with self.assertRaises(ValueError):
+            WindowedStatistics(1, history=0)
+
+        with self.assertRaises(ValueError):
+            WindowedStatistics(1, output_format="xml")